@@ -1330,6 +1330,67 @@ def result():
 
     return output
 
+# =============================================================================
+@auth.s3_requires_membership(1)
+def profile():
+    """
+        Aggregated request profiling timings as JSON, if enabled
+        by settings.base.request_profile
+
+        URL vars:
+            hours: the time window (hours, default 24)
+            category: limit to this category (e.g. "file", "model",
+                      "settings", "customise", "auth")
+    """
+
+    try:
+        hours = float(get_vars.get("hours", 24))
+    except (TypeError, ValueError):
+        hours = 24
+    since = request.utcnow - datetime.timedelta(hours=hours)
+
+    table = s3db.s3_profile_log
+    query = (table.date >= since)
+    category = get_vars.get("category")
+    if category:
+        query &= (table.category == category)
+    rows = db(query).select(table.date,
+                            table.category,
+                            table.name,
+                            table.samples,
+                            table.p50,
+                            table.p90,
+                            table.p99,
+                            table.maximum,
+                            orderby = (table.category, table.name, table.date),
+                            )
+
+    # Time series per item, to spot regressions
+    items = {}
+    for row in rows:
+        key = (row.category, row.name)
+        item = items.get(key)
+        if item is None:
+            item = items[key] = {"category": row.category,
+                                 "name": row.name,
+                                 "timings": [],
+                                 }
+        item["timings"].append({"date": row.date.isoformat(),
+                                "samples": row.samples,
+                                "p50": row.p50,
+                                "p90": row.p90,
+                                "p99": row.p99,
+                                "max": row.maximum,
+                                })
+
+    output = {"enabled": bool(settings.get_base_request_profile()),
+              "since": since.isoformat(),
+              "items": list(items.values()),
+              }
+
+    response.headers["Content-Type"] = "application/json"
+    return json.dumps(output, separators=(",", ":"))
+
 # =============================================================================
 # Configurations
 # =============================================================================
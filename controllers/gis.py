@@ -869,6 +869,41 @@ def hdata():
 
     return json.dumps(hdict, separators=SEPARATORS)
 
+# -----------------------------------------------------------------------------
+def tiles():
+    """
+        Return a Feature Layer as vector tile (Mapbox Vector Tile):
+            GET '/eden/gis/tiles/' + layer_id + '/' + z + '/' + x + '/' + y + '.mvt'
+    """
+
+    if not settings.get_gis_vector_tiles():
+        raise HTTP(404)
+
+    # NB web2py leaves the extension in the last arg
+    args = request.args
+    if len(args) != 4 or s3base.s3_get_extension() != "mvt":
+        raise HTTP(400)
+    try:
+        layer_id, z, x = [int(arg) for arg in args[:3]]
+        y = int(args[3].rsplit(".", 1)[0])
+    except ValueError:
+        raise HTTP(400)
+
+    tiles = s3base.VectorTiles(layer_id)
+    n = 2 ** min(z, tiles.MAX_ZOOM)
+    if not 0 <= z <= tiles.MAX_ZOOM or not 0 <= x < n or not 0 <= y < n:
+        raise HTTP(400)
+
+    if not tiles.layer:
+        raise HTTP(404, ERROR.BAD_RECORD)
+    if not tiles.permitted():
+        auth.permission.fail()
+
+    response.headers["Content-Type"] = "application/vnd.mapbox-vector-tile"
+    response.headers["Cache-Control"] = "private, max-age=60"
+
+    return tiles.tile(z, x, y)
+
 # -----------------------------------------------------------------------------
 def s3_gis_location_parents(r, **attr):
     """
@@ -102,4 +102,9 @@ current.MAX_FILENAME_LENGTH = 255 # Defined early for use by S3Config.
 import s3cfg
 current.deployment_settings = deployment_settings = settings = s3cfg.S3Config()
 
+# Request profiler (records only if enabled in settings)
+import s3profiler
+current.profiler = s3profiler.S3Profiler()
+current.profiler.mark("000_1st_run.py")
+
 # END =========================================================================
@@ -6,6 +6,10 @@
     Instantiate Classes
 """
 
+# Template config has been imported, so configure the request profiler
+current.profiler.mark("000_config.py")
+current.profiler.configure(settings)
+
 if settings.get_L10n_languages_readonly():
     # Make the Language files read-only for improved performance (default)
     T.is_writable = False
@@ -174,4 +178,6 @@ def s3_auth_on_logout(user):
     """
     s3_clear_session()
 
+current.profiler.mark("00_db.py")
+
 # END =========================================================================
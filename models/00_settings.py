@@ -307,4 +307,6 @@ s3.crud_strings = Storage(
     msg_no_match = T("No Matching Records"),
     )
 
+current.profiler.mark("00_settings.py")
+
 # END =========================================================================
@@ -86,4 +86,6 @@ s3db.configure("auth_membership",
 # Make available for controllers
 from core import S3ReusableField, s3_comments, s3_meta_fields
 
+current.profiler.mark("00_tables.py")
+
 # END =========================================================================
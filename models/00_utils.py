@@ -131,4 +131,6 @@ s3_menu_dict = {}
 from core import crud_controller
 current.crud_controller = crud_controller
 
+current.profiler.mark("00_utils.py")
+
 # END =========================================================================
@@ -49,12 +49,15 @@ def settings_task(taskname, user_id=None, **kwargs):
         return result
 
 # -----------------------------------------------------------------------------
-def maintenance(period = "daily"):
+def maintenance(period = "daily", job = None, user_id = None):
     """
         Run all maintenance tasks which should be done daily
         - instantiates and calls the Daily() class defined in the template's
           maintenance.py file - if it exists
         - falls back to the default template's maintenancy.py
+        - if the Daily() class declares independent jobs (MaintenanceJobs),
+          these are dispatched as separate tasks (to run concurrently),
+          and each such task runs only the specified job
     """
 
     maintenance = None
@@ -84,11 +87,52 @@ def maintenance(period = "daily"):
 
     if maintenance is not None:
         if period == "daily":
-            result = maintenance.Daily()()
+            routine = maintenance.Daily()
+            if isinstance(routine, s3base.MaintenanceJobs):
+                if job:
+                    result = routine.run(job)
+                else:
+                    result = routine.dispatch()
+            else:
+                result = routine()
         db.commit()
 
     return result
 
+# -----------------------------------------------------------------------------
+def s3_hierarchy_rebuild(tablename=None, user_id=None):
+    """
+        Rebuild the stored nodes of a dirty hierarchy
+            - queued when a hierarchy is marked as dirty
+
+        @param tablename: the tablename of the hierarchy, None for all
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = s3base.S3Hierarchy.rebuild(tablename)
+    db.commit()
+    return result
+
+# -----------------------------------------------------------------------------
+def s3_permission_store_realm_set(entities, user_id=None):
+    """
+        Store a realm set for realm queries
+            - queued when a new realm set is first used
+
+        @param entities: the pe_ids in the realm set
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = s3base.S3Permission.store_realm_set(entities)
+    db.commit()
+    return result
+
 # -----------------------------------------------------------------------------
 # GIS: always-enabled
 # -----------------------------------------------------------------------------
@@ -127,6 +171,9 @@ def gis_update_location_tree(feature, user_id=None):
     # Run the Task & return the result
     feature = json.loads(feature)
     path = gis.update_location_tree(feature)
+    if settings.get_gis_geometry_pyramid():
+        # Update the geometry pyramid for this feature
+        gis.update_geometry_levels([feature["id"]])
     db.commit()
     return path
 
@@ -151,6 +198,8 @@ tasks = {"dummy": dummy,
          "s3db_task": s3db_task,
          "settings_task": settings_task,
          "maintenance": maintenance,
+         "s3_hierarchy_rebuild": s3_hierarchy_rebuild,
+         "s3_permission_store_realm_set": s3_permission_store_realm_set,
          "gis_download_kml": gis_download_kml,
          "gis_update_location_tree": gis_update_location_tree,
          "org_site_check": org_site_check,
@@ -405,6 +454,24 @@ if has_module("msg"):
 
     tasks["notify_notify"] = notify_notify
 
+    # -------------------------------------------------------------------------
+    def notify_notify_batch(resource_ids, user_id=None):
+        """
+            Asynchronous task to notify a batch of subscribers about
+            resource updates, in-process. This task is created by
+            notify_check_subscriptions if settings.msg.notify_batch
+            is enabled.
+
+            @param resource_ids: the pr_subscription_resource record IDs
+        """
+        if user_id:
+            auth.s3_impersonate(user_id)
+
+        notify = s3base.S3Notifications
+        return notify.notify_batch(resource_ids)
+
+    tasks["notify_notify_batch"] = notify_notify_batch
+
 # -----------------------------------------------------------------------------
 if has_module("req"):
 
@@ -649,4 +716,6 @@ scheduler_task_id = S3ReusableField("scheduler_task_id",
                                     ondelete = "CASCADE")
 s3.scheduler_task_id = scheduler_task_id
 
+current.profiler.mark("tasks.py")
+
 # END =========================================================================
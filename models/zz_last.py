@@ -7,6 +7,9 @@
 # Pass Theme to Compiler
 settings.set_theme()
 
+# Rebuild the model index if outdated
+s3db.update_index()
+
 # Empty dict to store custom CRUD views
 s3.views = {}
 
@@ -62,4 +65,10 @@ if rest_controllers and (c, f) in rest_controllers:
 #from plugins import PluginLoader
 #PluginLoader.setup_all()
 
+# Store the startup timings of this request, and write
+# the aggregated timings to the log at regular intervals
+current.profiler.mark("zz_last.py")
+current.profiler.commit()
+current.profiler.flush()
+
 # END =========================================================================
@@ -136,6 +136,9 @@ if len(pop_list) > 0:
     # Create indexes for permission table
     auth.permission.create_indexes()
 
+    # Create index for pending scheduler tasks
+    s3task.create_indexes()
+
     # =========================================================================
     # Configure Scheduled Tasks
     #
@@ -193,8 +196,8 @@ if len(pop_list) > 0:
 
     # Override authorization
     auth.override = True
-    # No location tree updates
-    gis.disable_update_location_tree = True
+    # Defer location tree updates (bulk update at the end)
+    gis.defer_location_tree()
 
     # Load all Models to ensure all DB tables present
     s3db.load_all_models()
@@ -351,17 +354,17 @@ if len(pop_list) > 0:
 
     # Restore Auth
     auth.override = False
-    # Enable location tree updates
-    gis.disable_update_location_tree = False
 
     try:
         from shapely.wkt import loads as wkt_loads
     except ImportError:
         info("Skipping GIS location tree update as Shapely not installed...")
+        # Discard the deferred location tree updates
+        s3base.GIS.deferred_location_tree = None
     else:
-        # Update Location Tree (disabled during prepop)
+        # Update Location Tree (deferred during prepop)
         start = datetime.datetime.now()
-        gis.update_location_tree()
+        gis.flush_location_tree(rebuild_all=True)
         duration("Location Tree update completed", start)
 
     # Countries are only editable by MapAdmin
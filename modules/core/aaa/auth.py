@@ -3983,11 +3983,9 @@ Please go to %(url)s to approve this user."""
     def s3_set_roles(self):
         """ Update pe_id, roles and realms for the current user """
 
-        session = current.session
+        start = time.perf_counter()
 
-        s3 = current.response.s3
-        if "restricted_tables" in s3:
-            del s3["restricted_tables"]
+        session = current.session
 
         permission = self.permission
         permission.clear_cache()
@@ -4104,6 +4102,10 @@ Please go to %(url)s to approve this user."""
                 # Anonymous role has no realm
                 self.user["realms"][ANONYMOUS] = None
 
+        profiler = getattr(current, "profiler", None)
+        if profiler:
+            profiler.add("auth", "s3_set_roles", time.perf_counter() - start)
+
     # -------------------------------------------------------------------------
     def s3_create_role(self, role, description=None, *acls, **args):
         """
@@ -4211,6 +4213,7 @@ Please go to %(url)s to approve this user."""
             # Remove all permission rules for this role
             ptable = self.permission.table
             db(ptable.group_id == group_id).update(**data)
+            self.permission.invalidate_acls()
 
             # Remove the role
             deleted_uuid = "%s-deleted-%s" % (uuid4().hex[-12:], role.uuid[:40])
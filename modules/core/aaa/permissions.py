@@ -28,6 +28,9 @@
 __all__ = ("S3Permission",
            )
 
+import datetime
+import threading
+
 from collections import OrderedDict
 
 from gluon import current, redirect, HTTP, URL
@@ -35,7 +38,7 @@ from gluon.storage import Storage
 
 from s3dal import Field, Row, Table, original_tablename
 
-from ..model import S3MetaFields
+from ..model import DataModel, S3MetaFields
 from ..errors import S3PermissionError
 from ..tools import s3_get_extension
 
@@ -84,6 +87,20 @@ class S3Permission:
                "publish": PUBLISH,
                }
 
+    # Compiled ACLs, shared by all requests of this process
+    # {uri_hash: (version, stamp, acls)}
+    compiled_acls = {}
+    compiled_acls_lock = threading.Lock()
+
+    # Version of the compiled ACLs in this process, bumped by invalidate_acls
+    acl_version = 0
+
+    # Realm sets larger than this are stored in the database and
+    # referenced by a subquery, rather than inlined as list of literals
+    REALM_SET_THRESHOLD = 100
+    REALM_SET_TABLE = "s3_permission_realm"
+    REALM_ENTITY_TABLE = "s3_permission_realm_entity"
+
     # -------------------------------------------------------------------------
     def __init__(self, auth, tablename=None):
         """
@@ -149,6 +166,12 @@ class S3Permission:
         self.permission_cache = {}
         self.query_cache = {}
 
+        # Compiled ACLs (loaded lazily, see acls)
+        self._acls = None
+
+        # Stored realm sets used in this request {uid: set_id}
+        self.realm_sets = {}
+
         # Pages which never require permission:
         # Make sure that any data access via these pages uses
         # accessible_query explicitly!
@@ -230,6 +253,29 @@ class S3Permission:
                             )
             self.table = db[self.tablename]
 
+        db = current.db
+        if self.REALM_SET_TABLE not in db:
+            # Realm sets, identified by a hash of their entities
+            db.define_table(self.REALM_SET_TABLE,
+                            Field("uid", length=64),
+                            Field("size", "integer"),
+                            Field("accessed_on", "datetime"),
+                            migrate = migrate,
+                            fake_migrate = fake_migrate,
+                            )
+        if self.REALM_ENTITY_TABLE not in db:
+            # Entities in a realm set
+            db.define_table(self.REALM_ENTITY_TABLE,
+                            Field("set_id", "integer"),
+                            Field("pe_id", "integer"),
+                            migrate = migrate,
+                            fake_migrate = fake_migrate,
+                            )
+
+        # Indexes for realm set lookups
+        DataModel.create_indexes(self.REALM_SET_TABLE, "uid")
+        DataModel.create_indexes(self.REALM_ENTITY_TABLE, "set_id")
+
     # -------------------------------------------------------------------------
     def create_indexes(self):
         """
@@ -322,9 +368,6 @@ class S3Permission:
             # ACLs not relevant to this security policy
             return None
 
-        s3 = current.response.s3
-        if "restricted_tables" in s3:
-            del s3["restricted_tables"]
         self.clear_cache()
 
         if c is None and f is None and t is None:
@@ -394,6 +437,9 @@ class S3Permission:
                     acl["group_id"] = group_id
                     success = table.insert(**acl)
 
+        if success:
+            self.invalidate_acls()
+
         return success
 
     # -------------------------------------------------------------------------
@@ -426,6 +472,107 @@ class S3Permission:
                                delete = True
                                )
 
+    # -------------------------------------------------------------------------
+    @property
+    def acls(self):
+        """
+            The compiled ACLs, loaded once per request
+
+            Returns:
+                the compiled ACLs (see compile_acls)
+        """
+
+        acls = self._acls
+        if acls is None:
+            acls = self._acls = self.compile_acls()
+        return acls
+
+    # -------------------------------------------------------------------------
+    def compile_acls(self):
+        """
+            Get the compiled ACLs for the current DB; these are built once
+            per process, and rebuilt when ACLs have been modified, i.e.
+                - in this process: update_acl bumps the acl_version
+                - in other processes: detected by a stamp of the ACLs, i.e.
+                  their number, highest ID, and checksums of modification
+                  dates and permission bits (a maximum modification date
+                  alone would miss edits with earlier time stamps, e.g.
+                  from concurrent requests or servers with clock skew)
+
+            Returns:
+                dict {"pages": {(group_id, c, f): rules},
+                      "tables": {(group_id, tablename): rules},
+                      "restricted": set of restricted table names,
+                      }, with rules being a list of tuples
+                      (unrestricted, entity, uacl, oacl)
+        """
+
+        db = current.db
+        table = self.table
+
+        key = db._uri_hash
+        version = S3Permission.acl_version
+
+        aggregates = (table.id.count(),
+                      table.id.max(),
+                      table.modified_on.epoch().sum(),
+                      table.uacl.sum(),
+                      table.oacl.sum(),
+                      )
+        row = db(table.deleted == False).select(*aggregates).first()
+        stamp = tuple(row[aggregate] for aggregate in aggregates)
+
+        compiled = S3Permission.compiled_acls.get(key)
+        if compiled and compiled[0] == version and compiled[1] == stamp:
+            return compiled[2]
+
+        rows = db(table.deleted == False).select(table.group_id,
+                                                 table.controller,
+                                                 table.function,
+                                                 table.tablename,
+                                                 table.unrestricted,
+                                                 table.entity,
+                                                 table.uacl,
+                                                 table.oacl,
+                                                 )
+        pages, tables, restricted = {}, {}, set()
+        for row in rows:
+            rule = (row.unrestricted, row.entity, row.uacl, row.oacl)
+            if row.controller is not None:
+                # Page rule (controller or function)
+                rules = pages.setdefault((row.group_id, row.controller, row.function), [])
+            elif row.function is None and row.tablename is not None:
+                # Table rule
+                rules = tables.setdefault((row.group_id, row.tablename), [])
+                restricted.add(row.tablename)
+            else:
+                continue
+            rules.append(rule)
+
+        acls = {"pages": pages,
+                "tables": tables,
+                "restricted": restricted,
+                }
+
+        with S3Permission.compiled_acls_lock:
+            if S3Permission.acl_version == version:
+                S3Permission.compiled_acls[key] = (version, stamp, acls)
+
+        return acls
+
+    # -------------------------------------------------------------------------
+    def invalidate_acls(self):
+        """
+            Invalidate the compiled ACLs, to be called after modifying ACLs
+        """
+
+        with S3Permission.compiled_acls_lock:
+            S3Permission.acl_version += 1
+            S3Permission.compiled_acls.pop(current.db._uri_hash, None)
+
+        self._acls = None
+        self.clear_cache()
+
     # -------------------------------------------------------------------------
     # Record Ownership
     # -------------------------------------------------------------------------
@@ -671,7 +818,8 @@ class S3Permission:
                     role_realm = set(role_realm) - no_realm
 
                     if role_realm:
-                        q = (table[OGRP] == group_id) & (table[OENT].belongs(role_realm))
+                        q = (table[OGRP] == group_id) & \
+                            self.realm_belongs(table[OENT], role_realm)
                         if g is None:
                             g = q
                         else:
@@ -691,8 +839,7 @@ class S3Permission:
         return query
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def realm_query(table, entities):
+    def realm_query(self, table, entities):
         """
             Returns a query to select the records owned by one of the entities.
 
@@ -713,10 +860,181 @@ class S3Permission:
             if len(entities) == 1:
                 query = (table[OENT] == entities[0]) | public
             else:
-                query = (table[OENT].belongs(entities)) | public
+                query = self.realm_belongs(table[OENT], entities) | public
 
         return query
 
+    # -------------------------------------------------------------------------
+    def realm_belongs(self, field, entities):
+        """
+            Returns a query to select records with a realm entity field
+            value in a set of entities; large sets are stored in the
+            database and referenced by a subquery, so that the size of
+            the query does not depend on the size of the realm
+
+            Args:
+                field: the realm entity Field
+                entities: iterable of pe_ids
+
+            Returns:
+                a web2py Query instance
+        """
+
+        entities = set(entities)
+        if len(entities) <= self.REALM_SET_THRESHOLD:
+            return field.belongs(entities)
+
+        set_id = self.realm_set(entities)
+        if set_id is None:
+            # Realm set not stored yet
+            return field.belongs(entities)
+
+        etable = current.db[self.REALM_ENTITY_TABLE]
+
+        subquery = current.db(etable.set_id == set_id)._select(etable.pe_id)
+        return field.belongs(subquery)
+
+    # -------------------------------------------------------------------------
+    def realm_set(self, entities):
+        """
+            Looks up the stored realm set for a set of entities, queues
+            a task to store it if it doesn't exist yet
+
+            Args:
+                entities: set of pe_ids
+
+            Returns:
+                the realm set ID, or None if the set is not stored yet
+
+            Note:
+                - realm sets are immutable, and identified by a hash of
+                  their entities, so they can be shared by all users with
+                  the same realm
+                - new realm sets are stored asynchronously (store_realm_set),
+                  so that reading requests do not insert them
+                - the access date of a realm set is updated at most once
+                  a day, sets not accessed for some time can be removed
+                  with cleanup_realm_sets
+        """
+
+        pe_ids = sorted(entities)
+        uid = self.realm_set_uid(pe_ids)
+
+        realm_sets = self.realm_sets
+        if uid in realm_sets:
+            return realm_sets[uid]
+
+        db = current.db
+        stable = db[self.REALM_SET_TABLE]
+
+        now = current.request.utcnow
+        row = db(stable.uid == uid).select(stable.id,
+                                           stable.accessed_on,
+                                           limitby = (0, 1),
+                                           orderby = stable.id,
+                                           ).first()
+        if row:
+            set_id = row.id
+            if not row.accessed_on or \
+               row.accessed_on < now - datetime.timedelta(days=1):
+                row.update_record(accessed_on=now)
+        else:
+            set_id = None
+            current.s3task.schedule_task("s3_permission_store_realm_set",
+                                         args = [pe_ids],
+                                         timeout = 300,
+                                         user_id = False,
+                                         )
+
+        realm_sets[uid] = set_id
+        return set_id
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def store_realm_set(cls, entities):
+        """
+            Stores a realm set, unless it exists already; to be run as
+            asynchronous task
+
+            Args:
+                entities: iterable of pe_ids
+
+            Returns:
+                the realm set ID
+        """
+
+        pe_ids = sorted(set(entities))
+        uid = cls.realm_set_uid(pe_ids)
+
+        db = current.db
+        stable = db[cls.REALM_SET_TABLE]
+
+        row = db(stable.uid == uid).select(stable.id,
+                                           limitby = (0, 1),
+                                           orderby = stable.id,
+                                           ).first()
+        if row:
+            return row.id
+
+        # Concurrent tasks may create the same set twice, which
+        # is harmless since either copy is complete when visible
+        set_id = stable.insert(uid = uid,
+                               size = len(pe_ids),
+                               accessed_on = current.request.utcnow,
+                               )
+        etable = db[cls.REALM_ENTITY_TABLE]
+        etable.bulk_insert([{"set_id": set_id, "pe_id": pe_id}
+                            for pe_id in pe_ids
+                            ])
+        return set_id
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def realm_set_uid(pe_ids):
+        """
+            Generates the unique identifier of a realm set
+
+            Args:
+                pe_ids: the sorted list of pe_ids in the set
+
+            Returns:
+                the identifier (hex digest)
+        """
+
+        from hashlib import sha256
+
+        return sha256(",".join(str(pe_id) for pe_id in pe_ids).encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cleanup_realm_sets(cls, days=7):
+        """
+            Removes stored realm sets which have not been accessed for
+            a number of days, to be run by a maintenance task
+
+            Args:
+                days: the number of days
+
+            Returns:
+                the number of realm sets removed
+        """
+
+        db = current.db
+        if cls.REALM_SET_TABLE not in db:
+            return 0
+
+        stable = db[cls.REALM_SET_TABLE]
+        etable = db[cls.REALM_ENTITY_TABLE]
+
+        earliest = current.request.utcnow - datetime.timedelta(days=days)
+        query = (stable.accessed_on < earliest) | (stable.accessed_on == None)
+        set_ids = [row.id for row in db(query).select(stable.id)]
+        if set_ids:
+            db(etable.set_id.belongs(set_ids)).delete()
+            db(stable.id.belongs(set_ids)).delete()
+
+        return len(set_ids)
+
     # -------------------------------------------------------------------------
     def permitted_realms(self, tablename, method="read", c=None, f=None):
         """
@@ -1438,92 +1756,58 @@ class S3Permission:
             # No roles available (deny all)
             return acls
 
-        db = current.db
-        table = self.table
-
         c = c or self.controller
         f = f or self.function
         page_restricted = self.page_restricted(c=c, f=f)
 
-        # Base query
-        query = (table.group_id.belongs(roles)) & \
-                (table.deleted == False)
+        compiled = self.acls
+
+        # Collect the rules as tuples (group_id, rule type, rule)
+        rules = []
+        append = rules.append
 
         # Page ACLs
         if page_restricted:
-            q = (table.function == None)
-            if f and self.use_facls:
-                q |= (table.function == f)
-            q = (table.controller == c) & q
-        else:
-            q = None
+            pages = compiled["pages"]
+            for group_id in roles:
+                for rule in pages.get((group_id, c, None), ()):
+                    append((group_id, "c", rule))
+                if f and self.use_facls:
+                    for rule in pages.get((group_id, c, f), ()):
+                        append((group_id, "f", rule))
 
         # Table ACLs
         if t and self.use_tacls:
             # Be sure to use the original table name
             if hasattr(t, "_tablename"):
                 t = original_tablename(t)
-            tq = (table.tablename == t) & \
-                 (table.controller == None) & \
-                 (table.function == None)
-            q = tq if q is None else q | tq
-            table_restricted = self.table_restricted(t)
+            tables = compiled["tables"]
+            for group_id in roles:
+                for rule in tables.get((group_id, t), ()):
+                    append((group_id, "t", rule))
+            table_restricted = t in compiled["restricted"]
         else:
             table_restricted = False
 
-        # Retrieve the ACLs
-        if q is not None:
-            query = q & query
-            rows = db(query).select(table.group_id,
-                                    table.controller,
-                                    table.function,
-                                    table.tablename,
-                                    table.unrestricted,
-                                    table.entity,
-                                    table.uacl,
-                                    table.oacl,
-                                    cacheable = True,
-                                    )
-        else:
-            rows = []
-
         # Cascade ACLs
         ANY = "ANY"
 
         ALL = (self.ALL, self.ALL)
         NONE = (self.NONE, self.NONE)
 
-        use_facls = self.use_facls
-        def rule_type(r):
-            if r.controller is not None:
-                if r.function is None:
-                    return "c"
-                elif use_facls:
-                    return "f"
-            elif r.tablename is not None:
-                return "t"
-            return None
-
         most_permissive = lambda x, y: (x[0] | y[0], x[1] | y[1])
         most_restrictive = lambda x, y: (x[0] & y[0], x[1] & y[1])
 
         # Realms
         use_realms = self.entity_realm
-        for row in rows:
+        for group_id, rtype, (unrestricted, entity_id, uacl, oacl) in rules:
 
             # Get the assigning entities
-            group_id = row.group_id
-            if group_id not in realms:
-                continue
-            rtype = rule_type(row)
-            if rtype is None:
-                continue
-
             if use_realms:
-                if row.unrestricted:
+                if unrestricted:
                     entities = [ANY]
-                elif row.entity is not None:
-                    entities = [row.entity]
+                elif entity_id is not None:
+                    entities = [entity_id]
                 else:
                     entities = realms[group_id]
                 if entities is None:
@@ -1532,7 +1816,7 @@ class S3Permission:
                 entities = [ANY]
 
             # Merge the ACL
-            acl = (row["uacl"], row["oacl"])
+            acl = (uacl, oacl)
             for e in entities:
                 if e in acls:
                     eacls = acls[e]
@@ -1667,19 +1951,10 @@ class S3Permission:
                 t: the table name or Table
         """
 
-        s3 = current.response.s3
-
-        if not "restricted_tables" in s3:
-            table = self.table
-            query = (table.controller == None) & \
-                    (table.function == None) & \
-                    (table.deleted == False)
-            rows = current.db(query).select(table.tablename,
-                                            groupby = table.tablename,
-                                            )
-            s3.restricted_tables = [row.tablename for row in rows]
+        if not self.table:
+            return False
 
-        return str(t) in s3.restricted_tables
+        return str(t) in self.acls["restricted"]
 
     # -------------------------------------------------------------------------
     def hidden_modules(self):
@@ -38,12 +38,14 @@ __all__ = ("S3FilterWidget",
            "S3NotEmptyFilter",
            "S3EmptyFilter",
            "S3FilterForm",
+           "S3FilterOptions",
            "S3FilterString",
            "s3_get_filter_opts",
            "s3_set_default_filter",
            )
 
 import datetime
+import hashlib
 import json
 import re
 
@@ -2394,6 +2396,9 @@ class S3OptionsFilter(S3FilterWidget):
 
     alternatives = ["anyof", "contains"]
 
+    # Option keys prefetched by S3FilterOptions, tuple (resource, keys)
+    _prefetched = None
+
     # -------------------------------------------------------------------------
     def widget(self, resource, values):
         """
@@ -2622,83 +2627,34 @@ class S3OptionsFilter(S3FilterWidget):
                 #    deciding this would be even less scalable, hence:
                 # @todo: implement a widget option to enforce forward-lookup if
                 #        the look-up table is the big table
-                rows = None
+                rows = opt_keys = None
                 if field:
-                    ktablename, key, m = s3_get_foreign_key(field, m2m=False)
-                    if ktablename:
+                    lookup = self._lookup(resource, rfield)
+                else:
+                    lookup = None
+                if lookup:
+                    multiple = lookup.multiple
 
-                        multiple = m
+                    # Option keys prefetched for the whole filter form?
+                    prefetched = self._prefetched
+                    if prefetched and prefetched[0] is resource:
+                        opt_keys = list(prefetched[1])
 
-                        ktable = current.s3db.table(ktablename)
-                        key_field = ktable[key]
+                    elif lookup.reverse:
+                        key_field = lookup.key
                         colname = str(key_field)
-
-                        # Find only values linked to records the user is
-                        # permitted to read, and apply any resource filters
-                        # (= use the resource query)
-                        query = resource.get_query()
-
-                        # Must include rfilter joins when using the resource
-                        # query (both inner and left):
-                        rfilter = resource.rfilter
-                        if rfilter:
-                            join = rfilter.get_joins()
-                            left = rfilter.get_joins(left=True)
-                        else:
-                            join = left = None
-
-                        # The actual query for the look-up table
-                        # NB the inner join here is required even if rfilter
-                        #    already left-joins the look-up table, because we
-                        #    must make sure look-up values are indeed linked
-                        #    to the resource => not redundant!
-                        query &= (key_field == field) & \
-                                 current.auth.s3_accessible_query("read", ktable)
-
-                        # Exclude deleted keys
-                        # => there should be no references to deleted keys, so
-                        #    they are already excluded by (key_field == field),
-                        #    hence this is redundant:
-                        #if "deleted" in ktable.fields:
-                        #    query &= (ktable.deleted == False)
-
-                        # If the filter field is in a joined table itself,
-                        # then we also need the join for that table (this
-                        # could be redundant, but checking that will likely
-                        # take more effort than we can save by avoiding it)
-                        joins = rfield.join
-                        for tname in joins:
-                            query &= joins[tname]
-
-                        # Filter options by location?
-                        location_filter = opts.get("location_filter")
-                        if location_filter and "location_id" in ktable:
-                            location = current.session.s3.location_filter
-                            if location:
-                                query &= (ktable.location_id == location)
-
-                        # Filter options by organisation?
-                        org_filter = opts.get("org_filter")
-                        if org_filter and "organisation_id" in ktable:
-                            root_org = current.auth.root_org()
-                            if root_org:
-                                query &= ((ktable.organisation_id == root_org) | \
-                                          (ktable.organisation_id == None))
-                            #else:
-                            #    query &= (ktable.organisation_id == None)
-
-                        rows = current.db(query).select(key_field,
-                                                        resource._id.min(),
-                                                        groupby = key_field,
-                                                        join = join,
-                                                        left = left,
-                                                        )
+                        rows = current.db(lookup.query).select(key_field,
+                                                               resource._id.min(),
+                                                               groupby = key_field,
+                                                               join = lookup.join,
+                                                               left = lookup.left,
+                                                               )
 
                 # If we can not perform a reverse lookup, then we need
                 # to do a forward lookup of all unique values of the
                 # search field from all records in the table :/ still ok,
                 # but not endlessly scalable:
-                if rows is None:
+                if opt_keys is None and rows is None:
                     rows = resource.select([selector],
                                            limit = None,
                                            orderby = field,
@@ -2707,7 +2663,8 @@ class S3OptionsFilter(S3FilterWidget):
                                            as_rows = True,
                                            )
 
-                opt_keys = [] # Can't use set => would make orderby pointless
+                if opt_keys is None:
+                    opt_keys = [] # Can't use set => would make orderby pointless
                 if rows:
                     kappend = opt_keys.append
                     kextend = opt_keys.extend
@@ -2862,6 +2819,108 @@ class S3OptionsFilter(S3FilterWidget):
         # Sort the options
         return (ftype, options, opts.get("no_opts", NOOPT))
 
+    # -------------------------------------------------------------------------
+    def _lookup(self, resource, rfield):
+        """
+            Determine the database query to look up the option keys
+            for this widget
+
+            Args:
+                resource: the CRUDResource
+                rfield: the S3ResourceField for the filter field
+
+            Returns:
+                Storage with the lookup query, joins and key field, or None
+                if the option keys can not be found with a simple query
+        """
+
+        opts = self.opts
+
+        field = rfield.field
+        if field is None or opts.options is not None:
+            return None
+
+        # Find only values linked to records the user is
+        # permitted to read, and apply any resource filters
+        # (= use the resource query)
+        query = resource.get_query()
+
+        # Must include rfilter joins when using the resource
+        # query (both inner and left):
+        rfilter = resource.rfilter
+        if rfilter:
+            join = rfilter.get_joins()
+            left = rfilter.get_joins(left=True)
+        else:
+            join = left = None
+
+        ktablename, key, multiple = s3_get_foreign_key(field, m2m=False)
+        if not ktablename:
+            # Forward lookup of unique values, only possible with a
+            # simple query for plain fields in the master table
+            ftype = rfield.ftype
+            if rfield.tname != resource.tablename or \
+               ftype not in ("string", "integer"):
+                return None
+            return Storage(query = query,
+                           join = join,
+                           left = left,
+                           key = field,
+                           multiple = False,
+                           reverse = False,
+                           )
+
+        ktable = current.s3db.table(ktablename)
+        key_field = ktable[key]
+
+        # The actual query for the look-up table
+        # NB the inner join here is required even if rfilter
+        #    already left-joins the look-up table, because we
+        #    must make sure look-up values are indeed linked
+        #    to the resource => not redundant!
+        query &= (key_field == field) & \
+                 current.auth.s3_accessible_query("read", ktable)
+
+        # Exclude deleted keys
+        # => there should be no references to deleted keys, so
+        #    they are already excluded by (key_field == field),
+        #    hence this is redundant:
+        #if "deleted" in ktable.fields:
+        #    query &= (ktable.deleted == False)
+
+        # If the filter field is in a joined table itself,
+        # then we also need the join for that table (this
+        # could be redundant, but checking that will likely
+        # take more effort than we can save by avoiding it)
+        joins = rfield.join
+        for tname in joins:
+            query &= joins[tname]
+
+        # Filter options by location?
+        location_filter = opts.get("location_filter")
+        if location_filter and "location_id" in ktable:
+            location = current.session.s3.location_filter
+            if location:
+                query &= (ktable.location_id == location)
+
+        # Filter options by organisation?
+        org_filter = opts.get("org_filter")
+        if org_filter and "organisation_id" in ktable:
+            root_org = current.auth.root_org()
+            if root_org:
+                query &= ((ktable.organisation_id == root_org) | \
+                          (ktable.organisation_id == None))
+            #else:
+            #    query &= (ktable.organisation_id == None)
+
+        return Storage(query = query,
+                       join = join,
+                       left = left,
+                       key = key_field,
+                       multiple = multiple,
+                       reverse = True,
+                       )
+
     # -------------------------------------------------------------------------
     @staticmethod
     def _values(get_vars, variable):
@@ -3097,6 +3156,159 @@ class S3EmptyFilter(S3FilterWidget):
 
         return INPUT(**attr)
 
+# =============================================================================
+class S3FilterOptions:
+    """
+        Helper to look up the option keys for all S3OptionsFilter widgets
+        of a filter form in a single batched query (UNION ALL of the
+        per-widget lookups over the resource query), optionally caching
+        the results per resource filter and user realms
+    """
+
+    def __init__(self, resource, widgets):
+        """
+            Args:
+                resource: the CRUDResource
+                widgets: the filter widgets (list)
+        """
+
+        self.resource = resource
+        self.widgets = widgets
+
+    # -------------------------------------------------------------------------
+    def prefetch(self):
+        """
+            Look up the option keys for all eligible widgets, and hand
+            them over to the widgets (so that S3OptionsFilter._options
+            does not need to query the database per widget)
+
+            Returns:
+                the number of widgets with prefetched options
+        """
+
+        resource = self.resource
+        if resource is None:
+            return 0
+
+        db = current.db
+
+        # Collect the lookup queries, grouped by the type of the option
+        # keys (all sub-queries of a UNION must return the same type)
+        lookups = {}
+        for widget in self.widgets:
+            if not isinstance(widget, S3OptionsFilter):
+                continue
+            widget._prefetched = None
+
+            selector = widget.field
+            if isinstance(selector, (tuple, list)):
+                selector = selector[0]
+            try:
+                rfield = S3ResourceField(resource, selector)
+            except (AttributeError, SyntaxError):
+                continue
+            lookup = widget._lookup(resource, rfield)
+            if not lookup:
+                continue
+
+            key = lookup.key
+            ktype = key.type
+            if ktype == "id" or ktype[:9] == "reference":
+                ktype = "integer"
+            elif ktype not in ("integer", "string"):
+                continue
+
+            sql = db(lookup.query)._select(key.with_alias("opt"),
+                                           distinct = True,
+                                           join = lookup.join,
+                                           left = lookup.left,
+                                           )
+            lookups.setdefault(ktype, []).append((widget, sql.rstrip(";")))
+
+        if not lookups:
+            return 0
+
+        # Build one statement per key type
+        widgets = []
+        statements = []
+        for ktype in sorted(lookups):
+            subqueries = []
+            for widget, sql in lookups[ktype]:
+                index = len(widgets)
+                widgets.append(widget)
+                subqueries.append("SELECT %s AS widget, s%s.opt AS opt FROM (%s) s%s" %
+                                  (index, index, sql, index))
+            statements.append("%s ORDER BY widget, opt;" % " UNION ALL ".join(subqueries))
+
+        # Look up the option keys (from cache if possible)
+        cache_key, stamp = self.cache_key(statements)
+        keys = None
+        if cache_key:
+            expire = current.deployment_settings.get_search_filter_options_cache()
+            cached = current.cache.ram(cache_key,
+                                       lambda: None,
+                                       time_expire = expire,
+                                       )
+            if cached and cached[0] == stamp:
+                keys = cached[1]
+        if keys is None:
+            keys = {}
+            for statement in statements:
+                for index, value in db.executesql(statement):
+                    keys.setdefault(index, []).append(value)
+            if cache_key:
+                # time_expire=0 replaces the current cache entry
+                current.cache.ram(cache_key,
+                                  lambda: (stamp, keys),
+                                  time_expire = 0,
+                                  )
+
+        # Hand over the option keys to the widgets
+        for index, widget in enumerate(widgets):
+            widget._prefetched = (resource, keys.get(index, []))
+
+        return len(widgets)
+
+    # -------------------------------------------------------------------------
+    def cache_key(self, statements):
+        """
+            Generate a cache key for the option keys looked up by the
+            given statements, and look up the current version of the
+            master table (cached option keys are only valid for the same
+            version)
+
+            Args:
+                statements: the SQL statements for the lookup
+
+            Returns:
+                tuple (key, stamp), or (None, None) if option keys shall
+                not be cached
+
+            Note:
+                the table version only registers writes in this process,
+                options from writes in other processes are updated as the
+                cache expires (settings.search.filter_options_cache)
+        """
+
+        if not current.deployment_settings.get_search_filter_options_cache():
+            return None, None
+
+        table = self.resource.table
+        stamp = current.s3db.table_version(table)
+
+        # Option keys depend on the resource filter (contained in the SQL)
+        # and on the realms of the current user
+        user = current.auth.user
+        realms = user.realms if user else None
+
+        key = "%s|%s|%s" % (table._tablename,
+                            "|".join(statements),
+                            json.dumps(realms, sort_keys=True, default=str),
+                            )
+        key = "filter_options_%s" % hashlib.md5(key.encode("utf-8")).hexdigest()
+
+        return key, stamp
+
 # =============================================================================
 class S3FilterForm:
     """ Helper class to construct and render a filter form for a resource """
@@ -3378,6 +3590,9 @@ class S3FilterForm:
                 a list of form rows
         """
 
+        # Look up the options for all options filters at once
+        S3FilterOptions(resource, self.widgets).prefetch()
+
         rows = []
         rappend = rows.append
         advanced = False
@@ -1,2 +1,4 @@
 from .base import GIS
+from .index import SpatialIndex
+from .tiles import MVTLayer, VectorTiles
 from .widgets import MAP, MAP2
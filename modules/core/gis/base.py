@@ -46,7 +46,7 @@ from gluon.storage import Storage
 
 from s3dal import Rows
 
-from ..tools import JSONSEPARATORS, S3Trackable, s3_str
+from ..tools import JSONSEPARATORS, S3Trackable, s3_savepoint, s3_str
 
 KML_NAMESPACE = "http://earth.google.com/kml/2.2"
 
@@ -196,11 +196,19 @@ class GIS:
         GeoSpatial functions
     """
 
-    # Used to disable location tree updates during prepopulate.
-    # It is not appropriate to use auth.override for this, as there are times
-    # (e.g. during tests) when auth.override is turned on, but location tree
-    # updates should still be enabled.
-    disable_update_location_tree = False
+    # Location tree updates deferred until flush_location_tree (e.g. during
+    # prepopulate): set of location IDs (None = all locations), or None if
+    # not deferring. It is not appropriate to use auth.override for this,
+    # as there are times (e.g. during tests) when auth.override is turned
+    # on, but location tree updates should still be enabled.
+    deferred_location_tree = None
+
+    # Levels of the geometry pyramid (gis_location_geometry),
+    # as tuples (tolerance, precision), from coarse to fine
+    GEOMETRY_LEVELS = ((0.01, 3),
+                       (0.001, 4),
+                       (0.0001, 5),
+                       )
 
     def __init__(self):
         messages = current.messages
@@ -982,7 +990,7 @@ class GIS:
             This is used to validate lat, lon, and bounds for child locations.
 
             Caution: This calls update_location_tree if the parent bounds are
-            not set. During prepopulate, update_location_tree is disabled,
+            not set. During prepopulate, update_location_tree is deferred,
             so unless the parent contains its own bounds (i.e. they do not need
             to be propagated down from its ancestors), this will not provide a
             check on location nesting. Prepopulate data should be prepared to
@@ -1157,7 +1165,7 @@ class GIS:
             Assists lazy update of a database without location paths by calling
             update_location_tree to get the path.
 
-            Note that during prepopulate, update_location_tree is disabled,
+            Note that during prepopulate, update_location_tree is deferred,
             in which case this will only return the immediate parent.
         """
 
@@ -2020,6 +2028,17 @@ class GIS:
             query &= (table.deleted == False)
         # @ToDo: Check AAA (do this as a resource filter?)
 
+        index = self.get_spatial_index()
+        if index:
+            # Use the spatial index
+            location_ids = index.intersects(polygon)
+            query &= (locations.id.belongs(location_ids))
+            return db(query).select(locations.wkt,
+                                    locations.lat,
+                                    locations.lon,
+                                    table.ALL
+                                    )
+
         features = db(query).select(locations.wkt,
                                     locations.lat,
                                     locations.lon,
@@ -2380,11 +2399,20 @@ class GIS:
         settings = current.deployment_settings
         tolerance = settings.get_gis_simplify_tolerance()
 
+        # Simplification level by requested zoom/bbox
+        if geojson and settings.get_gis_geometry_pyramid():
+            level = GIS.get_geometry_level(tolerance)
+        else:
+            level = None
+
         output = {}
 
         if settings.get_gis_spatialdb():
             if geojson:
-                precision = settings.get_gis_precision()
+                if level is not None:
+                    tolerance, precision = GIS.GEOMETRY_LEVELS[level]
+                else:
+                    precision = settings.get_gis_precision()
                 if tolerance:
                     # Do the Simplify & GeoJSON direct from the DB
                     web2py_installed_version = parse_version(global_settings.web2py_version)
@@ -2421,6 +2449,19 @@ class GIS:
                         output[key].append(row.wkt)
                     else:
                         output[key] = [row.wkt]
+        elif level is not None:
+            # Look up the simplified geometries from the geometry pyramid
+            geometries = GIS.get_simplified_geojson(query, table.id, level)
+            if join:
+                for key, g in geometries:
+                    if key in output:
+                        output[key].append(g)
+                    else:
+                        output[key] = [g]
+            else:
+                # gis_location: always single
+                for key, g in geometries:
+                    output[key] = g
         else:
             rows = db(query).select(table.id,
                                     gtable.wkt)
@@ -2487,11 +2528,17 @@ class GIS:
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def get_location_data(resource, attr_fields=None, count=None):
+    def get_location_data(resource,
+                          attr_fields = None,
+                          count = None,
+                          format = None,
+                          layer_id = None,
+                          ):
         """
             Returns the locations, markers and popup tooltips for an XML export
             e.g. Feature Layers or Search results (Feature Resources)
             e.g. Exports in KML, GeoRSS or GPX format
+            e.g. Vector Tiles (VectorTiles)
 
             Called by S3ResourceTree
             Args:
@@ -2500,6 +2547,8 @@ class GIS:
                                   from get_vars or looking up in gis_layer_feature
             :param: count - total number of features
                            (can actually be more if features have multiple locations)
+            :param: format - the output format (default: request format)
+            :param: layer_id - the Feature Layer ID (default: "layer" get_var)
         """
 
         tablename = resource.tablename
@@ -2507,9 +2556,14 @@ class GIS:
             # Requires no special handling: XSLT uses normal fields
             return {}
 
-        format = current.auth.permission.format
-        geojson = format == "geojson"
-        if geojson:
+        if format is None:
+            format = current.auth.permission.format
+        # Vector tiles use the same data as GeoJSON, but always with
+        # markers, and not subject to max_features (the number of
+        # features is limited per tile, see VectorTiles.render)
+        mvt = format == "mvt"
+        geojson = mvt or format == "geojson"
+        if geojson and not mvt:
             if count and \
                count > current.deployment_settings.get_gis_max_features():
                 headers = {"Content-Type": "application/json"}
@@ -2556,7 +2610,8 @@ class GIS:
 
         layer = None
 
-        layer_id = get_vars.get("layer", None)
+        if layer_id is None:
+            layer_id = get_vars.get("layer", None)
         if layer_id:
             # Feature Layer
             # e.g. Search results loaded as a Feature Resource layer
@@ -2713,7 +2768,7 @@ class GIS:
                 #           duration,
                 #           )
 
-            _markers = get_vars.get("markers", None)
+            _markers = mvt or get_vars.get("markers", None)
             if _markers:
                 # Add a per-feature Marker
                 marker_fn = s3db.get_config(tablename, "marker_fn")
@@ -3156,12 +3211,18 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
         geojsons = {}
         settings = current.deployment_settings
         tolerance = settings.get_gis_simplify_tolerance()
+        precision = None
+        if settings.get_gis_geometry_pyramid():
+            # Vary simplification level & precision by requested zoom/bbox
+            level = GIS.get_geometry_level(tolerance)
+            if level is not None:
+                tolerance, precision = GIS.GEOMETRY_LEVELS[level]
         if settings.get_gis_spatialdb():
             # Do the Simplify & GeoJSON direct from the DB
             fields.remove("the_geom")
             fields.remove("wkt")
             _fields = [table[f] for f in fields]
-            rows = db(query).select(table.the_geom.st_simplify(tolerance).st_asgeojson(precision=4).with_alias("geojson"),
+            rows = db(query).select(table.the_geom.st_simplify(tolerance).st_asgeojson(precision=precision or 4).with_alias("geojson"),
                                     *_fields)
             for row in rows:
                 _row = row[tablename]
@@ -3179,7 +3240,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             for row in rows:
                 # Simplify the polygon to reduce download size
                 geojson = simplify(row.wkt, tolerance=tolerance,
-                                   output="geojson")
+                                   output="geojson",
+                                   precision=precision)
                 _id = row.id
                 if geojson:
                     geojsons[_id] = geojson
@@ -3228,10 +3290,6 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
         #    for row in rows:
         #        geojsons[row["gis_theme_data.id"]] = row.geojson
         #else:
-        rows = current.db(query).select(table.id,
-                                        gtable.level,
-                                        gtable.wkt)
-        simplify = GIS.simplify
         tolerance = {"L0": 0.01,
                      "L1": 0.005,
                      "L2": 0.00125,
@@ -3239,6 +3297,36 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                      "L4": 0.0003125,
                      "L5": 0.00015625,
                      }
+
+        if current.deployment_settings.get_gis_geometry_pyramid():
+            # Look up the simplified geometries from the geometry pyramid
+            get_geometry_level = GIS.get_geometry_level
+            levels = {}
+            rows = current.db(query).select(gtable.level,
+                                            groupby = gtable.level,
+                                            )
+            for row in rows:
+                level = get_geometry_level(tolerance.get(row.level))
+                if level is None:
+                    level = len(GIS.GEOMETRY_LEVELS) - 1
+                if level in levels:
+                    levels[level].append(row.level)
+                else:
+                    levels[level] = [row.level]
+            for level, lx in levels.items():
+                if None in lx:
+                    q = query & ((gtable.level.belongs(lx)) | (gtable.level == None))
+                else:
+                    q = query & (gtable.level.belongs(lx))
+                for record_id, geojson in GIS.get_simplified_geojson(q, table.id, level):
+                    geojsons[record_id] = geojson
+
+            return {"geojsons": {tablename: geojsons}}
+
+        rows = current.db(query).select(table.id,
+                                        gtable.level,
+                                        gtable.wkt)
+        simplify = GIS.simplify
         for row in rows:
             grow = row.gis_location
             # Simplify the polygon to reduce download size
@@ -4780,7 +4868,12 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         # During prepopulate, for efficiency, we don't update the location
         # tree, but rather leave that til after prepopulate is complete.
-        if GIS.disable_update_location_tree:
+        deferred = GIS.deferred_location_tree
+        if deferred is not None:
+            if not feature:
+                deferred.add(None)
+            elif "id" in feature:
+                deferred.add(int(feature["id"]))
             return None
 
         db = current.db
@@ -4869,29 +4962,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
 
         if not feature:
-            # We are updating all locations.
-            all_locations = True
-            # Do in chunks to save memory and also do in correct order
-            all_fields = (table.id, table.name, table.gis_feature_type,
-                          table.L0, table.L1, table.L2, table.L3, table.L4,
-                          table.lat, table.lon, table.wkt, table.inherited,
-                          # Handle Countries which start with Bounds set, yet are Points
-                          table.lat_min, table.lon_min, table.lat_max, table.lon_max,
-                          table.path, table.parent)
-            for level in ("L0", "L1", "L2", "L3", "L4", "L5", None):
-                query = (table.level == level) & (table.deleted == False)
-                try:
-                    features = db(query).select(*all_fields)
-                except MemoryError:
-                    current.log.error("S3GIS: Unable to update Location Tree for level %s: MemoryError" % level)
-                else:
-                    for feature in features:
-                        feature["level"] = level
-                        wkt = feature["wkt"]
-                        if wkt and not wkt.startswith("POI"):
-                            # Polygons aren't inherited
-                            feature["inherited"] = False
-                        update_location_tree(feature)  # all_locations is False here
+            # We are updating all locations => use bulk mode
+            GIS.rebuild_location_tree()
             # All Done!
             return None
 
@@ -5903,6 +5975,373 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         return _path
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def defer_location_tree():
+        """
+            Defer location tree updates until flush_location_tree (e.g.
+            during prepopulate), so that update_location_tree only records
+            the locations to update, and returns None
+        """
+
+        if GIS.deferred_location_tree is None:
+            GIS.deferred_location_tree = set()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def flush_location_tree(rebuild_all=False, progress=None):
+        """
+            Stop deferring location tree updates, and update the location
+            tree for all locations for which updates have been deferred
+            (in bulk mode)
+
+            Args:
+                rebuild_all: rebuild the whole location tree, regardless
+                             which updates have been deferred
+                progress: callback to report progress,
+                          see rebuild_location_tree
+
+            Returns:
+                the number of updated locations
+        """
+
+        deferred = GIS.deferred_location_tree
+        GIS.deferred_location_tree = None
+
+        if rebuild_all or deferred and None in deferred:
+            return GIS.rebuild_location_tree(progress=progress)
+        elif deferred:
+            return GIS.rebuild_location_tree(location_ids=deferred,
+                                             progress=progress,
+                                             )
+        return 0
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def rebuild_location_tree(location_ids=None, batch_size=500, progress=None):
+        """
+            Update GIS Locations' Materialized path, Lx locations, Lat/Lon
+            and Bounds in bulk mode, rather than feature by feature:
+                - loads the whole hierarchy at once (without geometries)
+                - computes the tree level by level in memory, parents first
+                - computes centroids and bounds only for polygons lacking them
+                - writes back only the changed locations, in batches
+
+            Args:
+                location_ids: update only these locations and their
+                              descendants (default: all locations)
+                batch_size: the number of locations to load geometries for,
+                            or to write back, at a time
+                progress: callback function(message, done, total) to report
+                          progress (default: log at info level)
+
+            Returns:
+                the number of updated locations
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        if progress is None:
+            def progress(message, done, total):
+                current.log.info("S3GIS", "%s: %s/%s" % (message, done, total))
+
+        LEVELS = ("L0", "L1", "L2", "L3", "L4", "L5")
+        BOUNDS = ("lat_min", "lat_max", "lon_min", "lon_max")
+
+        # Load the hierarchy
+        prefix = table.wkt[:3]
+        rows = db(table.deleted == False).select(table.id,
+                                                 table.parent,
+                                                 table.level,
+                                                 table.name,
+                                                 table.inherited,
+                                                 table.path,
+                                                 table.lat,
+                                                 table.lon,
+                                                 table.lat_min,
+                                                 table.lat_max,
+                                                 table.lon_min,
+                                                 table.lon_max,
+                                                 table.gis_feature_type,
+                                                 table.L0,
+                                                 table.L1,
+                                                 table.L2,
+                                                 table.L3,
+                                                 table.L4,
+                                                 table.L5,
+                                                 prefix,
+                                                 cacheable = True,
+                                                 )
+        nodes = {}
+        children = {}
+        for row in rows:
+            node = row.gis_location.as_dict()
+            node["prefix"] = row[prefix]
+            node_id = node["id"]
+            nodes[node_id] = node
+            parent = node["parent"]
+            if parent:
+                if parent in children:
+                    children[parent].append(node_id)
+                else:
+                    children[parent] = [node_id]
+        rows = None
+
+        # Determine which locations to update
+        if location_ids is not None:
+            affected = set()
+            pending = [i for i in location_ids if i in nodes]
+            while pending:
+                affected.update(pending)
+                pending = [child_id for node_id in pending
+                                    for child_id in children.get(node_id, ())
+                                    if child_id not in affected]
+            total = len(affected)
+        else:
+            affected = None
+            total = len(nodes)
+
+        changes = {}
+        def assign(node, fieldname, value):
+            # Set a new value, and record it if it differs
+            if node[fieldname] != value:
+                node[fieldname] = value
+                node_id = node["id"]
+                if node_id in changes:
+                    changes[node_id][fieldname] = value
+                else:
+                    changes[node_id] = {fieldname: value}
+
+        # Update defaults (modified_on etc.)
+        defaults = {}
+        for field in table:
+            update = field.update
+            if update is not None:
+                defaults[field.name] = update() if callable(update) else update
+
+        wkt_centroid = GIS.wkt_centroid
+        update_locations = GIS._update_locations
+
+        updated = done = 0
+
+        # Process the tree level by level, starting with the roots
+        generation = [node_id for node_id, node in nodes.items()
+                      if not node["parent"] or node["parent"] not in nodes]
+        visited = set(generation)
+        while generation:
+
+            if affected is not None:
+                current_ids = [i for i in generation if i in affected]
+            else:
+                current_ids = generation
+
+            # Compute centroids and bounds of polygons lacking them
+            missing = []
+            for node_id in current_ids:
+                node = nodes[node_id]
+                p = node["prefix"]
+                if p and not p.upper().startswith("POI") and \
+                   (node["lat"] is None or node["lon"] is None or
+                    any(node[fn] is None for fn in BOUNDS)):
+                    missing.append(node_id)
+            for index in range(0, len(missing), batch_size):
+                batch = missing[index:index + batch_size]
+                geometries = db(table.id.belongs(batch)).select(table.id,
+                                                                table.wkt,
+                                                                )
+                for row in geometries:
+                    node = nodes[row.id]
+                    form = Storage(vars = Storage(wkt = row.wkt),
+                                   errors = Storage(),
+                                   )
+                    form_vars = form.vars
+                    for fn in BOUNDS:
+                        form_vars[fn] = node[fn]
+                    wkt_centroid(form)
+                    if form.errors:
+                        current.log.error("S3GIS: %s" % form.errors)
+                        continue
+                    for fn in ("lat", "lon", "gis_feature_type") + BOUNDS:
+                        if fn in form_vars:
+                            assign(node, fn, form_vars[fn])
+                    if form_vars.wkt != row.wkt:
+                        # Cleaned by Shapely
+                        changes.setdefault(row.id, {})["wkt"] = form_vars.wkt
+                progress("Computing centroids", min(index + batch_size, len(missing)), len(missing))
+
+            # Compute path, Lx names and inherited Lat/Lon
+            for node_id in current_ids:
+                node = nodes[node_id]
+                level = node["level"]
+
+                parent = nodes.get(node["parent"]) if level != "L0" else None
+                names = dict.fromkeys(LEVELS)
+                if level == "L0":
+                    path = str(node_id)
+                elif parent:
+                    parent_level = parent["level"]
+                    if parent_level not in LEVELS or \
+                       level in LEVELS and parent_level >= level:
+                        current.log.error("Parent of %s Location ID %s has invalid level: %s is %s" % \
+                                          (level, node_id, parent["id"], parent_level))
+                        continue
+                    parent_path = parent["path"] or str(parent["id"])
+                    path = "%s/%s" % (parent_path, node_id)
+                    for l in LEVELS:
+                        names[l] = parent[l]
+                    names[parent_level] = parent["name"]
+                else:
+                    path = str(node_id)
+                if level in LEVELS:
+                    names[level] = node["name"]
+                    for l in LEVELS[LEVELS.index(level) + 1:]:
+                        names[l] = None
+
+                p = node["prefix"]
+                polygon = p and not p.upper().startswith("POI")
+                lat, lon = node["lat"], node["lon"]
+                inherited = node["inherited"]
+                if level == "L0" or polygon:
+                    # Polygons aren't inherited
+                    inherited = False
+                elif inherited or lat is None or lon is None:
+                    inherited = True
+                    if parent:
+                        lat, lon = parent["lat"], parent["lon"]
+                    else:
+                        lat = lon = None
+
+                if not polygon:
+                    # (Re-)build the Point WKT
+                    moved = lat != node["lat"] or lon != node["lon"]
+                    if lat is not None and lon is not None:
+                        if moved or not p:
+                            changes.setdefault(node_id, {})["wkt"] = "POINT (%s %s)" % (lon, lat)
+                            assign(node, "gis_feature_type", 1)
+                            node["prefix"] = "POI"
+                        for fn, value in (("lat_min", lat), ("lat_max", lat),
+                                          ("lon_min", lon), ("lon_max", lon)):
+                            if node[fn] is None:
+                                assign(node, fn, value)
+                    elif moved and p:
+                        changes.setdefault(node_id, {})["wkt"] = None
+                        node["prefix"] = None
+
+                assign(node, "inherited", inherited)
+                assign(node, "path", path)
+                assign(node, "lat", lat)
+                assign(node, "lon", lon)
+                for l in LEVELS:
+                    assign(node, l, names[l])
+
+            done += len(current_ids)
+
+            # Write back the changed locations
+            if len(changes) >= batch_size:
+                updated += update_locations(table, changes, defaults, batch_size)
+                changes.clear()
+            progress("Updating location tree", done, total)
+
+            # Proceed with the next level
+            next_generation = []
+            for node_id in generation:
+                for child_id in children.get(node_id, ()):
+                    if child_id not in visited:
+                        visited.add(child_id)
+                        next_generation.append(child_id)
+            generation = next_generation
+
+        if changes:
+            updated += update_locations(table, changes, defaults, batch_size)
+
+        skipped = len(nodes) - len(visited)
+        if skipped:
+            current.log.error("S3GIS: %s locations skipped in location tree update due to circular parent references" % skipped)
+
+        if current.deployment_settings.get_gis_geometry_pyramid():
+            # Update the geometry pyramid
+            GIS.update_geometry_levels()
+
+        progress("Location tree updated", updated, total)
+        return updated
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _update_locations(table, changes, defaults, batch_size=500):
+        """
+            Write back changes to the location tree, with one UPDATE for
+            each batch of locations
+
+            Args:
+                table: the gis_location table
+                changes: dict {location_id: {fieldname: value}}
+                defaults: dict {fieldname: value} of update defaults (to
+                          set for all locations)
+                batch_size: the maximum number of locations per UPDATE
+
+            Returns:
+                the number of updated locations
+
+            Note:
+                If a batch UPDATE fails, the locations of the batch are
+                updated one by one, skipping (and logging) those that fail
+        """
+
+        db = current.db
+        expand = db._adapter.expand
+
+        id_column = table._id._rname
+        items = list(changes.items())
+        failed = 0
+
+        for index in range(0, len(items), batch_size):
+            batch = items[index:index + batch_size]
+
+            # Values per column
+            columns = {}
+            for location_id, values in batch:
+                for fieldname, value in values.items():
+                    field = table[fieldname]
+                    case = "WHEN %s THEN %s" % (location_id, expand(value, field.type))
+                    if fieldname in columns:
+                        columns[fieldname].append(case)
+                    else:
+                        columns[fieldname] = [case]
+
+            assignments = []
+            for fieldname, cases in columns.items():
+                column = table[fieldname]._rname
+                assignments.append("%s=CASE %s %s ELSE %s END" % (column,
+                                                                  id_column,
+                                                                  " ".join(cases),
+                                                                  column,
+                                                                  ))
+            for fieldname, value in defaults.items():
+                field = table[fieldname]
+                assignments.append("%s=%s" % (field._rname, expand(value, field.type)))
+
+            sql = "UPDATE %s SET %s WHERE %s IN (%s);" % \
+                  (table._rname,
+                   ",".join(assignments),
+                   id_column,
+                   ",".join(str(location_id) for location_id, _ in batch),
+                   )
+            try:
+                with s3_savepoint():
+                    db.executesql(sql)
+            except Exception:
+                # Update row by row
+                for location_id, values in batch:
+                    try:
+                        with s3_savepoint():
+                            db(table._id == location_id).update(**dict(values, **defaults))
+                    except Exception as e:
+                        current.log.error("S3GIS: Unable to update location tree for feature %s: %s" % (location_id, e))
+                        failed += 1
+
+        return len(items) - failed
+
     # -------------------------------------------------------------------------
     @staticmethod
     def wkt_centroid(form):
@@ -6110,6 +6549,16 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                              "Upgrade Shapely for Performance enhancements")
 
         table = current.s3db.gis_location
+
+        index = GIS.get_spatial_index()
+        if index:
+            # Use the spatial index
+            location_ids = index.intersects(shape)
+            if location_ids:
+                query = (table.id.belongs(location_ids))
+                for loc in current.db(query).select():
+                    yield loc
+            return
         in_bbox = current.gis.query_features_by_bbox(*shape.bounds)
         has_wkt = (table.wkt != None) & (table.wkt != "")
 
@@ -6121,6 +6570,24 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             except ReadingError:
                 current.log.error("Error reading wkt of location with id", loc.id)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_spatial_index():
+        """
+            Get the in-process spatial index, if configured and no
+            spatial DB is used
+
+            Returns:
+                the SpatialIndex, or None
+        """
+
+        settings = current.deployment_settings
+        if settings.get_gis_spatialdb() or not settings.get_gis_spatial_index():
+            return None
+
+        from .index import SpatialIndex
+        return SpatialIndex.get()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_features_by_latlon(lat, lon):
@@ -6222,7 +6689,30 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                 precision: the number of decimal places to include in the output
         """
 
-        from shapely.geometry import Point, LineString, Polygon, MultiPolygon
+        shape = GIS.load_shape(wkt)
+        if shape is None:
+            return None
+
+        return GIS.simplify_shape(shape,
+                                  tolerance = tolerance,
+                                  preserve_topology = preserve_topology,
+                                  output = output,
+                                  precision = precision,
+                                  )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def load_shape(wkt):
+        """
+            Parse a WKT string with Shapely
+
+            Args:
+                wkt: the WKT string
+
+            Returns:
+                the Shapely geometry, or None if the WKT is invalid
+        """
+
         from shapely.wkt import loads as wkt_loads
 
         try:
@@ -6240,6 +6730,29 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             current.log.error("Invalid Shape: %s" % wkt)
             return None
 
+        return shape
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def simplify_shape(shape,
+                       tolerance=None,
+                       preserve_topology=True,
+                       output="wkt",
+                       precision=None
+                       ):
+        """
+            Simplify a Shapely geometry, see simplify()
+
+            Args:
+                shape: the Shapely geometry
+                tolerance: how aggressive a simplification to perform
+                preserve_topology: whether the simplified geometry should be maintained
+                output: whether to output as WKT or GeoJSON format
+                precision: the number of decimal places to include in the output
+        """
+
+        from shapely.geometry import Point, LineString, Polygon, MultiPolygon
+
         settings = current.deployment_settings
 
         if not precision:
@@ -6300,6 +6813,250 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         return output
 
+    # -------------------------------------------------------------------------
+    # Geometry Pyramid
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_geometry_level(tolerance=None):
+        """
+            Determine the level of the geometry pyramid to use for the
+            current request, from the requested zoom level or bounding box
+
+            Args:
+                tolerance: the simplification tolerance to use if the
+                           request specifies neither zoom nor bbox
+                           (default: simplify_tolerance setting)
+
+            Returns:
+                the level (index in GIS.GEOMETRY_LEVELS), or None if
+                no simplification is wanted
+        """
+
+        get_vars = current.request.get_vars
+
+        # Target tolerance = size of a map pixel (in degrees)
+        target = None
+
+        zoom = get_vars.get("zoom")
+        if zoom:
+            try:
+                target = 360.0 / (256 * 2 ** int(zoom))
+            except (ValueError, TypeError, OverflowError):
+                pass
+
+        if target is None:
+            bbox = get_vars.get("bbox")
+            if isinstance(bbox, list):
+                bbox = bbox[0]
+            if bbox:
+                try:
+                    minx, miny, maxx, maxy = [float(v) for v in bbox.split(",")]
+                except ValueError:
+                    pass
+                else:
+                    # Assume a map width of about 1000 pixels, and
+                    # the bbox ratio 1.5 of the ZoomBBOX strategy
+                    target = abs(maxx - minx) / 1500
+
+        if target is None:
+            if tolerance is None:
+                tolerance = current.deployment_settings.get_gis_simplify_tolerance()
+            if not tolerance:
+                return None
+            target = tolerance
+
+        # Choose the coarsest level which is at least as precise as the target
+        levels = GIS.GEOMETRY_LEVELS
+        for index, level in enumerate(levels):
+            if level[0] <= target:
+                return index
+
+        # Use the finest level
+        return len(levels) - 1
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_geometry_levels(shape):
+        """
+            Simplify a geometry for all levels of the geometry pyramid
+
+            Args:
+                shape: the Shapely geometry
+
+            Returns:
+                list of GeoJSON strings, one per level
+        """
+
+        simplify_shape = GIS.simplify_shape
+        return [simplify_shape(shape,
+                               tolerance = tolerance,
+                               output = "geojson",
+                               precision = precision,
+                               )
+                for tolerance, precision in GIS.GEOMETRY_LEVELS]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def store_geometry_levels(rows):
+        """
+            Compute and store the geometry pyramid for locations
+
+            Args:
+                rows: gis_location Rows, including id, wkt and modified_on
+
+            Returns:
+                dict {location_id: [GeoJSON per level]}
+        """
+
+        load_shape = GIS.load_shape
+        get_geometry_levels = GIS.get_geometry_levels
+
+        geometries = {}
+        items = []
+        for row in rows:
+            shape = load_shape(row.wkt) if row.wkt else None
+            if shape is None:
+                continue
+            location_id = row.id
+            levels = geometries[location_id] = get_geometry_levels(shape)
+            for index, geojson in enumerate(levels):
+                items.append({"location_id": location_id,
+                              "level": index,
+                              "geojson": geojson,
+                              "source_modified": row.modified_on,
+                              })
+
+        if geometries:
+            table = current.s3db.gis_location_geometry
+            current.db(table.location_id.belongs(set(geometries))).delete()
+            table.bulk_insert(items)
+
+        return geometries
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_geometry_levels(location_ids=None, chunk_size=500):
+        """
+            Update the geometry pyramid for all non-point locations for
+            which it is missing or outdated
+
+            Args:
+                location_ids: limit the update to these location IDs
+                chunk_size: the number of locations to process at a time
+
+            Returns:
+                the number of updated locations
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        gtable = s3db.gis_location
+        ptable = s3db.gis_location_geometry
+
+        query = (gtable.gis_feature_type != 1) & \
+                (gtable.wkt != None) & \
+                (gtable.deleted == False)
+        if location_ids is not None:
+            query &= (gtable.id.belongs(location_ids))
+        rows = db(query).select(gtable.id, gtable.modified_on)
+        modified = {row.id: row.modified_on for row in rows}
+
+        # Find the locations with missing or outdated pyramid
+        query = (ptable.level == 0)
+        if location_ids is not None:
+            query &= (ptable.location_id.belongs(location_ids))
+        rows = db(query).select(ptable.location_id, ptable.source_modified)
+        for row in rows:
+            location_id = row.location_id
+            if location_id in modified and \
+               modified[location_id] == row.source_modified:
+                del modified[location_id]
+
+        outdated = list(modified)
+        for index in range(0, len(outdated), chunk_size):
+            chunk = outdated[index:index + chunk_size]
+            rows = db(gtable.id.belongs(chunk)).select(gtable.id,
+                                                       gtable.wkt,
+                                                       gtable.modified_on,
+                                                       )
+            GIS.store_geometry_levels(rows)
+
+        return len(outdated)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_simplified_geojson(query, key, level):
+        """
+            Look up simplified GeoJSON geometries from the geometry pyramid,
+            simplifying the geometries of locations where the pyramid is
+            missing or outdated on-the-fly (the pyramid itself is updated
+            onaccept of the location, by update_geometry_levels)
+
+            Args:
+                query: the query, must include gis_location
+                key: the Field to key the geometries by
+                level: the pyramid level (see get_geometry_level)
+
+            Returns:
+                list of tuples (key, GeoJSON)
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        gtable = s3db.gis_location
+        ptable = s3db.gis_location_geometry
+
+        rows = db(query).select(key, gtable.id, gtable.modified_on)
+        if not rows:
+            return []
+
+        # Look up the pyramid level (not reading the WKT)
+        location_ids = {row[gtable.id] for row in rows}
+        pquery = (ptable.location_id.belongs(location_ids)) & \
+                 (ptable.level == level)
+        prows = db(pquery).select(ptable.location_id,
+                                  ptable.geojson,
+                                  ptable.source_modified,
+                                  )
+        pyramid = {prow.location_id: prow for prow in prows}
+
+        geojsons = {}
+        outdated = set()
+        for row in rows:
+            location_id = row[gtable.id]
+            prow = pyramid.get(location_id)
+            if prow and prow.source_modified == row[gtable.modified_on]:
+                geojsons[location_id] = prow.geojson
+            else:
+                outdated.add(location_id)
+
+        if outdated:
+            # Simplify the geometries of these locations (not storing
+            # them, so that reading requests do not write the pyramid)
+            tolerance, precision = GIS.GEOMETRY_LEVELS[level]
+            load_shape = GIS.load_shape
+            simplify_shape = GIS.simplify_shape
+            lrows = db(gtable.id.belongs(outdated)).select(gtable.id,
+                                                           gtable.wkt,
+                                                           )
+            for lrow in lrows:
+                shape = load_shape(lrow.wkt) if lrow.wkt else None
+                if shape is not None:
+                    geojsons[lrow.id] = simplify_shape(shape,
+                                                       tolerance = tolerance,
+                                                       output = "geojson",
+                                                       precision = precision,
+                                                       )
+
+        output = []
+        for row in rows:
+            geojson = geojsons.get(row[gtable.id])
+            if geojson:
+                output.append((row[key], geojson))
+        return output
+
     # -------------------------------------------------------------------------
     @staticmethod
     def show_map(id = "default_map",
@@ -0,0 +1,414 @@
+"""
+    Spatial Index
+
+    Copyright: (c) 2010-2021 Sahana Software Foundation
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("SpatialIndex",
+           )
+
+import datetime
+import threading
+import time
+
+from collections import OrderedDict
+from importlib.util import find_spec
+
+from gluon import current
+
+# =============================================================================
+class SpatialIndex:
+    """
+        In-process spatial index (STRtree) over the bounds of all
+        locations, with a cache of prepared geometries, to find locations
+        intersecting a shape without a spatial database
+
+        - built lazily, and kept per process and database
+        - refreshed incrementally when locations have been modified
+          (detected by count and latest modified_on of gis_location,
+          checked at most every CHECK_INTERVAL seconds), fully rebuilt
+          if locations have been removed, and regularly to pick up any
+          late-committed changes
+        - invalidated by location onaccept
+    """
+
+    # Process-wide instances, by DB
+    instances = {}
+    lock = threading.Lock()
+
+    # Maximum number of prepared geometries to cache
+    CACHE_SIZE = 10000
+
+    # Minimum number of candidates to prepare the search shape
+    # rather than using the prepared candidate geometries
+    PREPARE_THRESHOLD = 20
+
+    # Minimum interval between checks for modified locations (seconds)
+    CHECK_INTERVAL = 10
+
+    # Look-back period of incremental updates (seconds), to include
+    # locations committed after others with a later modified_on
+    LOOKBACK = 600
+
+    # Maximum age of the index before a full rebuild (seconds)
+    REBUILD_INTERVAL = 3600
+
+    def __init__(self):
+
+        # Instance lock for updates of the index and geometry cache
+        self.lock = threading.RLock()
+
+        self.bounds = {}
+        self.stamp = None
+        self.count = None
+        self.latest = None
+
+        # Time of the last check for modified locations, and of
+        # the last full build (time.monotonic)
+        self.checked = None
+        self.built = None
+
+        # Tuple (STRtree, location_ids, {id(box): location_id})
+        self.index = None
+
+        self.geometries = OrderedDict()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get(cls):
+        """
+            Get the spatial index for the current DB, build or refresh it
+            as necessary
+
+            Returns:
+                the SpatialIndex, or None if not available (Shapely
+                not installed)
+        """
+
+        try:
+            if find_spec("shapely.strtree") is None:
+                return None
+        except ImportError:
+            # Shapely not installed
+            return None
+
+        db = current.db
+        key = db._uri_hash
+
+        with cls.lock:
+            instance = cls.instances.get(key)
+            if instance is None:
+                instance = cls.instances[key] = cls()
+
+        instance.refresh()
+
+        return instance
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate(cls, location_ids=None):
+        """
+            Invalidate the spatial index of the current DB (in this process),
+            to be called when locations are added, updated or deleted
+
+            Args:
+                location_ids: the IDs of the modified locations, to drop
+                              their cached geometries (otherwise the index
+                              is discarded completely)
+        """
+
+        key = current.db._uri_hash
+
+        with cls.lock:
+            instance = cls.instances.get(key)
+            if instance is None:
+                return
+            if location_ids is None:
+                del cls.instances[key]
+                return
+
+        with instance.lock:
+            # Force refresh of bounds and geometries
+            instance.stamp = None
+            instance.checked = None
+            geometries = instance.geometries
+            for location_id in location_ids:
+                geometries.pop(location_id, None)
+
+    # -------------------------------------------------------------------------
+    def refresh(self):
+        """
+            Update the index if locations have been modified since it
+            was built; the check runs at most every CHECK_INTERVAL seconds,
+            and without holding any lock
+        """
+
+        now = time.monotonic()
+
+        checked = self.checked
+        if checked is not None and now - checked < self.CHECK_INTERVAL:
+            return
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        count = table.id.count()
+        latest = table.modified_on.max()
+        row = db(table.id > 0).select(count, latest).first()
+        stamp = (row[count], row[latest])
+
+        with self.lock:
+
+            rebuild = self.built is None or \
+                      now - self.built >= self.REBUILD_INTERVAL or \
+                      self.count is None or \
+                      stamp[0] < self.count
+            if stamp == self.stamp and not rebuild:
+                self.checked = now
+                return
+
+            bounds = self.bounds
+            fields = (table.id,
+                      table.deleted,
+                      table.modified_on,
+                      table.lon_min,
+                      table.lat_min,
+                      table.lon_max,
+                      table.lat_max,
+                      table.lon,
+                      table.lat,
+                      )
+            previous = self.latest
+            if rebuild or previous is None:
+                # Full (re-)build
+                bounds.clear()
+                self.geometries.clear()
+                query = (table.id > 0)
+                self.built = now
+            else:
+                # Incremental update
+                since = previous - datetime.timedelta(seconds=self.LOOKBACK)
+                query = (table.modified_on >= since)
+            rows = db(query).select(*fields)
+
+            geometries = self.geometries
+            for row in rows:
+                location_id = row.id
+                geometries.pop(location_id, None)
+                if row.deleted:
+                    bounds.pop(location_id, None)
+                    continue
+                box = self.get_bounds(row)
+                if box:
+                    bounds[location_id] = box
+                else:
+                    bounds.pop(location_id, None)
+
+            self.build()
+
+            self.stamp = stamp
+            self.count, self.latest = stamp
+            self.checked = now
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_bounds(row):
+        """
+            Get the bounds of a location
+
+            Args:
+                row: the gis_location Row
+
+            Returns:
+                tuple (lon_min, lat_min, lon_max, lat_max), or None if
+                the location has no coordinates
+        """
+
+        box = (row.lon_min, row.lat_min, row.lon_max, row.lat_max)
+        if any(v is None for v in box):
+            lon, lat = row.lon, row.lat
+            if lon is None or lat is None:
+                return None
+            box = (lon, lat, lon, lat)
+        return box
+
+    # -------------------------------------------------------------------------
+    def build(self):
+        """
+            Build the STRtree from the bounds
+        """
+
+        import shapely
+        from shapely.strtree import STRtree
+
+        bounds = self.bounds
+        location_ids = list(bounds)
+        if not location_ids:
+            self.index = None
+            return
+
+        if hasattr(shapely, "box"):
+            # Shapely>=2.0: vectorized
+            boxes = shapely.box(*zip(*(bounds[location_id] for location_id in location_ids)))
+            self.index = (STRtree(boxes), location_ids, None)
+        else:
+            from shapely.geometry import box as shape_box
+            boxes = [shape_box(*bounds[location_id]) for location_id in location_ids]
+            self.index = (STRtree(boxes),
+                          location_ids,
+                          {id(b): location_id for b, location_id in zip(boxes, location_ids)},
+                          )
+
+    # -------------------------------------------------------------------------
+    def candidates(self, shape):
+        """
+            Find all locations with bounds intersecting the bounds of a shape
+
+            Args:
+                shape: the shape (Shapely geometry)
+
+            Returns:
+                list of location IDs
+        """
+
+        index = self.index
+        if index is None:
+            return []
+        tree, location_ids, boxes = index
+
+        result = tree.query(shape)
+        if not len(result):
+            return []
+
+        if hasattr(result[0], "geom_type"):
+            # Shapely<2.0: returns geometries
+            return [boxes[id(b)] for b in result]
+        else:
+            # Shapely>=2.0: returns indices
+            return [location_ids[i] for i in result]
+
+    # -------------------------------------------------------------------------
+    def query_bbox(self, lon_min, lat_min, lon_max, lat_max):
+        """
+            Find all locations with bounds intersecting a bounding box
+
+            Args:
+                lon_min: the western boundary
+                lat_min: the southern boundary
+                lon_max: the eastern boundary
+                lat_max: the northern boundary
+
+            Returns:
+                list of location IDs
+        """
+
+        from shapely.geometry import box as shape_box
+
+        return self.candidates(shape_box(lon_min, lat_min, lon_max, lat_max))
+
+    # -------------------------------------------------------------------------
+    def intersects(self, shape):
+        """
+            Find all locations with geometries intersecting a shape
+
+            Args:
+                shape: the shape (Shapely geometry)
+
+            Returns:
+                list of location IDs
+        """
+
+        candidates = self.candidates(shape)
+        if not candidates:
+            return []
+
+        with self.lock:
+            geometries = self.get_geometries(candidates)
+        if len(candidates) >= self.PREPARE_THRESHOLD:
+            # Prepare the shape
+            from shapely.prepared import prep
+            test = prep(shape).intersects
+            return [location_id for location_id in candidates
+                    if location_id in geometries and \
+                       test(geometries[location_id].context)]
+        else:
+            # Use the prepared candidate geometries
+            return [location_id for location_id in candidates
+                    if location_id in geometries and \
+                       geometries[location_id].intersects(shape)]
+
+    # -------------------------------------------------------------------------
+    def get_geometries(self, location_ids):
+        """
+            Get the prepared geometries for locations, loading them from
+            the database as necessary
+
+            Args:
+                location_ids: the location IDs
+
+            Returns:
+                dict {location_id: prepared geometry}
+        """
+
+        from shapely.geometry import Point
+        from shapely.prepared import prep
+        from shapely.wkt import loads as wkt_loads
+
+        cache = self.geometries
+
+        geometries, missing = {}, []
+        for location_id in location_ids:
+            geometry = cache.get(location_id)
+            if geometry is None:
+                missing.append(location_id)
+            else:
+                cache.move_to_end(location_id)
+                geometries[location_id] = geometry
+
+        if missing:
+            table = current.s3db.gis_location
+            rows = current.db(table.id.belongs(missing)).select(table.id,
+                                                                table.wkt,
+                                                                table.lon,
+                                                                table.lat,
+                                                                )
+            for row in rows:
+                shape = None
+                if row.wkt:
+                    try:
+                        shape = wkt_loads(row.wkt)
+                    except Exception:
+                        current.log.error("Error reading wkt of location with id %s" % row.id)
+                if shape is None:
+                    if row.lon is None or row.lat is None:
+                        continue
+                    shape = Point(row.lon, row.lat)
+                geometries[row.id] = cache[row.id] = prep(shape)
+
+            # Limit the cache size
+            while len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return geometries
+
+# END =========================================================================
@@ -0,0 +1,869 @@
+"""
+    Vector Tiles
+
+    Copyright: (c) 2010-2021 Sahana Software Foundation
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("MVTLayer",
+           "VectorTiles",
+           )
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import time
+
+from math import atan, degrees, log, pi, radians, sin, sinh
+from urllib.parse import parse_qs
+
+from gluon import current
+
+# Maximum latitude of the Web Mercator projection
+MAX_LAT = 85.0511287798066
+
+# =============================================================================
+class MVTLayer:
+    """
+        Encoder for a layer of a Mapbox Vector Tile (MVT 2.1), without
+        dependency on protobuf libraries
+
+        - geometries are GeoJSON dicts in lon/lat (EPSG:4326), which
+          are projected into the tile coordinate space (Web Mercator)
+    """
+
+    # Tile coordinate space
+    EXTENT = 4096
+
+    # Geometry types
+    POINT = 1
+    LINESTRING = 2
+    POLYGON = 3
+
+    # Commands
+    MOVETO = 1
+    LINETO = 2
+    CLOSEPATH = 7
+
+    def __init__(self, name, z, x, y):
+        """
+            Args:
+                name: the layer name
+                z: the zoom level of the tile
+                x: the column of the tile
+                y: the row of the tile
+        """
+
+        self.name = name
+        self.z, self.x, self.y = z, x, y
+
+        self.features = []
+
+        self.keys = {}
+        self.values = {}
+
+    # -------------------------------------------------------------------------
+    def project(self, lon, lat):
+        """
+            Project a point into the tile coordinate space
+
+            Args:
+                lon: the longitude
+                lat: the latitude
+
+            Returns:
+                tuple (x, y) of integer tile coordinates (can lie outside
+                of the tile extent)
+        """
+
+        n = 2 ** self.z
+        extent = self.EXTENT
+
+        lat = max(min(lat, MAX_LAT), -MAX_LAT)
+        sin_lat = sin(radians(lat))
+
+        tx = (lon + 180.0) / 360.0 * n
+        ty = (0.5 - log((1 + sin_lat) / (1 - sin_lat)) / (4 * pi)) * n
+
+        return (int(round((tx - self.x) * extent)),
+                int(round((ty - self.y) * extent)),
+                )
+
+    # -------------------------------------------------------------------------
+    def add_feature(self, geometry, properties=None, feature_id=None):
+        """
+            Add a feature to the layer
+
+            Args:
+                geometry: the geometry (GeoJSON dict)
+                properties: dict of feature properties
+                feature_id: the feature ID (non-negative integer)
+        """
+
+        gtype = geometry.get("type")
+        if gtype == "GeometryCollection":
+            for g in geometry.get("geometries", ()):
+                self.add_feature(g, properties=properties, feature_id=feature_id)
+            return
+
+        coordinates = geometry.get("coordinates")
+        if not coordinates:
+            return
+
+        if gtype == "Point":
+            parts = self.encode_points([coordinates])
+            ftype = self.POINT
+        elif gtype == "MultiPoint":
+            parts = self.encode_points(coordinates)
+            ftype = self.POINT
+        elif gtype == "LineString":
+            parts = self.encode_lines([coordinates])
+            ftype = self.LINESTRING
+        elif gtype == "MultiLineString":
+            parts = self.encode_lines(coordinates)
+            ftype = self.LINESTRING
+        elif gtype == "Polygon":
+            parts = self.encode_polygons([coordinates])
+            ftype = self.POLYGON
+        elif gtype == "MultiPolygon":
+            parts = self.encode_polygons(coordinates)
+            ftype = self.POLYGON
+        else:
+            return
+        if not parts:
+            # Geometry collapsed at this zoom level
+            return
+
+        # Encode the commands with relative coordinates
+        commands = []
+        append = commands.append
+        zigzag = self.zigzag
+        cx = cy = 0
+        for command, points in parts:
+            if command == self.CLOSEPATH:
+                append(self.command(command, 1))
+                continue
+            append(self.command(command, len(points)))
+            for px, py in points:
+                append(zigzag(px - cx))
+                append(zigzag(py - cy))
+                cx, cy = px, py
+
+        # Encode the properties as tags
+        tags = []
+        if properties:
+            for key, value in properties.items():
+                if value is None:
+                    continue
+                tags.append(self.index(self.keys, key))
+                tags.append(self.index(self.values, self.encode_value(value)))
+
+        feature = b""
+        if feature_id is not None:
+            feature += self.varint_field(1, feature_id)
+        if tags:
+            feature += self.packed_field(2, tags)
+        feature += self.varint_field(3, ftype)
+        feature += self.packed_field(4, commands)
+
+        self.features.append(feature)
+
+    # -------------------------------------------------------------------------
+    def encode(self):
+        """
+            Encode the layer as MVT tile
+
+            Returns:
+                the tile (bytes), empty if the layer has no features
+        """
+
+        if not self.features:
+            return b""
+
+        bytes_field = self.bytes_field
+
+        layer = [self.varint_field(15, 2),
+                 bytes_field(1, self.name.encode("utf-8")),
+                 ]
+        layer.extend(bytes_field(2, feature) for feature in self.features)
+        layer.extend(bytes_field(3, key.encode("utf-8")) for key in self.keys)
+        layer.extend(bytes_field(4, value) for value in self.values)
+        layer.append(self.varint_field(5, self.EXTENT))
+
+        return bytes_field(3, b"".join(layer))
+
+    # -------------------------------------------------------------------------
+    # Geometry encoding
+    # -------------------------------------------------------------------------
+    def project_line(self, coordinates):
+        """
+            Project a sequence of coordinates into the tile coordinate
+            space, skipping repeated points
+
+            Args:
+                coordinates: sequence of [lon, lat]
+
+            Returns:
+                list of tuples (x, y)
+        """
+
+        project = self.project
+        points = []
+        last = None
+        for coordinate in coordinates:
+            point = project(coordinate[0], coordinate[1])
+            if point != last:
+                points.append(point)
+                last = point
+        return points
+
+    # -------------------------------------------------------------------------
+    def encode_points(self, coordinates):
+        """
+            Encode points
+
+            Args:
+                coordinates: list of [lon, lat]
+
+            Returns:
+                list of tuples (command, points)
+        """
+
+        project = self.project
+        points = [project(c[0], c[1]) for c in coordinates]
+        return [(self.MOVETO, points)]
+
+    # -------------------------------------------------------------------------
+    def encode_lines(self, lines):
+        """
+            Encode line strings
+
+            Args:
+                lines: list of line strings (lists of [lon, lat])
+
+            Returns:
+                list of tuples (command, points)
+        """
+
+        parts = []
+        for line in lines:
+            points = self.project_line(line)
+            if len(points) < 2:
+                continue
+            parts.append((self.MOVETO, points[:1]))
+            parts.append((self.LINETO, points[1:]))
+        return parts
+
+    # -------------------------------------------------------------------------
+    def encode_polygons(self, polygons):
+        """
+            Encode polygons; exterior rings are oriented clockwise and
+            interior rings anti-clockwise (in tile coordinates, with
+            the y axis pointing down)
+
+            Args:
+                polygons: list of polygons (lists of rings)
+
+            Returns:
+                list of tuples (command, points)
+        """
+
+        parts = []
+        for polygon in polygons:
+            for index, ring in enumerate(polygon):
+                points = self.project_line(ring)
+                if len(points) > 1 and points[0] == points[-1]:
+                    points.pop()
+                if len(points) < 3:
+                    if index == 0:
+                        # Exterior ring collapsed => skip the polygon
+                        break
+                    continue
+                area = self.area(points)
+                if not area:
+                    if index == 0:
+                        break
+                    continue
+                if (area < 0) == (index == 0):
+                    points.reverse()
+                parts.append((self.MOVETO, points[:1]))
+                parts.append((self.LINETO, points[1:]))
+                parts.append((self.CLOSEPATH, None))
+        return parts
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def area(points):
+        """
+            Signed area of a ring (surveyor's formula)
+
+            Args:
+                points: list of tuples (x, y)
+
+            Returns:
+                twice the signed area (positive if clockwise in
+                tile coordinates)
+        """
+
+        area = 0
+        x0, y0 = points[-1]
+        for x1, y1 in points:
+            area += x0 * y1 - x1 * y0
+            x0, y0 = x1, y1
+        return area
+
+    # -------------------------------------------------------------------------
+    # Protocol buffer encoding
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def command(command, count):
+        """ Command integer """
+
+        return (command & 0x7) | (count << 3)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def zigzag(value):
+        """ ZigZag-encode a signed integer """
+
+        return value << 1 if value >= 0 else (-value << 1) - 1
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def varint(value):
+        """ Encode an unsigned integer as varint """
+
+        output = bytearray()
+        while True:
+            byte = value & 0x7f
+            value >>= 7
+            if value:
+                output.append(byte | 0x80)
+            else:
+                output.append(byte)
+                return bytes(output)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def varint_field(cls, number, value):
+        """ Encode a varint field """
+
+        return cls.varint(number << 3) + cls.varint(value)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def bytes_field(cls, number, value):
+        """ Encode a length-delimited field """
+
+        return cls.varint(number << 3 | 2) + cls.varint(len(value)) + value
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def packed_field(cls, number, values):
+        """ Encode a packed repeated varint field """
+
+        varint = cls.varint
+        return cls.bytes_field(number, b"".join(varint(v) for v in values))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def encode_value(cls, value):
+        """
+            Encode a property value as MVT Value message
+
+            Args:
+                value: the value (str, int, float or bool; other types
+                       are encoded as strings)
+
+            Returns:
+                the encoded Value (bytes)
+        """
+
+        if isinstance(value, bool):
+            return cls.varint_field(7, int(value))
+        elif isinstance(value, int):
+            if value >= 0:
+                return cls.varint_field(5, value)
+            else:
+                return cls.varint_field(6, cls.zigzag(value))
+        elif isinstance(value, float):
+            return cls.varint(3 << 3 | 1) + struct.pack("<d", value)
+        else:
+            return cls.bytes_field(1, str(value).encode("utf-8"))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def index(items, item):
+        """
+            Get the index of a key or value in the layer, adding it
+            as necessary
+
+            Args:
+                items: the dict of keys or values
+                item: the key or value
+
+            Returns:
+                the index
+        """
+
+        index = items.get(item)
+        if index is None:
+            index = items[item] = len(items)
+        return index
+
+# =============================================================================
+class VectorTiles:
+    """
+        Vector tiles (MVT) of Feature Layers, with a disk cache
+
+        - the tile data are looked up like GeoJSON for the layer, and
+          subject to the same authorization rules and layer filter
+        - tiles are cached in uploads/gis_cache/tiles, per layer and
+          data version, which changes whenever the layer, the records,
+          the locations or the realms of the user change (data changes
+          are detected within STAMP_TTL seconds)
+        - the number of features per tile is limited to
+          settings.gis.max_features, and geometries are simplified
+          by zoom level (geometry pyramid)
+    """
+
+    # Buffer around the tile (in tile coordinate units)
+    BUFFER = 64
+
+    # Maximum zoom level
+    MAX_ZOOM = 22
+
+    # Age (in seconds) after which outdated versions are removed
+    CACHE_EXPIRY = 86400
+
+    # Data stamps per layer, shared by all requests of this process
+    # {(uri_hash, layer_id): (expires, stamps)}
+    stamps = {}
+
+    # Time (in seconds) for which the data stamps of a layer are re-used
+    STAMP_TTL = 30
+
+    def __init__(self, layer_id):
+        """
+            Args:
+                layer_id: the Feature Layer ID
+        """
+
+        self.layer_id = layer_id
+
+        self._layer = None
+
+    # -------------------------------------------------------------------------
+    @property
+    def layer(self):
+        """
+            The Feature Layer record (lazy property)
+
+            Returns:
+                the gis_layer_feature Row, or None if not found
+        """
+
+        layer = self._layer
+        if layer is None:
+            table = current.s3db.gis_layer_feature
+            query = (table.layer_id == self.layer_id) & \
+                    (table.deleted == False)
+            layer = current.db(query).select(table.layer_id,
+                                             table.name,
+                                             table.controller,
+                                             table.function,
+                                             table.filter,
+                                             table.modified_on,
+                                             limitby = (0, 1),
+                                             ).first()
+            self._layer = layer
+        return layer
+
+    # -------------------------------------------------------------------------
+    def permitted(self):
+        """
+            Check whether the layer exists and the user is permitted
+            to read its resource
+
+            Returns:
+                True|False
+        """
+
+        layer = self.layer
+        if not layer or not layer.controller or not layer.function:
+            return False
+
+        if layer.controller not in current.deployment_settings.modules:
+            # Module is disabled
+            return False
+
+        return current.auth.permission.has_permission("read",
+                                                      c = layer.controller,
+                                                      f = layer.function,
+                                                      )
+
+    # -------------------------------------------------------------------------
+    def tile(self, z, x, y):
+        """
+            Get a tile, from the cache if available
+
+            Args:
+                z: the zoom level
+                x: the column
+                y: the row
+
+            Returns:
+                the tile (bytes)
+        """
+
+        path = self.cache_path(z, x, y)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        tile = self.render(z, x, y)
+
+        # Write to a temporary file first, so that concurrent requests
+        # never read an incomplete tile
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        tmp = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(tile)
+        os.replace(tmp, path)
+
+        return tile
+
+    # -------------------------------------------------------------------------
+    def render(self, z, x, y):
+        """
+            Render a tile
+
+            Args:
+                z: the zoom level
+                x: the column
+                y: the row
+
+            Returns:
+                the tile (bytes)
+        """
+
+        layer = self.layer
+        tablename = "%s_%s" % (layer.controller, layer.function)
+
+        s3db = current.s3db
+        if not s3db.table(tablename):
+            return b""
+
+        # Filter by layer filter and tile bounds (incl. buffer)
+        get_vars = self.filter_vars(layer.filter)
+        get_vars["bbox"] = "%s,%s,%s,%s" % self.bounds(z, x, y, buffer=self.BUFFER)
+
+        resource = s3db.resource(tablename, vars=get_vars)
+
+        # Limit the number of features per tile
+        limit = current.deployment_settings.get_gis_max_features()
+        resource.load(limit=limit)
+        record_ids = resource._ids
+        if not record_ids:
+            return b""
+        if len(record_ids) >= limit:
+            # Restrict all further lookups to the loaded records
+            current.log.debug("Vector tile %s/%s/%s/%s truncated to %s features" %
+                              (self.layer_id, z, x, y, limit))
+            resource.add_filter(resource.table._id.belongs(record_ids))
+            resource.load(limit=limit)
+
+        # Simplification level of geometries by zoom level
+        current.request.get_vars["zoom"] = str(z)
+
+        from .base import GIS
+        data = GIS.get_location_data(resource,
+                                     format = "mvt",
+                                     layer_id = self.layer_id,
+                                     )
+        if not data:
+            return b""
+
+        mvt = MVTLayer(tablename, z, x, y)
+
+        attributes = data["attributes"].get(tablename, {})
+        markers = data["markers"].get(tablename)
+        styles = data["styles"]
+
+        clip = self.clipper(z, x, y)
+
+        def properties(record_id):
+            props = dict(attributes.get(record_id) or {})
+            if markers:
+                marker = markers.get(record_id) \
+                         if "image" not in markers else markers
+                if isinstance(marker, dict):
+                    marker = marker.get("image")
+                if marker:
+                    props["marker"] = marker
+            style = styles.get(record_id)
+            if style:
+                props["style"] = style
+            return props
+
+        # Points
+        latlons = data["latlons"].get(tablename, {})
+        for record_id, (lat, lon) in latlons.items():
+            if lat is None or lon is None:
+                continue
+            mvt.add_feature({"type": "Point", "coordinates": [lon, lat]},
+                            properties = properties(record_id),
+                            feature_id = record_id,
+                            )
+
+        # Lines and Polygons
+        geojsons = data["geojsons"].get(tablename, {})
+        for record_id, items in geojsons.items():
+            if not isinstance(items, list):
+                items = [items]
+            props = properties(record_id)
+            for item in items:
+                if not item:
+                    continue
+                try:
+                    geometry = json.loads(item) if isinstance(item, str) else item
+                except ValueError:
+                    continue
+                geometry = clip(geometry)
+                if geometry:
+                    mvt.add_feature(geometry,
+                                    properties = props,
+                                    feature_id = record_id,
+                                    )
+
+        return mvt.encode()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def filter_vars(layer_filter):
+        """
+            Parse the filter of a Feature Layer (URL query string)
+
+            Args:
+                layer_filter: the filter string
+
+            Returns:
+                dict of URL filter vars
+        """
+
+        get_vars = {}
+        if layer_filter:
+            for k, v in parse_qs(layer_filter, keep_blank_values=True).items():
+                get_vars[k] = v[0] if len(v) == 1 else v
+        return get_vars
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def bounds(cls, z, x, y, buffer=0):
+        """
+            Get the bounds of a tile
+
+            Args:
+                z: the zoom level
+                x: the column
+                y: the row
+                buffer: buffer around the tile (in tile coordinate units)
+
+            Returns:
+                tuple (lon_min, lat_min, lon_max, lat_max)
+        """
+
+        n = 2.0 ** z
+        b = float(buffer) / MVTLayer.EXTENT
+
+        def lon(tx):
+            return tx / n * 360.0 - 180.0
+
+        def lat(ty):
+            return degrees(atan(sinh(pi * (1 - 2 * ty / n))))
+
+        return (max(lon(x - b), -180.0),
+                max(lat(y + 1 + b), -MAX_LAT),
+                min(lon(x + 1 + b), 180.0),
+                min(lat(y - b), MAX_LAT),
+                )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clipper(cls, z, x, y):
+        """
+            Get a function to clip geometries to the tile bounds (incl.
+            buffer), to avoid encoding large polygons in full in every
+            tile they touch
+
+            Args:
+                z: the zoom level
+                x: the column
+                y: the row
+
+            Returns:
+                a function geometry => clipped geometry (GeoJSON dicts),
+                which returns the geometry unchanged if Shapely is not
+                installed
+        """
+
+        try:
+            from shapely.geometry import box, mapping, shape
+        except ImportError:
+            return lambda geometry: geometry
+
+        bounds = box(*cls.bounds(z, x, y, buffer=cls.BUFFER))
+
+        def clip(geometry):
+            if geometry.get("type") in ("Point", "MultiPoint"):
+                return geometry
+            try:
+                g = shape(geometry)
+                if bounds.contains(g):
+                    return geometry
+                g = g.intersection(bounds)
+            except Exception:
+                # Invalid geometry => use unclipped
+                return geometry
+            return None if g.is_empty else mapping(g)
+
+        return clip
+
+    # -------------------------------------------------------------------------
+    def version(self):
+        """
+            Get the current data version of the layer, for the user
+
+            Returns:
+                a hash (str)
+        """
+
+        stamps = [self.layer.modified_on]
+        stamps.extend(self.data_stamps())
+
+        user = current.auth.user
+        stamps.append(user.realms if user else None)
+        stamps.append(current.T.accepted_language)
+
+        data = json.dumps(stamps, default=str, sort_keys=True)
+        return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    def data_stamps(self):
+        """
+            Get the stamps (count, latest modified_on) of the layer table
+            and the locations; these are looked up at most once every
+            STAMP_TTL seconds per layer and process, rather than for
+            every tile
+
+            Returns:
+                list of stamps
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        key = (db._uri_hash, self.layer_id)
+        now = time.time()
+
+        cached = self.stamps.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        layer = self.layer
+        tablename = "%s_%s" % (layer.controller, layer.function)
+
+        stamps = []
+        for table in (s3db.table(tablename), s3db.gis_location):
+            if table is None:
+                continue
+            count = table._id.count()
+            if "modified_on" in table.fields:
+                latest = table.modified_on.max()
+                row = db(table._id > 0).select(count, latest).first()
+                stamps.append((row[count], row[latest]))
+            else:
+                row = db(table._id > 0).select(count).first()
+                stamps.append(row[count])
+
+        self.stamps[key] = (now + self.STAMP_TTL, stamps)
+
+        return stamps
+
+    # -------------------------------------------------------------------------
+    def cache_path(self, z, x, y):
+        """
+            Get the path of a tile in the cache, removing outdated
+            versions of the layer as necessary
+
+            Args:
+                z: the zoom level
+                x: the column
+                y: the row
+
+            Returns:
+                the path (str)
+        """
+
+        folder = os.path.join(current.request.folder,
+                              "uploads",
+                              "gis_cache",
+                              "tiles",
+                              str(self.layer_id),
+                              )
+        version = self.version()
+
+        path = os.path.join(folder, version)
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+            self.cleanup(folder, version)
+
+        return os.path.join(path, str(z), str(x), "%s.mvt" % y)
+
+    # -------------------------------------------------------------------------
+    def cleanup(self, folder, version):
+        """
+            Remove all other versions of the layer from the cache that
+            have not been written to for CACHE_EXPIRY seconds
+
+            Args:
+                folder: the cache folder of the layer
+                version: the current version (to keep)
+        """
+
+        expired = time.time() - self.CACHE_EXPIRY
+        for name in os.listdir(folder):
+            if name == version:
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                # Removed concurrently
+                pass
+
+# END =========================================================================
@@ -1363,13 +1363,20 @@ class S3CRUD(CRUDMethod):
             if represent and represent != "0":
                 represent = True
 
+            # Keyset pagination (continuation token from previous page)
+            after = get_vars.get("after")
+
             exporter = S3Exporter().json
-            output = exporter(resource,
-                              start = start,
-                              limit = limit,
-                              represent = represent,
-                              tooltip = tooltip,
-                              )
+            try:
+                output = exporter(resource,
+                                  start = start,
+                                  limit = limit,
+                                  represent = represent,
+                                  tooltip = tooltip,
+                                  after = after,
+                                  )
+            except ValueError:
+                r.error(400, "Invalid continuation token")
 
         elif representation == "pdf":
 
@@ -1578,16 +1585,23 @@ class S3CRUD(CRUDMethod):
             if orderby is None:
                 orderby = get_config("orderby", None)
 
+            # Keyset pagination (continuation token from previous page)
+            after = get_vars.get("after")
+
             # Get a data table
             if totalrows != 0:
-                dt, displayrows = resource.datatable(fields = list_fields,
-                                                     start = start,
-                                                     limit = limit,
-                                                     left = left,
-                                                     orderby = orderby,
-                                                     distinct = False,
-                                                     list_id = list_id,
-                                                     )
+                try:
+                    dt, displayrows = resource.datatable(fields = list_fields,
+                                                         start = start,
+                                                         limit = limit,
+                                                         left = left,
+                                                         orderby = orderby,
+                                                         distinct = False,
+                                                         list_id = list_id,
+                                                         after = after,
+                                                         )
+                except ValueError:
+                    r.error(400, "Invalid continuation token")
             else:
                 dt, displayrows = None, 0
             if totalrows is None:
@@ -34,6 +34,7 @@ from gluon import current
 from gluon.storage import Storage
 from gluon.tools import callback
 
+from ..filters import S3FilterOptions
 from ..tools import JSONSEPARATORS
 
 from .base import CRUDMethod
@@ -122,6 +123,9 @@ class S3Filter(CRUDMethod):
                                               filter = current.response.s3.filter,
                                               )
 
+            # Look up the options for all options filters at once
+            S3FilterOptions(fresource, filter_widgets).prefetch()
+
             for widget in filter_widgets:
                 if hasattr(widget, "ajax_options"):
                     opts = widget.ajax_options(fresource)
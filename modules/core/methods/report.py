@@ -1858,50 +1858,67 @@ class S3PivotTable:
 
         # Retrieve the records ------------------------------------------------
         #
-        data = resource.select(list(self.rfields.keys()), limit=None)
+        data = resource.select(list(self.rfields.keys()),
+                               limit = None,
+                               columnar = True,
+                               )
         drows = data["rows"]
         if drows:
 
             key = str(resource.table._id)
             records = Storage([(i[key], i) for i in drows])
 
-            # Generate the data frame -----------------------------------------
-            #
             gfields = self.gfields
             pkey_colname = gfields[self.pkey]
             rows_colname = gfields[rows]
             cols_colname = gfields[cols]
 
+            rfields = self.rfields
+            axes = [rfield
+                    for rfield in (rfields[rows], rfields[cols])
+                    if rfield != None]
+
+            # Filter axis values
             if strict:
-                rfields = self.rfields
-                axes = (rfield
-                        for rfield in (rfields[rows], rfields[cols])
-                        if rfield != None)
                 axisfilter = self.axisfilter(resource, axes)
             else:
                 axisfilter = None
 
-            dataframe = []
-            extend = dataframe.extend
-            expand = self._expand
+            if not axisfilter and all(self._scalar(rfield) for rfield in axes):
 
-            for _id in records:
-                row = records[_id]
-                item = {key: _id}
-                if rows_colname:
-                    item[rows_colname] = row[rows_colname]
-                if cols_colname:
-                    item[cols_colname] = row[cols_colname]
-                extend(expand(item, axisfilter=axisfilter))
-
-            self.records = records
+                # Group the records by integer-coded axis values ----------
+                #
+                self.records = records
+                matrix, rnames, cnames = self._pivot_scalar(records,
+                                                            pkey_colname,
+                                                            rows_colname,
+                                                            cols_colname,
+                                                            )
+            else:
 
-            # Group the records -----------------------------------------------
-            #
-            matrix, rnames, cnames = self._pivot(dataframe,
-                                                 pkey_colname,
-                                                 rows_colname,
-                                                 cols_colname)
+                # Generate the data frame ---------------------------------
+                #
+                dataframe = []
+                extend = dataframe.extend
+                expand = self._expand
+
+                for _id in records:
+                    row = records[_id]
+                    item = {key: _id}
+                    if rows_colname:
+                        item[rows_colname] = row[rows_colname]
+                    if cols_colname:
+                        item[cols_colname] = row[cols_colname]
+                    extend(expand(item, axisfilter=axisfilter))
+
+                self.records = records
+
+                # Group the records ---------------------------------------
+                #
+                matrix, rnames, cnames = self._pivot(dataframe,
+                                                     pkey_colname,
+                                                     rows_colname,
+                                                     cols_colname)
 
             # Initialize columns and rows -------------------------------------
             #
@@ -2645,6 +2662,78 @@ class S3PivotTable:
 
         return matrix, rnames, cnames
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _scalar(rfield):
+        """
+            Check whether a field can only have a single, atomic value
+            per record, i.e. is neither virtual nor list/json/blob-type,
+            and in the master table (a join can produce multiple values)
+
+            Args:
+                rfield: the S3ResourceField
+
+            Returns:
+                boolean
+        """
+
+        ftype = rfield.ftype
+
+        return bool(rfield.field) and \
+               not rfield.virtual and \
+               not rfield.left and \
+               ftype[:5] != "list:" and \
+               ftype not in ("json", "blob")
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _pivot_scalar(records, pkey_colname, rows_colname, cols_colname):
+        """
+            2-dimensional pivoting of records with scalar axis values,
+            faster alternative to _expand+_pivot: groups the records in
+            a single pass, integer-coding the axis values, without
+            generating an intermediate data frame
+
+            Args:
+                records: the records, a dict {record_id: row}
+                pkey_colname: column name of the primary key
+                rows_colname: column name of the row dimension
+                cols_colname: column name of the column dimension
+
+            Returns:
+                tuple of (cell matrix, row headers, column headers),
+                same as _pivot
+        """
+
+        rvalues = {}
+        cvalues = {}
+        cells = {}
+
+        for record_id, row in records.items():
+
+            rvalue = row[rows_colname] if rows_colname else None
+            cvalue = row[cols_colname] if cols_colname else None
+
+            r = rvalues.get(rvalue)
+            if r is None:
+                r = rvalues[rvalue] = len(rvalues)
+            c = cvalues.get(cvalue)
+            if c is None:
+                c = cvalues[cvalue] = len(cvalues)
+
+            cell = cells.get((r, c))
+            if cell is None:
+                cells[(r, c)] = [record_id]
+            else:
+                cell.append(record_id)
+
+        numcols = len(cvalues)
+        matrix = [[cells.get((r, c)) for c in range(numcols)]
+                  for r in range(len(rvalues))]
+
+        # Dicts retain insertion order = index order
+        return matrix, list(rvalues), list(cvalues)
+
     # -------------------------------------------------------------------------
     def _add_layer(self, matrix, fact):
         """
@@ -2675,6 +2764,14 @@ class S3PivotTable:
         layer = fact.layer
         precision = self.precision.get(fact.selector)
 
+        # Scalar fact values can be accessed directly
+        rfield = self.rfields.get(fact.selector) if fact.selector else None
+        if rfield and self._scalar(rfield) and rfield.colname:
+            scalar = True
+            colname = rfield.colname
+        else:
+            scalar = False
+
         numcols = len(self.col)
         numrows = len(self.row)
 
@@ -2732,14 +2829,19 @@ class S3PivotTable:
                     col_values = row_records
                     all_values = list(records.keys())
                 else:
-                    values = []
-                    append = values.append
-                    for i in ids:
-                        value = extract(records[i], fact.selector)
-                        if value is None:
-                            continue
-                        append(value)
-                    values = list(s3_flatlist(values))
+                    if scalar:
+                        # Direct access to the column, no flattening required
+                        values = [v for v in (records[i][colname] for i in ids)
+                                  if v is not None]
+                    else:
+                        values = []
+                        append = values.append
+                        for i in ids:
+                            value = extract(records[i], fact.selector)
+                            if value is None:
+                                continue
+                            append(value)
+                        values = list(s3_flatlist(values))
                     if fact.method in ("list", "count"):
                         values =  list(set(values))
                     row_values.extend(values)
@@ -28,6 +28,7 @@
 __all__ = ("RESTful",)
 
 import json
+import os
 import sys
 
 from urllib.request import urlopen
@@ -219,6 +220,18 @@ class RESTful(CRUDMethod):
         if target == resource.tablename:
             # Master resource targetted
             target = None
+
+        # Stream native S3XML/S3JSON exports in batches?
+        stream = None
+        if current.deployment_settings.get_base_xml_export_stream() and \
+           not target and not mdata:
+            if representation == "s3json" and stylesheet == \
+               os.path.join(r.folder, r.XSLT_PATH, "s3json", "export.xsl"):
+                # Identity transformation => not needed
+                stylesheet = None
+            if stylesheet is None:
+                stream = True
+
         output = resource.export_xml(start = start,
                                      limit = limit,
                                      msince = msince,
@@ -233,13 +246,45 @@ class RESTful(CRUDMethod):
                                      as_json = as_json,
                                      maxbounds = maxbounds,
                                      target = target,
+                                     stream = stream,
                                      **args)
         # Transformation error?
         if not output:
             r.error(400, "XSLT Transformation Error: %s " % current.xml.error)
 
+        if stream:
+            # Send the chunks as they are exported
+            return RESTful.send_chunks(output)
+
         return output
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def send_chunks(chunks):
+        """
+            Generator to send the chunks of a streamed export as response
+            body; runs after the controller has returned, i.e. when the
+            request transaction has already been committed and the DB
+            connection released, so the export uses a new connection
+            which must be released at the end
+
+            Args:
+                chunks: iterable of output chunks (bytes)
+
+            Yields:
+                the output chunks
+        """
+
+        db = current.db
+        try:
+            for chunk in chunks:
+                yield chunk
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def put_tree(r, **attr):
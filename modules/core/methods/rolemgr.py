@@ -676,6 +676,8 @@ class S3RoleManager(CRUDMethod):
                         # Add the rule
                         table.insert(**data)
 
+            current.auth.permission.invalidate_acls()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def copy_role(r, **attr):
@@ -755,6 +757,7 @@ class S3RoleManager(CRUDMethod):
                               entity = rule.entity,
                               unrestricted = rule.unrestricted,
                               )
+            current.auth.permission.invalidate_acls()
 
         message = current.T("New Role %(role)s created") % {"role": name}
         return current.xml.json_message(message=message)
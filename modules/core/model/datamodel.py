@@ -28,7 +28,11 @@
 __all__ = ("DataModel",
            )
 
+import json
+import os
 import sys
+import threading
+import time
 
 from gluon import current, IS_EMPTY_OR, TAG
 from gluon.storage import Storage
@@ -36,7 +40,7 @@ from gluon.tools import callback
 
 from s3dal import Table, Field, original_tablename
 
-from ..tools import IS_ONE_OF
+from ..tools import IS_ONE_OF, S3Hierarchy, S3RepresentCache
 from ..ui import S3ScriptItem
 
 from .dynamic import DynamicTableModel, DYNAMIC_PREFIX
@@ -54,6 +58,24 @@ class DataModel:
     LOAD = "eden_model_load"
     DELETED = "deleted"
 
+    # Per-request instrumentation of model loading
+    FRAMES = "eden_model_frames"
+    NAMES = "eden_model_names"
+    TIMINGS = "eden_model_timings"
+
+    # Index of names defined by models {folder: {name: (module, model)}},
+    # shared by all requests of this process
+    INDEX_FILE = "s3db_index.json"
+    indexes = {}
+    outdated = set()
+    index_lock = threading.Lock()
+
+    # Database indexes created by this process {(uri_hash, index_name)}
+    db_indexes = set()
+
+    # Write counters of tables in this process {(uri_hash, tablename): version}
+    versions = {}
+
     def __init__(self, module=None):
 
         self.cache = (current.cache.ram, 60)
@@ -88,31 +110,39 @@ class DataModel:
             if self.__loaded():
                 return
             self.__lock()
+
+            db = current.db
+            start = time.time()
+            tables = set(db.tables)
+            frames = self.__frames()
+            frames.append(set())
+
+            names = []
             try:
                 env = self.mandatory()
-            except Exception:
-                self.__unlock()
-                raise
-            else:
                 if isinstance(env, dict):
                     response.s3.update(env)
-            if module in mandatory_models or \
-               current.deployment_settings.has_module(module):
-                try:
+                    names.extend(env)
+                if module in mandatory_models or \
+                   current.deployment_settings.has_module(module):
                     env = self.model()
-                except Exception:
-                    self.__unlock()
-                    raise
-            else:
-                try:
+                else:
                     env = self.defaults()
-                except Exception:
-                    self.__unlock()
-                    raise
-            if isinstance(env, dict):
-                response.s3.update(env)
+                if isinstance(env, dict):
+                    response.s3.update(env)
+                    names.extend(env)
+            finally:
+                nested = frames.pop()
+                self.__unlock()
             self.__loaded(True)
-            self.__unlock()
+
+            # Tables defined by nested model loads belong to those models
+            defined = set(db.tables) - tables
+            if frames:
+                frames[-1] |= defined
+            names.extend(defined - nested)
+
+            self.__register(module, names, time.time() - start)
 
     # -------------------------------------------------------------------------
     def __loaded(self, loaded=None):
@@ -155,6 +185,70 @@ class DataModel:
                 del response[LOCK]
         return
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def __frames(cls):
+        """
+            The stack of model loads in the current request, each frame
+            a set of the tables defined by nested model loads
+
+            Returns:
+                list of sets of tablenames
+        """
+
+        response = current.response
+
+        frames = response.get(cls.FRAMES)
+        if frames is None:
+            frames = response[cls.FRAMES] = []
+        return frames
+
+    # -------------------------------------------------------------------------
+    def __register(self, prefix, names, duration):
+        """
+            Records which names have been defined by this model, and how
+            long it took to load it
+
+            Args:
+                prefix: the module prefix
+                names: the names (tables and response.s3 globals) defined
+                duration: the load time (seconds), including nested loads
+        """
+
+        response = current.response
+
+        registry = response.get(self.NAMES)
+        if registry is None:
+            registry = response[self.NAMES] = {}
+
+        model = self.__class__
+        source = (model.__module__, model.__name__)
+        for name in names:
+            if not name.startswith(DYNAMIC_PREFIX):
+                registry.setdefault(name, source)
+
+        timings = response.get(self.TIMINGS)
+        if timings is None:
+            timings = response[self.TIMINGS] = []
+        timings.append((model.__name__, prefix, duration))
+
+        profiler = getattr(current, "profiler", None)
+        if profiler:
+            profiler.add("model", model.__name__, duration)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def timings(cls):
+        """
+            The models loaded in the current request, and their load times
+
+            Returns:
+                list of tuples (model name, prefix, duration), duration
+                in seconds and including nested model loads
+        """
+
+        return list(current.response.get(cls.TIMINGS) or [])
+
     # -------------------------------------------------------------------------
     def __getattr__(self, name):
         """ Model auto-loader """
@@ -275,6 +369,16 @@ class DataModel:
                 pass
         else:
             modules = s3db.module_map.get(prefix)
+
+            if modules:
+                # Look up the defining model in the index
+                model = cls.indexed_model(tablename, modules)
+                if model is not None:
+                    model(prefix)
+                    if hasattr(db, tablename) or \
+                       not db_only and tablename in s3:
+                        modules = None
+
             if modules:
 
                 for module in modules:
@@ -319,6 +423,191 @@ class DataModel:
         else:
             return default
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def indexed_model(cls, name, modules):
+        """
+            Looks up the DataModel defining a name in the model index
+
+            Args:
+                name: the name (tablename or response.s3 global)
+                modules: the modules for the prefix of the name
+
+            Returns:
+                the DataModel class, or None if not found
+        """
+
+        entry = cls.get_index().get(name)
+        if not entry:
+            return None
+
+        module_name, model_name = entry
+        for module in modules:
+            if module.__name__ == module_name:
+                model = module.__dict__.get(model_name)
+                if hasattr(model, "_edenmodel"):
+                    return model
+                break
+
+        return None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_index(cls):
+        """
+            Gets the index of all names defined by models, loading it from
+            the cache file if necessary
+
+            Returns:
+                dict {name: (module name, model name)}
+
+            Note:
+                - if the cache file is missing or outdated, an empty index
+                  is returned (so lookups fall back to scanning the modules)
+                  until update_index has been run
+        """
+
+        key = current.request.folder
+
+        index = cls.indexes.get(key)
+        if index is None:
+            with cls.index_lock:
+                index = cls.indexes.get(key)
+                if index is None:
+                    index = cls.load_index()
+                    if index is None:
+                        # Outdated, to be rebuilt by update_index
+                        index = {}
+                        cls.outdated.add(key)
+                    cls.indexes[key] = index
+
+        return index
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update_index(cls):
+        """
+            Rebuilds the index if the cache file was found missing or
+            outdated in this process; to be run after all model files
+            have been executed (models/zz_last.py)
+        """
+
+        cls.get_index()
+
+        key = current.request.folder
+        if key not in cls.outdated:
+            return
+
+        with cls.index_lock:
+            if key not in cls.outdated:
+                return
+            # Another process may have rebuilt it meanwhile
+            index = cls.load_index()
+            if index is None:
+                index = cls.build_index()
+            cls.indexes[key] = index
+            cls.outdated.discard(key)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def index_signature(cls):
+        """
+            The signature of the current models, to validate the index
+
+            Returns:
+                dict {"modules": [enabled modules],
+                      "files": {path: mtime},
+                      }
+        """
+
+        files = {}
+        for modules in current.s3db.module_map.values():
+            for module in modules:
+                path = getattr(module, "__file__", None)
+                if path:
+                    try:
+                        files[path] = os.path.getmtime(path)
+                    except OSError:
+                        pass
+
+        return {"modules": sorted(current.deployment_settings.modules),
+                "files": files,
+                }
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def index_path(cls):
+        """
+            The path of the index cache file
+
+            Returns:
+                the path, or None if the cache folder is not available
+        """
+
+        folder = os.path.join(current.request.folder, "cache")
+        if not os.path.isdir(folder):
+            return None
+        return os.path.join(folder, cls.INDEX_FILE)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def load_index(cls):
+        """
+            Loads the index from the cache file
+
+            Returns:
+                the index, or None if the cache file is missing or the
+                models have been modified since it was written
+        """
+
+        path = cls.index_path()
+        if not path or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r") as cache:
+                data = json.load(cache)
+        except (IOError, ValueError):
+            return None
+
+        if data.get("signature") != cls.index_signature():
+            return None
+
+        return {name: tuple(entry) for name, entry in data["index"].items()}
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build_index(cls):
+        """
+            Builds the index by loading all models, and writes it to the
+            cache file
+
+            Returns:
+                the index
+        """
+
+        start = time.time()
+
+        cls.load_all_models()
+        index = dict(current.response.get(cls.NAMES) or {})
+
+        path = cls.index_path()
+        if path:
+            data = {"signature": cls.index_signature(),
+                    "index": index,
+                    }
+            tmp = "%s.%s" % (path, os.getpid())
+            try:
+                with open(tmp, "w") as cache:
+                    json.dump(data, cache)
+                os.replace(tmp, path)
+            except (IOError, OSError):
+                current.log.error("Could not write model index to %s" % path)
+
+        current.log.info("Model index built in %.3fs (%s names)" % \
+                         (time.time() - start, len(index)))
+        return index
+
     # -------------------------------------------------------------------------
     @classmethod
     def load(cls, prefix):
@@ -399,9 +688,107 @@ class DataModel:
         if hasattr(db, tablename):
             table = getattr(db, tablename)
         else:
+            on_define = args.get("on_define")
+            def define(table):
+                DataModel.track_writes(table)
+                if on_define:
+                    on_define(table)
+            args["on_define"] = define
             table = db.define_table(tablename, *fields, **args)
         return table
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def track_writes(cls, table):
+        """
+            Register DAL callbacks to increase the version number of
+            a table with every insert, update or delete
+
+            Args:
+                table: the Table
+        """
+
+        if getattr(table, "_tracked", False):
+            return
+
+        key = (current.db._uri_hash, original_tablename(table))
+        versions = cls.versions
+
+        def bump(*args):
+            versions[key] = versions.get(key, 0) + 1
+            # Callbacks must not return True (would abort the write)
+            return False
+
+        table._after_insert.append(bump)
+        table._after_update.append(bump)
+        table._after_delete.append(bump)
+        table._tracked = True
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def table_version(cls, table):
+        """
+            Get the version number of a table, which is increased with
+            every write through the DAL in this process, to invalidate
+            cached query results for the table
+
+            Args:
+                table: the Table
+
+            Returns:
+                the version number (int)
+
+            Note:
+                writes in other processes are not registered, so cached
+                results must still expire after a short time
+        """
+
+        cls.track_writes(table)
+
+        return cls.versions.get((current.db._uri_hash, original_tablename(table)), 0)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def create_indexes(cls, tablename, *indexes):
+        """
+            Create database indexes for a table if they don't exist yet;
+            to be called after the table definition, takes effect only
+            if migration is enabled (i.e. whenever the table itself would
+            be created or altered), and only once per process
+
+            Args:
+                tablename: the table name
+                indexes: the indexed field names, a tuple of field names
+                         for a multi-column index
+
+            Note:
+                only supported for postgres and sqlite
+        """
+
+        settings = current.deployment_settings
+        if not settings.get_base_migrate():
+            return
+
+        dbtype = settings.get_database_type()
+        if dbtype in ("postgres", "sqlite"):
+            sql = "CREATE INDEX IF NOT EXISTS %(index)s ON %(table)s (%(fields)s);"
+        else:
+            return
+
+        db = current.db
+        created = cls.db_indexes
+        for fields in indexes:
+            if isinstance(fields, str):
+                fields = (fields,)
+            names = {"table": tablename,
+                     "fields": ", ".join(fields),
+                     "index": "%s_%s_idx" % (tablename, "_".join(fields)),
+                     }
+            key = (db._uri_hash, names["index"])
+            if key not in created:
+                db.executesql(sql % names)
+                created.add(key)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_aliased(table, alias):
@@ -633,6 +1020,13 @@ class DataModel:
         else:
             tablename = table
 
+        # Invalidate shared representations of the record
+        record_vars = record.vars if "vars" in record else record
+        S3RepresentCache.invalidate(tablename, record_vars.get("id"))
+
+        # Update the hierarchy node of the record
+        S3Hierarchy.update_node(tablename, record_vars.get("id"))
+
         onaccept = cls.get_config(tablename, "%s_onaccept" % method,
                    cls.get_config(tablename, "onaccept"))
         if onaccept:
@@ -48,6 +48,13 @@ from ..tools import s3_decode_iso_datetime, s3_encode_iso_datetime, s3_utc, \
 class S3Notifications:
     """ Framework to send notifications about subscribed events """
 
+    # Maximum time difference (seconds) between the last check times
+    # of subscriptions to notify in the same batch
+    BATCH_WINDOW = 300
+
+    # Maximum number of subscriptions per batch
+    BATCH_SIZE = 1000
+
     # -------------------------------------------------------------------------
     @classmethod
     def check_subscriptions(cls):
@@ -63,12 +70,25 @@ class S3Notifications:
 
         subscriptions = cls._subscriptions(now)
         if subscriptions:
-            run_async = current.s3task.run_async
-            for row in subscriptions:
-                # Create asynchronous notification task.
-                row.update_record(locked = True)
-                run_async("notify_notify", args=[row.id])
-            message = "%s notifications scheduled." % len(subscriptions)
+            resource_ids = [row.pr_subscription_resource.id for row in subscriptions]
+            # Lock the subscriptions
+            rtable = current.s3db.pr_subscription_resource
+            current.db(rtable.id.belongs(resource_ids)).update(locked = True)
+            # Create asynchronous notification tasks
+            run_async_many = current.s3task.run_async_many
+            if current.deployment_settings.get_msg_notify_batch():
+                batches = cls._batches(subscriptions)
+                run_async_many("notify_notify_batch",
+                               [([batch], None) for batch in batches],
+                               timeout = 1800,
+                               )
+                message = "%s notifications scheduled in %s batches." % \
+                          (len(resource_ids), len(batches))
+            else:
+                run_async_many("notify_notify",
+                               [([resource_id], None) for resource_id in resource_ids],
+                               )
+                message = "%s notifications scheduled." % len(resource_ids)
         else:
             message = "No notifications to schedule."
 
@@ -140,33 +160,15 @@ class S3Notifications:
         # Break up the URL into its components
         purl = list(urlparse.urlparse(lookup_url))
 
-        # Subscription parameters
-        # Date (must ensure we pass to REST as tz-aware)
+        # Subscription parameters and filters
         last_check_time = s3_encode_iso_datetime(r.last_check_time)
-        query = {"subscription": auth_token, "format": "msg"}
-        if "upd" in s.notify_on:
-            query["~.modified_on__ge"] = "%sZ" % last_check_time
-        else:
-            query["~.created_on__ge"] = "%sZ" % last_check_time
-
-        # Filters
-        if f.query:
-            from ..filters import S3FilterString
-            resource = s3db.resource(r.resource)
-            fstring = S3FilterString(resource, f.query)
-            for k, v in fstring.get_vars.items():
-                if v is not None:
-                    if k in query:
-                        value = query[k]
-                        if type(value) is list:
-                            value.append(v)
-                        else:
-                            query[k] = [value, v]
-                    else:
-                        query[k] = v
-            query_nice = s3_str(fstring.represent())
-        else:
-            query_nice = None
+        query, query_nice = cls._filter_vars(r.resource,
+                                             s.notify_on,
+                                             r.last_check_time,
+                                             f.query,
+                                             )
+        query["subscription"] = auth_token
+        query["format"] = "msg"
 
         # Add subscription parameters and filters to the URL query, and
         # put the URL back together
@@ -229,6 +231,293 @@ class S3Notifications:
         # Done
         return message
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def notify_batch(cls, resource_ids):
+        """
+            Asynchronous task to notify a batch of subscribers about
+            updates, in-process (i.e. without lookup requests):
+                - groups the subscriptions by resource, URL, filter and
+                  notification triggers (and last check time window)
+                - partitions each group by the permissions and language
+                  of the subscribers
+                - extracts the data once per partition, renders the
+                  messages once per format and sends them to all
+                  subscribers in the partition (through S3Msg)
+
+            Args:
+                resource_ids: the pr_subscription_resource record IDs
+
+            Returns:
+                status message
+
+            Note:
+                Resource customisations are applied, but - other than with
+                the lookup request - not the prep of the subscribed controller
+        """
+
+        _debug = current.log.debug
+        _debug("S3Notifications.notify_batch(%s subscriptions)" % len(resource_ids))
+
+        db = current.db
+        s3db = current.s3db
+
+        stable = s3db.pr_subscription
+        rtable = db.pr_subscription_resource
+        ftable = s3db.pr_filter
+        ltable = s3db.pr_person_user
+
+        # Extract the subscription data
+        join = stable.on(rtable.subscription_id == stable.id)
+        left = [ftable.on(ftable.id == stable.filter_id),
+                ltable.on((ltable.pe_id == stable.pe_id) & \
+                          (ltable.deleted == False)),
+                ]
+        rows = db(rtable.id.belongs(resource_ids)).select(stable.pe_id,
+                                                          stable.frequency,
+                                                          stable.notify_on,
+                                                          stable.method,
+                                                          stable.email_format,
+                                                          stable.attachment,
+                                                          rtable.id,
+                                                          rtable.resource,
+                                                          rtable.url,
+                                                          rtable.last_check_time,
+                                                          ftable.query,
+                                                          ltable.user_id,
+                                                          join = join,
+                                                          left = left,
+                                                          )
+
+        # Group the subscriptions
+        groups, seen = {}, set()
+        for row in rows:
+            r = row.pr_subscription_resource
+            if r.id in seen:
+                # Person with multiple user accounts
+                continue
+            seen.add(r.id)
+            key = (r.resource,
+                   r.url,
+                   row.pr_filter.query,
+                   tuple(sorted(row.pr_subscription.notify_on or ())),
+                   )
+            if key in groups:
+                groups[key].append(row)
+            else:
+                groups[key] = [row]
+
+        auth = current.auth
+        permission = auth.permission
+
+        # Remember the current user and request context
+        user_id = auth.user.id if auth.user else None
+        controller, function = permission.controller, permission.function
+
+        results = {}
+        try:
+            for subscriptions in groups.values():
+                for batch in cls._batches(subscriptions, key=None):
+                    results.update(cls._notify_group(batch))
+        finally:
+            # Restore user and request context
+            permission.controller, permission.function = controller, function
+            auth.s3_impersonate(user_id)
+
+        # Update time stamps and unlock
+        intervals = s3db.pr_subscription_check_intervals
+        updates, failed = {}, []
+        for row in rows:
+            r = row.pr_subscription_resource
+            result = results.get(r.id)
+            if result is None or not result[0]:
+                failed.append(r.id)
+                continue
+            last_check_time = result[1]
+            frequency = row.pr_subscription.frequency
+            key = (last_check_time, frequency)
+            if key in updates:
+                updates[key].append(r.id)
+            else:
+                updates[key] = [r.id]
+        for (last_check_time, frequency), ids in updates.items():
+            interval = datetime.timedelta(minutes=intervals.get(frequency, 0))
+            db(rtable.id.belongs(ids)).update(auth_token = None,
+                                              locked = False,
+                                              last_check_time = last_check_time,
+                                              next_check_time = last_check_time + interval,
+                                              )
+        if failed:
+            db(rtable.id.belongs(failed)).update(auth_token = None,
+                                                 locked = False,
+                                                 )
+        db.commit()
+
+        message = "%s subscribers notified, %s failed." % \
+                  (len(seen) - len(failed), len(failed))
+        _debug(message)
+        return message
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _notify_group(cls, subscriptions):
+        """
+            Notify a group of subscribers with the same resource, URL,
+            filter and notification triggers, in-process
+
+            Args:
+                subscriptions: the subscriptions, joined Rows
+                               pr_subscription/pr_subscription_resource/
+                               pr_filter/pr_person_user
+
+            Returns:
+                dict {resource_id: (success, last_check_time)}
+        """
+
+        _debug = current.log.debug
+
+        auth = current.auth
+        permission = auth.permission
+
+        first = subscriptions[0]
+        r = first.pr_subscription_resource
+        tablename = r.resource
+
+        # Time stamp for the next check
+        now = datetime.datetime.utcnow()
+
+        results = {}
+        def done(rows, success, message=None):
+            for row in rows:
+                results[row.pr_subscription_resource.id] = (success, now)
+            if message:
+                _debug(message)
+
+        # Parse the URL
+        purl = urlparse.urlparse(r.url)
+        path = [arg for arg in purl.path.strip("/").split("/") if arg]
+        if len(path) < 2 or "_" not in tablename:
+            done(subscriptions, False, "Invalid subscription URL: %s" % r.url)
+            return results
+        c, f, args = path[0], path[1], path[2:]
+        prefix, name = tablename.split("_", 1)
+
+        # Subscription parameters and filters
+        last_check_time = min(row.pr_subscription_resource.last_check_time or now
+                              for row in subscriptions)
+        get_vars = dict((k, v[0] if len(v) == 1 else v)
+                        for k, v in urlparse.parse_qs(purl.query).items())
+        filter_vars, query_nice = cls._filter_vars(tablename,
+                                                   first.pr_subscription.notify_on,
+                                                   last_check_time,
+                                                   first.pr_filter.query,
+                                                   )
+        for k, v in filter_vars.items():
+            if k in get_vars:
+                value = get_vars[k]
+                if type(value) is not list:
+                    value = [value]
+                get_vars[k] = value + (v if type(v) is list else [v])
+            else:
+                get_vars[k] = v
+
+        public_url = current.deployment_settings.get_base_public_url()
+        page_url = "%s/%s/%s" % (public_url,
+                                 current.request.application,
+                                 r.url.lstrip("/"),
+                                 )
+
+        # Evaluate permissions in the context of the subscribed controller
+        permission.controller, permission.function = c, f
+
+        # Partition the subscribers by permissions and language
+        default_language = current.deployment_settings.get_L10n_default_language()
+        partitions = {}
+        for row in subscriptions:
+            s = row.pr_subscription
+            if not s.notify_on or not s.method:
+                done([row], True, "No notifications configured for this subscription")
+                continue
+            if not s.pe_id:
+                done([row], False, "Not authorized")
+                continue
+            user_id = row.pr_person_user.user_id
+            try:
+                auth.s3_impersonate(user_id)
+            except ValueError:
+                auth.s3_impersonate(None)
+                user_id = None
+            user = auth.user
+            realms = user.realms if user else None
+            language = user.language if user and user.language else default_language
+            key = (str(auth.s3_accessible_query("read", tablename)),
+                   tuple(sorted((k, tuple(v) if v else v) for k, v in realms.items())) if realms else None,
+                   language,
+                   )
+            if key in partitions:
+                partitions[key][2].append(row)
+            else:
+                partitions[key] = (user_id, language, [row])
+
+        # Extract, render and send per partition, in the language of the subscribers
+        from ..controller import CRUDRequest
+        T = current.T
+        ui_language = T.accepted_language
+        try:
+            for user_id, language, rows in partitions.values():
+
+                auth.s3_impersonate(user_id)
+                T.force(language)
+
+                try:
+                    req = CRUDRequest(prefix,
+                                      name,
+                                      c = c,
+                                      f = f,
+                                      args = args,
+                                      get_vars = get_vars,
+                                      extension = "msg",
+                                      http = "POST",
+                                      )
+                    req.customise_resource()
+                    resource = req.component if req.component else req.resource
+                    data = cls._lookup(resource)
+                except Exception:
+                    exc_info = sys.exc_info()[:2]
+                    done(rows, False, "%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                    continue
+
+                if not data["rows"]:
+                    done(rows, True, "No records found")
+                    continue
+
+                composed = {}
+                for row in rows:
+                    s = row.pr_subscription
+                    subscription = {"pe_id": s.pe_id,
+                                    "notify_on": s.notify_on,
+                                    "method": s.method,
+                                    "email_format": s.email_format,
+                                    "attachment": s.attachment,
+                                    "resource": tablename,
+                                    "last_check_time": last_check_time,
+                                    "filter_query": query_nice,
+                                    "page_url": page_url,
+                                    "item_url": None,
+                                    }
+
+                    # Render once per format
+                    key = (tuple(s.method), s.email_format, bool(s.attachment))
+                    if key not in composed:
+                        composed[key] = cls._compose(resource, data, subscription)
+
+                    success, errors = cls._deliver(s.pe_id, composed[key])
+                    done([row], success, ", ".join(errors) if errors else None)
+        finally:
+            T.force(ui_language)
+
+        return results
+
     # -------------------------------------------------------------------------
     @classmethod
     def send(cls, r, resource):
@@ -274,24 +563,75 @@ class S3Notifications:
         if not pe_id:
             r.unauthorised()
 
+        # Extract the data
+        data = cls._lookup(resource)
+        if not data["rows"]:
+            return json_message(message="No records found")
+
+        # Render and send the message(s)
+        subscription["last_check_time"] = s3_decode_iso_datetime(subscription["last_check_time"])
+        success, errors = cls._deliver(pe_id, cls._compose(resource, data, subscription))
+
+        # Done
+        if errors:
+            message = ", ".join(errors)
+        else:
+            message = "Success"
+        return json_message(success=success,
+                            statuscode=200 if success else 403,
+                            message=message)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _lookup(resource):
+        """
+            Extract the updates for a subscription
+
+            Args:
+                resource: the CRUDResource (filtered)
+
+            Returns:
+                the data dict from CRUDResource.select
+        """
+
         # Fields to extract
         fields = resource.list_fields(key="notify_fields")
         if "created_on" not in fields:
             fields.append("created_on")
 
         # Extract the data
-        data = resource.select(fields,
+        return resource.select(fields,
                                represent=True,
                                raw_data=True)
-        rows = data["rows"]
 
-        # How many records do we have?
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _compose(cls, resource, data, subscription):
+        """
+            Render the notification messages for a subscription
+
+            Args:
+                resource: the CRUDResource
+                data: the data returned from CRUDResource.select
+                subscription: the subscription data (dict)
+
+            Returns:
+                dict {"subject": the subject line,
+                      "messages": {contact_method: message},
+                      "document_ids": document IDs to attach,
+                      "send_data": additional arguments for send_by_pe_id,
+                      "errors": list of rendering errors,
+                      }
+        """
+
+        rows = data["rows"]
         numrows = len(rows)
-        if not numrows:
-            return json_message(message="No records found")
 
         #_debug("%s rows:" % numrows)
 
+        notify_on = subscription["notify_on"]
+        methods = subscription["method"]
+
         # Prepare meta-data
         get_config = resource.get_config
         settings = current.deployment_settings
@@ -304,7 +644,7 @@ class S3Notifications:
         else:
             resource_name = string.capwords(resource.name, "_")
 
-        last_check_time = s3_decode_iso_datetime(subscription["last_check_time"])
+        last_check_time = subscription["last_check_time"]
 
         email_format = subscription["email_format"]
         if not email_format:
@@ -376,21 +716,17 @@ class S3Notifications:
                         pass
             return None
 
-        # Render and send the message(s)
+        # Render the message(s)
         templates = settings.get_template()
         if templates != "default" and not isinstance(templates, (tuple, list)):
             templates = (templates,)
         prefix = resource.get_config("notify_template", "notify")
 
-        send = current.msg.send_by_pe_id
-
-        success = False
+        messages = {}
         errors = []
 
         for method in methods:
 
-            error = None
-
             # Get the message template
             msg_template = None
             filenames = ["%s_%s.html" % (prefix, method.lower())]
@@ -426,21 +762,51 @@ class S3Notifications:
                 if hasattr(msg_template, "close"):
                     msg_template.close()
 
-            if not message:
-                continue
+            if message:
+                messages[method] = message
+
+        return {"subject": s3_truncate(subject, 78), # RFC 2822
+                "messages": messages,
+                "document_ids": document_ids,
+                "send_data": send_data,
+                "errors": errors,
+                }
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _deliver(pe_id, composed):
+        """
+            Send the rendered notification messages to a subscriber
+
+            Args:
+                pe_id: the subscriber's PE ID
+                composed: the rendered messages (see _compose)
+
+            Returns:
+                tuple (success, errors), success=True if at least
+                one notification went out
+        """
+
+        send = current.msg.send_by_pe_id
+
+        success = False
+        errors = list(composed["errors"])
+
+        for method, message in composed["messages"].items():
+
+            error = None
 
             # Send the message
             #_debug("Sending message per %s" % method)
             #_debug(message)
             try:
                 sent = send(pe_id,
-                            # RFC 2822
-                            subject=s3_truncate(subject, 78),
+                            subject=composed["subject"],
                             message=message,
                             contact_method=method,
                             system_generated=True,
-                            document_ids=document_ids,
-                            **send_data)
+                            document_ids=composed["document_ids"],
+                            **composed["send_data"])
             except:
                 exc_info = sys.exc_info()[:2]
                 error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
@@ -457,14 +823,107 @@ class S3Notifications:
                 if error:
                     errors.append(error)
 
-        # Done
-        if errors:
-            message = ", ".join(errors)
+        return success, errors
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _filter_vars(tablename, notify_on, last_check_time, filter_query):
+        """
+            Get the URL filter vars to look up the updates for a subscription
+
+            Args:
+                tablename: the subscribed table name
+                notify_on: the notification triggers
+                last_check_time: the last check time (datetime)
+                filter_query: the subscription filter query (JSON)
+
+            Returns:
+                tuple (vars, filter_query_nice), vars being a dict of
+                URL query vars, and filter_query_nice a human-readable
+                representation of the subscription filter (or None)
+        """
+
+        # Date (must ensure we pass to REST as tz-aware)
+        last_check_time = s3_encode_iso_datetime(last_check_time)
+        query = {}
+        if "upd" in notify_on:
+            query["~.modified_on__ge"] = "%sZ" % last_check_time
         else:
-            message = "Success"
-        return json_message(success=success,
-                            statuscode=200 if success else 403,
-                            message=message)
+            query["~.created_on__ge"] = "%sZ" % last_check_time
+
+        # Filters
+        if filter_query:
+            from ..filters import S3FilterString
+            resource = current.s3db.resource(tablename)
+            fstring = S3FilterString(resource, filter_query)
+            for k, v in fstring.get_vars.items():
+                if v is not None:
+                    if k in query:
+                        value = query[k]
+                        if type(value) is list:
+                            value.append(v)
+                        else:
+                            query[k] = [value, v]
+                    else:
+                        query[k] = v
+            query_nice = s3_str(fstring.represent())
+        else:
+            query_nice = None
+
+        return query, query_nice
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _batches(cls, subscriptions, key=True):
+        """
+            Split due subscriptions into batches of subscriptions to the
+            same resource (URL, filter and notification triggers), with
+            last check times in the same time window
+
+            Args:
+                subscriptions: joined Rows pr_subscription/pr_subscription_resource
+                key: group the subscriptions by resource, URL, filter and
+                     notification triggers first (otherwise they are assumed
+                     to be grouped already)
+
+            Returns:
+                list of batches, each a list of pr_subscription_resource
+                record IDs if key is True, otherwise a list of Rows
+        """
+
+        if key:
+            groups = {}
+            for row in subscriptions:
+                r = row.pr_subscription_resource
+                s = row.pr_subscription
+                k = (r.resource, r.url, s.filter_id, tuple(sorted(s.notify_on or ())))
+                if k in groups:
+                    groups[k].append(row)
+                else:
+                    groups[k] = [row]
+            groups = groups.values()
+        else:
+            groups = [subscriptions]
+
+        window = datetime.timedelta(seconds=cls.BATCH_WINDOW)
+        epoch = datetime.datetime.min
+
+        batches = []
+        for rows in groups:
+            rows = sorted(rows, key=lambda row: row.pr_subscription_resource.last_check_time or epoch)
+            batch, start = [], None
+            for row in rows:
+                last_check_time = row.pr_subscription_resource.last_check_time or epoch
+                if batch and (last_check_time - start > window or len(batch) >= cls.BATCH_SIZE):
+                    batches.append(batch)
+                    batch = []
+                if not batch:
+                    start = last_check_time
+                batch.append(row.pr_subscription_resource.id if key else row)
+            if batch:
+                batches.append(batch)
+
+        return batches
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -550,7 +1009,13 @@ class S3Notifications:
                 ((next_check == None) | \
                  (next_check <= now)) & \
                 query
-        return db(query).select(rtable.id, join=join)
+        return db(query).select(rtable.id,
+                                rtable.resource,
+                                rtable.url,
+                                rtable.last_check_time,
+                                stable.filter_id,
+                                stable.notify_on,
+                                join=join)
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -35,7 +35,7 @@ from gluon.tools import callback
 from s3dal import original_tablename, Row
 
 from ..tools import s3_get_last_record_id, s3_has_foreign_key, \
-                    s3_remove_last_record_id
+                    s3_remove_last_record_id, S3Hierarchy, S3RepresentCache
 
 __all__ = ("DeleteProcess",
            )
@@ -46,8 +46,18 @@ DELETED = "deleted"
 class DeleteProcess:
     """
         Process to delete/archive records
+
+        - records are processed in batches, with set-based queries for
+          authorization, cascade, super-entity unlinking and archiving/
+          deletion; if a batch fails, it is processed row by row to
+          identify (and possibly skip) the undeletable rows
+        - tables with an ondelete-hook are processed row by row, so that
+          the hook runs immediately after the deletion of each record
     """
 
+    # Maximum number of records per batch
+    BATCH_SIZE = 500
+
     def __init__(self, resource, archive=None, representation=None):
         """
             Args:
@@ -141,14 +151,21 @@ class DeleteProcess:
         has_permission = current.auth.s3_has_permission
         prepare = self.prepare
 
+        if joined:
+            rows = [getattr(row, tablename) for row in rows]
+
+        # Bulk authorization, records outside of the accessible set
+        # are checked individually
+        accessible = self.accessible([row[pkey] for row in rows])
+
         records = []
-        for row in rows:
+        for record in rows:
 
-            record = getattr(row, tablename) if joined else row
             record_id = record[pkey]
 
             # Check permissions
-            if not has_permission("delete", table, record_id=record_id):
+            if record_id not in accessible and \
+               not has_permission("delete", table, record_id=record_id):
                 self.permission_error = True
                 add_error(record_id, "not permitted")
                 continue
@@ -177,84 +194,241 @@ class DeleteProcess:
         # Delete the records
         db = current.db
 
-        audit = current.audit
-        resource = self.resource
-        prefix, name = resource.prefix, resource.name
-
-        ondelete = self.ondelete
-        delete_super = current.s3db.delete_super
+        # Process row by row if:
+        # - the records can reference each other (the cascade of one
+        #   row could otherwise process other rows too)
+        # - there is an ondelete-hook, which must run immediately after
+        #   the deletion of each record (it may inspect the database)
+        if self.self_referencing or self.ondelete:
+            size = 1
+        else:
+            size = self.BATCH_SIZE
 
         num_deleted = 0
-        for row in deletable:
+        failed = False
+        for i in range(0, len(deletable), size):
 
-            record_id = row[pkey]
-            success = True
+            batch = deletable[i:i + size]
 
-            if self.archive:
-                # Run automatic deletion cascade
-                success = self.cascade(row, check_all=check_all)
-
-            if success:
-                # Unlink all super-records
-                success = delete_super(table, row)
-                if not success:
-                    add_error(record_id, "super-entity deletion failed")
-
-            if success:
-                # Auto-delete linked record if appropriate
-                self.auto_delete_linked(row)
-
-                # Archive/delete the row itself
-                if self.archive:
-                    success = self.archive_record(row, replaced_by=replaced_by)
-                else:
-                    success = self.delete_record(row)
+            if len(batch) > 1:
+                # Process the entire batch
+                errors = dict(self.errors)
+                success = self.delete_rows(batch,
+                                           replaced_by = replaced_by,
+                                           check_all = check_all,
+                                           )
+                if success:
+                    for row in batch:
+                        self.postprocess(row)
+                    if not cascade and skip_undeletable:
+                        db.commit()
+                    num_deleted += len(batch)
+                    continue
 
-            if success:
-                # Postprocess delete
+                elif cascade:
+                    # Cascade failure, will be rolled back by master process
+                    break
 
-                # Clear session
-                if s3_get_last_record_id(tablename) == record_id:
-                    s3_remove_last_record_id(tablename)
+                # Master process failure
+                db.rollback()
+                if not skip_undeletable:
+                    # Exit, but identify the failing record first
+                    self.locate_error(batch,
+                                      errors,
+                                      replaced_by = replaced_by,
+                                      check_all = check_all,
+                                      )
+                    self.log_errors()
+                    break
 
-                # Audit
-                audit("delete", prefix, name,
-                      record = record_id,
-                      representation = self.representation,
-                      )
+                # Process the batch row by row, to skip only the
+                # undeletable rows
+                self.errors = errors
+
+            for row in batch:
 
-                # On-delete hook
-                if ondelete:
-                    callback(ondelete, row)
+                success = self.delete_rows([row],
+                                           replaced_by = replaced_by,
+                                           check_all = check_all,
+                                           )
+                if success:
+                    self.postprocess(row)
 
-                # Subsequent cascade errors would roll back successful
-                # deletions too => we want to prevent that when skipping
-                # undeletable rows, so commit here if this is the master
-                # process
-                if not cascade and skip_undeletable:
-                    db.commit()
+                    # Subsequent cascade errors would roll back successful
+                    # deletions too => we want to prevent that when skipping
+                    # undeletable rows, so commit here if this is the master
+                    # process
+                    if not cascade and skip_undeletable:
+                        db.commit()
 
-                num_deleted += 1
+                    num_deleted += 1
 
-            elif not cascade:
-                # Master process failure
-                db.rollback()
-                self.log_errors()
+                elif not cascade:
+                    # Master process failure
+                    db.rollback()
+                    self.log_errors()
 
-                if skip_undeletable:
-                    # Try next row
-                    continue
+                    if skip_undeletable:
+                        # Try next row
+                        continue
+                    else:
+                        # Exit immediately
+                        failed = True
+                        break
                 else:
-                    # Exit immediately
+                    # Cascade failure, no point to try any other row
+                    # - will be rolled back by master process
+                    failed = True
                     break
-            else:
-                # Cascade failure, no point to try any other row
-                # - will be rolled back by master process
+
+            if failed:
                 break
 
         self.set_resource_error()
         return num_deleted
 
+    # -------------------------------------------------------------------------
+    def accessible(self, record_ids):
+        """
+            Determine which of the records are accessible for deletion,
+            using the accessible query (bulk authorization)
+
+            Args:
+                record_ids: the record IDs
+
+            Returns:
+                set of accessible record IDs
+
+            Note:
+                Records not in the accessible set may still be deletable
+                (e.g. unapproved records with review permission), so
+                their permission must be checked individually
+        """
+
+        if not record_ids:
+            return set()
+
+        db = current.db
+        table = self.table
+        pkey = table._id.name
+
+        query = current.auth.s3_accessible_query("delete", table)
+
+        accessible = set()
+        size = self.BATCH_SIZE
+        for i in range(0, len(record_ids), size):
+            ids = record_ids[i:i + size]
+            rows = db(table._id.belongs(ids) & query).select(table._id)
+            accessible.update(row[pkey] for row in rows)
+
+        return accessible
+
+    # -------------------------------------------------------------------------
+    def delete_rows(self, rows, replaced_by=None, check_all=False):
+        """
+            Delete/archive a set of rows, including the deletion cascade,
+            the super-entity links and linked records
+
+            Args:
+                rows: the Rows to delete
+                replaced_by: dict of {replaced_id: replacement_id},
+                             used by record merger
+                check_all: process the entire cascade to reveal all errors
+
+            Returns:
+                True for success, False on error (caller must roll back)
+        """
+
+        success = True
+
+        if self.archive:
+            # Run automatic deletion cascade
+            success = self.cascade(rows, check_all=check_all)
+
+        if success:
+            # Unlink all super-records
+            success = self.delete_super(rows)
+
+        if success:
+            # Auto-delete linked records if appropriate
+            self.auto_delete_linked(rows)
+
+            # Archive/delete the rows themselves
+            if self.archive:
+                success = self.archive_records(rows, replaced_by=replaced_by)
+            else:
+                success = self.delete_records(rows)
+
+        return success
+
+    # -------------------------------------------------------------------------
+    def locate_error(self, rows, errors, replaced_by=None, check_all=False):
+        """
+            Process the rows of a failed batch one by one, in order to
+            report the error for the failing record rather than for the
+            entire batch; rolls back the transaction in any case
+
+            Args:
+                rows: the Rows of the failed batch
+                errors: the errors before processing the batch
+                replaced_by: dict of {replaced_id: replacement_id},
+                             used by record merger
+                check_all: process the entire cascade to reveal all errors
+        """
+
+        batch_errors = self.errors
+        self.errors = errors
+
+        located = False
+        for row in rows:
+            if not self.delete_rows([row],
+                                    replaced_by = replaced_by,
+                                    check_all = check_all,
+                                    ):
+                located = True
+                break
+
+        current.db.rollback()
+
+        if not located:
+            # Failure only occurs in the batch => report batch errors
+            self.errors = batch_errors
+
+    # -------------------------------------------------------------------------
+    def postprocess(self, row):
+        """
+            Postprocess the deletion of a row (session, audit, caches,
+            ondelete-hook)
+
+            Args:
+                row: the deleted Row
+        """
+
+        tablename = self.tablename
+        record_id = row[self.table._id.name]
+
+        # Clear session
+        if s3_get_last_record_id(tablename) == record_id:
+            s3_remove_last_record_id(tablename)
+
+        # Audit
+        resource = self.resource
+        current.audit("delete", resource.prefix, resource.name,
+                      record = record_id,
+                      representation = self.representation,
+                      )
+
+        # Invalidate shared representations of the record
+        S3RepresentCache.invalidate(tablename, record_id)
+
+        # Remove the hierarchy node of the record
+        S3Hierarchy.remove_node(tablename, row)
+
+        # On-delete hook
+        ondelete = self.ondelete
+        if ondelete:
+            callback(ondelete, row)
+
     # -------------------------------------------------------------------------
     def extract(self):
         """
@@ -358,13 +532,13 @@ class DeleteProcess:
         return [row for row in rows if row[pkey] in deletable]
 
     # -------------------------------------------------------------------------
-    def cascade(self, row, check_all=False):
+    def cascade(self, rows, check_all=False):
         """
             Run the automatic deletion cascade: remove or update records
-            referencing this row with ondelete!="RESTRICT"
+            referencing these rows with ondelete!="RESTRICT"
 
             Args:
-                row: the Row to delete
+                rows: the Rows to delete
                 check_all: process the entire cascade to reveal all
                            errors (rather than breaking out of it after
                            the first error)
@@ -373,7 +547,7 @@ class DeleteProcess:
         tablename = self.tablename
         table = self.table
         pkey = table._id.name
-        record_id = row[pkey]
+        record_ids = [row[pkey] for row in rows]
 
         success = True
 
@@ -388,7 +562,10 @@ class DeleteProcess:
             tn = reference.tablename
             rtable = db[tn]
 
-            query = (reference == record_id)
+            if len(record_ids) == 1:
+                query = (reference == record_ids[0])
+            else:
+                query = (reference.belongs(record_ids))
             if tn == tablename:
                 query &= (reference != rtable._id)
 
@@ -408,7 +585,7 @@ class DeleteProcess:
                 delete(cascade=True)
                 if delete.errors:
                     success = False
-                    add_error(record_id, delete.errors)
+                    self.add_cascade_errors(reference, record_ids, delete.errors)
                     if check_all:
                         continue
                     else:
@@ -430,7 +607,9 @@ class DeleteProcess:
                     db(query).update(**{fn: default})
                 except Exception:
                     success = False
-                    add_error(record_id, sys.exc_info()[1])
+                    error = sys.exc_info()[1]
+                    for record_id in record_ids:
+                        add_error(record_id, error)
                     if check_all:
                         continue
                     else:
@@ -439,12 +618,51 @@ class DeleteProcess:
         return success
 
     # -------------------------------------------------------------------------
-    def auto_delete_linked(self, row):
+    def add_cascade_errors(self, reference, record_ids, errors):
         """
-            Auto-delete linked records if row was the last link
+            Add the errors of a cascade process to the records referenced
+            by the failed records
 
             Args:
-                row: the Row about to get deleted
+                reference: the reference Field
+                record_ids: the IDs of the records being deleted
+                errors: the errors of the cascade process
+                        {(tablename, record_id): error}
+        """
+
+        add_error = self.add_error
+
+        if len(record_ids) == 1:
+            add_error(record_ids[0], errors)
+            return
+
+        # Look up which record is referenced by each failed record
+        rtable = current.db[reference.tablename]
+        failed = [key[1] for key in errors]
+        rows = current.db(rtable._id.belongs(failed)).select(rtable._id,
+                                                              reference,
+                                                              )
+        referenced = {row[rtable._id]: row[reference] for row in rows}
+
+        by_record = {}
+        for key, error in errors.items():
+            record_id = referenced.get(key[1])
+            targets = [record_id] if record_id in record_ids else record_ids
+            for target in targets:
+                if target not in by_record:
+                    by_record[target] = {}
+                by_record[target][key] = error
+
+        for record_id, record_errors in by_record.items():
+            add_error(record_id, record_errors)
+
+    # -------------------------------------------------------------------------
+    def auto_delete_linked(self, rows):
+        """
+            Auto-delete linked records if the rows were the last links
+
+            Args:
+                rows: the Rows about to get deleted
         """
 
         resource = self.resource
@@ -453,45 +671,115 @@ class DeleteProcess:
         if linked and resource.autodelete and linked.autodelete:
 
             table = self.table
+            pkey = table._id.name
             rkey = linked.rkey
-            if rkey in row:
-                this_rkey = row[rkey]
-
-                # Check for other links to the same linked record
-                query = (table._id != row[table._id.name]) & \
-                        (table[rkey] == this_rkey)
-                if DELETED in table:
-                    query &= (table[DELETED] != True)
-                remaining = current.db(query).select(table._id,
-                                                     limitby = (0, 1),
-                                                     ).first()
-                if not remaining:
-                    # Try to delete the linked record
-                    s3db = current.s3db
-                    fkey = linked.fkey
-                    linked_table = s3db.table(linked.tablename)
-                    query = (linked_table[fkey] == this_rkey)
-                    linked = s3db.resource(linked_table,
-                                           filter = query,
-                                           unapproved = True,
-                                           )
-                    delete = DeleteProcess(linked,
-                                           archive = self.archive,
-                                           representation = self.representation,
-                                           )
-                    delete(cascade=True)
-                    if delete.errors:
-                        delete.log_errors()
+
+            values = {row[rkey] for row in rows if rkey in row}
+            values.discard(None)
+            if not values:
+                return
+
+            # Check for other links to the same linked records
+            db = current.db
+            record_ids = [row[pkey] for row in rows]
+            query = (~(table._id.belongs(record_ids))) & \
+                    (table[rkey].belongs(values))
+            if DELETED in table:
+                query &= (table[DELETED] != True)
+            remaining = db(query).select(table[rkey], distinct=True)
+            values -= {row[rkey] for row in remaining}
+
+            if values:
+                # Try to delete the linked records
+                s3db = current.s3db
+                fkey = linked.fkey
+                linked_table = s3db.table(linked.tablename)
+                query = (linked_table[fkey].belongs(values))
+                linked = s3db.resource(linked_table,
+                                       filter = query,
+                                       unapproved = True,
+                                       )
+                delete = DeleteProcess(linked,
+                                       archive = self.archive,
+                                       representation = self.representation,
+                                       )
+                delete(cascade=True)
+                if delete.errors:
+                    delete.log_errors()
+
+    # -------------------------------------------------------------------------
+    def delete_super(self, rows):
+        """
+            Remove the super-entity links of the rows, and delete the
+            super-records
+
+            Args:
+                rows: the Rows to delete
+
+            Returns:
+                True for success, False on error
+        """
+
+        s3db = current.s3db
+        table = self.table
+        pkey = table._id.name
+
+        if len(rows) == 1:
+            row = rows[0]
+            success = s3db.delete_super(table, row)
+            if not success:
+                self.add_error(row[pkey], "super-entity deletion failed")
+            return success
+
+        supertables = s3db.get_config(self.tablename, "super_entity")
+        if not supertables:
+            return True
+        if not isinstance(supertables, (list, tuple)):
+            supertables = [supertables]
+
+        db = current.db
+        for sname in supertables:
+            stable = s3db.table(sname) if isinstance(sname, str) else sname
+            if stable is None:
+                continue
+            key = stable._id.name
+            if key not in table.fields:
+                continue
+
+            values = {}
+            for row in rows:
+                value = row[key]
+                if value:
+                    values[row[pkey]] = value
+            if not values:
+                continue
+
+            # Remove the super keys
+            # - the Rows remain unchanged, as they may be needed for
+            #   a row-by-row retry after rollback
+            db(table._id.belongs(list(values))).update(**{key: None})
+
+            # Delete the super records
+            sresource = s3db.resource(stable, id=list(set(values.values())))
+            deleted = sresource.delete(cascade=True, log_errors=True)
+
+            if not deleted or sresource.error:
+                for record_id in values:
+                    self.add_error(record_id, "super-entity deletion failed")
+                return False
+
+        return True
 
     # -------------------------------------------------------------------------
     # Record Archiving/Deletion
     # -------------------------------------------------------------------------
-    def archive_record(self, row, replaced_by=None):
+    def archive_records(self, rows, replaced_by=None):
         """
-            Archive ("soft-delete") a record
+            Archive ("soft-delete") a set of records; records with the
+            same archive data (e.g. same foreign keys) are updated together
 
             Args:
-                row: the Row to delete
+                rows: the Rows to delete
                 replaced_by: dict of {replaced_id: replacement_id}, used \
                              by record merger to log which record has replaced which
 
@@ -499,6 +787,54 @@ class DeleteProcess:
                 True for success, False on error
         """
 
+        if len(rows) == 1:
+            return self.archive_record(rows[0], replaced_by=replaced_by)
+
+        table = self.table
+        pkey = table._id.name
+
+        groups = {}
+        for row in rows:
+            data = self.archive_data(row, replaced_by=replaced_by)
+            key = json.dumps(data, sort_keys=True, default=str)
+            if key in groups:
+                groups[key][1].append(row[pkey])
+            else:
+                groups[key] = (data, [row[pkey]])
+
+        db = current.db
+        add_error = self.add_error
+        for data, record_ids in groups.values():
+            try:
+                result = db(table._id.belongs(record_ids)).update(**data)
+            except Exception:
+                # Integrity Error
+                error = sys.exc_info()[1]
+                for record_id in record_ids:
+                    add_error(record_id, error)
+                return False
+
+            if result != len(record_ids):
+                # Unknown Error
+                for record_id in record_ids:
+                    add_error(record_id, "archiving failed")
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def archive_data(self, row, replaced_by=None):
+        """
+            Get the data to update a record with when archiving it
+
+            Args:
+                row: the Row to delete
+                replaced_by: dict of {replaced_id: replacement_id}
+
+            Returns:
+                the data, a dict {fieldname: value}
+        """
+
         table = self.table
         table_fields = table.fields
 
@@ -506,9 +842,12 @@ class DeleteProcess:
         data = {"deleted": True}
 
         # Reset foreign keys to resolve constraints
+        # - super keys have been removed before archiving (delete_super),
+        #   so their values are not remembered
+        super_keys = self.super_keys
         fk = {}
         for fname in self.foreign_keys:
-            value = row[fname]
+            value = row[fname] if fname not in super_keys else None
             if value:
                 fk[fname] = value
             if not table[fname].notnull:
@@ -523,6 +862,27 @@ class DeleteProcess:
             if rb:
                 data["deleted_rb"] = rb
 
+        return data
+
+    # -------------------------------------------------------------------------
+    def archive_record(self, row, replaced_by=None):
+        """
+            Archive ("soft-delete") a record
+
+            Args:
+                row: the Row to delete
+                replaced_by: dict of {replaced_id: replacement_id}, used \
+                             by record merger to log which record has replaced which
+
+            Returns:
+                True for success, False on error
+        """
+
+        table = self.table
+
+        record_id = row[table._id.name]
+        data = self.archive_data(row, replaced_by=replaced_by)
+
         try:
             result = current.db(table._id == record_id).update(**data)
         except Exception:
@@ -537,6 +897,43 @@ class DeleteProcess:
         else:
             return True
 
+    # -------------------------------------------------------------------------
+    def delete_records(self, rows):
+        """
+            Delete a set of records
+
+            Args:
+                rows: the Rows to delete
+
+            Returns:
+                True for success, False on error
+        """
+
+        if len(rows) == 1:
+            return self.delete_record(rows[0])
+
+        table = self.table
+        pkey = table._id.name
+        record_ids = [row[pkey] for row in rows]
+
+        add_error = self.add_error
+        try:
+            result = current.db(table._id.belongs(record_ids)).delete()
+        except Exception:
+            # Integrity Error
+            error = sys.exc_info()[1]
+            for record_id in record_ids:
+                add_error(record_id, error)
+            return False
+
+        if result != len(record_ids):
+            # Unknown Error
+            for record_id in record_ids:
+                add_error(record_id, "deletion failed")
+            return False
+        else:
+            return True
+
     # -------------------------------------------------------------------------
     def delete_record(self, row):
         """
@@ -664,6 +1061,25 @@ class DeleteProcess:
 
         return restrictions
 
+    # -------------------------------------------------------------------------
+    @property
+    def self_referencing(self):
+        """
+            Whether the records can be referenced by records in the same
+            table (only relevant for archiving, which runs the cascade)
+
+            Returns:
+                boolean
+        """
+
+        if not self.archive:
+            return False
+
+        tablename = self.tablename
+        return any(reference.tablename == tablename
+                   for reference in self.references
+                   )
+
     # -------------------------------------------------------------------------
     def introspect(self):
         """
@@ -71,7 +71,8 @@ class S3Exporter:
              fields=None,
              orderby=None,
              represent=False,
-             tooltip=None):
+             tooltip=None,
+             after=None):
         """
             Export a resource as JSON
 
@@ -91,6 +92,9 @@ class S3Exporter:
                          to return a dict {k:tooltip} => used by
                          filterOptionsS3 to extract onhover-tooltips for
                          Ajax-update of options
+                after: continuation token for keyset pagination (empty
+                       string for the first page); the token for the next
+                       page is returned in the X-Continuation-Token header
         """
 
         if fields is None:
@@ -125,11 +129,13 @@ class S3Exporter:
                     fields.append(tooltip)
 
         # Get the data
-        _rows = resource.select(fields,
-                                start=start,
-                                limit=limit,
-                                orderby=orderby,
-                                represent=represent).rows
+        data = resource.select(fields,
+                               start=start,
+                               limit=limit,
+                               orderby=orderby,
+                               represent=represent,
+                               after=after)
+        _rows = data.rows
 
         # Simplify to plain fieldnames for fields in this table
         tn = "%s." % resource.tablename
@@ -206,6 +212,8 @@ class S3Exporter:
         response = current.response
         if response:
             response.headers["Content-Type"] = "application/json"
+            if data.next:
+                response.headers["X-Continuation-Token"] = data.next
 
         from gluon.serializers import json as jsons
         return jsons(rows)
@@ -49,7 +49,8 @@ from gluon.tools import callback
 from s3dal import Field
 
 from ..tools import s3_format_datetime, s3_get_foreign_key, \
-                    s3_has_foreign_key, s3_str, s3_utc
+                    s3_has_foreign_key, s3_savepoint, s3_str, s3_utc, \
+                    S3Hierarchy, S3RepresentCache
 
 # =============================================================================
 class XMLImporter:
@@ -149,6 +150,7 @@ class XMLImporter:
                     select_items = None,
                     strategy = None,
                     sync_policy = None,
+                    bulk = None,
                     ):
         """
             Import data from an S3XML element tree.
@@ -169,6 +171,8 @@ class XMLImporter:
                                    (list of import item record IDs)
                 strategy: list of allowed import methods
                 sync_policy: the synchronization policy (SyncPolicy)
+                bulk: use bulk mode (True or batch size), defaults
+                      to deployment setting
         """
 
         db = current.db
@@ -176,6 +180,9 @@ class XMLImporter:
 
         s3 = current.response.s3
 
+        if bulk is None:
+            bulk = current.deployment_settings.get_import_bulk()
+
         table = s3db.table(tablename)
         if not table or "id" not in table.fields:
             return ImportResult(False, current.ERROR.BAD_RESOURCE)
@@ -203,6 +210,7 @@ class XMLImporter:
                                    files = files,
                                    strategy = strategy,
                                    sync_policy = sync_policy,
+                                   bulk = bulk,
                                    )
 
             # Add import items for matching elements
@@ -230,6 +238,7 @@ class XMLImporter:
                                        job_id = job_id,
                                        strategy = strategy,
                                        sync_policy = sync_policy,
+                                       bulk = bulk,
                                        )
             except SyntaxError:
                 return ImportResult(False, current.ERROR.BAD_SOURCE)
@@ -433,6 +442,9 @@ class ImportJob():
         Class to import an element tree into the database
     """
 
+    # Default batch size for bulk mode
+    BULK_SIZE = 500
+
     def __init__(self,
                  table,
                  tree = None,
@@ -440,6 +452,7 @@ class ImportJob():
                  job_id = None,
                  strategy = None,
                  sync_policy = None,
+                 bulk = False,
                  ):
         """
             Args:
@@ -448,6 +461,9 @@ class ImportJob():
                 job_id: restore job from database (record ID or job_id)
                 strategy: the import strategy
                 sync_policy: the synchronization policy
+                bulk: use bulk mode, i.e. pre-resolve UIDs and S3Duplicate
+                      keys for the whole job, and insert new records in
+                      batches (True or batch size)
         """
 
         self.error = None # the last error
@@ -475,6 +491,18 @@ class ImportJob():
 
         self.log = None
 
+        # Bulk mode
+        if bulk is True:
+            bulk = self.BULK_SIZE
+        self.bulk = bulk if bulk and bulk > 0 else False
+        self._uids = None
+        self._originals = {}
+        self._duplicates = {}
+        self._referenced = None
+        self._pending = {}
+        self._pending_keys = {}
+        self._bulk_failed = False
+
         # Import strategy
         if strategy is None:
             METHOD = ImportItem.METHOD
@@ -1088,21 +1116,28 @@ class ImportJob():
 
         self.log = log_items
         failed = False
+        logged = set()
         for item_id in import_list:
             item = items[item_id]
-            error = None
 
             if item.accepted is not False:
-                logged = False
                 success = item.commit(ignore_errors=ignore_errors)
             else:
                 # Field validation failed
-                logged = True
+                logged.add(item_id)
                 success = ignore_errors
 
             if not success:
                 failed = True
 
+        # Insert any remaining batches (bulk mode)
+        self.flush()
+        if self._bulk_failed and not ignore_errors:
+            failed = True
+
+        for item_id in import_list:
+            item = items[item_id]
+
             error = item.error
             if error:
                 current.log.error(error)
@@ -1111,7 +1146,7 @@ class ImportJob():
                 if element is not None:
                     if not element.get(ATTRIBUTE.error, False):
                         element.set(ATTRIBUTE.error, s3_str(error))
-                    if not logged:
+                    if item_id not in logged:
                         self.error_tree.append(deepcopy(element))
                 if item.tablename == tablename:
                     errors += 1
@@ -1139,6 +1174,368 @@ class ImportJob():
         self.deleted = deleted
         return True
 
+    # -------------------------------------------------------------------------
+    # Bulk mode
+    # -------------------------------------------------------------------------
+    def original(self, table, record, mandatory=None):
+        """
+            Find the original record for a possible duplicate (see
+            CRUDResource.original), in bulk mode using the UIDs that
+            have been pre-resolved for the whole job
+
+            Args:
+                table: the table
+                record: the record as dict or S3XML Element
+                mandatory: the mandatory fields of the table
+
+            Returns:
+                the original Row, or None if not found
+        """
+
+        if self.bulk:
+            tablename = table._tablename
+
+            originals = self._originals.get(tablename)
+            if originals is None:
+                originals = self.preload(table, mandatory=mandatory)
+                self._originals[tablename] = originals
+
+            uid = record.get(current.xml.UID)
+            if uid and uid in originals:
+                return originals[uid]
+
+            # Pending inserts with the same keys must be visible to the lookup
+            pending_keys = self._pending_keys.get(tablename)
+            if pending_keys and \
+               not pending_keys.isdisjoint(self.original_keys(table, record)):
+                self.flush(tablename)
+
+        from ..resource import CRUDResource
+        return CRUDResource.original(table, record, mandatory=mandatory)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def original_keys(table, record):
+        """
+            Get the keys by which CRUDResource.original could match a
+            record, to look them up in the pending inserts (bulk mode)
+
+            Args:
+                table: the table
+                record: the record as dict or S3XML Element
+
+            Returns:
+                set of tuples (fieldname, value)
+        """
+
+        from ..resource import CRUDResource
+
+        xml = current.xml
+        UID = xml.UID
+
+        keys = set()
+        for fn, value in CRUDResource.original_keys(table, record).items():
+            if fn == UID:
+                value = xml.import_uid(value)
+            keys.add((fn, s3_str(value)))
+
+        return keys
+
+    # -------------------------------------------------------------------------
+    def preload(self, table, mandatory=None):
+        """
+            Look up the originals for all UIDs of a table in the import
+            tree with a single query
+
+            Args:
+                table: the table
+                mandatory: the mandatory fields of the table
+
+            Returns:
+                dict {uid: Row or None}
+
+            Note:
+                Tables with unique keys other than the UID are not
+                pre-resolved, since those keys take precedence in
+                CRUDResource.original
+        """
+
+        xml = current.xml
+        UID = xml.UID
+
+        originals = {}
+
+        pkey = table._id.name
+        if UID not in table.fields or \
+           any(table[fn].unique for fn in table.fields if fn not in (UID, pkey)):
+            return originals
+
+        # Collect the UIDs for all tables from the tree
+        uids = self._uids
+        if uids is None:
+            uids = self._uids = {}
+            uidmap = self.uidmap
+            if uidmap:
+                for name, uid in uidmap[UID]:
+                    if name in uids:
+                        uids[name].append(uid)
+                    else:
+                        uids[name] = [uid]
+
+        uids = uids.get(table._tablename)
+        if not uids:
+            return originals
+
+        import_uid = xml.import_uid
+        keys = {}
+        for uid in uids:
+            keys[import_uid(uid)] = uid
+            originals[uid] = None
+
+        from ..resource import CRUDResource
+        fields = CRUDResource.import_fields(table, [UID], mandatory=mandatory)
+        rows = current.db(table[UID].belongs(set(keys))).select(*fields)
+        for row in rows:
+            uid = keys.get(row[UID])
+            if uid:
+                originals[uid] = row
+
+        return originals
+
+    # -------------------------------------------------------------------------
+    def duplicates(self, table, deduplicator):
+        """
+            Get the duplicate candidates for all items of a table in
+            this job (bulk mode)
+
+            Args:
+                table: the table
+                deduplicator: the S3Duplicate instance for the table
+
+            Returns:
+                dict {key: [Row]}, see S3Duplicate.preload
+        """
+
+        tablename = table._tablename
+
+        duplicates = self._duplicates.get(tablename)
+        if duplicates is None:
+            records = [item.data for item in self.items.values()
+                       if item.tablename == tablename and item.data and not item.id
+                       ]
+            index = deduplicator.preload(table, records)
+
+            # Reverse lookup to invalidate keys of updated records
+            keys = {}
+            pkey = table._id.name
+            for key, rows in index.items():
+                for row in rows:
+                    keys[row[pkey]] = key
+
+            duplicates = (deduplicator, index, keys)
+            self._duplicates[tablename] = duplicates
+
+        return duplicates[1]
+
+    # -------------------------------------------------------------------------
+    def invalidate(self, item):
+        """
+            Remove the keys of an item from the pre-resolved UIDs and
+            duplicates before writing it, so that subsequent items with
+            the same keys are looked up from the database instead
+
+            Args:
+                item: the ImportItem
+        """
+
+        tablename = item.tablename
+        data = item.data
+
+        originals = self._originals.get(tablename)
+        if originals:
+            UID = current.xml.UID
+            element = item.element
+            if element is not None:
+                originals.pop(element.get(UID), None)
+            if data:
+                originals.pop(data.get(UID), None)
+
+        duplicates = self._duplicates.get(tablename)
+        if duplicates:
+            deduplicator, index, keys = duplicates
+            if data:
+                index.pop(deduplicator.key(item.table, data), None)
+            if item.id:
+                index.pop(keys.get(item.id), None)
+
+    # -------------------------------------------------------------------------
+    def defer(self, item, data):
+        """
+            Schedule a new record for batch insert (bulk mode)
+
+            Args:
+                item: the ImportItem
+                data: the record data to insert
+
+            Returns:
+                True if the insert has been deferred, otherwise False
+
+            Note:
+                Records that are referenced by other items of the job,
+                or have components, are always inserted immediately;
+                tables can opt out with the "bulk_import" setting
+        """
+
+        if not self.bulk:
+            return False
+
+        table = item.table
+        UID = current.xml.UID
+        if UID not in table.fields or \
+           table._id.name != "id" or \
+           item.components or item.update:
+            return False
+
+        tablename = item.tablename
+        if not current.s3db.get_config(tablename, "bulk_import", True):
+            return False
+
+        referenced = self._referenced
+        if referenced is None:
+            referenced = self._referenced = set()
+            for i in self.items.values():
+                for reference in i.references:
+                    entry = reference.entry
+                    if entry and entry.item_id:
+                        referenced.add(entry.item_id)
+        if item.item_id in referenced:
+            return False
+
+        # UID is needed to retrieve the record ID after insert
+        if not data.get(UID):
+            data[UID] = uuid.uuid4().urn
+
+        pending = self._pending.get(tablename)
+        if pending is None:
+            pending = self._pending[tablename] = []
+        pending.append((item, data))
+
+        keys = self.original_keys(table, data)
+        pending_keys = self._pending_keys.get(tablename)
+        if pending_keys is None:
+            self._pending_keys[tablename] = keys
+        else:
+            pending_keys |= keys
+
+        if len(pending) >= self.bulk:
+            self.flush(tablename)
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def flush(self, tablename=None):
+        """
+            Insert all pending new records (bulk mode), then run the
+            post-commit phase (audit, onaccept etc.) for the batch
+
+            Args:
+                tablename: insert only the pending records for this table
+        """
+
+        pending = self._pending
+        if not pending:
+            return
+
+        if tablename:
+            tablenames = [tablename]
+        else:
+            tablenames = list(pending.keys())
+
+        for tn in tablenames:
+            batch = pending.pop(tn, None)
+            self._pending_keys.pop(tn, None)
+            if not batch:
+                continue
+
+            table = batch[0][0].table
+            self.bulk_insert(table, batch)
+
+            # Post-process the batch
+            for item, _ in batch:
+                if item.committed:
+                    item.postprocess()
+
+    # -------------------------------------------------------------------------
+    def bulk_insert(self, table, batch):
+        """
+            Insert a batch of new records with multi-row INSERTs, one
+            per set of columns
+
+            Args:
+                table: the table
+                batch: list of tuples (item, data)
+        """
+
+        db = current.db
+        adapter = db._adapter
+
+        UID = current.xml.UID
+
+        # Build the rows and group them by columns
+        groups = {}
+        for item, data in batch:
+            row = table._fields_and_values_for_insert(data)
+            if any(f(row) for f in table._before_insert):
+                # Insert cancelled by callback
+                continue
+            values = row.op_values()
+            columns = tuple(field.name for field, _ in values)
+            if columns in groups:
+                groups[columns].append((item, row, values))
+            else:
+                groups[columns] = [(item, row, values)]
+
+        after_insert = table._after_insert
+        for columns, rows in groups.items():
+
+            sql = "INSERT INTO %s(%s) VALUES %s;" % \
+                  (table._rname,
+                   ",".join(table[fn]._rname for fn in columns),
+                   ",".join("(%s)" % ",".join(adapter.expand(v, f.type) for f, v in values)
+                            for _, _, values in rows
+                            ),
+                   )
+            ids = {}
+            try:
+                with s3_savepoint():
+                    db.executesql(sql)
+            except Exception:
+                # Insert row by row to identify the failing records
+                for item, _, values in rows:
+                    try:
+                        with s3_savepoint():
+                            ids[item.item_id] = adapter.insert(table, values)
+                    except Exception:
+                        item.error = s3_str(sys.exc_info()[1])
+                        item.skip = True
+                        self._bulk_failed = True
+            else:
+                # Look up the record IDs
+                uids = {}
+                for item, row, _ in rows:
+                    uids[row[UID]] = item.item_id
+                query = table[UID].belongs(set(uids))
+                for record in db(query).select(table._id, table[UID]):
+                    ids[uids[record[UID]]] = record[table._id]
+
+            for item, row, _ in rows:
+                record_id = ids.get(item.item_id)
+                if record_id:
+                    item.id = record_id
+                    item.committed = True
+                    for f in after_insert:
+                        f(row, record_id)
+
     # -------------------------------------------------------------------------
     def store(self):
         """
@@ -1393,10 +1790,10 @@ class ImportItem:
 
         from ..resource import CRUDResource
         if original is None:
-            original = CRUDResource.original(table,
-                                             element,
-                                             mandatory = self._mandatory_fields(),
-                                             )
+            original = self.job.original(table,
+                                         element,
+                                         mandatory = self._mandatory_fields(),
+                                         )
         elif isinstance(original, str) and UID in table.fields:
             # Single-component update in add-item => load the original now
             query = (table[UID] == original)
@@ -1477,10 +1874,10 @@ class ImportItem:
         if self.original is not None:
             original = self.original
         elif self.data:
-            original = CRUDResource.original(table,
-                                             self.data,
-                                             mandatory = mandatory,
-                                             )
+            original = self.job.original(table,
+                                         self.data,
+                                         mandatory = mandatory,
+                                         )
         else:
             original = None
 
@@ -1520,6 +1917,9 @@ class ImportItem:
                 # Use the resource's deduplicator to identify the original
                 resolve = current.s3db.get_config(self.tablename, "deduplicate")
                 if data and resolve:
+                    if not isinstance(resolve, S3Duplicate):
+                        # Custom deduplicators must see pending inserts
+                        self.job.flush(self.tablename)
                     resolve(self)
 
             if self.id and self.method in (UPDATE, DELETE, MERGE):
@@ -1895,6 +2295,10 @@ class ImportItem:
         if callable(job.log):
             job.log(self)
 
+        # Pre-resolved keys are outdated by this write (bulk mode)
+        if job.bulk:
+            job.invalidate(self)
+
         tablename = self.tablename
         enforce_realm_update = False
 
@@ -2005,6 +2409,10 @@ class ImportItem:
                 if MCI in table.fields:
                     data[MCI] = self.mci
 
+                # Defer the insert to a batch (bulk mode)
+                if job.defer(self, data):
+                    return True
+
                 # Insert the new record
                 try:
                     success = table.insert(**dict(data))
@@ -2100,54 +2508,7 @@ class ImportItem:
 
         # Audit + onaccept on successful commits
         if self.committed:
-
-            # Create a pseudo-form for callbacks
-            form = Storage()
-            form.method = method
-            form.table = table
-            form.vars = self.data
-            prefix, name = tablename.split("_", 1)
-            if self.id:
-                form.vars.id = self.id
-
-            # Audit
-            current.audit(method, prefix, name,
-                          form = form,
-                          record = self.id,
-                          representation = "xml",
-                          )
-
-            # Prevent that record post-processing breaks time-delayed
-            # synchronization by implicitly updating "modified_on"
-            if MTIME in table.fields:
-                modified_on = table[MTIME]
-                modified_on_update = modified_on.update
-                modified_on.update = None
-            else:
-                modified_on_update = None
-
-            # Update super entity links
-            s3db.update_super(table, form.vars)
-            if method == CREATE:
-                # Set record owner
-                current.auth.s3_set_record_owner(table, self.id)
-            elif method == UPDATE:
-                # Update realm
-                update_realm = enforce_realm_update or \
-                               s3db.get_config(table, "update_realm")
-                if update_realm:
-                    current.auth.set_realm_entity(table, self.id,
-                                                  force_update = True,
-                                                  )
-            # Onaccept
-            key = "%s_onaccept" % method
-            onaccept = current.deployment_settings.get_import_callback(tablename, key)
-            if onaccept:
-                callback(onaccept, form, tablename=tablename)
-
-            # Restore modified_on.update
-            if modified_on_update is not None:
-                modified_on.update = modified_on_update
+            self.postprocess(enforce_realm_update=enforce_realm_update)
 
         # Update referencing items
         if self.update and self.id:
@@ -2181,6 +2542,83 @@ class ImportItem:
 
         return True
 
+    # -------------------------------------------------------------------------
+    def postprocess(self, enforce_realm_update=False):
+        """
+            Post-process this item after it has been committed (audit,
+            super-entity links, record owner and realm, onaccept)
+
+            Args:
+                enforce_realm_update: update the realm entity even if
+                                      not configured for the table
+        """
+
+        s3db = current.s3db
+
+        MTIME = current.xml.MTIME
+
+        METHOD = self.METHOD
+        CREATE = METHOD.CREATE
+        UPDATE = METHOD.UPDATE
+
+        method = self.method
+        table = self.table
+        tablename = self.tablename
+
+        # Create a pseudo-form for callbacks
+        form = Storage()
+        form.method = method
+        form.table = table
+        form.vars = self.data
+        prefix, name = tablename.split("_", 1)
+        if self.id:
+            form.vars.id = self.id
+
+        # Audit
+        current.audit(method, prefix, name,
+                      form = form,
+                      record = self.id,
+                      representation = "xml",
+                      )
+
+        # Prevent that record post-processing breaks time-delayed
+        # synchronization by implicitly updating "modified_on"
+        if MTIME in table.fields:
+            modified_on = table[MTIME]
+            modified_on_update = modified_on.update
+            modified_on.update = None
+        else:
+            modified_on_update = None
+
+        # Update super entity links
+        s3db.update_super(table, form.vars)
+        if method == CREATE:
+            # Set record owner
+            current.auth.s3_set_record_owner(table, self.id)
+        elif method == UPDATE:
+            # Update realm
+            update_realm = enforce_realm_update or \
+                           s3db.get_config(table, "update_realm")
+            if update_realm:
+                current.auth.set_realm_entity(table, self.id,
+                                              force_update = True,
+                                              )
+        # Invalidate shared representations of the record
+        S3RepresentCache.invalidate(tablename, self.id)
+
+        # Update the hierarchy node of the record
+        S3Hierarchy.update_node(tablename, self.id)
+
+        # Onaccept
+        key = "%s_onaccept" % method
+        onaccept = current.deployment_settings.get_import_callback(tablename, key)
+        if onaccept:
+            callback(onaccept, form, tablename=tablename)
+
+        # Restore modified_on.update
+        if modified_on_update is not None:
+            modified_on.update = modified_on_update
+
     # -------------------------------------------------------------------------
     def _dynamic_defaults(self, data):
         """
@@ -2781,42 +3219,56 @@ class S3Duplicate:
         data = item.data
         table = item.table
 
-        query = None
-        error = "Invalid field for duplicate detection: %s (%s)"
+        # Use pre-resolved candidates in bulk imports
+        job = getattr(item, "job", None)
+        if job is not None and job.bulk:
+            candidates = job.duplicates(table, self).get(self.key(table, data))
+            if candidates is None:
+                # Pending inserts must be visible to the query
+                job.flush(table._tablename)
+        else:
+            candidates = None
 
-        # Primary query (mandatory)
-        primary = self.primary
-        for fname in primary:
+        if candidates is not None:
+            duplicate = self.select(table, data, candidates)
 
-            if fname not in table.fields:
-                raise SyntaxError(error % (fname, table))
+        else:
+            query = None
+            error = "Invalid field for duplicate detection: %s (%s)"
 
-            field = table[fname]
-            value = data.get(fname)
+            # Primary query (mandatory)
+            primary = self.primary
+            for fname in primary:
 
-            q = self.match(field, value)
-            query = q if query is None else query & q
+                if fname not in table.fields:
+                    raise SyntaxError(error % (fname, table))
 
-        # Secondary queries (optional)
-        secondary = self.secondary
-        for fname in secondary:
+                field = table[fname]
+                value = data.get(fname)
 
-            if fname not in table.fields:
-                raise SyntaxError(error % (fname, table))
+                q = self.match(field, value)
+                query = q if query is None else query & q
 
-            field = table[fname]
-            value = data.get(fname)
-            if value:
-                query &= self.match(field, value)
+            # Secondary queries (optional)
+            secondary = self.secondary
+            for fname in secondary:
 
-        # Ignore deleted records?
-        if self.ignore_deleted and "deleted" in table.fields:
-            query &= (table.deleted == False)
+                if fname not in table.fields:
+                    raise SyntaxError(error % (fname, table))
+
+                field = table[fname]
+                value = data.get(fname)
+                if value:
+                    query &= self.match(field, value)
+
+            # Ignore deleted records?
+            if self.ignore_deleted and "deleted" in table.fields:
+                query &= (table.deleted == False)
 
-        # Find a match
-        duplicate = current.db(query).select(table._id,
-                                             limitby = (0, 1)
-                                             ).first()
+            # Find a match
+            duplicate = current.db(query).select(table._id,
+                                                 limitby = (0, 1)
+                                                 ).first()
 
         if duplicate:
             # Match found: Update import item
@@ -2829,6 +3281,135 @@ class S3Duplicate:
         # For uses outside of imports:
         return duplicate
 
+    # -------------------------------------------------------------------------
+    def preload(self, table, records):
+        """
+            Look up the duplicate candidates for multiple records at once,
+            with one belongs-query per primary field (bulk import)
+
+            Args:
+                table: the Table
+                records: the records (dicts)
+
+            Returns:
+                dict {key: [Row]}, key as returned by key(), with an
+                empty list for keys without match
+
+            Raises:
+                SyntaxError: if any of the query fields doesn't exist in
+                             the table
+        """
+
+        error = "Invalid field for duplicate detection: %s (%s)"
+        for fname in self.primary | self.secondary:
+            if fname not in table.fields:
+                raise SyntaxError(error % (fname, table))
+
+        index = {}
+        for record in records:
+            key = self.key(table, record)
+            if key is not None:
+                index[key] = []
+        if not index:
+            return index
+
+        primary = sorted(self.primary)
+
+        query = None
+        for i, fname in enumerate(primary):
+            field = table[fname]
+            if self.ignore_case and str(field.type) in ("string", "text"):
+                expr = field.lower()
+            else:
+                expr = field
+            q = expr.belongs(set(key[i] for key in index))
+            query = q if query is None else query & q
+
+        if self.ignore_deleted and "deleted" in table.fields:
+            query &= (table.deleted == False)
+
+        fnames = set(primary) | self.secondary
+        fields = [table._id] + [table[fname] for fname in fnames]
+        rows = current.db(query).select(orderby=table._id, *fields)
+        for row in rows:
+            candidates = index.get(self.key(table, row))
+            if candidates is not None:
+                candidates.append(row)
+
+        return index
+
+    # -------------------------------------------------------------------------
+    def key(self, table, record):
+        """
+            Get the primary key values of a record, for lookups of
+            pre-resolved candidates
+
+            Args:
+                table: the Table
+                record: the record (dict or Row)
+
+            Returns:
+                a tuple of the normalized primary values, or None if the
+                record cannot be looked up by key
+        """
+
+        key = []
+        for fname in sorted(self.primary):
+            value = record.get(fname)
+            if value is None or isinstance(value, (list, dict)):
+                return None
+            key.append(self.normalize(table[fname], value))
+
+        return tuple(key)
+
+    # -------------------------------------------------------------------------
+    def select(self, table, data, candidates):
+        """
+            Select the first duplicate candidate that matches the
+            secondary fields
+
+            Args:
+                table: the Table
+                data: the import item data
+                candidates: the candidate Rows
+
+            Returns:
+                the duplicate Row, or None if no match
+        """
+
+        normalize = self.normalize
+        secondary = [(table[fname], data.get(fname)) for fname in self.secondary]
+
+        for row in candidates:
+            for field, value in secondary:
+                if value and \
+                   normalize(field, value) != normalize(field, row[field.name]):
+                    break
+            else:
+                return row
+
+        return None
+
+    # -------------------------------------------------------------------------
+    def normalize(self, field, value):
+        """
+            Helper function to normalize a value for key comparison
+            (analogous to match)
+
+            Args:
+                field: the Field
+                value: the value
+
+            Returns:
+                the normalized value
+        """
+
+        if self.ignore_case and \
+           hasattr(value, "lower") and str(field.type) in ("string", "text"):
+            return s3_str(value).lower()
+
+        return value
+
     # -------------------------------------------------------------------------
     def match(self, field, value):
         """
@@ -463,6 +463,8 @@ class CRUDResource:
                represent = False,
                show_links = True,
                raw_data = False,
+               columnar = False,
+               after = None,
                ):
         """
             Extract data from this resource
@@ -481,6 +483,10 @@ class CRUDResource:
                 as_rows: return the rows (don't extract)
                 represent: render field value representations
                 raw_data: include raw data in the result
+                columnar: use columnar extraction (faster for large
+                          result sets, see S3ResourceData)
+                after: continuation token for keyset pagination (empty
+                       string for the first page), see S3ResourceData
         """
 
         data = S3ResourceData(self,
@@ -498,12 +504,64 @@ class CRUDResource:
                               represent = represent,
                               show_links = show_links,
                               raw_data = raw_data,
+                              columnar = columnar,
+                              after = after,
                               )
         if as_rows:
             return data.rows
         else:
             return data
 
+    # -------------------------------------------------------------------------
+    def iterate(self,
+                fields = None,
+                batch_size = 1000,
+                orderby = None,
+                represent = False,
+                raw_data = False,
+                ):
+        """
+            Generator to extract all records from this resource in
+            batches, using keyset pagination where possible (i.e. effort
+            per batch is independent of the position in the result)
+
+            Args:
+                fields: the fields to extract (selector strings)
+                batch_size: the number of records per batch
+                orderby: orderby-expression for DAL (keyset pagination
+                         requires ordering by a single field of the
+                         master table, falls back to OFFSET otherwise)
+                represent: render field value representations
+                raw_data: include raw data in the result
+
+            Yields:
+                the records (as extracted by select)
+        """
+
+        start, after = 0, ""
+        while True:
+            data = self.select(fields,
+                               start = start,
+                               limit = batch_size,
+                               orderby = orderby,
+                               represent = represent,
+                               raw_data = raw_data,
+                               columnar = True,
+                               after = after,
+                               )
+            rows = data.rows
+            for row in rows:
+                yield row
+
+            if len(rows) < batch_size:
+                break
+            if data.keyset:
+                after = data.next
+                if not after:
+                    break
+            else:
+                start += batch_size
+
     # -------------------------------------------------------------------------
     def insert(self, **fields):
         """
@@ -866,6 +924,7 @@ class CRUDResource:
                   orderby = None,
                   distinct = False,
                   list_id = None,
+                  after = None,
                   ):
         """
             Generate a data table of this resource
@@ -878,6 +937,7 @@ class CRUDResource:
                 orderby: orderby for DB query
                 distinct: distinct-flag for DB query
                 list_id: the datatable ID
+                after: continuation token for keyset pagination
 
             Returns:
                 tuple (DataTable, numrows), where numrows represents
@@ -912,6 +972,8 @@ class CRUDResource:
                            count = True,
                            getids = False,
                            represent = True,
+                           columnar = True,
+                           after = after,
                            )
 
         rows = data.rows
@@ -922,6 +984,7 @@ class CRUDResource:
         # Generate the data table
         rfields = data.rfields
         dt = DataTable(rfields, rows, list_id, orderby=orderby)
+        dt.next = data.next
 
         return dt, data.numrows
 
@@ -1002,6 +1065,7 @@ class CRUDResource:
              left = None,
              distinct = False,
              orderby = None,
+             after = None,
              ):
         """
             Export a JSON representation of the resource.
@@ -1013,6 +1077,7 @@ class CRUDResource:
                 left: list of (additional) left joins
                 distinct: select only distinct rows
                 orderby: Orderby-expression for the query
+                after: continuation token for keyset pagination
 
             Returns:
                 the JSON (as string), representing a list of dicts
@@ -1025,6 +1090,8 @@ class CRUDResource:
                            orderby = orderby,
                            left = left,
                            distinct = distinct,
+                           columnar = True,
+                           after = after,
                            )
 
         return json.dumps(data.rows)
@@ -1474,6 +1541,7 @@ class CRUDResource:
                    location_data = None,
                    map_data = None,
                    target = None,
+                   stream = None,
                    **args):
         """
             Export this resource as S3XML
@@ -1511,7 +1579,17 @@ class CRUDResource:
                                looked-up in bulk ready for xml.gis_encode()
                 map_data: dictionary of options which can be read by the map
                 target: alias of component targetted (or None to target master resource)
+                stream: write the output to this stream (binary file-like
+                        object) rather than returning it as string, or True
+                        to return a generator of output chunks (bytes);
+                        native S3XML/S3JSON exports of the master resource
+                        are then written in batches of records (see
+                        settings.base.xml_export_stream)
                 args: dict of arguments to pass to the XSLT stylesheet
+
+            Returns:
+                the output (str, or ElementTree if as_tree), the output
+                stream, or a generator of output chunks
         """
 
         xml = current.xml
@@ -1532,6 +1610,30 @@ class CRUDResource:
                                map_data = map_data,
                                )
 
+        # Stream the export in batches, if possible
+        if stream is not None and xmlformat is None and not target and not as_tree:
+            batch_size = current.deployment_settings.get_base_xml_export_stream()
+            attr = {"as_json": as_json,
+                    "batch_size": batch_size or 1000,
+                    "start": start,
+                    "limit": limit,
+                    "msince": msince,
+                    "sync_filters": filters,
+                    "fields": fields,
+                    "references": references,
+                    "mcomponents": mcomponents,
+                    "dereference": dereference,
+                    "maxdepth": maxdepth,
+                    "rcomponents": rcomponents,
+                    "mdata": mdata,
+                    "maxbounds": maxbounds,
+                    "pretty_print": pretty_print,
+                    }
+            if stream is True:
+                return rtree.chunks(**attr)
+            rtree.stream(stream, **attr)
+            return stream
+
         tree = rtree.build(start = start,
                            limit = limit,
                            msince = msince,
@@ -1570,6 +1672,15 @@ class CRUDResource:
             else:
                 output = xml.tostring(tree, pretty_print=pretty_print)
 
+        if stream is not None and output and not as_tree:
+            if isinstance(output, str):
+                output = output.encode("utf-8")
+            if stream is True:
+                output = iter([output])
+            else:
+                stream.write(output)
+                output = stream
+
         return output
 
     # -------------------------------------------------------------------------
@@ -1588,6 +1699,7 @@ class CRUDResource:
                    select_items = None,
                    strategy = None,
                    sync_policy = None,
+                   bulk = None,
                    **args):
         """
             Import data
@@ -1606,6 +1718,8 @@ class CRUDResource:
                 select_items: items of the previous import job to select
                 strategy: allowed import methods
                 SyncPolicy sync_policy: the synchronization policy
+                bulk: use bulk mode (True or batch size), defaults
+                      to deployment setting
                 args: arguments for the transformation stylesheet
         """
 
@@ -1644,6 +1758,7 @@ class CRUDResource:
                                        select_items = select_items,
                                        strategy = strategy,
                                        sync_policy = sync_policy,
+                                       bulk = bulk,
                                        )
 
     # -------------------------------------------------------------------------
@@ -1879,6 +1994,57 @@ class CRUDResource:
         """
 
         db = current.db
+        xml = current.xml
+
+        UID = xml.UID
+
+        pvalues = cls.original_keys(table, record)
+
+        # Build match query
+        query = None
+        for f in pvalues:
+            if f == UID:
+                continue
+            _query = (table[f] == pvalues[f])
+            if query is not None:
+                query = query | _query
+            else:
+                query = _query
+
+        fields = cls.import_fields(table, pvalues, mandatory=mandatory)
+
+        # Try to find exactly one match by non-UID unique keys
+        if query is not None:
+            original = db(query).select(limitby=(0, 2), *fields)
+            if len(original) == 1:
+                return original.first()
+
+        # If no match, then try to find a UID-match
+        if UID in pvalues:
+            uid = xml.import_uid(pvalues[UID])
+            query = (table[UID] == uid)
+            original = db(query).select(limitby=(0, 1), *fields).first()
+            if original:
+                return original
+
+        # No match or multiple matches
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def original_keys(table, record):
+        """
+            Get the values for unique fields from a record, i.e. the
+            keys to find the original record (see original)
+
+            Args:
+                table: the table
+                record: the record as dict or S3XML Element
+
+            Returns:
+                Storage {fieldname: value}
+        """
+
         xml = current.xml
         xml_decode = xml.xml_decode
 
@@ -1915,35 +2081,7 @@ class CRUDResource:
         else:
             raise TypeError
 
-        # Build match query
-        query = None
-        for f in pvalues:
-            if f == UID:
-                continue
-            _query = (table[f] == pvalues[f])
-            if query is not None:
-                query = query | _query
-            else:
-                query = _query
-
-        fields = cls.import_fields(table, pvalues, mandatory=mandatory)
-
-        # Try to find exactly one match by non-UID unique keys
-        if query is not None:
-            original = db(query).select(limitby=(0, 2), *fields)
-            if len(original) == 1:
-                return original.first()
-
-        # If no match, then try to find a UID-match
-        if UID in pvalues:
-            uid = xml.import_uid(pvalues[UID])
-            query = (table[UID] == uid)
-            original = db(query).select(limitby=(0, 1), *fields).first()
-            if original:
-                return original
-
-        # No match or multiple matches
-        return None
+        return pvalues
 
     # -------------------------------------------------------------------------
     @staticmethod
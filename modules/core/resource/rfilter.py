@@ -33,10 +33,13 @@ from functools import reduce
 from gluon import current
 from gluon.storage import Storage
 
-from s3dal import Rows
+from s3dal import Rows, original_tablename
 
 from .query import S3ResourceQuery, S3Joins, S3URLQuery
 
+# Maximum number of location IDs from the spatial index to filter by bbox
+MAX_BBOX_IDS = 5000
+
 # =============================================================================
 class S3ResourceFilter:
     """ Class representing a resource filter """
@@ -795,6 +798,19 @@ class S3ResourceFilter:
                             # Old DAL or non-spatial database
                             pass
 
+                    if bbox_filter is None and \
+                       original_tablename(gtable) == "gis_location":
+                        # Use the spatial index, if available
+                        index = current.gis.get_spatial_index()
+                        if index:
+                            location_ids = index.query_bbox(float(minLon),
+                                                            float(minLat),
+                                                            float(maxLon),
+                                                            float(maxLat),
+                                                            )
+                            if len(location_ids) <= MAX_BBOX_IDS:
+                                bbox_filter = gtable.id.belongs(location_ids)
+
                     if bbox_filter is None:
                         # Standard Query
                         bbox_filter = (gtable.lon > float(minLon)) & \
@@ -29,6 +29,10 @@ __all__ = ("S3ResourceTree",
            )
 
 import json
+import shutil
+import tempfile
+
+from itertools import islice
 from lxml import etree
 
 from gluon import current
@@ -36,11 +40,15 @@ from gluon.storage import Storage
 
 from s3dal import original_tablename
 
-from ..tools import s3_get_foreign_key, s3_str, S3Represent, S3RepresentLazy
+from ..tools import JSONSEPARATORS, s3_get_foreign_key, s3_str, \
+                    S3Represent, S3RepresentLazy
 
 from .query import FS, S3URLQuery
 from .resource import DEFAULT, MAXDEPTH
 
+# Maximum size of in-memory spools for streaming S3JSON exports (bytes)
+SPOOL_SIZE = 1048576
+
 # =============================================================================
 class S3ResourceTree:
     """ Resource Tree Builder """
@@ -137,10 +145,8 @@ class S3ResourceTree:
             mcomponents = []
 
         xml = current.xml
-        s3db = current.s3db
 
         # Use lazy representations
-        lazy = []
         current.auth_user_represent = S3Represent(lookup = "auth_user",
                                                   fields = ["email"],
                                                   )
@@ -170,9 +176,472 @@ class S3ResourceTree:
             self.masters.extend(masters)
             self.nodes.extend(nodes)
 
+        # Export dependencies
         depth = maxdepth if dereference else 0
+        masters, nodes = self.export_dependencies(depth = depth,
+                                                  fields = fields,
+                                                  references = references,
+                                                  rcomponents = rcomponents,
+                                                  sync_filters = sync_filters,
+                                                  xmlformat = xmlformat,
+                                                  mdata = mdata,
+                                                  target = target,
+                                                  )
+        if masters:
+            self.masters.extend(masters)
+            self.nodes.extend(nodes)
+
+        # Create root element
+        root = etree.Element(xml.TAG.root)
+
+        # Add map data to root element
+        map_data = self.map_data
+        if map_data:
+            # Gets loaded before re-dumping, so no need to compact
+            # or avoid double-encoding
+            # NB Ensure we don't double-encode unicode!
+            #root.set("map", json.dumps(map_data, separators=JSONSEPARATORS,
+            #                           ensure_ascii=False))
+            root.set("map", json.dumps(map_data))
+
+        # Render all master nodes
+        self.render(root, self.masters)
+
+        # Complete the tree
+        tree = xml.tree(None,
+                        root = root,
+                        domain = xml.domain,
+                        url = self.base_url,
+                        results = results,
+                        start = start,
+                        limit = limit,
+                        maxbounds = maxbounds,
+                        )
+
+        # Store number of results in resource
+        resource.results = results
+
+        return tree
+
+    # -------------------------------------------------------------------------
+    def stream(self, output, **attr):
+        """
+            Export the resource as S3XML (or S3JSON) and write it to an
+            output stream, batch by batch, rather than building the
+            complete tree in memory
+
+            Args:
+                output: the output stream (a binary file-like object)
+                attr: the export parameters, see write()
+
+            Returns:
+                the number of exported master records
+        """
+
+        for _ in self.write(output, **attr):
+            pass
+
+        return self.resource.results
+
+    # -------------------------------------------------------------------------
+    def chunks(self, **attr):
+        """
+            Generator to export the resource as S3XML (or S3JSON) batch
+            by batch, so that the output can be sent to the client while
+            it is being rendered
+
+            Args:
+                attr: the export parameters, see write()
+
+            Yields:
+                the output as bytes, one chunk per batch
+        """
+
+        output = ChunkBuffer()
+        for _ in self.write(output, **attr):
+            chunk = output.read()
+            if chunk:
+                yield chunk
+
+        chunk = output.read()
+        if chunk:
+            yield chunk
+
+    # -------------------------------------------------------------------------
+    def write(self,
+              output,
+              as_json = False,
+              batch_size = 1000,
+              start = 0,
+              limit = None,
+              msince = None,
+              sync_filters = None,
+              fields = None,
+              references = None,
+              mcomponents = DEFAULT,
+              dereference = True,
+              maxdepth = MAXDEPTH,
+              rcomponents = None,
+              mdata = False,
+              maxbounds = False,
+              pretty_print = False,
+              ):
+        """
+            Generator to export the resource as S3XML (or S3JSON) and
+            write it to an output stream batch by batch
+
+            Args:
+                output: the output stream (a binary file-like object)
+                as_json: write S3JSON rather than S3XML
+                batch_size: number of master records to export per batch
+
+                start: index of the first record to export (slicing)
+                limit: maximum number of records to export (slicing)
+
+                msince: export only records which have been modified
+                        after this datetime
+                sync_filters: additional URL filters (Sync), as dict
+                              {tablename: {url_var: string}}
+
+                fields: data fields to include (default: all)
+                references: foreign keys to include (default: all)
+                mcomponents: components of the master resource to
+                             include (list of aliases), empty list
+                             for all available components
+
+                dereference: include referenced resources
+                maxdepth: maximum depth for reference exports
+                rcomponents: components of referenced resources to
+                             include (list of "tablename:alias")
+
+                mdata: mobile data export
+                       (=>reduced field set, lookup-only option)
+                maxbounds: include lat/lon boundaries in the top
+                           level element (off by default)
+                pretty_print: insert newlines/indentation in the
+                              output (XML only)
+
+            Yields:
+                None after each batch has been written to the output
+
+            Note:
+                - XSLT transformation requires the complete tree, so
+                  this works only for native S3XML/S3JSON
+                - references are resolved per batch, i.e. referenced
+                  records are exported with the first batch that refers
+                  to them (as in build, they follow the referencing records)
+                - the number of exported master records is stored in
+                  resource.results before the first batch is written
+        """
+
+        if mcomponents is DEFAULT:
+            mcomponents = []
+        offset = start if start else 0
+
+        xml = current.xml
+
+        resource = self.resource
+
+        # Apply the export filters to the master resource
+        orderby = self.add_filters(resource,
+                                   msince = msince,
+                                   sync_filters = sync_filters,
+                                   )
+
+        # Number of results
+        results = max(resource.count() - offset, 0)
+        if limit is not None:
+            results = min(results, limit)
+        resource.results = results
+
+        # Root element (attributes only)
+        root = etree.Element(xml.TAG.root)
+        map_data = self.map_data
+        if map_data:
+            root.set("map", json.dumps(map_data))
+        tree = xml.tree([] if results else None,
+                        root = root,
+                        domain = xml.domain,
+                        url = self.base_url,
+                        results = results,
+                        start = start,
+                        limit = limit,
+                        maxbounds = maxbounds,
+                        )
+
+        batches = self.batches(batch_size = batch_size,
+                               start = offset,
+                               limit = limit,
+                               orderby = orderby,
+                               msince = msince,
+                               sync_filters = sync_filters,
+                               fields = fields,
+                               references = references,
+                               mcomponents = mcomponents,
+                               depth = maxdepth if dereference else 0,
+                               rcomponents = rcomponents,
+                               mdata = mdata,
+                               )
+
+        if as_json:
+            for _ in self.write_json(output, tree, batches):
+                yield
+        else:
+            with etree.xmlfile(output, encoding="utf-8") as xf:
+                xf.write_declaration()
+                with xf.element(root.tag, attrib=dict(root.attrib)):
+                    for container in batches:
+                        for element in container:
+                            xf.write(element, pretty_print=pretty_print)
+                        xf.flush()
+                        yield
+
+    # -------------------------------------------------------------------------
+    def batches(self,
+                batch_size = 1000,
+                start = 0,
+                limit = None,
+                orderby = None,
+                msince = None,
+                sync_filters = None,
+                fields = None,
+                references = None,
+                mcomponents = None,
+                depth = MAXDEPTH,
+                rcomponents = None,
+                mdata = False,
+                ):
+        """
+            Generator to export the (filtered) master resource in batches
+            of records, together with their dependencies
+
+            Args:
+                batch_size: number of master records per batch
+                start: index of the first record to export
+                limit: maximum number of records to export
+                orderby: orderby-expression for the master records
+                depth: maximum depth for reference exports
+                other args: see write()
+
+            Yields:
+                a root Element per batch, containing the <resource>
+                elements for the batch
+        """
+
+        xml = current.xml
+
+        resource = self.resource
+
+        # Use lazy representations
+        current.auth_user_represent = S3Represent(lookup = "auth_user",
+                                                  fields = ["email"],
+                                                  )
+
+        # Iterate over the master record IDs
+        # - CRUDResource.iterate uses keyset pagination, so the effort
+        #   per batch does not grow with the position in the result
+        pkey = resource._id
+        colname = str(pkey)
+        rows = resource.iterate([pkey.name],
+                                batch_size = batch_size,
+                                orderby = orderby,
+                                )
+        end = start + limit if limit is not None else None
+        rows = islice(rows, start, end)
+
+        while True:
+            record_ids = [row[colname] for row in islice(rows, batch_size)]
+            if not record_ids:
+                break
+
+            self.pending_dependencies = {}
+
+            # Export the master records of this batch
+            # - restricting the original resource to the batch, so that
+            #   its filters and component context are retained
+            restore = self.restrict(resource, pkey.belongs(record_ids))
+            try:
+                masters, _ = self.export_resource(resource,
+                                                  fields = fields,
+                                                  references = references,
+                                                  components = mcomponents,
+                                                  msince = msince,
+                                                  sync_filters = sync_filters,
+                                                  mdata = mdata,
+                                                  location_data = self.location_data,
+                                                  )
+            finally:
+                # Remove the batch filter before the next batch of
+                # record IDs is selected
+                restore()
+
+            # Export the dependencies of this batch
+            dmasters, _ = self.export_dependencies(depth = depth,
+                                                   fields = fields,
+                                                   references = references,
+                                                   rcomponents = rcomponents,
+                                                   sync_filters = sync_filters,
+                                                   mdata = mdata,
+                                                   )
+            if dmasters:
+                masters.extend(dmasters)
+
+            # Render the nodes
+            container = etree.Element(xml.TAG.root)
+            self.render(container, masters)
+
+            yield container
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def restrict(resource, query):
+        """
+            Temporarily add a filter to a resource, e.g. to export it in
+            batches of records
+
+            Args:
+                resource: the CRUDResource
+                query: the filter Query
+
+            Returns:
+                a function to remove the filter again, which also removes
+                any other filters added to the resource in the meantime
+        """
+
+        rfilter = resource.rfilter
+        if rfilter is None:
+            rfilter = resource.build_query()
+        queries = list(rfilter.queries)
+        filters = list(rfilter.filters)
+
+        def clear_components():
+            # Components and links have filters derived from the master
+            # filter, which must be rebuilt
+            for component in resource.components.loaded.values():
+                component.clear_query()
+                if component.link is not None:
+                    component.link.clear_query()
+
+        resource.add_filter(query)
+        clear_components()
+
+        def restore():
+            rfilter.queries[:] = queries
+            rfilter.filters[:] = filters
+            rfilter.query = None
+            rfilter.transformed = None
+            resource.clear()
+            clear_components()
+
+        return restore
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def write_json(output, tree, batches):
+        """
+            Write an S3JSON export to an output stream, converting the
+            batches into JSON as they are exported
+
+            Args:
+                output: the output stream (a binary file-like object)
+                tree: the ElementTree with the root element (attributes)
+                batches: iterable of Elements containing the <resource>
+                         elements to write
+
+            Yields:
+                None after each batch has been written to the output
+
+            Note:
+                S3JSON groups all records of the same table into one list,
+                so records of tables other than the master table are spooled
+                (in memory, or in temporary files if they grow large) until
+                all batches have been exported
+        """
+
+        xml = current.xml
+
+        write = lambda chunk: output.write(chunk.encode("utf-8"))
+        dumps = lambda obj: json.dumps(obj, separators=JSONSEPARATORS)
+
+        first = None
+        spools = {}
+        for container in batches:
+            data = xml.tree2json(container, as_dict=True)
+            for key, items in data.items():
+                if not items:
+                    continue
+                chunk = ",".join(dumps(item) for item in items)
+                if first is None:
+                    # The first list (=master records) is written
+                    # straight to the output
+                    first = key
+                    write("{%s:[%s" % (dumps(key), chunk))
+                elif key == first:
+                    write(",%s" % chunk)
+                elif key in spools:
+                    spools[key].write((",%s" % chunk).encode("utf-8"))
+                else:
+                    spool = spools[key] = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+                    spool.write(chunk.encode("utf-8"))
+            yield
+
+        # Append the spooled lists
+        if first is not None:
+            write("]")
+            for key, spool in spools.items():
+                write(",%s:[" % dumps(key))
+                spool.seek(0)
+                shutil.copyfileobj(spool, output)
+                spool.close()
+                write("]")
+
+        # Append the root attributes
+        attributes = xml.tree2json(tree, as_dict=True)
+        attributes = ",".join("%s:%s" % (dumps(k), dumps(v))
+                              for k, v in attributes.items()
+                              )
+        if first is not None:
+            write(",%s}" % attributes if attributes else "}")
+        else:
+            write("{%s}" % attributes)
+
+    # -------------------------------------------------------------------------
+    def export_dependencies(self,
+                            depth = MAXDEPTH,
+                            fields = None,
+                            references = None,
+                            rcomponents = None,
+                            sync_filters = None,
+                            xmlformat = None,
+                            mdata = False,
+                            target = None,
+                            ):
+        """
+            Export all pending dependencies (recursively, up to depth),
+            and resolve the identities of the remaining dependencies
+
+            Args:
+                depth: maximum depth for reference exports
+                fields: data fields to include (default: all)
+                references: foreign keys to include (default: all)
+                rcomponents: components of referenced resources to
+                             include (list of "tablename:alias")
+                sync_filters: additional URL filters (Sync), as dict
+                              {tablename: {url_var: string}}
+                xmlformat: pre-parsed XSLT stylesheet wrapper
+                mdata: mobile data export
+                       (=>reduced field set, lookup-only option)
+                target: alias of component targeted
+                        (or None to target master resource)
+
+            Returns:
+                tuple (masters, nodes) with the exported nodes
+        """
+
+        s3db = current.s3db
+
+        all_masters, all_nodes = [], []
 
-        # Export dependencies
         dependencies = self.pending_dependencies
         while dependencies and depth:
 
@@ -198,8 +667,8 @@ class S3ResourceTree:
                                                       location_data = None,
                                                       )
                 if masters:
-                    self.masters.extend(masters)
-                    self.nodes.extend(nodes)
+                    all_masters.extend(masters)
+                    all_nodes.extend(nodes)
 
             dependencies = self.pending_dependencies
 
@@ -208,51 +677,39 @@ class S3ResourceTree:
         if dependencies:
             self.export_identities(dependencies)
 
-        # Create root element
-        root = etree.Element(xml.TAG.root)
+        return all_masters, all_nodes
 
-        # Add map data to root element
-        map_data = self.map_data
-        if map_data:
-            # Gets loaded before re-dumping, so no need to compact
-            # or avoid double-encoding
-            # NB Ensure we don't double-encode unicode!
-            #root.set("map", json.dumps(map_data, separators=JSONSEPARATORS,
-            #                           ensure_ascii=False))
-            root.set("map", json.dumps(map_data))
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def render(root, masters):
+        """
+            Render the XML elements for master nodes (including all
+            component nodes)
+
+            Args:
+                root: the root element to append the elements to
+                masters: the master nodes
+        """
+
+        # Use lazy representations
+        lazy = []
 
         # Render all master nodes
         location_references = []
-        for node in self.masters:
+        for node in masters:
             lref = node.add_element_to(root, lazy=lazy)
             if lref:
                 location_references.extend(lref)
 
         # Add Lat/Lon attributes to all location references
         if location_references:
-            xml.latlon(location_references)
+            current.xml.latlon(location_references)
 
         # Render all pending lazy representations
         if lazy:
             for renderer, element, attr, f in lazy:
                 renderer.render_node(element, attr, f)
 
-        # Complete the tree
-        tree = xml.tree(None,
-                        root = root,
-                        domain = xml.domain,
-                        url = self.base_url,
-                        results = results,
-                        start = start,
-                        limit = limit,
-                        maxbounds = maxbounds,
-                        )
-
-        # Store number of results in resource
-        resource.results = results
-
-        return tree
-
     # -------------------------------------------------------------------------
     def export_resource(self,
                         resource,
@@ -526,6 +983,56 @@ class S3ResourceTree:
                 add: flag for the preliminary msince-decision (if component)
         """
 
+        orderby = S3ResourceTree.add_filters(resource,
+                                             msince = msince,
+                                             sync_filters = sync_filters,
+                                             hierarchy_link = hierarchy_link,
+                                             add = add,
+                                             )
+
+        # Fields to load
+        tablename = resource.tablename
+        if xmlformat:
+            include, exclude = xmlformat.get_fields(target or tablename) # TODO must always use tablename?
+        else:
+            include, exclude = None, None
+
+        # Load the records
+        # NB this is only done once for all master records,
+        # subset per master record is selected by self.get
+        resource.load(fields = include,
+                      skip = exclude,
+                      start = start,
+                      limit = limit,
+                      orderby = orderby,
+                      virtual = False,
+                      cacheable = True,
+                      )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def add_filters(resource,
+                    msince = None,
+                    sync_filters = None,
+                    hierarchy_link = None,
+                    add = True,
+                    ):
+        """
+            Add the export filters (MCI, sync filters, msince) to a resource
+
+            Args:
+                resource: the CRUDResource
+                msince: export only records which have been modified
+                        after this datetime
+                sync_filters: additional URL filters (Sync), as dict
+                              {tablename: {url_var: string}}
+                hierarchy_link: TODO
+                add: flag for the preliminary msince-decision (if component)
+
+            Returns:
+                the orderby-expression for the export
+        """
+
         table = resource.table
         tablename = resource.tablename
 
@@ -554,23 +1061,7 @@ class S3ResourceTree:
         else:
             orderby = None
 
-        # Fields to load
-        if xmlformat:
-            include, exclude = xmlformat.get_fields(target or tablename) # TODO must always use tablename?
-        else:
-            include, exclude = None, None
-
-        # Load the records
-        # NB this is only done once for all master records,
-        # subset per master record is selected by self.get
-        resource.load(fields = include,
-                      skip = exclude,
-                      start = start,
-                      limit = limit,
-                      orderby = orderby,
-                      virtual = False,
-                      cacheable = True,
-                      )
+        return orderby
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1326,4 +1817,40 @@ class S3ResourceNode:
 
         return rmap, lref
 
+# =============================================================================
+class ChunkBuffer:
+    """ Write-only file-like object collecting output chunks """
+
+    def __init__(self):
+
+        self.chunks = []
+
+    # -------------------------------------------------------------------------
+    def write(self, data):
+        """
+            Add a chunk to the buffer
+
+            Args:
+                data: the chunk (bytes)
+
+            Returns:
+                the number of bytes written
+        """
+
+        self.chunks.append(data)
+        return len(data)
+
+    # -------------------------------------------------------------------------
+    def read(self):
+        """
+            Remove all chunks from the buffer
+
+            Returns:
+                the buffered data (bytes)
+        """
+
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
 # END =========================================================================
@@ -25,7 +25,10 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import base64
+import hashlib
 import json
+import sqlite3
 
 from itertools import chain
 
@@ -60,7 +63,9 @@ class S3ResourceData:
                  as_rows = False,
                  represent = False,
                  show_links = True,
-                 raw_data = False
+                 raw_data = False,
+                 columnar = False,
+                 after = None,
                  ):
         """
             Constructor, extracts (and represents) data from a resource
@@ -80,6 +85,14 @@ class S3ResourceData:
                 as_rows: return the rows (don't extract/represent)
                 represent: render field value representations
                 raw_data: include raw data in the result
+                columnar: extract raw tuples column-wise rather than
+                          row by row from DAL Rows (faster for large
+                          result sets, falls back to Rows extraction if
+                          virtual fields or post-filters are involved)
+                after: continuation token for keyset pagination, i.e. select
+                       the records following the last record of the previous
+                       page (empty string for the first page), ignores start;
+                       the token for the next page is returned as self.next
 
             Notes:
                 - as_rows / groupby prevent automatic splitting of
@@ -189,9 +202,35 @@ class S3ResourceData:
         # Extra filters
         efilter = rfilter.get_extra_filters()
 
+        # Keyset pagination
+        keyset = self.keyset_key(orderby) if after is not None and limit else None
+        if keyset:
+            # Order by the key, with the record ID as tie-breaker
+            field, desc = keyset
+            if str(field) == pkey:
+                orderby = orderby_aggr = [~field if desc else field]
+            else:
+                orderby.append(table._id)
+                orderby_aggr.append(table._id)
+
+            count_query = query
+            if after:
+                kquery = self.keyset_query(keyset, after)
+                if kquery is None:
+                    raise ValueError("Invalid continuation token")
+                master_query = query = query & kquery
+            start = 0
+
         # Is this a paginated request?
         pagination = limit is not None or start
 
+        # Can we use columnar extraction?
+        if columnar:
+            columnar = not (as_rows or groupby or vfilter or efilter) and \
+                       not table.virtualfields and \
+                       not any(rfield.virtual for rfield in dfields + vfields)
+        self.columnar = columnar
+
         # Subselect?
         subselect = bool(ljoins or ijoins or efilter or vfilter and pagination)
 
@@ -328,7 +367,14 @@ class S3ResourceData:
             db = current.db
 
             master_fields = list(qfields.keys())
-            if not groupby and not pagination and \
+            if columnar and not pagination and \
+               ids and len(master_fields) == 1:
+                # We already have the ids, and master query doesn't select
+                # anything else => skip the master query, construct columns
+                # from ids instead
+                rows = S3Columns([pkey], [list(ids)])
+
+            elif not groupby and not pagination and \
                has_id and ids and len(master_fields) == 1:
                 # We already have the ids, and master query doesn't select
                 # anything else => skip the master query, construct Rows from
@@ -368,6 +414,12 @@ class S3ResourceData:
                     vf = table.virtualfields
                     osetattr(table, "virtualfields", [])
 
+                if columnar:
+                    # Fetch raw tuples rather than Rows
+                    attr = {"processor": S3Columns.from_tuples}
+                else:
+                    attr = {}
+
                 rows = db(master_query).select(join = master_ijoins,
                                                left = master_ljoins,
                                                distinct = distinct,
@@ -376,7 +428,8 @@ class S3ResourceData:
                                                limitby = limitby,
                                                orderby_on_limitby = orderby_on_limitby,
                                                cacheable = not as_rows,
-                                               *list(qfields.values()))
+                                               *list(qfields.values()),
+                                               **attr)
 
                 # Restore virtual fields
                 if not virtual:
@@ -467,6 +520,19 @@ class S3ResourceData:
         self.numrows = 0 if totalrows is None else totalrows
         self.ids = ids
 
+        self.keyset = bool(keyset)
+        self.next = None
+        if keyset:
+            if count:
+                # Count all matching records, not just the following ones
+                self.numrows = self.filter_query(count_query,
+                                                 join = filter_ijoins,
+                                                 left = filter_ljoins,
+                                                 )[0]
+            last = page if page is not None else self.getids(rows, pkey)
+            if last and len(last) >= limit:
+                self.next = self.keyset_token(keyset, last[-1])
+
         if groupby or as_rows:
             # Just store the rows, no further queries or extraction
             self.rows = rows
@@ -477,12 +543,19 @@ class S3ResourceData:
 
         else:
             # Extract the data from the master rows
-            records = self.extract(rows,
-                                   pkey,
-                                   list(mfields),
-                                   join = hasattr(rows[0], tablename),
-                                   represent = represent,
-                                   )
+            if columnar:
+                records = self.extract_columns(rows,
+                                               pkey,
+                                               list(mfields),
+                                               represent = represent,
+                                               )
+            else:
+                records = self.extract(rows,
+                                       pkey,
+                                       list(mfields),
+                                       join = hasattr(rows[0], tablename),
+                                       represent = represent,
+                                       )
 
             # Extract the page record IDs if we don't have them yet
             if page is None:
@@ -721,6 +794,135 @@ class S3ResourceData:
 
         return expr, aggr, fields, tables
 
+    # -------------------------------------------------------------------------
+    def keyset_key(self, orderby):
+        """
+            Determine the key for keyset pagination from the orderby
+
+            Args:
+                orderby: the resolved orderby expression (list)
+
+            Returns:
+                tuple (field, desc), the sort key field and whether it
+                is descending, or None if keyset pagination is not
+                possible for this orderby (=use OFFSET instead)
+
+            Note:
+                keyset pagination requires ordering by a single field
+                of the master table (optionally followed by the record
+                ID), or the record ID alone
+        """
+
+        table = self.table
+        pkey = str(table._id)
+
+        if not orderby:
+            return table._id, False
+
+        adapter = S3DAL()
+
+        key = []
+        for item in orderby:
+            if isinstance(item, Field):
+                key.append((item, False))
+            elif type(item) is Expression and \
+                 item.op == adapter.INVERT and isinstance(item.first, Field):
+                key.append((item.first, True))
+            else:
+                return None
+
+        if len(key) == 2 and str(key[1][0]) == pkey and not key[1][1]:
+            key = key[:1]
+        if len(key) != 1:
+            return None
+
+        field, desc = key[0]
+        if field.tablename != table._tablename or \
+           field.type in ("json", "blob") or field.type[:5] == "list:":
+            return None
+
+        return field, desc
+
+    # -------------------------------------------------------------------------
+    def keyset_token(self, keyset, record_id):
+        """
+            Generate a continuation token for keyset pagination
+
+            Args:
+                keyset: the keyset key, tuple (field, desc)
+                record_id: the ID of the last record in the page
+
+            Returns:
+                the continuation token (URL-safe string)
+        """
+
+        field, desc = keyset
+
+        table = self.table
+        if field is table._id or str(field) == str(table._id):
+            value = record_id
+        else:
+            row = current.db(table._id == record_id).select(field,
+                                                            limitby = (0, 1),
+                                                            ).first()
+            value = row[field] if row else None
+
+        token = json.dumps([str(field), desc, value, record_id],
+                           separators = (",", ":"),
+                           default = str,
+                           )
+        return base64.urlsafe_b64encode(token.encode("utf-8")).decode("utf-8")
+
+    # -------------------------------------------------------------------------
+    def keyset_query(self, keyset, token):
+        """
+            Generate a query for the records following the position
+            encoded in a continuation token
+
+            Args:
+                keyset: the keyset key, tuple (field, desc)
+                token: the continuation token
+
+            Returns:
+                a Query, or None if the token is invalid or has been
+                generated for a different ordering
+        """
+
+        try:
+            token = base64.urlsafe_b64decode(str(token).encode("utf-8"))
+            colname, desc, value, record_id = json.loads(token.decode("utf-8"))
+            record_id = int(record_id)
+        except (TypeError, ValueError):
+            return None
+
+        field, desc_ = keyset
+        if colname != str(field) or bool(desc) != desc_:
+            return None
+
+        table = self.table
+        if str(field) == str(table._id):
+            return table._id < record_id if desc else table._id > record_id
+
+        # Whether NULLs come first in this direction (PostgreSQL sorts
+        # NULLs as the greatest values, other databases as the least)
+        nulls_first = desc
+        if current.deployment_settings.get_database_type() != "postgres":
+            nulls_first = not nulls_first
+
+        tie = table._id > record_id
+        if value is None:
+            if nulls_first:
+                query = (field != None) | ((field == None) & tie)
+            else:
+                query = (field == None) & tie
+        else:
+            follows = field < value if desc else field > value
+            query = follows | ((field == value) & tie)
+            if not nulls_first:
+                query |= (field == None)
+
+        return query
+
     # -------------------------------------------------------------------------
     def filter_query(self,
                      query,
@@ -755,6 +957,18 @@ class S3ResourceData:
         vf = table.virtualfields
         osetattr(table, "virtualfields", [])
 
+        # Look up the total number of matching records in the cache
+        total_key, stamp = self.total_key(query, join, left)
+        totalrows = None
+        if total_key:
+            expire = current.deployment_settings.get_base_count_cache()
+            cached = current.cache.ram(total_key,
+                                       lambda: None,
+                                       time_expire = expire,
+                                       )
+            if cached and cached[0] == stamp:
+                totalrows = cached[1]
+
         if getids and limitby:
             # Large result sets expected on average (settings.base.bigtable)
             # => effort almost independent of result size, much faster
@@ -762,40 +976,67 @@ class S3ResourceData:
             start = limitby[0]
             limit = limitby[1] - start
 
-            # Don't penalize the smallest filter results (=effective filtering)
-            if limit:
-                maxids = max(limit, 200)
-                limitby_ = (start, start + maxids)
-            else:
-                limitby_ = None
-
-            # Extract record IDs
             field = table._id
-            rows = db(query).select(field,
-                                    join = join,
-                                    left = left,
-                                    limitby = limitby_,
-                                    orderby = orderby,
-                                    groupby = field,
-                                    cacheable = True,
-                                    )
             pkey = str(field)
-            results = rows[:limit] if limit else rows
-            ids = [row[pkey] for row in results]
-
-            totalids = len(rows)
-            if limit and totalids >= maxids or start != 0 and not totalids:
-                # Count all matching records
-                cnt = table._id.count(distinct=True)
-                row = db(query).select(cnt,
-                                       join = join,
-                                       left = left,
-                                       cacheable = True,
-                                       ).first()
-                totalrows = row[cnt]
+
+            if limit and (totalrows is not None or self.window_count()):
+                if totalrows is None:
+                    # Count all matching records in the same query
+                    cnt = Expression(db, "COUNT(*) OVER ()", type="integer")
+                    fields = (field, cnt)
+                else:
+                    # Total number known, only extract the page
+                    cnt = None
+                    fields = (field,)
+
+                rows = db(query).select(*fields,
+                                        join = join,
+                                        left = left,
+                                        limitby = limitby,
+                                        orderby = orderby,
+                                        groupby = field,
+                                        cacheable = True,
+                                        )
+                ids = [row[pkey] for row in rows]
+
+                if totalrows is not None:
+                    pass
+                elif rows:
+                    totalrows = rows.first()[cnt]
+                elif start == 0:
+                    totalrows = 0
+                else:
+                    # Beyond the last page
+                    totalrows = self.count_query(query, join, left)
             else:
-                # We already know how many there are
-                totalrows = start + totalids
+                # Don't penalize the smallest filter results (=effective filtering)
+                if limit:
+                    maxids = max(limit, 200)
+                    limitby_ = (start, start + maxids)
+                else:
+                    limitby_ = None
+
+                # Extract record IDs
+                rows = db(query).select(field,
+                                        join = join,
+                                        left = left,
+                                        limitby = limitby_,
+                                        orderby = orderby,
+                                        groupby = field,
+                                        cacheable = True,
+                                        )
+                results = rows[:limit] if limit else rows
+                ids = [row[pkey] for row in results]
+
+                totalids = len(rows)
+                if totalrows is not None:
+                    pass
+                elif limit and totalids >= maxids or start != 0 and not totalids:
+                    # Count all matching records
+                    totalrows = self.count_query(query, join, left)
+                else:
+                    # We already know how many there are
+                    totalrows = start + totalids
 
         elif getids:
             # Extract all matching IDs, then count them in Python
@@ -815,20 +1056,105 @@ class S3ResourceData:
 
         else:
             # Only count, do not extract any IDs (constant effort)
-            field = table._id.count(distinct=True)
-            rows = db(query).select(field,
-                                    join = join,
-                                    left = left,
-                                    cacheable = True,
-                                    )
             ids = None
-            totalrows = rows.first()[field]
+            if totalrows is None:
+                totalrows = self.count_query(query, join, left)
+
+        if total_key and totalrows is not None:
+            # Store the total number of matching records (time_expire=0
+            # replaces the current cache entry)
+            current.cache.ram(total_key,
+                              lambda: (stamp, totalrows),
+                              time_expire = 0,
+                              )
 
         # Restore the virtual fields
         osetattr(table, "virtualfields", vf)
 
         return totalrows, ids
 
+    # -------------------------------------------------------------------------
+    def count_query(self, query, join=None, left=None):
+        """
+            Count all records matching a query
+
+            Args:
+                query: the filter query
+                join: the inner joins for the query
+                left: the left joins for the query
+
+            Returns:
+                the number of matching records
+        """
+
+        cnt = self.table._id.count(distinct=True)
+        row = current.db(query).select(cnt,
+                                       join = join,
+                                       left = left,
+                                       cacheable = True,
+                                       ).first()
+        return row[cnt]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def window_count():
+        """
+            Whether the total number of matching records can be counted
+            in the same query as the page IDs (window function)
+
+            Returns:
+                True|False
+        """
+
+        settings = current.deployment_settings
+        if not settings.get_base_window_count():
+            return False
+
+        dbtype = settings.get_database_type()
+        if dbtype == "postgres":
+            return True
+        elif dbtype == "sqlite":
+            # Window functions require SQLite 3.25+
+            return sqlite3.sqlite_version_info >= (3, 25, 0)
+        return False
+
+    # -------------------------------------------------------------------------
+    def total_key(self, query, join=None, left=None):
+        """
+            Generate a cache key for the total number of records matching
+            a filter query, and look up the current version of the table
+            (cached totals are only valid for the same version)
+
+            Args:
+                query: the filter query
+                join: the inner joins for the query
+                left: the left joins for the query
+
+            Returns:
+                tuple (key, stamp), or (None, None) if totals shall
+                not be cached
+
+            Note:
+                the table version only registers writes in this process,
+                totals from writes in other processes are updated as the
+                cache expires (settings.base.count_cache)
+        """
+
+        if not current.deployment_settings.get_base_count_cache():
+            return None, None
+
+        db = current.db
+        table = self.table
+        stamp = current.s3db.table_version(table)
+
+        # The SQL for the filter query (=serialized resource filter)
+        sql = db(query)._select(table._id, join=join, left=left)
+
+        key = "%s|%s" % (table._tablename, sql)
+        key = "resource_total_%s" % hashlib.md5(key.encode("utf-8")).hexdigest()
+
+        return key, stamp
+
     # -------------------------------------------------------------------------
     def master_fields(self,
                       dfields,
@@ -1035,19 +1361,33 @@ class S3ResourceData:
         # Retrieve the subtable rows
         # - can't use distinct with native JSON fields
         distinct = not any(f.type == "json" for f in sfields)
+        columnar = self.columnar
+        if columnar:
+            attr = {"processor": S3Columns.from_tuples}
+        else:
+            attr = {}
         rows = current.db(query).select(left = sjoins,
                                         distinct = distinct,
                                         cacheable = True,
-                                        *sfields)
+                                        *sfields,
+                                        **attr)
 
         # Extract and merge the data
-        records = self.extract(rows,
-                               pkey,
-                               extract,
-                               records = records,
-                               join = True,
-                               represent = represent,
-                               )
+        if columnar:
+            records = self.extract_columns(rows,
+                                           pkey,
+                                           extract,
+                                           records = records,
+                                           represent = represent,
+                                           )
+        else:
+            records = self.extract(rows,
+                                   pkey,
+                                   extract,
+                                   records = records,
+                                   join = True,
+                                   represent = represent,
+                                   )
 
         return records
 
@@ -1140,6 +1480,75 @@ class S3ResourceData:
 
         return records
 
+    # -------------------------------------------------------------------------
+    def extract_columns(self,
+                        data,
+                        pkey,
+                        columns,
+                        records = None,
+                        represent = False
+                        ):
+        """
+            Extract the data from columnar raw data and store them in
+            self.field_data; alternative to extract() which processes
+            each column in a single pass, rather than row by row
+
+            Args:
+                data: the raw data (S3Columns)
+                pkey: the primary key
+                columns: the columns to extract
+                records: the records dict to merge the data into
+                represent: collect unique values per field and estimate
+                           representation efforts for list:types
+        """
+
+        field_data = self.field_data
+        effort = self.effort
+
+        if records is None:
+            records = {}
+
+        # Group by primary key (once for all columns)
+        keys = data.column(pkey)
+        for k in keys:
+            if k not in records:
+                records[k] = {}
+
+        for col in columns:
+            fvalues, frecords, joined, list_type, virtual, json_type = field_data[col]
+
+            values = data.column(col)
+            if values is None:
+                current.log.warning("Warning S3ResourceData.extract_columns: column %s not in data" % col)
+                values = [None] * len(keys)
+
+            for k, value in zip(keys, values):
+
+                record = records[k]
+                rvalues = record.get(col)
+                if rvalues is None:
+                    rvalues = record[col] = {}
+                    if k not in frecords:
+                        frecords[k] = rvalues
+
+                if list_type and value is not None:
+                    if represent and value:
+                        effort[col] += 30 + len(value)
+                    for v in value:
+                        rvalues[v] = None
+                        if represent:
+                            fvalues[v] = None
+                    continue
+                elif json_type:
+                    # Returns unhashable types
+                    value = json.dumps(value)
+
+                rvalues[value] = None
+                if represent:
+                    fvalues[value] = None
+
+        return records
+
     # -------------------------------------------------------------------------
     def render(self,
                rfield,
@@ -1305,6 +1714,10 @@ class S3ResourceData:
                 list of unique record IDs
         """
 
+        if isinstance(rows, S3Columns):
+            # Already unique and in order of first match
+            return list(dict.fromkeys(rows.column(pkey)))
+
         x = set()
         seen = x.add
 
@@ -1417,4 +1830,98 @@ class S3ResourceData:
             items = expr
         return items
 
+# =============================================================================
+class S3Columns:
+    """
+        Column-oriented storage of raw query results, used instead of
+        DAL Rows for columnar extraction in S3ResourceData
+    """
+
+    def __init__(self, colnames, columns):
+        """
+            Args:
+                colnames: the column names
+                columns: the column values, a list of lists in
+                         the same order as colnames
+        """
+
+        self.colnames = colnames
+        self.columns = dict(zip(colnames, columns))
+
+        self.length = len(columns[0]) if columns else 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_tuples(cls, rows, fields, colnames, cacheable=False, **attr):
+        """
+            Processor for DAL select, converts the raw tuples of the
+            DB cursor into column-oriented storage, parsing the values
+            column by column instead of instantiating Row objects
+
+            Args:
+                rows: the raw rows (list of tuples)
+                fields: the selected fields
+                colnames: the column names
+                cacheable: ignored (S3Columns are always "cacheable")
+
+            Returns:
+                S3Columns
+        """
+
+        parse_value = current.db._adapter.parse_value
+
+        raw = list(zip(*rows)) if rows else [()] * len(colnames)
+
+        columns = []
+        for field, values in zip(fields, raw):
+            if isinstance(field, Field):
+                ftype = field.type
+                itype = field._itype
+                values = [parse_value(v, itype, ftype) if v is not None else None
+                          for v in values]
+            else:
+                values = list(values)
+            columns.append(values)
+
+        return cls(colnames, columns)
+
+    # -------------------------------------------------------------------------
+    def column(self, colname):
+        """
+            Get all values of a column
+
+            Args:
+                colname: the column name
+
+            Returns:
+                list of values, or None if the column is not present
+        """
+
+        return self.columns.get(colname)
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+
+        return self.length
+
+    # -------------------------------------------------------------------------
+    def __getitem__(self, key):
+        """
+            Get a slice of the data (for pagination)
+
+            Args:
+                key: the slice
+
+            Returns:
+                S3Columns
+        """
+
+        if not isinstance(key, slice):
+            raise TypeError("S3Columns only support slicing")
+
+        colnames = self.colnames
+        columns = self.columns
+
+        return self.__class__(colnames, [columns[c][key] for c in colnames])
+
 # END =========================================================================
@@ -48,6 +48,7 @@ class S3Hierarchy:
                  represent = None,
                  filter = None,
                  leafonly = True,
+                 roots = None,
                  ):
         """
             Args:
@@ -58,6 +59,7 @@ class S3Hierarchy:
                 filter: additional filter query for the table to
                         select the relevant subset
                 leafonly: filter strictly for leaf nodes
+                roots: load only the subtrees under these root nodes
         """
 
         self.tablename = tablename
@@ -65,6 +67,12 @@ class S3Hierarchy:
             current.s3db.configure(tablename, hierarchy=hierarchy)
         self.represent = represent
 
+        if roots is not None:
+            if not isinstance(roots, (list, tuple, set)):
+                roots = [roots]
+            roots = tuple(sorted(set(roots)))
+        self.roots_only = roots
+
         self.filter = filter
         self.leafonly = leafonly
 
@@ -203,9 +211,12 @@ class S3Hierarchy:
 
         tablename = self.tablename
         if tablename :
+            roots = self.roots_only
+            key = (tablename, roots) if roots is not None else tablename
+
             hierarchies = current.model["hierarchies"]
-            if tablename in hierarchies:
-                hierarchy = hierarchies[tablename]
+            if key in hierarchies:
+                hierarchy = hierarchies[key]
                 self.__theset = hierarchy["nodes"]
                 self.__flags = hierarchy["flags"]
             else:
@@ -214,7 +225,7 @@ class S3Hierarchy:
                 self.load()
                 hierarchy = {"nodes": self.__theset,
                              "flags": self.__flags}
-                hierarchies[tablename] = hierarchy
+                hierarchies[key] = hierarchy
         else:
             self.__theset = dict()
             self.__flags = dict()
@@ -247,7 +258,10 @@ class S3Hierarchy:
 
     # -------------------------------------------------------------------------
     def load(self):
-        """ Try loading the hierarchy from s3_hierarchy """
+        """
+            Try loading the hierarchy (or the subtrees under self.roots_only)
+            from s3_hierarchy_node
+        """
 
         if not self.config:
             return
@@ -258,26 +272,47 @@ class S3Hierarchy:
             self.__status(dirty=True)
             return
 
-        htable = current.s3db.s3_hierarchy
+        db = current.db
+        s3db = current.s3db
+
+        htable = s3db.s3_hierarchy
         query = (htable.tablename == tablename)
-        row = current.db(query).select(htable.dirty,
-                                       htable.hierarchy,
-                                       limitby = (0, 1)
-                                       ).first()
-        if row and not row.dirty:
-            data = row.hierarchy
+        row = db(query).select(htable.dirty,
+                               htable.hierarchy,
+                               limitby = (0, 1)
+                               ).first()
+
+        if row and not row.dirty and row.hierarchy is None:
+
+            ntable = s3db.s3_hierarchy_node
+            query = (ntable.tablename == tablename)
+            roots = self.roots_only
+            if roots is not None:
+                query &= (ntable.root.belongs(roots))
+            rows = db(query).select(ntable.node_id,
+                                    ntable.parent,
+                                    ntable.category,
+                                    )
+
             theset = self.__theset
             theset.clear()
-            for node_id, item in data["nodes"].items():
-                theset[int(node_id)] = {"p": item["p"],
-                                        "c": item["c"],
-                                        "s": set(item["s"]) \
-                                             if item["s"] else set()}
+            for node in rows:
+                theset[node.node_id] = {"p": node.parent,
+                                        "c": node.category,
+                                        "s": set(),
+                                        }
+            for node_id, node in theset.items():
+                parent = theset.get(node["p"])
+                if parent:
+                    parent["s"].add(node_id)
+
             self.__status(dirty = False,
                           dbupdate = None,
                           dbstatus = True)
             return
         else:
+            # Hierarchy not stored, dirty, or stored as JSON document
+            # (legacy) => must be rebuilt
             self.__status(dirty = True,
                           dbupdate = None,
                           dbstatus = False if row else None)
@@ -285,7 +320,7 @@ class S3Hierarchy:
 
     # -------------------------------------------------------------------------
     def save(self):
-        """ Save this hierarchy in s3_hierarchy """
+        """ Save this hierarchy in s3_hierarchy_node """
 
         if not self.config:
             return
@@ -295,26 +330,46 @@ class S3Hierarchy:
         if not self.__status("dbupdate"):
             return
 
-        # Serialize the theset
-        nodes_dict = {}
-        for node_id, node in theset.items():
-            nodes_dict[node_id] = {"p": node["p"],
-                                   "c": node["c"],
-                                   "s": list(node["s"]) \
-                                        if node["s"] else []}
+        db = current.db
+        s3db = current.s3db
+
+        # Determine the root of each node
+        roots = {}
+        for node_id in theset:
+            path = []
+            root = node_id
+            while root not in roots:
+                path.append(root)
+                parent = theset[root]["p"]
+                if not parent or parent not in theset or parent in path:
+                    break
+                root = parent
+            root = roots.get(root, root)
+            for n in path:
+                roots[n] = root
+
+        # Replace the stored nodes
+        ntable = s3db.s3_hierarchy_node
+        db(ntable.tablename == tablename).delete()
+        ntable.bulk_insert([{"tablename": tablename,
+                             "node_id": node_id,
+                             "parent": node["p"],
+                             "category": node["c"],
+                             "root": roots[node_id],
+                             } for node_id, node in theset.items()])
 
         # Generate record
         data = {"tablename": tablename,
                 "dirty": False,
-                "hierarchy": {"nodes": nodes_dict}
+                "hierarchy": None,
                 }
 
         # Get current entry
-        htable = current.s3db.s3_hierarchy
+        htable = s3db.s3_hierarchy
         query = (htable.tablename == tablename)
-        row = current.db(query).select(htable.id,
-                                       limitby = (0, 1)
-                                       ).first()
+        row = db(query).select(htable.id,
+                               limitby = (0, 1)
+                               ).first()
 
         if row:
             # Update record
@@ -347,6 +402,7 @@ class S3Hierarchy:
             return
 
         hierarchies = current.model["hierarchies"]
+        cls.__forget(tablename)
         if tablename in hierarchies:
             hierarchy = hierarchies[tablename]
             flags = hierarchy["flags"]
@@ -368,8 +424,52 @@ class S3Hierarchy:
             elif not row.dirty:
                 row.update_record(dirty=True)
             flags["dbstatus"] = False
+
+            # Rebuild the stored nodes asynchronously (the task is picked
+            # up only after this request has committed)
+            current.s3task.schedule_task("s3_hierarchy_rebuild",
+                                         args = [tablename],
+                                         timeout = 600,
+                                         user_id = False,
+                                         )
         return
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls, tablename=None):
+        """
+            Rebuild the stored nodes of dirty hierarchies from their
+            target tables; to be run as asynchronous task or during
+            maintenance, so that reading requests never write the nodes
+
+            Args:
+                tablename: the tablename, None to rebuild all dirty
+                           hierarchies
+
+            Returns:
+                the number of rebuilt hierarchies
+        """
+
+        db = current.db
+
+        htable = current.s3db.s3_hierarchy
+        query = (htable.dirty == True) | (htable.hierarchy != None)
+        if tablename:
+            query = (htable.tablename == tablename) & query
+        rows = db(query).select(htable.tablename)
+
+        rebuilt = 0
+        for row in rows:
+            h = cls(row.tablename)
+            if not h.config:
+                continue
+            # Reads the target table if dirty, then stores the nodes
+            theset = h.theset
+            h.save()
+            rebuilt += 1
+
+        return rebuilt
+
     # -------------------------------------------------------------------------
     def read(self):
         """ Rebuild this hierarchy from the target table """
@@ -411,6 +511,20 @@ class S3Hierarchy:
         # Update status: memory is clean, db needs update
         self.__status(dirty=False, dbupdate=True)
 
+        # Reduce to the requested subtrees
+        roots = self.roots_only
+        if roots is not None:
+            theset = self.__theset
+            keep = set()
+            node_ids = [node_id for node_id in roots if node_id in theset]
+            while node_ids:
+                node_id = node_ids.pop()
+                keep.add(node_id)
+                node_ids.extend(theset[node_id]["s"])
+            for node_id in list(theset):
+                if node_id not in keep:
+                    del theset[node_id]
+
         # Remove subset
         self.__roots = None
         self.__nodes = None
@@ -644,11 +758,236 @@ class S3Hierarchy:
                     current.db.rollback()
                 return None
 
-        if not cascade and total:
-            self.dirty(tablename)
-
         return total
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update_node(cls, tablename, record_id):
+        """
+            Add or move the node of a record after it has been created or
+            updated, to be called onaccept (incremental alternative to dirty)
+
+            Args:
+                tablename: the tablename
+                record_id: the record ID
+        """
+
+        if not tablename or not record_id:
+            return
+        if not current.s3db.get_config(tablename, "hierarchy"):
+            return
+
+        h = cls(tablename)
+        try:
+            node = h.__lookup(record_id)
+        except (AttributeError, SyntaxError):
+            return
+        if not node:
+            return
+        node_id, parent_id, category, deleted = node
+
+        if deleted:
+            h.__remove(node_id)
+            return
+
+        cls.__forget(tablename)
+
+        # Update the hierarchy in memory
+        hierarchy = current.model["hierarchies"].get(tablename)
+        if hierarchy and not hierarchy["flags"].get("dirty"):
+            theset = h.theset
+            if parent_id and parent_id not in theset:
+                # Parent not in the hierarchy => rebuild
+                cls.dirty(tablename)
+                return
+            h.add(node_id, parent_id=parent_id, category=category)
+            theset[node_id]["c"] = category
+
+        # Update the stored hierarchy
+        if not h.__stored():
+            return
+
+        db = current.db
+        ntable = current.s3db.s3_hierarchy_node
+        base = (ntable.tablename == tablename)
+
+        if parent_id:
+            query = base & (ntable.node_id == parent_id)
+            parent = db(query).select(ntable.root, limitby=(0, 1)).first()
+            if not parent:
+                # Parent not stored => rebuild
+                cls.dirty(tablename)
+                return
+            root = parent.root
+        else:
+            root = node_id
+
+        query = base & (ntable.node_id == node_id)
+        row = db(query).select(ntable.id,
+                               ntable.parent,
+                               ntable.category,
+                               ntable.root,
+                               limitby = (0, 1),
+                               ).first()
+        if not row:
+            ntable.insert(tablename = tablename,
+                          node_id = node_id,
+                          parent = parent_id,
+                          category = category,
+                          root = root,
+                          )
+        elif row.parent != parent_id or row.category != category:
+            row.update_record(parent = parent_id,
+                              category = category,
+                              root = root,
+                              )
+            if row.root != root:
+                # Move the whole subtree to the new root
+                descendants = set()
+                node_ids = {node_id}
+                while node_ids:
+                    query = base & (ntable.parent.belongs(node_ids))
+                    rows = db(query).select(ntable.node_id)
+                    node_ids = set(r.node_id for r in rows) - descendants
+                    descendants |= node_ids
+                if descendants:
+                    query = base & (ntable.node_id.belongs(descendants))
+                    db(query).update(root=root)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def remove_node(cls, tablename, row):
+        """
+            Remove the node of a record after it has been deleted, to be
+            called ondelete (incremental alternative to dirty)
+
+            Args:
+                tablename: the tablename
+                row: the deleted Row
+        """
+
+        if not tablename or not row:
+            return
+        if not current.s3db.get_config(tablename, "hierarchy"):
+            return
+
+        h = cls(tablename)
+        try:
+            node_id = row.get(h.pkey.name)
+        except (AttributeError, SyntaxError):
+            return
+        if node_id:
+            h.__remove(node_id)
+        else:
+            cls.dirty(tablename)
+
+    # -------------------------------------------------------------------------
+    def __remove(self, node_id):
+        """
+            Remove a node from the hierarchy in memory and in the DB;
+            nodes with children are left to a rebuild
+
+            Args:
+                node_id: the node ID
+        """
+
+        tablename = self.tablename
+        cls = self.__class__
+
+        cls.__forget(tablename)
+
+        hierarchy = current.model["hierarchies"].get(tablename)
+        if hierarchy and not hierarchy["flags"].get("dirty"):
+            node = self.theset.get(node_id)
+            if node and node["s"]:
+                cls.dirty(tablename)
+                return
+            self.remove(node_id)
+
+        if not self.__stored():
+            return
+
+        db = current.db
+        ntable = current.s3db.s3_hierarchy_node
+        base = (ntable.tablename == tablename)
+
+        query = base & (ntable.parent == node_id)
+        if db(query).select(ntable.id, limitby=(0, 1)).first():
+            cls.dirty(tablename)
+        else:
+            db(base & (ntable.node_id == node_id)).delete()
+
+    # -------------------------------------------------------------------------
+    def __lookup(self, record_id):
+        """
+            Look up the node data for a record
+
+            Args:
+                record_id: the record ID
+
+            Returns:
+                tuple (node_id, parent_id, category, deleted),
+                or None if the record does not exist
+        """
+
+        table = current.s3db[self.tablename]
+
+        pkey = self.pkey
+        fkey = self.fkey
+        ckey = self.ckey
+
+        fields = [pkey, fkey]
+        if ckey is not None:
+            fields.append(table[ckey])
+        if "deleted" in table.fields:
+            fields.append(table.deleted)
+
+        query = (table._id == record_id)
+        rows = current.db(query).select(left=self.left, *fields)
+        if not rows:
+            return None
+
+        # Last link wins (as in read)
+        row = rows.last()
+        category = row[table[ckey]] if ckey is not None else None
+        deleted = row[table.deleted] if "deleted" in table.fields else False
+
+        return row[pkey], row[fkey], category, deleted
+
+    # -------------------------------------------------------------------------
+    def __stored(self):
+        """
+            Check whether the stored nodes of this hierarchy are current
+
+            Returns:
+                True|False
+        """
+
+        htable = current.s3db.s3_hierarchy
+        query = (htable.tablename == self.tablename)
+        row = current.db(query).select(htable.dirty,
+                                       htable.hierarchy,
+                                       limitby = (0, 1),
+                                       ).first()
+
+        return bool(row and not row.dirty and row.hierarchy is None)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __forget(tablename):
+        """
+            Discard any subtrees of a hierarchy loaded in this request,
+            so they get reloaded after a change
+
+            Args:
+                tablename: the tablename
+        """
+
+        hierarchies = current.model["hierarchies"]
+        for key in list(hierarchies.keys()):
+            if isinstance(key, tuple) and key[0] == tablename:
+                del hierarchies[key]
+
     # -------------------------------------------------------------------------
     def add(self, node_id, parent_id=None, category=None):
         """
@@ -666,6 +1005,10 @@ class S3Hierarchy:
             node = theset[node_id]
             if category is not None:
                 node["c"] = category
+            # Detach from previous parent
+            previous = theset.get(node.get("p"))
+            if previous and node["p"] != parent_id:
+                previous["s"].discard(node_id)
         elif node_id:
             node = {"s": set(), "c": category}
         else:
@@ -26,6 +26,7 @@
 """
 
 __all__ = ("S3Represent",
+           "S3RepresentCache",
            "S3RepresentLazy",
            "S3PriorityRepresent",
            "s3_URLise",
@@ -47,7 +48,10 @@ __all__ = ("S3Represent",
 
 import re
 import sys
+import threading
+import time
 
+from collections import OrderedDict
 from itertools import chain
 
 from gluon import current, A, DIV, IMG, IS_URL, SPAN, TAG, URL, XML
@@ -134,6 +138,8 @@ class S3Represent:
         self.setup = False
         self.theset = None
         self.queries = 0
+        self.cache = None
+        self.namespace = None
         self.lazy = []
         self.lazy_show_link = False
 
@@ -496,8 +502,71 @@ class S3Represent:
         else:
             self.htemplate = "%s > %s"
 
+        # Shared cache
+        # - not if link() is overridden, as it may need the row (which
+        #   is not looked up when the representation is found in the cache)
+        cache = S3RepresentCache.instance()
+        if cache and self.table is not None and not self.options and \
+           type(self).link is S3Represent.link:
+            shared = self.shared_key()
+            if shared:
+                namespace, tablenames, by_id = shared
+                cache.register(namespace, tablenames, by_id=by_id)
+                self.cache = cache
+                self.namespace = namespace
+
         self.setup = True
 
+    # -------------------------------------------------------------------------
+    def shared_key(self):
+        """
+            Get the namespace of this representation method in the
+            process-wide representation cache (S3RepresentCache), can
+            be overridden in subclasses with custom lookups in order to
+            opt in
+
+            Returns:
+                tuple (namespace, tablenames, by_id), where namespace is
+                a tuple identifying the lookup, tablenames are the names
+                of all tables the representations depend on, and by_id
+                indicates that each representation depends only on the
+                record in the first table with the represented value as
+                its ID; or None if representations cannot be shared
+                between requests
+        """
+
+        # Custom lookups or representations can depend on anything
+        if self.custom_lookup or \
+           type(self).represent_row is not S3Represent.represent_row:
+            return None
+
+        # Hierarchical representations depend on other records
+        if self.hierarchy:
+            return None
+
+        # Callable labels only if they are module-level functions
+        labels = self.labels
+        if self.clabels:
+            name = getattr(labels, "__qualname__", None)
+            if not name or "<" in name:
+                return None
+            labels = "%s.%s" % (labels.__module__, name)
+        elif labels is not None:
+            labels = s3_str(labels)
+
+        tablename = self.table._tablename
+        namespace = (tablename,
+                     self.key,
+                     tuple(self.fields) if self.fields else None,
+                     current.T.accepted_language,
+                     labels,
+                     self.translate,
+                     self.field_sep,
+                     s3_str(self.none),
+                     )
+
+        return namespace, (tablename,), self.key == self.table._id.name
+
     # -------------------------------------------------------------------------
     def _lookup(self, values, rows=None):
         """
@@ -584,6 +653,13 @@ class S3Represent:
                 if pop(k, None):
                     items[keys.get(k, k)] = theset[k]
 
+        # Check the shared cache for the remaining values
+        cache = self.cache
+        if cache and lookup:
+            for k, v in cache.get(self.namespace, list(lookup.keys())).items():
+                del lookup[k]
+                items[keys.get(k, k)] = theset[k] = v
+
         # Retrieve additional rows as needed
         if lookup:
             if not self.custom_lookup:
@@ -613,6 +689,10 @@ class S3Represent:
                     lookup.pop(k, None)
                     items[keys.get(k, k)] = theset[k] = represent_row(row)
 
+                # Share the new representations
+                if cache:
+                    cache.set(self.namespace, {k: theset[k] for k in rows})
+
         # Anything left gets set to default
         if lookup:
             for k in lookup:
@@ -657,6 +737,233 @@ class S3Represent:
         theset[value] = result
         return result
 
+# =============================================================================
+class S3RepresentCache:
+    """
+        Process-wide LRU cache for S3Represent lookups, shared between
+        requests (enabled by settings.base.represent_cache)
+
+        - entries are keyed by (namespace, value), where the namespace
+          identifies the lookup (tablename, key, fields, language etc.,
+          see S3Represent.shared_key)
+        - entries are invalidated per record when the record is written
+          (DataModel.onaccept, forms, imports, deletion) in this process,
+          and expire after a time-to-live (to pick up changes made by
+          other processes)
+        - only plain text representations are cached
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, size=10000, ttl=300):
+        """
+            Args:
+                size: maximum number of entries
+                ttl: time-to-live of entries (seconds)
+        """
+
+        self.size = size
+        self.ttl = ttl
+
+        self.lock = threading.RLock()
+
+        # The entries, {(namespace, value): (representation, expires)}
+        self.entries = OrderedDict()
+
+        # Cached values per namespace, {namespace: set(values)}
+        self.values = {}
+
+        # Namespaces per table, {tablename: {namespace: by_id}}
+        self.namespaces = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def instance(cls):
+        """
+            Get the process-wide cache instance
+
+            Returns:
+                S3RepresentCache, or None if disabled
+        """
+
+        instance = cls._instance
+        if instance is None:
+            settings = current.deployment_settings
+            size = settings.get_base_represent_cache()
+            if not size:
+                return None
+            with cls._lock:
+                instance = cls._instance
+                if instance is None:
+                    ttl = settings.get_base_represent_cache_ttl()
+                    instance = cls._instance = cls(size=size, ttl=ttl)
+        return instance
+
+    # -------------------------------------------------------------------------
+    def register(self, namespace, tablenames, by_id=True):
+        """
+            Register a namespace for invalidation
+
+            Args:
+                namespace: the namespace
+                tablenames: the names of the tables the representations
+                            depend on
+                by_id: the values in the namespace are record IDs of the
+                       first table in tablenames (=allows invalidation of
+                       individual entries rather than the entire namespace)
+        """
+
+        namespaces = self.namespaces
+        if namespace in self.values:
+            return
+
+        with self.lock:
+            self.values[namespace] = set()
+            for index, tablename in enumerate(tablenames):
+                if tablename not in namespaces:
+                    namespaces[tablename] = {}
+                namespaces[tablename][namespace] = by_id and index == 0
+
+    # -------------------------------------------------------------------------
+    def get(self, namespace, values):
+        """
+            Look up representations
+
+            Args:
+                namespace: the namespace
+                values: the values to look up
+
+            Returns:
+                dict {value: representation} for all values found
+        """
+
+        entries = self.entries
+        now = time.monotonic()
+
+        found = {}
+        with self.lock:
+            for value in values:
+                key = (namespace, value)
+                entry = entries.get(key)
+                if entry is None:
+                    continue
+                representation, expires = entry
+                if expires > now:
+                    entries.move_to_end(key)
+                    found[value] = representation
+                else:
+                    # Expired
+                    del entries[key]
+                    self.values[namespace].discard(value)
+            self.hits += len(found)
+            self.misses += len(values) - len(found)
+
+        return found
+
+    # -------------------------------------------------------------------------
+    def set(self, namespace, items):
+        """
+            Store representations
+
+            Args:
+                namespace: the namespace
+                items: dict {value: representation}
+        """
+
+        entries = self.entries
+        expires = time.monotonic() + self.ttl
+
+        with self.lock:
+            values = self.values.get(namespace)
+            if values is None:
+                return
+            for value, representation in items.items():
+                if isinstance(representation, lazyT):
+                    representation = s3_str(representation)
+                elif not isinstance(representation, str):
+                    # Markup, can't share
+                    continue
+                key = (namespace, value)
+                entries[key] = (representation, expires)
+                entries.move_to_end(key)
+                values.add(value)
+
+            # Evict least recently used entries
+            size = self.size
+            while len(entries) > size:
+                (ns, value), entry = entries.popitem(last=False)
+                self.values[ns].discard(value)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate(cls, tablename, record_id=None):
+        """
+            Invalidate all entries depending on a table or record
+
+            Args:
+                tablename: the table name
+                record_id: the record ID, None to invalidate all entries
+                           depending on the table
+        """
+
+        instance = cls._instance
+        if instance is None:
+            return
+
+        namespaces = instance.namespaces.get(tablename)
+        if not namespaces:
+            return
+
+        if record_id is not None:
+            try:
+                record_id = int(record_id)
+            except (ValueError, TypeError):
+                record_id = None
+
+        entries = instance.entries
+        with instance.lock:
+            for namespace, by_id in namespaces.items():
+                values = instance.values[namespace]
+                if by_id and record_id is not None:
+                    if record_id in values:
+                        values.discard(record_id)
+                        entries.pop((namespace, record_id), None)
+                else:
+                    for value in values:
+                        entries.pop((namespace, value), None)
+                    values.clear()
+
+    # -------------------------------------------------------------------------
+    def clear(self):
+        """ Remove all entries and reset the counters """
+
+        with self.lock:
+            self.entries.clear()
+            for values in self.values.values():
+                values.clear()
+            self.hits = self.misses = 0
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+        """
+            Get cache statistics
+
+            Returns:
+                dict {"size": number of entries,
+                      "hits": number of cache hits,
+                      "misses": number of cache misses,
+                      }
+        """
+
+        return {"size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                }
+
 # =============================================================================
 class S3RepresentLazy:
     """
@@ -37,15 +37,20 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ("S3Task",)
+__all__ = ("S3Task",
+           "MaintenanceJobs",
+           )
 
 import datetime
 import json
+import time
+import uuid
 
 from gluon import current, IS_EMPTY_OR, IS_INT_IN_RANGE
 from gluon.storage import Storage
 
 from .calendar import S3DateTime
+from .utils import s3_savepoint
 from .validators import IS_UTC_DATETIME
 
 # -----------------------------------------------------------------------------
@@ -54,6 +59,15 @@ class S3Task:
 
     TASK_TABLENAME = "scheduler_task"
 
+    # Statuses of pending tasks (for duplicate check)
+    PENDING = ("QUEUED", "ALLOCATED", "RUNNING")
+
+    # Number of seconds to cache the worker liveness state
+    ALIVE_TTL = 15
+
+    # Worker liveness state per DB, {uri_hash: (expires, alive)}
+    _alive = {}
+
     # -------------------------------------------------------------------------
     def __init__(self):
 
@@ -297,6 +311,139 @@ class S3Task:
         # Return task ID so that status can be polled
         return queued.id
 
+    # -------------------------------------------------------------------------
+    def run_async_many(self, task, jobs, timeout=300):
+        """
+            Wrapper to call an asynchronous task for many sets of arguments
+            at once, e.g. for mass updates, queuing all tasks with a few
+            multi-row INSERTs rather than validating and inserting them
+            one by one
+                - run from the main request
+
+            Args:
+                task: The function which should be run
+                            - async if a worker is alive
+                jobs: list of tuples (args, vars), the unnamed args and
+                      the named vars to send to the function per task
+                timeout: The length of time available for each task to complete
+                            - default 300s (5 mins)
+
+            Returns:
+                list of task IDs, in the order of jobs (None for tasks
+                run synchronously, or which could not be queued)
+        """
+
+        # Check that task is defined (and callable)
+        tasks = current.response.s3.tasks
+        if not tasks or not callable(tasks.get(task)):
+            return False
+
+        # Check that args/vars are JSON-serializable
+        items = []
+        for args, vars in jobs:
+            if args is None:
+                args = []
+            if vars is None:
+                vars = {}
+            try:
+                args_json = json.dumps(args)
+            except (ValueError, TypeError):
+                msg = "S3Task.run_async_many args not JSON-serializable: %s" % args
+                current.log.error(msg)
+                raise
+            try:
+                json.dumps(vars)
+            except (ValueError, TypeError):
+                msg = "S3Task.run_async_many vars not JSON-serializable: %s" % vars
+                current.log.error(msg)
+                raise
+            items.append((args, args_json, vars))
+
+        if not items:
+            return []
+
+        # Run synchronously if scheduler not running
+        if not self._is_alive():
+            function = tasks[task]
+            for args, _, vars in items:
+                function(*args, **vars)
+            return [None] * len(items)
+
+        # Add the current user to the vars
+        auth = current.auth
+        user_id = auth.user.id if auth.user else None
+
+        application_name = "%s/default" % current.request.application
+
+        rows = []
+        for args, args_json, vars in items:
+            if user_id:
+                vars["user_id"] = user_id
+            rows.append({"application_name": application_name,
+                         "task_name": task,
+                         "function_name": task,
+                         "args": args_json,
+                         "vars": json.dumps(vars),
+                         "timeout": timeout,
+                         "uuid": str(uuid.uuid4()),
+                         })
+
+        return self._bulk_insert(rows)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _bulk_insert(cls, rows, batch_size=500):
+        """
+            Insert scheduler tasks with multi-row INSERTs
+
+            Args:
+                rows: list of dicts with the task data (each including a uuid)
+                batch_size: the maximum number of tasks per INSERT
+
+            Returns:
+                list of task IDs, in the order of rows (None for tasks
+                that could not be queued)
+        """
+
+        db = current.db
+        table = db[cls.TASK_TABLENAME]
+        expand = db._adapter.expand
+
+        uuids = [row["uuid"] for row in rows]
+
+        for index in range(0, len(rows), batch_size):
+            batch = rows[index:index + batch_size]
+            values = [table._fields_and_values_for_insert(row).op_values() for row in batch]
+            columns = [field for field, _ in values[0]]
+            sql = "INSERT INTO %s(%s) VALUES %s;" % \
+                  (table._rname,
+                   ",".join(field._rname for field in columns),
+                   ",".join("(%s)" % ",".join(expand(v, f.type) for f, v in row)
+                            for row in values
+                            ),
+                   )
+            try:
+                with s3_savepoint():
+                    db.executesql(sql)
+            except Exception:
+                # Insert row by row, skipping those that fail
+                for row in batch:
+                    try:
+                        with s3_savepoint():
+                            table.insert(**row)
+                    except Exception as e:
+                        current.log.error("S3Task: could not queue task %s: %s" % \
+                                          (row["task_name"], e))
+
+        # Look up the task IDs
+        task_ids = {}
+        for index in range(0, len(uuids), batch_size):
+            query = table.uuid.belongs(uuids[index:index + batch_size])
+            for row in db(query).select(table.id, table.uuid):
+                task_ids[row.uuid] = row.id
+
+        return [task_ids.get(u) for u in uuids]
+
     # -------------------------------------------------------------------------
     def schedule_task(self,
                       task,
@@ -406,7 +553,7 @@ class S3Task:
                                                    task_name = task,
                                                    function_name = function_name,
                                                    args = json.dumps(args),
-                                                   vars = json.dumps(vars),
+                                                   vars = json.dumps(vars, sort_keys=True),
                                                    **kwargs)
         return task_id
 
@@ -428,15 +575,16 @@ class S3Task:
 
         args_json = json.dumps(args)
 
-        query = ((ttable.function_name == task) & \
-                 (ttable.args == args_json) & \
-                 (ttable.status.belongs(["RUNNING", "QUEUED", "ALLOCATED"])))
-        jobs = db(query).select(ttable.vars)
-        for job in jobs:
-            job_vars = json.loads(job.vars)
-            if job_vars == vars:
-                return True
-        return False
+        # Compare the JSON-encoded vars in the DB rather than decoding
+        # them (schedule_task stores them with sorted keys, other tasks
+        # in original key order)
+        vars_json = {json.dumps(vars), json.dumps(vars, sort_keys=True)}
+
+        query = (ttable.function_name == task) & \
+                (ttable.status.belongs(S3Task.PENDING)) & \
+                (ttable.args == args_json) & \
+                (ttable.vars.belongs(vars_json))
+        return not db(query).isempty()
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -445,6 +593,7 @@ class S3Task:
             Returns True if there is at least 1 active worker to run scheduled
             tasks
                 - run from the main request
+                - the result is cached (per process) for ALIVE_TTL seconds
 
             Note:
                 Can't run this 1/request at the beginning since the tables
@@ -457,6 +606,13 @@ class S3Task:
         #    return False
 
         db = current.db
+
+        # Use the cached state if still valid
+        key = db._uri_hash
+        state = S3Task._alive.get(key)
+        if state and state[0] > time.time():
+            return state[1]
+
         table = db.scheduler_worker
 
         now = datetime.datetime.now()
@@ -469,7 +625,32 @@ class S3Task:
                                         cache = cache,
                                         ).first()
 
-        return True if worker_alive else False
+        alive = True if worker_alive else False
+        S3Task._alive[key] = (time.time() + S3Task.ALIVE_TTL, alive)
+
+        return alive
+
+    # -------------------------------------------------------------------------
+    def create_indexes(self):
+        """
+            Create a partial index for pending tasks in the scheduler_task
+            table, for faster duplicate checks
+        """
+
+        dbtype = current.deployment_settings.get_database_type()
+
+        if dbtype in ("postgres", "sqlite"):
+            sql = "CREATE INDEX IF NOT EXISTS %(index)s ON %(table)s (%(field)s) WHERE status IN (%(status)s);"
+        else:
+            return
+
+        names = {"table": self.TASK_TABLENAME,
+                 "field": "function_name",
+                 "status": ",".join("'%s'" % status for status in self.PENDING),
+                 }
+        names["index"] = "%(table)s_pending_idx" % names
+
+        current.db.executesql(sql % names)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -491,4 +672,214 @@ class S3Task:
         if task:
             task.update_record(status = "QUEUED")
 
+# =============================================================================
+class MaintenanceJobs:
+    """
+        Base class for template maintenance routines (e.g. Daily) which
+        are declared as independent jobs, so that the scheduler can run
+        them concurrently in separate tasks (and transactions)
+
+        - subclasses declare the names of their job methods in jobs
+        - the maintenance task dispatches the jobs as separate tasks,
+          each of which runs a single job, recording its execution time
+          in s3_maintenance_log
+        - calling the instance runs all jobs serially (fallback)
+    """
+
+    # The period of this routine
+    period = "daily"
+
+    # Names of the job methods (to be declared in subclass)
+    jobs = ()
+
+    # Timeout for each job task (seconds)
+    timeout = 1800
+
+    # Default number of records per batch for delete_batched
+    BATCH_SIZE = 1000
+
+    # -------------------------------------------------------------------------
+    def __call__(self):
+        """
+            Run all jobs serially
+
+            Returns:
+                error message(s), or None if successful
+        """
+
+        errors = []
+        for name in self.jobs:
+            error = self.run(name)
+            if error:
+                errors.append("%s: %s" % (name, error))
+
+        return "\n".join(errors) if errors else None
+
+    # -------------------------------------------------------------------------
+    def dispatch(self):
+        """
+            Queue all jobs as separate maintenance tasks (runs them
+            synchronously if no worker is alive)
+
+            Returns:
+                status message
+        """
+
+        jobs = [(None, {"period": self.period, "job": name}) for name in self.jobs]
+        current.s3task.run_async_many("maintenance", jobs, timeout=self.timeout)
+
+        return "%s jobs dispatched" % len(jobs)
+
+    # -------------------------------------------------------------------------
+    def run(self, name):
+        """
+            Run a single job, and record its execution time
+
+            Args:
+                name: the name of the job method
+
+            Returns:
+                error message, or None if successful
+        """
+
+        if name not in self.jobs:
+            return "Unknown job %s" % name
+
+        db = current.db
+
+        current.log.info("%s maintenance: %s" % (self.period.capitalize(), name))
+
+        start = datetime.datetime.utcnow()
+        started = time.time()
+        try:
+            error = getattr(self, name)()
+        except Exception as e:
+            db.rollback()
+            error = str(e)
+            status = "FAILED"
+            current.log.error("Maintenance job %s failed: %s" % (name, error))
+        else:
+            db.commit()
+            status = "FAILED" if error else "SUCCESS"
+        duration = time.time() - started
+
+        table = current.s3db.s3_maintenance_log
+        table.insert(period = self.period,
+                     job = name,
+                     start_time = start,
+                     duration = duration,
+                     status = status,
+                     result = str(error) if error else None,
+                     )
+        db.commit()
+
+        return error if error else None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def delete_batched(cls, table, query, left=None, before=None, batch_size=None):
+        """
+            Delete all records matching a query, with set-based DELETEs
+            in bounded batches, each committed separately
+
+            Args:
+                table: the Table
+                query: the Query
+                left: left joins for the query
+                before: function(record_ids) to run before deleting each
+                        batch, e.g. to remove dependent records
+                batch_size: the maximum number of records per batch
+
+            Returns:
+                the total number of deleted records
+
+            Note:
+                This is a plain DAL delete, i.e. neither archiving nor
+                ondelete-cascades are applied
+
+                Each batch is committed, and thereby also any uncommitted
+                changes of the caller; if a batch cannot be deleted (e.g.
+                due to a foreign key constraint), only the batch is rolled
+                back (savepoint), and its records are deleted one by one
+                instead, skipping those that fail, so that they do not block
+                the deletion of all others
+        """
+
+        db = current.db
+
+        if not batch_size:
+            batch_size = cls.BATCH_SIZE
+
+        total = 0
+        failed = []
+        while True:
+            q = query
+            if failed:
+                q &= ~(table._id.belongs(failed))
+            rows = db(q).select(table._id,
+                                left = left,
+                                limitby = (0, batch_size),
+                                )
+            record_ids = [row[table._id] for row in rows]
+            if not record_ids:
+                break
+            try:
+                with s3_savepoint():
+                    if before:
+                        before(record_ids)
+                    deleted = db(table._id.belongs(record_ids)).delete()
+            except Exception:
+                deleted = cls.delete_each(table, record_ids, before, failed)
+            db.commit()
+            total += deleted
+            if len(record_ids) < batch_size:
+                break
+
+        if failed:
+            current.log.warning("Could not delete %s %s records: %s" % \
+                                (len(failed),
+                                 table._tablename,
+                                 ", ".join(str(i) for i in failed),
+                                 ))
+        return total
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def delete_each(table, record_ids, before=None, failed=None):
+        """
+            Delete records one by one, each in a savepoint, as fallback
+            when a batch cannot be deleted as a whole
+
+            Args:
+                table: the Table
+                record_ids: the record IDs
+                before: function(record_ids) to run before deleting
+                        each record
+                failed: list to add the IDs of records which could not
+                        be deleted to
+
+            Returns:
+                the number of deleted records
+
+            Note:
+                This does not commit, the caller must commit the transaction
+        """
+
+        db = current.db
+
+        deleted = 0
+        for record_id in record_ids:
+            try:
+                with s3_savepoint():
+                    if before:
+                        before([record_id])
+                    deleted += db(table._id == record_id).delete()
+            except Exception as e:
+                current.log.debug("Could not delete %s record %s: %s" % \
+                                  (table._tablename, record_id, e))
+                if failed is not None:
+                    failed.append(record_id)
+
+        return deleted
+
 # END =========================================================================
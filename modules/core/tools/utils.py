@@ -48,6 +48,7 @@ __all__ = ("RCVARS",
            "s3_remove_last_record_id",
            "s3_represent_value",
            "s3_required_label",
+           "s3_savepoint",
            "s3_set_extension",
            "s3_set_match_strings",
            "s3_store_last_record_id",
@@ -62,7 +63,9 @@ import copy
 import os
 import platform
 import sys
+import uuid
 
+from contextlib import contextmanager
 from html.parser import HTMLParser
 from urllib import parse as urlparse
 
@@ -760,6 +763,53 @@ def s3_orderby_fields(table, orderby, expr=False):
             continue
         yield f
 
+# =============================================================================
+@contextmanager
+def s3_savepoint(db=None):
+    """
+        Context manager to run database statements inside a SAVEPOINT,
+        so that a failing statement only rolls back its own changes
+        while the enclosing transaction remains usable (PostgreSQL would
+        otherwise reject all further statements in the transaction)
+
+        Args:
+            db: the database (defaults to current.db)
+
+        Example:
+            try:
+                with s3_savepoint():
+                    db.executesql(sql)
+            except Exception:
+                # The transaction can still be used here
+                ...
+
+        Note:
+            Savepoints are only used with PostgreSQL, MySQL and SQLite
+    """
+
+    if db is None:
+        db = current.db
+
+    engine = db._adapter.dbengine
+    if engine not in ("postgres", "mysql", "sqlite"):
+        yield
+        return
+
+    if engine == "sqlite" and not db._adapter.connection.in_transaction:
+        # Begin the transaction explicitly, as releasing the outermost
+        # savepoint would otherwise commit it
+        db.executesql("BEGIN")
+
+    name = "s3_%s" % uuid.uuid4().hex
+    db.executesql("SAVEPOINT %s" % name)
+    try:
+        yield
+    except Exception:
+        db.executesql("ROLLBACK TO SAVEPOINT %s" % name)
+        db.executesql("RELEASE SAVEPOINT %s" % name)
+        raise
+    db.executesql("RELEASE SAVEPOINT %s" % name)
+
 # =============================================================================
 def s3_get_extension(request=None):
     """
@@ -76,6 +76,9 @@ class DataTable:
         self._orderby = orderby
         self.dt_ordering = None
 
+        # Continuation token for keyset pagination
+        self.next = None
+
     # -------------------------------------------------------------------------
     @property
     def orderby(self):
@@ -606,6 +609,8 @@ class DataTable:
                   "data": data_array,
                   "draw": draw,
                   }
+        if self.next:
+            output["next"] = self.next
 
         if stringify:
             output = jsons(output)
@@ -53,7 +53,8 @@ from gluon.validators import Validator
 from s3dal import Field, original_tablename
 
 from ..tools import s3_mark_required, s3_store_last_record_id, s3_str, \
-                    s3_validate, JSONERRORS, JSONSEPARATORS, S3Represent
+                    s3_validate, JSONERRORS, JSONSEPARATORS, S3Represent, \
+                    S3RepresentCache
 
 from .widgets import S3Selector, S3UploadWidget
 
@@ -752,6 +753,13 @@ class S3SQLDefaultForm(S3SQLForm):
                 self.resource.lastid = str(form_vars.id)
                 s3_store_last_record_id(tablename, form_vars.id)
 
+            # Invalidate shared representations of the record
+            S3RepresentCache.invalidate(tablename, form_vars.id)
+
+            # Update the hierarchy node of the record
+            from ..tools import S3Hierarchy
+            S3Hierarchy.update_node(tablename, form_vars.id)
+
             # Execute onaccept
             try:
                 callback(onaccept, form, tablename=tablename)
@@ -1582,6 +1590,13 @@ class S3SQLCustomForm(S3SQLForm):
             component.lastid = str(accept_id)
             s3_store_last_record_id(tablename, accept_id)
 
+            # Invalidate shared representations of the record
+            S3RepresentCache.invalidate(tablename, accept_id)
+
+            # Update the hierarchy node of the record
+            from ..tools import S3Hierarchy
+            S3Hierarchy.update_node(tablename, accept_id)
+
             # Execute onaccept
             try:
                 callback(onaccept, form, tablename=tablename)
@@ -475,6 +475,12 @@ class S3Config(Storage):
         """
         customise = self.get("customise_%s_controller" % tablename)
         if customise:
+            profiler = getattr(current, "profiler", None)
+            if profiler and profiler.enabled:
+                customise = profiler.wrap("customise",
+                                          "%s_controller" % tablename,
+                                          customise,
+                                          )
             return customise(**attr)
         else:
             return attr
@@ -497,7 +503,15 @@ class S3Config(Storage):
             - runs after controller customisation
             - but runs before prep
         """
-        return self.get("customise_%s_resource" % tablename)
+        customise = self.get("customise_%s_resource" % tablename)
+        if customise:
+            profiler = getattr(current, "profiler", None)
+            if profiler and profiler.enabled:
+                customise = profiler.wrap("customise",
+                                          "%s_resource" % tablename,
+                                          customise,
+                                          )
+        return customise
 
     # -------------------------------------------------------------------------
     def has_module(self, module_name):
@@ -1068,6 +1082,14 @@ class S3Config(Storage):
         """
         return self.base.get("rest_controllers")
 
+    def get_base_request_profile(self):
+        """
+            Whether to profile the fixed overhead of requests (model files,
+            data models, settings getters, customise-hooks, roles), and
+            write the aggregated timings to s3_profile_log (see admin/profile)
+        """
+        return self.base.get("request_profile", False)
+
     def get_base_migrate(self):
         """ Whether to allow Web2Py to migrate the SQL database to the new structure """
         return self.base.get("migrate", True)
@@ -1104,6 +1126,56 @@ class S3Config(Storage):
       """
         return self.base.get("bigtable", False)
 
+    def get_base_window_count(self):
+        """
+            Count the total number of matching records in the same query
+            as the IDs of the current page (window function, requires
+            PostgreSQL or SQLite 3.25+, only applies for bigtable)
+        """
+        return self.base.get("window_count", True)
+
+    def get_base_count_cache(self):
+        """
+            Cache the total number of records matching a resource filter
+            for paginated lists, so that paging doesn't recount every time
+            - number of seconds to cache totals, True for 30 seconds
+        """
+        setting = self.base.get("count_cache", False)
+        if setting is True:
+            setting = 30
+        return setting
+
+    def get_base_xml_export_stream(self):
+        """
+            Stream native S3XML/S3JSON exports (REST API, e.g. sync pulls)
+            to the client in batches of master records rather than building
+            the complete element tree in memory
+            - number of master records per batch, True for 1000
+        """
+        setting = self.base.get("xml_export_stream", False)
+        if setting is True:
+            setting = 1000
+        return setting
+
+    def get_base_represent_cache(self):
+        """
+            Share foreign key representations between requests in a
+            process-wide cache (S3RepresentCache)
+            - True to enable, or the maximum number of entries (int)
+        """
+        setting = self.base.get("represent_cache", False)
+        if setting is True:
+            setting = 10000
+        return setting
+
+    def get_base_represent_cache_ttl(self):
+        """
+            Time-to-live (seconds) of entries in the shared representation
+            cache; changes made by other processes become visible after
+            this time at the latest
+        """
+        return self.base.get("represent_cache_ttl", 300)
+
     def get_base_cdn(self):
         """
             Should we use CDNs (Content Distribution Networks) to serve some common CSS/JS?
@@ -1211,6 +1283,16 @@ class S3Config(Storage):
 
         return None
 
+    def get_import_bulk(self):
+        """
+            Use bulk mode for imports: pre-resolve UIDs and S3Duplicate
+            keys for the whole import job, insert new records in batches
+            and run onaccept after each batch
+                - True, or the batch size (default batch size is 500)
+                - tables can opt out with s3db.configure(bulk_import=False)
+        """
+        return self.base.get("import_bulk", False)
+
     # -------------------------------------------------------------------------
     # Logger settings
     def get_log_level(self):
@@ -1772,6 +1854,33 @@ class S3Config(Storage):
         """
         return self.gis.get("simplify_tolerance", 0.01)
 
+    def get_gis_spatial_index(self):
+        """
+            Use an in-process spatial index (requires Shapely) to find
+            locations intersecting a shape or bounding box, if not using
+            a spatial DB
+        """
+        return self.gis.get("spatial_index", False)
+
+    def get_gis_geometry_pyramid(self):
+        """
+            Store simplified geometries of locations at multiple levels
+            (gis_location_geometry), and choose the level for GeoJSON
+            output by the requested zoom/bbox, rather than simplifying
+            all polygons with simplify_tolerance on every request
+            - with a spatial DB, the DB simplifies the geometries at the
+              tolerance and precision of the level instead
+        """
+        return self.gis.get("geometry_pyramid", False)
+
+    def get_gis_vector_tiles(self):
+        """
+            Serve Feature Layers as vector tiles (Mapbox Vector Tiles)
+            from gis/tiles/{layer_id}/{z}/{x}/{y}.mvt, cached on disk
+            in uploads/gis_cache/tiles
+        """
+        return self.gis.get("vector_tiles", False)
+
     def get_gis_precision(self):
         """
             Number of Decimal places to put in output
@@ -2752,6 +2861,16 @@ class S3Config(Storage):
         """
         return self.msg.get("notify_check_subscriptions", False)
 
+    def get_msg_notify_batch(self):
+        """
+            Whether to notify subscribers in batches, extracting and
+            rendering the data in-process once for all subscribers with
+            the same resource, filter and permissions (rather than with
+            a lookup request to the subscribed controller per subscriber)
+            - resource customisations are applied, but not controller preps
+        """
+        return self.msg.get("notify_batch", False)
+
     def get_msg_notify_subject(self):
         """
             Template for the subject line in update notifications.
@@ -2867,6 +2986,19 @@ class S3Config(Storage):
         """ Text for saved filter load-button """
         return self.search.get("filter_manager_load")
 
+    def get_search_filter_options_cache(self):
+        """
+            Cache the option keys looked up for options filters per
+            resource filter and user realms, so that rendering the
+            filter form and the Ajax-refresh of filter options do
+            not repeat the lookup
+            - number of seconds to cache options, True for 30 seconds
+        """
+        setting = self.search.get("filter_options_cache", False)
+        if setting is True:
+            setting = 30
+        return setting
+
     # =========================================================================
     # Setup
     #
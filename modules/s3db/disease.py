@@ -30,6 +30,7 @@
 __all__ = ("DiseaseDataModel",
            "DiseaseMonitoringModel",
            "DiseaseCertificateModel",
+           "DiseaseResultTransmissionModel",
            "DiseaseCaseTrackingModel",
            "DiseaseContactTracingModel",
            "DiseaseStatsModel",
@@ -911,6 +912,82 @@ class DiseaseCertificateModel(DataModel):
 
         return None
 
+# =============================================================================
+class DiseaseResultTransmissionModel(DataModel):
+    """
+        Model for a queue of test results to be transmitted to external
+        result servers (e.g. a warning app backend) in batches
+    """
+
+    names = ("disease_result_transmission",
+             )
+
+    def model(self):
+
+        T = current.T
+
+        # ---------------------------------------------------------------------
+        # Result Transmission Queue
+        #
+        transmission_status = {"PENDING": T("Pending"),
+                               "SENT": T("Sent"),
+                               "FAILED": T("Failed"),
+                               }
+        tablename = "disease_result_transmission"
+        self.define_table(tablename,
+                          # The test result (disease_case_diagnostics record ID)
+                          Field("result_id", "integer",
+                                ),
+                          # The receiving system
+                          Field("target",
+                                ),
+                          # Sender ID (e.g. lab ID), for grouping
+                          Field("sender_id",
+                                ),
+                          # The result data to transmit (JSON object)
+                          Field("payload", "json",
+                                ),
+                          Field("status",
+                                default = "PENDING",
+                                represent = represent_option(transmission_status),
+                                requires = IS_IN_SET(transmission_status),
+                                ),
+                          Field("attempts", "integer",
+                                default = 0,
+                                ),
+                          # Date/time of the next attempt (backoff)
+                          s3_datetime("next_attempt",
+                                      label = T("Next Attempt"),
+                                      ),
+                          # UUID of the batch in which the result was sent
+                          # (last attempted)
+                          Field("batch",
+                                ),
+                          s3_datetime("sent_on",
+                                      label = T("Sent on"),
+                                      ),
+                          Field("errors", "text",
+                                ),
+                          *s3_meta_fields())
+
+        self.configure(tablename,
+                       insertable = False,
+                       editable = False,
+                       deletable = False,
+                       )
+
+        # ---------------------------------------------------------------------
+        # Pass names back to global scope (s3.*)
+        #
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def defaults():
+        """ Safe defaults for names in case the module is disabled """
+
+        return None
+
 # =============================================================================
 class DiseaseCaseTrackingModel(DataModel):
 
@@ -2536,19 +2613,20 @@ class DiseaseStatsModel(DataModel):
                                 orderby = ~gtable.level,
                                 )
 
-        run_async = current.s3task.run_async
         from gluon.serializers import json as jsons
 
         dates = jsons(dates)
+        jobs = []
         for row in rows:
             location_id = row.id
             children = [c.id for c in all_children if c.parent == location_id]
             children = json.dumps(children)
             for parameter_id in parameters:
-                run_async("disease_stats_update_location_aggregates",
-                          args = [location_id, children, parameter_id, dates],
-                          timeout = 1800 # 30m
-                          )
+                jobs.append(([location_id, children, parameter_id, dates], None))
+        current.s3task.run_async_many("disease_stats_update_location_aggregates",
+                                      jobs,
+                                      timeout = 1800 # 30m
+                                      )
 
     # -------------------------------------------------------------------------
     @staticmethod
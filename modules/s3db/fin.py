@@ -34,8 +34,11 @@ __all__ = ("FinExpensesModel",
            "fin_voucher_eligibility_types",
            "fin_voucher_start_billing",
            "fin_voucher_settle_invoice",
+           "fin_voucher_hmac",
            )
 
+import multiprocessing
+
 from collections import OrderedDict
 
 from gluon import *
@@ -2633,63 +2636,274 @@ class fin_VoucherProgram:
                 True|False whether the transaction is intact
         """
 
+        count, invalid, broken = self.verify_chain([transaction_id])
+
+        return count == 1 and not invalid and not broken
+
+    # -------------------------------------------------------------------------
+    def verify_chain(self, transaction_ids=None, batch_size=5000, processes=None):
+        """
+            Verify the integrity of the transaction chain of the program
+            (=check the vhash and the ouuid link of each transaction);
+            transactions are loaded in batches in program order, and the
+            hashes of preceding transactions looked up once per batch
+
+            Args:
+                transaction_ids: the transactions to verify, default all
+                                 transactions in the program
+                batch_size: the number of transactions per batch
+                processes: the number of worker processes to generate the
+                           hashes, default in this process
+
+            Returns:
+                tuple (count, invalid, broken)
+                    - the number of transactions verified
+                    - the IDs of transactions with incorrect hash, or
+                      which do not belong to the program
+                    - the IDs of transactions where the preceding
+                      transaction could not be found
+        """
+
+        invalid, broken = [], []
+
+        program = self.program
+        if not program:
+            if transaction_ids is not None:
+                invalid.extend(transaction_ids)
+            return 0, invalid, broken
+        program_id = program.id
+
         db = current.db
         table = current.s3db.fin_voucher_transaction
+        fields = [table.id,
+                  table.uuid,
+                  table.ouuid,
+                  table.date,
+                  table.type,
+                  table.credit,
+                  table.voucher,
+                  table.debit,
+                  table.compensation,
+                  table.voucher_id,
+                  table.debit_id,
+                  table.vhash,
+                  ]
+
+        if transaction_ids is not None:
+            transaction_ids = sorted(set(transaction_ids))
+
+        key = current.deployment_settings.hmac_key
+        pool = multiprocessing.Pool(processes) if processes else None
+
+        # Hashes of recent transactions by UUID (ouuid normally refers
+        # to one of the immediately preceding transactions)
+        hashes = OrderedDict()
+
+        count = offset = 0
+        last_id = 0
+        try:
+            while True:
+                if transaction_ids is None:
+                    query = (table.program_id == program_id) & \
+                            (table.id > last_id)
+                    rows = db(query).select(*fields,
+                                            limitby = (0, batch_size),
+                                            orderby = table.id,
+                                            )
+                    if not rows:
+                        break
+                    last_id = rows.last().id
+                else:
+                    chunk = transaction_ids[offset:offset + batch_size]
+                    if not chunk:
+                        break
+                    offset += batch_size
+                    query = (table.program_id == program_id) & \
+                            (table.id.belongs(chunk))
+                    rows = db(query).select(*fields, orderby=table.id)
+                    if len(rows) != len(chunk):
+                        found = set(row.id for row in rows)
+                        invalid.extend(i for i in chunk if i not in found)
+
+                for row in rows:
+                    hashes[row.uuid] = row.vhash
+
+                # Look up all other preceding transactions at once
+                ouuids = set(row.ouuid for row in rows
+                             if row.ouuid and row.ouuid not in hashes)
+                if ouuids:
+                    query = (table.program_id == program_id) & \
+                            (table.uuid.belongs(ouuids))
+                    preceding = db(query).select(table.uuid, table.vhash)
+                    for row in preceding:
+                        hashes[row.uuid] = row.vhash
+
+                result = self.verify_batch(program.uuid, key, rows, hashes, pool=pool)
+                invalid.extend(result[0])
+                broken.extend(result[1])
+                count += len(rows)
+
+                # Discard older hashes
+                while len(hashes) > 2 * batch_size:
+                    hashes.popitem(last=False)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        return count, invalid, broken
 
-        # Get the transaction record
-        query = (table.id == transaction_id)
-        transaction = db(query).select(table.ALL,
-                                       limitby = (0, 1),
-                                       ).first()
-        if not transaction:
-            return False
+    # -------------------------------------------------------------------------
+    @classmethod
+    def verify_batch(cls, puuid, key, rows, hashes, pool=None):
+        """
+            Verify a batch of transactions
 
-        # Get preceding transaction's hash
-        ouuid = transaction.ouuid
-        if ouuid:
-            query = (table.uuid == ouuid) & \
-                    (table.program_id == transaction.program_id)
-            p_transaction = db(query).select(table.vhash,
-                                             limitby = (0, 1),
-                                             ).first()
-            if p_transaction is None:
-                return False
-            ohash = p_transaction.vhash
+            Args:
+                puuid: the program UUID
+                key: the HMAC key
+                rows: the transaction Rows
+                hashes: dict of the vhashes of the preceding transactions,
+                        {uuid: vhash}
+                pool: a multiprocessing.Pool to generate the hashes
+
+            Returns:
+                tuple (invalid, broken), lists of transaction IDs
+        """
+
+        invalid, broken = [], []
+
+        verify = []
+        inputs = []
+        for row in rows:
+            ouuid = row.ouuid
+            if ouuid:
+                ohash = hashes.get(ouuid)
+                if ohash is None:
+                    broken.append(row.id)
+                    continue
+            else:
+                ohash = None
+            data = {"ouuid": ouuid,
+                    "date": row.date,
+                    "type": row.type,
+                    "credit": row.credit,
+                    "voucher": row.voucher,
+                    "debit": row.debit,
+                    "compensation": row.compensation,
+                    "voucher_id": row.voucher_id,
+                    "debit_id": row.debit_id,
+                    }
+            verify.append(row)
+            inputs.append(cls._hash_input(puuid, data, ohash))
+
+        if pool and len(inputs) > 1:
+            chunks = [(key, inputs[i:i + 500])
+                      for i in range(0, len(inputs), 500)]
+            vhashes = []
+            for result in pool.map(fin_voucher_hmac, chunks):
+                vhashes.extend(result)
         else:
-            ohash = None
-
-        # Verify the hash
-        data = {"ouuid": ouuid,
-                "date": transaction.date,
-                "type": transaction.type,
-                "credit": transaction.credit,
-                "voucher": transaction.voucher,
-                "debit": transaction.debit,
-                "compensation": transaction.compensation,
-                "voucher_id": transaction.voucher_id,
-                "debit_id": transaction.debit_id,
-                }
-        vhash = self._hash(data, ohash)
+            vhashes = fin_voucher_hmac((key, inputs))
 
-        return vhash == transaction.vhash
+        for row, vhash in zip(verify, vhashes):
+            if vhash != row.vhash:
+                invalid.append(row.id)
+
+        return invalid, broken
 
     # -------------------------------------------------------------------------
-    def audit(self, correct=False):
+    def audit(self, correct=False, processes=None):
         """
             Run a full audit of the entire program:
                 - verify all transactions
                 - verify all balances, vouchers and debits
 
             Args:
-                correct: correct any incorrect balances
+                correct: correct any incorrect balances (only if all
+                         transactions are intact)
+                processes: the number of worker processes to generate
+                           the transaction hashes
 
             Returns:
-                audit report
-
-            TODO implement
+                audit report, a dict {"transactions": number of transactions,
+                                      "invalid": [transaction IDs],
+                                      "broken": [transaction IDs],
+                                      "balances": [(tablename, record ID,
+                                                    fieldname, balance,
+                                                    expected)],
+                                      "corrected": True|False,
+                                      }
         """
 
-        return True
+        count, invalid, broken = self.verify_chain(processes=processes)
+        report = {"transactions": count,
+                  "invalid": invalid,
+                  "broken": broken,
+                  "balances": [],
+                  "corrected": False,
+                  }
+
+        program = self.program
+        if not program:
+            return report
+        program_id = program.id
+
+        db = current.db
+        s3db = current.s3db
+
+        ttable = s3db.fin_voucher_transaction
+        base = (ttable.program_id == program_id) & \
+               (ttable.deleted == False)
+        mismatches = []
+
+        # Program balances
+        credit = ttable.credit.sum()
+        compensation = ttable.compensation.sum()
+        row = db(base).select(credit, compensation).first()
+        expected = {"credit": row[credit] or 0,
+                    "compensation": row[compensation] or 0,
+                    }
+        ptable = s3db.fin_voucher_program
+        for fn in ("credit", "compensation"):
+            if (program[fn] or 0) != expected[fn]:
+                mismatches.append((ptable, program.id, fn, program[fn], expected[fn]))
+
+        # Voucher and debit balances
+        for tablename, fkey, fn in (("fin_voucher", "voucher_id", "voucher"),
+                                    ("fin_voucher_debit", "debit_id", "debit"),
+                                    ):
+            table = s3db[tablename]
+            total = ttable[fn].sum()
+            query = base & (ttable[fkey] != None)
+            rows = db(query).select(ttable[fkey],
+                                    total,
+                                    groupby = ttable[fkey],
+                                    )
+            expected = {row[ttable[fkey]]: row[total] or 0 for row in rows}
+
+            query = (table.program_id == program_id) & \
+                    (table.deleted == False)
+            rows = db(query).select(table.id, table.balance)
+            for row in rows:
+                balance = expected.get(row.id, 0)
+                if (row.balance or 0) != balance:
+                    mismatches.append((table, row.id, "balance", row.balance, balance))
+
+        report["balances"] = [(table._tablename, record_id, fn, balance, value)
+                              for table, record_id, fn, balance, value in mismatches
+                              ]
+
+        if correct and mismatches and not invalid and not broken:
+            for table, record_id, fn, _, value in mismatches:
+                data = {fn: value}
+                if "modified_on" in table.fields:
+                    data["modified_on"] = table.modified_on
+                    data["modified_by"] = table.modified_by
+                db(table.id == record_id).update(**data)
+            report["corrected"] = True
+
+        return report
 
     # -------------------------------------------------------------------------
     def earliest_billing_date(self, billing_id=None, configure=None):
@@ -2748,23 +2962,37 @@ class fin_VoucherProgram:
                 the hash as string
         """
 
+        inp = self._hash_input(self.program.uuid, transaction, ohash)
+
+        key = current.deployment_settings.hmac_key
+        return fin_voucher_hmac((key, [inp]))[0]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _hash_input(puuid, transaction, ohash):
+        """
+            Generate the input for the verification hash of a transaction
+
+            Args:
+                puuid: the program UUID
+                transaction: the transaction data
+                ohash: the hash of the preceding transaction
+
+            Returns:
+                the hash input as JSON string
+        """
+
         # Generate signature from transaction data
         signature = {}
         signature.update(transaction)
         signature["date"] = s3_format_datetime(transaction["date"])
 
         # Hash it, together with program UUID and ohash
-        data = {"puuid": self.program.uuid,
+        data = {"puuid": puuid,
                 "ohash": ohash,
                 "signature": signature,
                 }
-        inp = json.dumps(data, separators=JSONSEPARATORS)
-
-        crypt = CRYPT(key = current.deployment_settings.hmac_key,
-                      digest_alg = "sha512",
-                      salt = False,
-                      )
-        return str(crypt(inp)[0])
+        return json.dumps(data, separators=JSONSEPARATORS)
 
     # -------------------------------------------------------------------------
     def __transaction(self, data):
@@ -2834,6 +3062,28 @@ class fin_VoucherProgram:
 
         return True
 
+# =============================================================================
+def fin_voucher_hmac(args):
+    """
+        Generate verification hashes for voucher transactions (can be
+        used as multiprocessing worker)
+
+        Args:
+            args: tuple (key, inputs), the HMAC key and a list of
+                  hash inputs
+
+        Returns:
+            list of hashes (strings)
+    """
+
+    key, inputs = args
+
+    crypt = CRYPT(key = key,
+                  digest_alg = "sha512",
+                  salt = False,
+                  )
+    return [str(crypt(inp)[0]) for inp in inputs]
+
 # =============================================================================
 class fin_VoucherBilling:
     """
@@ -2947,6 +3197,15 @@ class fin_VoucherBilling:
                                 orderby = dtable.date,
                                 )
 
+        # Verify all transactions at once
+        transaction_ids = [row.fin_voucher_transaction.id for row in rows]
+        transaction_ids = [i for i in transaction_ids if i is not None]
+        if transaction_ids:
+            _, corrupted, broken = program.verify_chain(transaction_ids)
+            corrupted = set(corrupted) | set(broken)
+        else:
+            corrupted = set()
+
         log = current.log
         invalid_debit = "Voucher program billing - invalid debit: #%s"
         invalid_transaction = "Voucher program billing - corrupted transaction: #%s"
@@ -2965,7 +3224,7 @@ class fin_VoucherBilling:
                                     modified_on = dtable.modified_on,
                                     modified_by = dtable.modified_by,
                                     )
-            elif program.verify(transaction.id):
+            elif transaction.id not in corrupted:
                 # Valid transaction
                 debit_id = debit.id
                 if debit_id in totals:
@@ -67,6 +67,7 @@ class GISLocationModel(DataModel):
     """
 
     names = ("gis_location",
+             "gis_location_geometry",
              #"gis_location_error",
              "gis_location_id",
              "gis_country_id",
@@ -422,6 +423,25 @@ class GISLocationModel(DataModel):
                         # s3_comments(),
                         # *s3_meta_fields())
 
+        # ---------------------------------------------------------------------
+        # Geometry Pyramid
+        # - simplified GeoJSON of location geometries, one record per
+        #   location and simplification level (see GIS.GEOMETRY_LEVELS)
+        # - maintained by GIS.update_geometry_levels
+        #
+        tablename = "gis_location_geometry"
+        self.define_table(tablename,
+                          location_id(empty = False,
+                                      ondelete = "CASCADE",
+                                      ),
+                          Field("level", "integer"),
+                          Field("geojson", "text"),
+                          # modified_on of the location when the
+                          # geometry was simplified
+                          Field("source_modified", "datetime"),
+                          )
+        self.create_indexes(tablename, ("location_id", "level"))
+
         # Pass names back to global scope (s3.*)
         return {"gis_location_id": location_id,
                 "gis_country_id": country_id,
@@ -459,6 +479,10 @@ class GISLocationModel(DataModel):
             db = current.db
             db(db.gis_location.id == location_id).update(path = None)
 
+        if current.deployment_settings.get_gis_spatial_index():
+            # Refresh the spatial index for this location
+            SpatialIndex.invalidate([location_id])
+
         if not auth.override and \
            not auth.rollback:
             # Update the Path (async if-possible)
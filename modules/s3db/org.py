@@ -5715,6 +5715,29 @@ class org_OrganisationRepresent(S3Represent):
 
         return s3_str(name)
 
+    # -------------------------------------------------------------------------
+    def shared_key(self):
+        """
+            Namespace for the shared representation cache, see
+            S3Represent.shared_key
+        """
+
+        namespace = ("org_organisation",
+                     self.acronym,
+                     self.parent,
+                     self.language if self.translate else None,
+                     s3_str(self.default),
+                     )
+
+        tablenames = ["org_organisation"]
+        if self.parent:
+            tablenames.append("org_organisation_branch")
+        if self.translate:
+            tablenames.append("org_organisation_name")
+
+        # With parent, representations depend on other organisations too
+        return namespace, tablenames, not self.parent
+
     # -------------------------------------------------------------------------
     def dt_orderby(self, field, direction, orderby, left):
         """
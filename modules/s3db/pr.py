@@ -105,6 +105,10 @@ __all__ = (# PR Base Entities
            "pr_descendants",
            "pr_rebuild_path",
            "pr_role_rebuild_path",
+           "pr_update_closure",
+           "pr_init_closure",
+           "pr_rebuild_closure",
+           "pr_check_closure",
 
            # Helper for ImageLibrary
            "pr_image_modify",
@@ -143,12 +147,16 @@ OTHER_ROLE = 9
 # Compact JSON encoding
 SEPARATORS = (",", ":")
 
+# Databases with an initialized OU hierarchy closure {uri_hash}
+PR_CLOSURE_READY = set()
+
 # =============================================================================
 class PRPersonEntityModel(DataModel):
     """ Person Super-Entity """
 
     names = ("pr_pentity",
              "pr_affiliation",
+             "pr_ou_closure",
              "pr_person_user",
              "pr_role",
              "pr_role_types",
@@ -402,6 +410,7 @@ class PRPersonEntityModel(DataModel):
 
         # Resource configuration
         configure(tablename,
+                  onaccept = self.pr_role_onaccept,
                   onvalidation = self.pr_role_onvalidation,
                   )
 
@@ -455,6 +464,19 @@ class PRPersonEntityModel(DataModel):
                   ondelete = self.pr_affiliation_ondelete,
                   )
 
+        # ---------------------------------------------------------------------
+        # OU Hierarchy Closure
+        # - all (transitive) OU ancestors of each entity with their distance,
+        #   maintained by pr_update_closure (not for direct editing)
+        #
+        tablename = "pr_ou_closure"
+        define_table(tablename,
+                     Field("pe_id", "integer"),
+                     Field("ancestor_pe_id", "integer"),
+                     Field("depth", "integer"),
+                     )
+        self.create_indexes(tablename, "pe_id", "ancestor_pe_id")
+
         # ---------------------------------------------------------------------
         # Pass names back to global scope (s3.*)
         #
@@ -654,6 +676,21 @@ class PRPersonEntityModel(DataModel):
                 current.s3db.pr_role_rebuild_path(role_id, clear=True)
         return
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pr_role_onaccept(form):
+        """
+            Update the OU hierarchy closure for the affiliates of a role
+            (role type or parent entity may have changed)
+
+            Args:
+                form: the CRUD form
+        """
+
+        role_id = form.vars.get("id")
+        if role_id:
+            pr_role_update_closure(role_id)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def pr_pentity_onaccept(form):
@@ -9501,7 +9538,10 @@ def pr_define_role(pe_id,
             if str(role_type) != str(OU):
                 data["path"] = None
             s3db.pr_role_rebuild_path(duplicate.id, clear=True)
-        duplicate.update_record(**data)
+            duplicate.update_record(**data)
+            pr_role_update_closure(duplicate.id)
+        else:
+            duplicate.update_record(**data)
         record_id = duplicate.id
     else:
         record_id = rtable.insert(**data)
@@ -9740,42 +9780,16 @@ def pr_get_path(pe_id):
 def pr_get_ancestors(pe_id):
     """
         Find all ancestor entities of a person entity in the OU hierarchy
-        (performs a path lookup where paths are available, otherwise rebuilds
-        paths).
+        (performs a lookup in the closure table)
 
         Args:
             pe_id: the person entity ID
 
         Returns:
-            a list of PE IDs
+            a list of PE IDs (as strings), nearest ancestors first
     """
 
-    s3db = current.s3db
-    atable = s3db.pr_affiliation
-    rtable = s3db.pr_role
-    query = (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (atable.pe_id == pe_id) & \
-            (rtable.deleted != True) & \
-            (rtable.role_type == OU)
-
-    roles = current.db(query).select(rtable.id,
-                                     rtable.pe_id,
-                                     rtable.path,
-                                     rtable.role_type)
-    paths = []
-    append = paths.append
-    for role in roles:
-        path = S3MultiPath([role.pe_id])
-        if role.path is None:
-            ppath = pr_role_rebuild_path(role)
-        else:
-            ppath = S3MultiPath(role.path)
-        path.extend(role.pe_id, ppath, cut=pe_id)
-        append(path)
-    ancestors = S3MultiPath.all_nodes(paths)
-
-    return ancestors
+    return pr_ancestors([pe_id])[pe_id]
 
 # =============================================================================
 def pr_instance_type(pe_id):
@@ -9873,141 +9887,90 @@ def pr_realm_users(realm, roles=None, role_types=OU):
 def pr_ancestors(entities):
     """
         Find all ancestor entities of the given entities in the
-        OU hierarchy.
+        OU hierarchy (performs a lookup in the closure table)
 
         Args:
             entities: List of PE IDs
 
         Returns:
-            Storage of lists of PE IDs
+            Storage of lists of PE IDs (as strings), nearest ancestors first
     """
 
     if not entities:
         return Storage()
 
-    s3db = current.s3db
-    atable = s3db.pr_affiliation
-    rtable = s3db.pr_role
-    query = (atable.deleted != True) & \
-            (atable.role_id == rtable.id) & \
-            (atable.pe_id.belongs(entities)) & \
-            (rtable.deleted != True) & \
-            (rtable.role_type == OU)
-    rows = current.db(query).select(rtable.id,
-                                    rtable.pe_id,
-                                    rtable.path,
-                                    rtable.role_type,
-                                    atable.pe_id)
+    pr_init_closure()
+    ctable = current.s3db.pr_ou_closure
+    if len(entities) == 1:
+        query = (ctable.pe_id == list(entities)[0])
+    else:
+        query = (ctable.pe_id.belongs(set(entities)))
+    rows = current.db(query).select(ctable.pe_id,
+                                    ctable.ancestor_pe_id,
+                                    orderby = (ctable.depth,
+                                               ctable.ancestor_pe_id,
+                                               ),
+                                    )
+
     ancestors = Storage([(pe_id, []) for pe_id in entities])
-    r = rtable._tablename
-    a = atable._tablename
     for row in rows:
-        pe_id = row[a].pe_id
-        paths = ancestors[pe_id]
-        role = row[r]
-        path = S3MultiPath([role.pe_id])
-        if role.path is None:
-            ppath = pr_role_rebuild_path(role)
-        else:
-            ppath = S3MultiPath(role.path)
-        path.extend(role.pe_id, ppath, cut=pe_id)
-        paths.append(path)
-    for pe_id in ancestors:
-        ancestors[pe_id] = S3MultiPath.all_nodes(ancestors[pe_id])
+        ancestors[row.pe_id].append(str(row.ancestor_pe_id))
     return ancestors
 
 # =============================================================================
-def pr_descendants(pe_ids, skip=None, root=True):
+def pr_descendants(pe_ids):
     """
-        Find descendant entities of a person entity in the OU hierarchy
-        (performs a real search, not a path lookup), grouped by root PE
+        Find descendant entities of person entities in the OU hierarchy
+        (performs a lookup in the closure table), grouped by root PE
 
         Args:
             pe_ids: set/list of pe_ids
-            skip: list of person entity IDs to skip during
-                  descending (internal)
-            root: this is the top-node (internal)
 
         Returns:
-            a dict of lists of descendant PEs per root PE
+            a dict of lists of descendant PEs per root PE (excluding
+            pr_person entities)
     """
 
-    if skip is None:
-        skip = set()
-
-    # We still need to support Py 2.6
-    #pe_ids = {i for i in pe_ids if i not in skip}
-    pe_ids = set(i for i in pe_ids if i not in skip)
+    pe_ids = set(pe_ids)
     if not pe_ids:
         return {}
 
+    pr_init_closure()
     s3db = current.s3db
     etable = s3db.pr_pentity
-    rtable = s3db.pr_role
-    atable = s3db.pr_affiliation
-
-    q = (rtable.pe_id.belongs(pe_ids)) \
-        if len(pe_ids) > 1 else (rtable.pe_id == list(pe_ids)[0])
-
-    query = (q & (rtable.role_type == OU) & (rtable.deleted != True)) & \
-            ((atable.role_id == rtable.id) & (atable.deleted != True)) & \
-            (etable.pe_id == atable.pe_id)
+    ctable = s3db.pr_ou_closure
 
-    rows = current.db(query).select(rtable.pe_id,
-                                    atable.pe_id,
-                                    etable.instance_type)
-    r = rtable._tablename
-    e = etable._tablename
-    a = atable._tablename
+    if len(pe_ids) == 1:
+        query = (ctable.ancestor_pe_id == list(pe_ids)[0])
+    else:
+        query = (ctable.ancestor_pe_id.belongs(pe_ids))
+    query &= (etable.pe_id == ctable.pe_id) & \
+             (etable.instance_type != "pr_person")
 
-    nodes = set()
-    ogetattr = object.__getattribute__
+    rows = current.db(query).select(ctable.ancestor_pe_id,
+                                    ctable.pe_id,
+                                    orderby = ctable.depth,
+                                    )
 
     result = {}
-
-    skip.update(pe_ids)
     for row in rows:
-
-        parent = ogetattr(ogetattr(row, r), "pe_id")
-        child = ogetattr(ogetattr(row, a), "pe_id")
-        instance_type = ogetattr(ogetattr(row, e), "instance_type")
-        if instance_type != "pr_person":
-            if parent not in result:
-                result[parent] = []
-            result[parent].append(child)
-        if child not in skip:
-            nodes.add(child)
-
-    if nodes:
-        descendants = pr_descendants(nodes, skip=skip, root=False)
-        for child, nodes in descendants.items():
-            for parent, children in result.items():
-                if child in children:
-                    for node in nodes:
-                        if node not in children:
-                            children.append(node)
-    if root:
-        for child, nodes in result.items():
-            for parent, children in result.items():
-                if child in children:
-                    for node in nodes:
-                        if node not in children and node != parent:
-                            children.append(node)
+        closure = row.pr_ou_closure
+        parent = closure.ancestor_pe_id
+        if parent not in result:
+            result[parent] = []
+        result[parent].append(closure.pe_id)
 
     return result
 
 # =============================================================================
-def pr_get_descendants(pe_ids, entity_types=None, skip=None, ids=True):
+def pr_get_descendants(pe_ids, entity_types=None):
     """
         Find descendant entities of a person entity in the OU hierarchy
-        (performs a real search, not a path lookup).
+        (performs a lookup in the closure table).
 
         Args:
             pe_ids: person entity ID or list of PE IDs
             entity_types: optional filter to a specific entity_type
-            ids: whether to return a list of pe ids or nodes (internal)
-            skip: list of person entity IDs to skip during
-                  descending (internal)
 
         Returns:
             a list of PE-IDs
@@ -10015,65 +9978,30 @@ def pr_get_descendants(pe_ids, entity_types=None, skip=None, ids=True):
 
     if not pe_ids:
         return []
-    if type(pe_ids) is not set:
-        pe_ids = set(pe_ids) \
-                 if isinstance(pe_ids, (list, tuple)) else {pe_ids}
+    if not isinstance(pe_ids, (list, tuple, set)):
+        pe_ids = [pe_ids]
+    pe_ids = set(pe_ids)
 
-    db = current.db
+    pr_init_closure()
     s3db = current.s3db
-    etable = s3db.pr_pentity
-    rtable = db.pr_role
-    atable = db.pr_affiliation
-
-    if skip is None:
-        skip = set()
-    skip.update(pe_ids)
+    ctable = s3db.pr_ou_closure
 
-    if len(pe_ids) > 1:
-        q = (rtable.pe_id.belongs(pe_ids))
+    if len(pe_ids) == 1:
+        query = (ctable.ancestor_pe_id == list(pe_ids)[0])
     else:
-        q = (rtable.pe_id == list(pe_ids)[0])
-
-    query = ((rtable.deleted != True) & q & (rtable.role_type == OU)) & \
-            ((atable.deleted != True) & (atable.role_id == rtable.id))
+        query = (ctable.ancestor_pe_id.belongs(pe_ids))
 
     if entity_types is not None:
-        query &= (etable.pe_id == atable.pe_id)
-        rows = db(query).select(etable.pe_id, etable.instance_type)
-        # We still need to support Py 2.6
-        #result = {(r.pe_id, r.instance_type) for r in rows}
-        result = set((r.pe_id, r.instance_type) for r in rows)
-        # We still need to support Py 2.6
-        #node_ids = {i for i, t in result if i not in skip}
-        node_ids = set(i for i, t in result if i not in skip)
-    else:
-        rows = db(query).select(atable.pe_id)
-        # We still need to support Py 2.6
-        #result = {r.pe_id for r in rows}
-        result = set(r.pe_id for r in rows)
-        # We still need to support Py 2.6
-        #node_ids = {i for i in result if i not in skip}
-        node_ids = set(i for i in result if i not in skip)
-    # Recurse
-    if node_ids:
-        descendants = pr_get_descendants(node_ids,
-                                         skip = skip,
-                                         entity_types = entity_types,
-                                         ids = False)
-        result.update(descendants)
-
-    if ids:
-        if entity_types is not None:
-            if type(entity_types) is not set:
-                if not isinstance(entity_types, (tuple, list)):
-                    entity_types = {entity_types}
-                else:
-                    entity_types = set(entity_types)
-            return [n[0] for n in result if n[1] in entity_types]
+        etable = s3db.pr_pentity
+        if isinstance(entity_types, (tuple, list, set)):
+            query &= (etable.instance_type.belongs(set(entity_types)))
         else:
-            return list(result)
-    else:
-        return result
+            query &= (etable.instance_type == entity_types)
+        query &= (etable.pe_id == ctable.pe_id)
+
+    rows = current.db(query).select(ctable.pe_id, distinct=True)
+
+    return [row.pe_id for row in rows]
 
 # =============================================================================
 # Internal Path Tools
@@ -10105,6 +10033,9 @@ def pr_rebuild_path(pe_id, clear=False):
         if role.path is None:
             pr_role_rebuild_path(role, clear=clear)
 
+    # Update the closure for this entity and its descendants
+    pr_update_closure(pe_id)
+
 # =============================================================================
 def pr_role_rebuild_path(role_id, skip=None, clear=False):
     """
@@ -10174,6 +10105,252 @@ def pr_role_rebuild_path(role_id, skip=None, clear=False):
 
     return path
 
+# =============================================================================
+# OU Hierarchy Closure
+# =============================================================================
+def pr_update_closure(pe_ids):
+    """
+        Update the OU hierarchy closure for person entities whose OU
+        affiliations have changed, and for all their descendants
+
+        Args:
+            pe_ids: the person entity ID, or a list of PE IDs
+    """
+
+    if not pe_ids:
+        return
+    if not isinstance(pe_ids, (list, tuple, set)):
+        pe_ids = [pe_ids]
+
+    pr_init_closure()
+    db = current.db
+    ctable = current.s3db.pr_ou_closure
+
+    # The descendants of the updated entities are affected too, but
+    # their set doesn't change (only the ancestors do)
+    nodes = set(pe_ids)
+    query = (ctable.ancestor_pe_id.belongs(nodes))
+    rows = db(query).select(ctable.pe_id, distinct=True)
+    nodes.update(row.pe_id for row in rows)
+
+    # Ancestors of all parents outside the affected set are up-to-date
+    parents = pr_ou_parents(nodes)
+    outer = set()
+    for items in parents.values():
+        outer.update(p for p in items if p not in nodes)
+    known = dict((p, {}) for p in outer)
+    if outer:
+        query = (ctable.pe_id.belongs(outer))
+        rows = db(query).select(ctable.pe_id,
+                                ctable.ancestor_pe_id,
+                                ctable.depth,
+                                )
+        for row in rows:
+            known[row.pe_id][row.ancestor_pe_id] = row.depth
+
+    closure = pr_compute_closure(nodes, parents, known)
+
+    # Replace the closure of all affected entities
+    db(ctable.pe_id.belongs(nodes)).delete()
+    pr_store_closure(closure)
+
+# =============================================================================
+def pr_rebuild_closure():
+    """
+        Rebuild the OU hierarchy closure from scratch (e.g. to repair
+        inconsistencies)
+
+        Returns:
+            the number of closure entries
+    """
+
+    db = current.db
+    ctable = current.s3db.pr_ou_closure
+
+    parents = pr_ou_parents()
+    closure = pr_compute_closure(set(parents), parents, {})
+
+    db(ctable.id > 0).delete()
+    return pr_store_closure(closure)
+
+# =============================================================================
+def pr_init_closure():
+    """
+        Build the OU hierarchy closure if it is empty, i.e. on first use
+        after upgrading an existing database; checked once per process
+        before any lookup or update of the closure
+    """
+
+    db = current.db
+
+    key = db._uri_hash
+    if key in PR_CLOSURE_READY:
+        return
+
+    ctable = current.s3db.pr_ou_closure
+    if not db(ctable.id > 0).select(ctable.id, limitby=(0, 1)).first():
+
+        if current.deployment_settings.get_database_type() == "postgres":
+            # Prevent concurrent builds (lock is released at commit)
+            db.executesql("LOCK TABLE %s IN EXCLUSIVE MODE;" % ctable._tablename)
+            empty = not db(ctable.id > 0).select(ctable.id, limitby=(0, 1)).first()
+        else:
+            empty = True
+
+        if empty:
+            current.log.info("Building OU hierarchy closure")
+            pr_rebuild_closure()
+
+    PR_CLOSURE_READY.add(key)
+
+# =============================================================================
+def pr_check_closure():
+    """
+        Verify the OU hierarchy closure against the current affiliations
+
+        Returns:
+            a list of tuples (pe_id, ancestor_pe_id, expected, stored) for
+            all entries where the stored depth differs from the expected
+            depth (None if missing), empty if the closure is consistent
+    """
+
+    ctable = current.s3db.pr_ou_closure
+
+    parents = pr_ou_parents()
+    expected = pr_compute_closure(set(parents), parents, {})
+
+    stored = {}
+    rows = current.db(ctable.id > 0).select(ctable.pe_id,
+                                            ctable.ancestor_pe_id,
+                                            ctable.depth,
+                                            )
+    for row in rows:
+        stored[(row.pe_id, row.ancestor_pe_id)] = row.depth
+
+    errors = []
+    for pe_id, ancestors in expected.items():
+        for ancestor, depth in ancestors.items():
+            actual = stored.pop((pe_id, ancestor), None)
+            if actual != depth:
+                errors.append((pe_id, ancestor, depth, actual))
+    for (pe_id, ancestor), actual in stored.items():
+        errors.append((pe_id, ancestor, None, actual))
+
+    return errors
+
+# -----------------------------------------------------------------------------
+def pr_role_update_closure(role_id):
+    """
+        Update the OU hierarchy closure for all affiliates of a role
+
+        Args:
+            role_id: the role ID
+    """
+
+    atable = current.s3db.pr_affiliation
+    query = (atable.role_id == role_id) & \
+            (atable.deleted != True)
+    rows = current.db(query).select(atable.pe_id)
+    pr_update_closure(set(row.pe_id for row in rows))
+
+# -----------------------------------------------------------------------------
+def pr_ou_parents(pe_ids=None):
+    """
+        Look up the immediate OU parents of person entities
+
+        Args:
+            pe_ids: the person entity IDs, None for all entities
+
+        Returns:
+            a dict {pe_id: set of parent PE IDs}
+    """
+
+    s3db = current.s3db
+    atable = s3db.pr_affiliation
+    rtable = s3db.pr_role
+
+    query = (atable.deleted != True) & \
+            (atable.role_id == rtable.id) & \
+            (rtable.deleted != True) & \
+            (rtable.role_type == OU)
+    if pe_ids is not None:
+        query &= (atable.pe_id.belongs(pe_ids))
+    rows = current.db(query).select(atable.pe_id, rtable.pe_id)
+
+    parents = dict((pe_id, set()) for pe_id in pe_ids or ())
+    for row in rows:
+        pe_id = row.pr_affiliation.pe_id
+        if pe_id in parents:
+            parents[pe_id].add(row.pr_role.pe_id)
+        else:
+            parents[pe_id] = {row.pr_role.pe_id}
+    return parents
+
+# -----------------------------------------------------------------------------
+def pr_compute_closure(nodes, parents, known):
+    """
+        Compute the ancestors (with shortest distance) of person entities
+
+        Args:
+            nodes: the person entity IDs to compute the closure for
+            parents: the immediate OU parents of the nodes,
+                     as dict {pe_id: set of parent PE IDs}
+            known: the ancestors of all parents which are not in nodes,
+                   as dict {pe_id: {ancestor_pe_id: depth}}
+
+        Returns:
+            a dict {pe_id: {ancestor_pe_id: depth}}
+    """
+
+    closure = dict((node, {}) for node in nodes)
+
+    # Relax until stable (converges after as many passes as the
+    # deepest chain within nodes, also if the hierarchy has loops)
+    changed = True
+    while changed:
+        changed = False
+        for node in nodes:
+            ancestors = closure[node]
+            for parent in parents.get(node, ()):
+                if parent in closure:
+                    inherited = closure[parent]
+                else:
+                    inherited = known.get(parent, {})
+                candidates = [(parent, 0)]
+                candidates.extend(inherited.items())
+                for ancestor, depth in candidates:
+                    if ancestor == node:
+                        continue
+                    depth += 1
+                    if ancestors.get(ancestor, depth + 1) > depth:
+                        ancestors[ancestor] = depth
+                        changed = True
+
+    return closure
+
+# -----------------------------------------------------------------------------
+def pr_store_closure(closure):
+    """
+        Write closure entries to the database
+
+        Args:
+            closure: the closure, as dict {pe_id: {ancestor_pe_id: depth}}
+
+        Returns:
+            the number of entries written
+    """
+
+    items = [{"pe_id": pe_id,
+              "ancestor_pe_id": ancestor,
+              "depth": depth,
+              }
+             for pe_id, ancestors in closure.items()
+             for ancestor, depth in ancestors.items()
+             ]
+    if items:
+        current.s3db.pr_ou_closure.bulk_insert(items)
+    return len(items)
+
 # -----------------------------------------------------------------------------
 def pr_image_modify(image_file,
                     image_name,
@@ -28,6 +28,8 @@
 __all__ = ("S3HierarchyModel",
            "S3DashboardModel",
            "S3ImportJobModel",
+           "S3MaintenanceModel",
+           "S3ProfileModel",
            "S3DynamicTablesModel",
            "s3_table_rheader",
            "s3_scheduler_rheader",
@@ -43,6 +45,7 @@ class S3HierarchyModel(DataModel):
     """ Model for stored object hierarchies """
 
     names = ("s3_hierarchy",
+             "s3_hierarchy_node",
              )
 
     def model(self):
@@ -59,6 +62,26 @@ class S3HierarchyModel(DataModel):
                           Field("hierarchy", "json"),
                           *S3MetaFields.timestamps())
 
+        # ---------------------------------------------------------------------
+        # Stored Object Hierarchy Nodes
+        # - one row per node, so that the hierarchy can be updated
+        #   incrementally and loaded per subtree
+        #
+        tablename = "s3_hierarchy_node"
+        self.define_table(tablename,
+                          Field("tablename", length=64),
+                          Field("node_id", "integer"),
+                          Field("parent", "integer"),
+                          Field("category", "json"),
+                          # The root node of the subtree
+                          Field("root", "integer"),
+                          )
+        self.create_indexes(tablename,
+                            ("tablename", "node_id"),
+                            ("tablename", "parent"),
+                            ("tablename", "root"),
+                            )
+
         # ---------------------------------------------------------------------
         # Return global names to s3.*
         #
@@ -206,6 +229,64 @@ class S3ImportJobModel(DataModel):
         # ---------------------------------------------------------------------
         return None
 
+# =============================================================================
+class S3MaintenanceModel(DataModel):
+    """ Execution log of maintenance jobs """
+
+    names = ("s3_maintenance_log",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Maintenance Job Log
+        # - one row per job execution, see core.MaintenanceJobs
+        #
+        tablename = "s3_maintenance_log"
+        self.define_table(tablename,
+                          Field("period", length=16),
+                          Field("job", length=64),
+                          s3_datetime("start_time", default="now"),
+                          # Execution time in seconds
+                          Field("duration", "double"),
+                          Field("status", length=16),
+                          Field("result", "text"),
+                          )
+
+        # ---------------------------------------------------------------------
+        return None
+
+# =============================================================================
+class S3ProfileModel(DataModel):
+    """ Aggregated request profiling timings """
+
+    names = ("s3_profile_log",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Profile Log
+        # - percentiles of the timings recorded by a process within an
+        #   interval, see s3profiler.S3Profiler
+        #
+        tablename = "s3_profile_log"
+        self.define_table(tablename,
+                          s3_datetime("date", default="now"),
+                          Field("category", length=64),
+                          Field("name", length=128),
+                          # Number of samples
+                          Field("samples", "integer"),
+                          # Percentiles and maximum in milliseconds
+                          Field("p50", "double"),
+                          Field("p90", "double"),
+                          Field("p99", "double"),
+                          Field("maximum", "double"),
+                          )
+
+        # ---------------------------------------------------------------------
+        return None
+
 # =============================================================================
 class S3DynamicTablesModel(DataModel):
     """ Model for dynamic tables """
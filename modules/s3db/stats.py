@@ -1016,16 +1016,17 @@ class StatsDemographicModel(DataModel):
 
         # Now that the time aggregate types have been set up correctly,
         # fire off requests for the location aggregates to be calculated
-        run_async = current.s3task.run_async
+        jobs = []
         for (param_id, loc_dict) in parents_data.items():
             total_id = param_total_dict[param_id]
             for (loc_id, (changed_periods, loc_level)) in loc_dict.items():
                 for (start_date, end_date) in changed_periods:
                     s, e = str(start_date), str(end_date)
-                    run_async("stats_demographic_update_aggregate_location",
-                              args = [loc_level, loc_id, param_id, total_id, s, e],
-                              timeout = 1800 # 30m
-                              )
+                    jobs.append(([loc_level, loc_id, param_id, total_id, s, e], None))
+        current.s3task.run_async_many("stats_demographic_update_aggregate_location",
+                                      jobs,
+                                      timeout = 1800 # 30m
+                                      )
 
     # -------------------------------------------------------------------------
     @staticmethod
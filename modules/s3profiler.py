@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+""" S3 Request Profiler
+
+    @copyright: (c) 2021 Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import math
+import threading
+import time
+
+from collections import deque
+from functools import wraps
+from types import FunctionType
+
+from gluon import current
+
+# =============================================================================
+class S3Profiler(object):
+    """
+        Per-request profiler for the fixed overhead of requests (model
+        files, DataModel instantiation, settings getters, template
+        customisation hooks and s3_set_roles), instantiated in
+        models/000_1st_run.py as current.profiler
+
+        Enabled by settings.base.request_profile; the wall times are
+        collected per process, and their percentiles regularly written
+        to the s3_profile_log table (see admin/profile for a JSON view).
+
+        Timings are recorded under a category and a name, e.g.:
+
+            with current.profiler.measure("auth", "s3_set_roles"):
+                ...
+    """
+
+    # Process-wide samples {folder: {(category, name): deque of durations}}
+    samples = {}
+
+    # Last flush of the samples {folder: timestamp}
+    flushed = {}
+
+    lock = threading.Lock()
+
+    # Maximum number of samples per item between flushes
+    SAMPLES = 1000
+
+    # Minimum interval between flushes (seconds)
+    INTERVAL = 300
+
+    # Minimum time per request for individual settings getters
+    # to be recorded (seconds)
+    GETTER_THRESHOLD = 0.0005
+
+    # Whether the settings getters have been instrumented in this process
+    getters_wrapped = False
+
+    def __init__(self):
+
+        self.last = time.perf_counter()
+
+        # Whether profiling is enabled, None until configured
+        self.enabled = None
+
+        # Timings recorded before commit [(category, name, duration)]
+        self.timings = []
+        self.committed = False
+
+        # Time spent in settings getters {name: duration}
+        self.getters = {}
+        self.getter_depth = 0
+
+    # -------------------------------------------------------------------------
+    def configure(self, settings):
+        """
+            Determine whether profiling is enabled, and instrument the
+            settings getters if so; to be called after the template config
+            has been imported (models/00_db.py)
+
+            Args:
+                settings: the S3Config instance
+        """
+
+        enabled = self.enabled = bool(settings.get_base_request_profile())
+
+        if enabled and not S3Profiler.getters_wrapped:
+            with self.lock:
+                if not S3Profiler.getters_wrapped:
+                    self.wrap_getters(settings.__class__)
+                    S3Profiler.getters_wrapped = True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def wrap_getters(config):
+        """
+            Instrument all getters of the settings class to record their
+            execution times
+
+            Args:
+                config: the settings class (S3Config)
+        """
+
+        def instrument(name, getter):
+
+            @wraps(getter)
+            def wrapper(*args, **kwargs):
+                profiler = getattr(current, "profiler", None)
+                if not profiler or not profiler.enabled:
+                    return getter(*args, **kwargs)
+
+                profiler.getter_depth += 1
+                start = time.perf_counter()
+                try:
+                    return getter(*args, **kwargs)
+                finally:
+                    profiler.getter_depth -= 1
+                    if not profiler.getter_depth:
+                        # Record only outermost getters
+                        getters = profiler.getters
+                        getters[name] = getters.get(name, 0) + \
+                                        time.perf_counter() - start
+            return wrapper
+
+        for name, getter in list(vars(config).items()):
+            if name.startswith("get_") and isinstance(getter, FunctionType):
+                setattr(config, name, instrument(name, getter))
+
+    # -------------------------------------------------------------------------
+    def mark(self, name):
+        """
+            Record the time since the previous mark, to be called at the
+            end of each model file
+
+            Args:
+                name: the name of the model file
+        """
+
+        now = time.perf_counter()
+        self.add("file", name, now - self.last)
+        self.last = now
+
+    # -------------------------------------------------------------------------
+    def measure(self, category, name):
+        """
+            Context manager to measure the execution time of a block
+
+            Args:
+                category: the category
+                name: the name
+        """
+
+        return _Measurement(self, category, name)
+
+    # -------------------------------------------------------------------------
+    def wrap(self, category, name, function):
+        """
+            Wrap a function to measure its execution time
+
+            Args:
+                category: the category
+                name: the name
+                function: the function
+
+            Returns:
+                the wrapped function
+        """
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.measure(category, name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    # -------------------------------------------------------------------------
+    def add(self, category, name, duration):
+        """
+            Record a timing
+
+            Args:
+                category: the category
+                name: the name
+                duration: the duration (seconds)
+        """
+
+        if self.enabled is False:
+            return
+
+        if self.committed:
+            self.store([(category, name, duration)])
+        else:
+            self.timings.append((category, name, duration))
+
+    # -------------------------------------------------------------------------
+    def commit(self):
+        """
+            Store the timings recorded so far (the startup phase of the
+            request), and store all further timings immediately; to be
+            called at the end of the models (models/zz_last.py)
+        """
+
+        if self.committed:
+            return
+        self.committed = True
+
+        timings = self.timings
+        self.timings = []
+
+        if not self.enabled:
+            return
+
+        # Time spent in settings getters during startup
+        getters = self.getters
+        self.getters = {}
+        if getters:
+            timings.append(("settings", "(all getters)", sum(getters.values())))
+            threshold = self.GETTER_THRESHOLD
+            for name, duration in getters.items():
+                if duration >= threshold:
+                    timings.append(("settings", name, duration))
+
+        self.store(timings)
+
+    # -------------------------------------------------------------------------
+    def store(self, timings):
+        """
+            Add timings to the process-wide samples
+
+            Args:
+                timings: list of tuples (category, name, duration)
+        """
+
+        if not timings:
+            return
+
+        key = current.request.folder
+        size = self.SAMPLES
+
+        with self.lock:
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = self.samples[key] = {}
+                self.flushed[key] = time.time()
+            for category, name, duration in timings:
+                item = (category, name)
+                if item not in samples:
+                    samples[item] = deque(maxlen=size)
+                samples[item].append(duration)
+
+    # -------------------------------------------------------------------------
+    def flush(self, force=False):
+        """
+            Write the percentiles of the process-wide samples to the
+            log table, if the flush interval has elapsed
+
+            Args:
+                force: flush regardless of the interval
+
+            Returns:
+                the number of items written
+
+            Note:
+                The log entries are committed immediately, so that they are
+                not lost when the request transaction is rolled back later;
+                if writing fails, the samples are kept for the next flush
+        """
+
+        if not self.enabled:
+            return 0
+
+        key = current.request.folder
+        now = time.time()
+
+        with self.lock:
+            samples = self.samples.get(key)
+            if not samples:
+                return 0
+            if not force and now - self.flushed.get(key, now) < self.INTERVAL:
+                return 0
+            self.samples[key] = {}
+            self.flushed[key] = now
+
+        table = current.s3db.s3_profile_log
+        rows = []
+        for (category, name), durations in samples.items():
+            durations = sorted(durations)
+            rows.append({"category": category,
+                         "name": name,
+                         "samples": len(durations),
+                         "p50": self.percentile(durations, 50) * 1000,
+                         "p90": self.percentile(durations, 90) * 1000,
+                         "p99": self.percentile(durations, 99) * 1000,
+                         "maximum": durations[-1] * 1000,
+                         })
+
+        db = current.db
+        try:
+            table.bulk_insert(rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.restore(key, samples)
+            current.log.error("Could not write profile log: %s" % e)
+            return 0
+
+        return len(rows)
+
+    # -------------------------------------------------------------------------
+    def restore(self, key, samples):
+        """
+            Return samples which could not be written to the process-wide
+            samples, merging them with those recorded in the meantime
+
+            Args:
+                key: the application folder
+                samples: the samples {(category, name): deque of durations}
+        """
+
+        size = self.SAMPLES
+
+        with self.lock:
+            current_samples = self.samples.get(key)
+            if current_samples is None:
+                current_samples = self.samples[key] = {}
+            for item, durations in samples.items():
+                recorded = current_samples.get(item)
+                merged = deque(durations, maxlen=size)
+                if recorded:
+                    merged.extend(recorded)
+                current_samples[item] = merged
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def percentile(values, p):
+        """
+            Get a percentile (nearest-rank method)
+
+            Args:
+                values: the values, sorted
+                p: the percentile (0..100)
+
+            Returns:
+                the value
+        """
+
+        if not values:
+            return None
+
+        rank = int(math.ceil(p / 100.0 * len(values))) - 1
+        return values[max(0, min(rank, len(values) - 1))]
+
+# =============================================================================
+class _Measurement(object):
+    """ Context manager for S3Profiler.measure """
+
+    def __init__(self, profiler, category, name):
+
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+
+        self.profiler.add(self.category,
+                          self.name,
+                          time.perf_counter() - self.start,
+                          )
+        return False
+
+# END =========================================================================
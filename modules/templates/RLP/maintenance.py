@@ -34,6 +34,10 @@ class Daily():
         table = s3db.sync_log
         db(table.timestmp < week_past).delete()
 
+        # Cleanup Request Profile logs
+        table = s3db.s3_profile_log
+        db(table.date < week_past).delete()
+
         # Cleanup Sessions
         osjoin = os.path.join
         osstat = os.stat
@@ -57,6 +61,14 @@ class Daily():
         # Cleanup unverified accounts
         self.cleanup_unverified_accounts()
 
+        # Cleanup stored realm sets
+        from core import S3Permission
+        S3Permission.cleanup_realm_sets(days=7)
+
+        # Rebuild stored hierarchies which are still dirty
+        from core import S3Hierarchy
+        S3Hierarchy.rebuild()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def cleanup_unverified_accounts():
@@ -218,6 +218,13 @@ def config(settings):
     # Custom settings
     settings.custom.test_station_registration = True
     settings.custom.test_station_cleanup = True
+    # Queue test results for batch transmission to CWA
+    # - requires the cwa_send_results task to be scheduled
+    settings.custom.cwa_queue = False
+    # Concurrent requests to the DCC server, and maximum number of
+    # DCCs to upload per issuer and poll cycle (None = default)
+    settings.custom.dcc_poll_workers = None
+    settings.custom.dcc_issuer_rate_limit = None
 
     # -------------------------------------------------------------------------
     def poll_dcc():
@@ -230,6 +237,17 @@ def config(settings):
 
     settings.tasks.poll_dcc = poll_dcc
 
+    # -------------------------------------------------------------------------
+    def cwa_send_results():
+        """
+            Scheduler task to send queued test results to CWA
+        """
+
+        from .cwa import CWAResultQueue
+        return CWAResultQueue().process()
+
+    settings.tasks.cwa_send_results = cwa_send_results
+
     # -------------------------------------------------------------------------
     # Realm Rules
     #
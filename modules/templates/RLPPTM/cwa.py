@@ -293,10 +293,15 @@ class TestResultRegistration(CRUDMethod):
                         cwa_report.register_consent(processing_type,
                                                     formvars.get("consent"),
                                                     )
-                    # Send to CWA
-                    success = cwa_report.send()
+                    # Send to CWA (or queue for batch transmission)
+                    if current.deployment_settings.get_custom("cwa_queue"):
+                        success = cwa_report.enqueue()
+                        success_message = T("Result queued for reporting to %(system)s")
+                    else:
+                        success = cwa_report.send()
+                        success_message = T("Result reported to %(system)s")
                     if success:
-                        response.information = T("Result reported to %(system)s") % CWA
+                        response.information = success_message % CWA
                         retry = False
                     else:
                         response.error = T("Report to %(system)s failed") % CWA
@@ -878,13 +883,13 @@ class CWAReport:
         consent.assert_consent(dhash, processing_type, response)
 
     # -------------------------------------------------------------------------
-    def send(self):
+    def testresult(self):
         """
-            Send the CWA Report to the server;
-            see also: https://github.com/corona-warn-app/cwa-quicktest-onboarding/blob/master/api/quicktest-openapi.json
+            The QuickTestResult JSON structure for this report
 
             Returns:
-                True|False whether successful
+                the QuickTestResult as dict, or None if the result
+                cannot be reported
         """
 
         # Encode the result
@@ -892,48 +897,56 @@ class CWAReport:
         result = results.get(self.result)
         if not result:
             current.log.error("CWAReport: invalid test result %s" % self.result)
-            return False
+            return None
 
-        # Build the QuickTestResult JSON structure
         data = self.data
-        testresult = {"id": data.get("hash"),
-                      "sc": data.get("timestamp"),
-                      "result": result,
-                      }
-
-        # The CWA server URL
-        settings = current.deployment_settings
-        server_url = settings.get_custom("cwa_server_url")
-        if not server_url:
-            raise RuntimeError("No CWA server URL configured")
+        return {"id": data.get("hash"),
+                "sc": data.get("timestamp"),
+                "result": result,
+                }
 
-        # The client credentials to access the server
-        folder = current.request.folder
-        cert = settings.get_custom("cwa_client_certificate")
-        key = settings.get_custom("cwa_certificate_key")
-        if not cert or not key:
-            raise RuntimeError("No CWA client credentials configured")
-        cert = "%s/%s" % (folder, cert)
-        key = "%s/%s" % (folder, key)
+    # -------------------------------------------------------------------------
+    def lab_id(self):
+        """
+            The LabID to send with this report (required for DCC)
 
-        # The certificate chain to verify the server identity
-        verify = settings.get_custom("cwa_server_ca")
-        if verify:
-            # Use the specified CA Certificate to verify server identity
-            verify = "%s/%s" % (current.request.folder, verify)
-        else:
-            # Use python-certifi (=> make sure the latest version is installed)
-            verify = True
+            Returns:
+                the LabID, or None if not required
+        """
 
-        # Build the result_list
-        result_list = {"testResults": [testresult]}
         if self.dcc:
             # Look up the LabID
             lab_id = DCC.get_issuer_id(self.site_id)
             if not lab_id:
                 raise RuntimeError("Point-of-Care ID for test station not found")
-            else:
-                result_list["labId"] = lab_id
+        else:
+            lab_id = None
+
+        return lab_id
+
+    # -------------------------------------------------------------------------
+    def send(self):
+        """
+            Send the CWA Report to the server;
+            see also: https://github.com/corona-warn-app/cwa-quicktest-onboarding/blob/master/api/quicktest-openapi.json
+
+            Returns:
+                True|False whether successful
+        """
+
+        # Build the QuickTestResult JSON structure
+        testresult = self.testresult()
+        if not testresult:
+            return False
+
+        # The CWA server URL and client credentials
+        server_url, cert, key, verify = self.get_credentials()
+
+        # Build the result_list
+        result_list = {"testResults": [testresult]}
+        lab_id = self.lab_id()
+        if lab_id:
+            result_list["labId"] = lab_id
 
         # POST to server
         try:
@@ -958,6 +971,319 @@ class CWAReport:
         # Success
         return True
 
+    # -------------------------------------------------------------------------
+    def enqueue(self):
+        """
+            Add the CWA Report to the transmission queue, to be sent to
+            the server by the cwa_send_results scheduler task (CWAResultQueue)
+
+            Returns:
+                True|False whether successful
+        """
+
+        testresult = self.testresult()
+        if not testresult:
+            return False
+
+        table = current.s3db.disease_result_transmission
+        record_id = table.insert(result_id = self.result_id,
+                                 target = "CWA",
+                                 sender_id = self.lab_id(),
+                                 payload = testresult,
+                                 status = "PENDING",
+                                 next_attempt = datetime.datetime.utcnow(),
+                                 )
+        return bool(record_id)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_credentials():
+        """
+            Get the URL and credentials for access to the CWA server
+
+            Returns:
+                tuple (server_url, cert, key, verify)
+                    - server_url = the URL to send results to
+                    - cert       = absolute pathname of the SSL client
+                                   certificate
+                    - key        = absolute pathname of the key for the
+                                   client certificate
+                    - verify     = absolute pathname to the CA certificate
+                                   chain for the server certificate, or True
+                                   to use python-certifi
+        """
+
+        settings = current.deployment_settings
+        folder = current.request.folder
+
+        # The CWA server URL
+        server_url = settings.get_custom("cwa_server_url")
+        if not server_url:
+            raise RuntimeError("No CWA server URL configured")
+
+        # The client credentials to access the server
+        cert = settings.get_custom("cwa_client_certificate")
+        key = settings.get_custom("cwa_certificate_key")
+        if not cert or not key:
+            raise RuntimeError("No CWA client credentials configured")
+        cert = "%s/%s" % (folder, cert)
+        key = "%s/%s" % (folder, key)
+
+        # The certificate chain to verify the server identity
+        verify = settings.get_custom("cwa_server_ca")
+        if verify:
+            # Use the specified CA Certificate to verify server identity
+            verify = "%s/%s" % (folder, verify)
+        else:
+            # Use python-certifi (=> make sure the latest version is installed)
+            verify = True
+
+        return server_url, cert, key, verify
+
+# =============================================================================
+class CWAResultQueue:
+    """
+        Queue of test results to transmit to the CWA server, sent in
+        batches (multi-result QuickTestResultLists) over a keep-alive
+        session; to be processed by a scheduler task
+    """
+
+    # Maximum number of results per QuickTestResultList
+    BATCH_SIZE = 100
+
+    # Maximum number of results to process per run
+    LIMIT = 5000
+
+    # Backoff after failed attempts (seconds), doubled with every attempt
+    BACKOFF = 60
+    MAX_BACKOFF = 21600
+
+    # Maximum number of attempts before a result is marked as failed
+    MAX_ATTEMPTS = 12
+
+    # Time after which claimed results become due again if the run
+    # which claimed them did not complete (seconds)
+    CLAIM_TIMEOUT = 3600
+
+    def __init__(self, batch_size=None, limit=None):
+        """
+            Args:
+                batch_size: maximum number of results per request
+                limit: maximum number of results to process per run
+        """
+
+        self.batch_size = batch_size if batch_size else self.BATCH_SIZE
+        self.limit = limit if limit else self.LIMIT
+
+        self._session = None
+        self.server_url = None
+
+    # -------------------------------------------------------------------------
+    @property
+    def session(self):
+        """
+            The HTTP session to send the results (lazy property); the
+            session keeps the connection (and TLS handshake) alive across
+            subsequent requests
+
+            Returns:
+                requests.Session
+        """
+
+        session = self._session
+        if session is None:
+            server_url, cert, key, verify = CWAReport.get_credentials()
+
+            session = requests.Session()
+            session.cert = (cert, key)
+            session.verify = verify
+
+            self.server_url = server_url
+            self._session = session
+
+        return session
+
+    # -------------------------------------------------------------------------
+    def process(self):
+        """
+            Send all pending results that are due
+
+            Returns:
+                error messages (str), or None if all batches were sent
+        """
+
+        rows = self.claim()
+
+        # Group the results by sender (=LabID)
+        senders = {}
+        for row in rows:
+            sender_id = row.sender_id
+            if sender_id not in senders:
+                senders[sender_id] = [row]
+            else:
+                senders[sender_id].append(row)
+
+        # Send the results in batches
+        errors = []
+        batch_size = self.batch_size
+        try:
+            for sender_id, results in senders.items():
+                for index in range(0, len(results), batch_size):
+                    error = self.send(results[index:index+batch_size], sender_id)
+                    if error:
+                        errors.append(error)
+        finally:
+            self.close()
+
+        return "\n".join(errors) if errors else None
+
+    # -------------------------------------------------------------------------
+    def claim(self):
+        """
+            Claim the pending results that are due, by postponing their
+            next attempt for CLAIM_TIMEOUT, so that concurrent runs do
+            not process them again
+
+            Returns:
+                the claimed queue entries (Rows)
+
+            Note:
+                The claim is a conditional UPDATE, so of two concurrent
+                runs selecting the same entries only one can claim each
+                entry (the other run's UPDATE no longer matches it).
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.disease_result_transmission
+        now = datetime.datetime.utcnow()
+        query = (table.target == "CWA") & \
+                (table.status == "PENDING") & \
+                ((table.next_attempt == None) | (table.next_attempt <= now)) & \
+                (table.deleted == False)
+        rows = db(query).select(table.id,
+                                limitby = (0, self.limit),
+                                orderby = table.id,
+                                )
+        if not rows:
+            return rows
+
+        claim = uuid.uuid4().urn
+        timeout = now + datetime.timedelta(seconds=self.CLAIM_TIMEOUT)
+        selected = (table.id.belongs([row.id for row in rows]))
+        db(query & selected).update(next_attempt = timeout,
+                                    batch = claim,
+                                    )
+        db.commit()
+
+        return db(selected & (table.batch == claim)).select(table.id,
+                                               table.sender_id,
+                                               table.payload,
+                                               table.attempts,
+                                               orderby = table.id,
+                                               )
+
+    # -------------------------------------------------------------------------
+    def send(self, rows, sender_id=None):
+        """
+            Send a batch of results as a QuickTestResultList, and update
+            the status of the queue entries
+
+            Args:
+                rows: the queue entries (Rows)
+                sender_id: the LabID
+
+            Returns:
+                error message, or None if successful
+        """
+
+        db = current.db
+        table = current.s3db.disease_result_transmission
+
+        result_list = {"testResults": [row.payload for row in rows]}
+        if sender_id:
+            result_list["labId"] = sender_id
+
+        # POST to server
+        error = None
+        try:
+            sr = self.session.post(self.server_url, json=result_list)
+        except Exception:
+            # Local error
+            error = "CWA batch transmission failed (local error: %s)" % sys.exc_info()[1]
+        else:
+            # Check return code (should be 204, but 202/200 would also be good news)
+            if sr.status_code not in (204, 202, 200):
+                # Remote error
+                error = "CWA batch transmission failed, status code %s" % sr.status_code
+
+        batch = uuid.uuid4().urn
+        now = datetime.datetime.utcnow()
+        ids = [row.id for row in rows]
+
+        if not error:
+            db(table.id.belongs(ids)).update(status = "SENT",
+                                             batch = batch,
+                                             sent_on = now,
+                                             errors = None,
+                                             )
+        else:
+            current.log.error(error)
+
+            # Schedule the next attempt with exponential backoff
+            # (entries are grouped by number of previous attempts)
+            attempts = {}
+            for row in rows:
+                n = (row.attempts or 0) + 1
+                if n in attempts:
+                    attempts[n].append(row.id)
+                else:
+                    attempts[n] = [row.id]
+            for n, record_ids in attempts.items():
+                data = {"attempts": n,
+                        "batch": batch,
+                        "errors": error,
+                        }
+                if n >= self.MAX_ATTEMPTS:
+                    data["status"] = "FAILED"
+                else:
+                    data["next_attempt"] = now + self.backoff(n)
+                db(table.id.belongs(record_ids)).update(**data)
+
+        # Commit the status update per batch, so that subsequent
+        # failures do not roll it back
+        db.commit()
+
+        return error
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def backoff(cls, attempts):
+        """
+            Compute the delay before the next attempt
+
+            Args:
+                attempts: the number of failed attempts so far
+
+            Returns:
+                datetime.timedelta
+        """
+
+        delay = cls.BACKOFF * 2 ** max(attempts - 1, 0)
+        return datetime.timedelta(seconds=min(delay, cls.MAX_BACKOFF))
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+            Close the HTTP session
+        """
+
+        session = self._session
+        if session is not None:
+            session.close()
+            self._session = None
+
 # =============================================================================
 class CWACardLayout(RLPCardLayout):
     """
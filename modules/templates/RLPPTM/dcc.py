@@ -8,13 +8,17 @@ import base64
 import cbor2
 import datetime
 import hashlib
-import json
 import re
 import requests
 import secrets
 import sys
+import time
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
@@ -27,6 +31,10 @@ from gluon import current
 ISSUER_PREFIX = "lsjvrlp"
 EXPIRY_PERIOD = 48 # DCC expires 48h after probe
 
+POLL_WORKERS = 8 # Number of concurrent requests to the DCC server
+ISSUER_RATE_LIMIT = 100 # Maximum number of DCCs to upload per issuer and poll cycle
+TIMEOUT = 60 # Timeout for requests to the DCC server (seconds)
+
 NONLATIN = re.compile(r"[^\u0020-\u0233\u1E02-\u1EF9]")
 SEPARATORS = re.compile(r"[\u002C\u0020\u002D]")
 DIACRITICS = {"A" : r"[\u00C0-\u00C3\u0100-\u0104\u01CD\u01DE\u01FA\u1EA0-\u1EB6]",
@@ -77,10 +85,31 @@ CHARSET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ<"
 
 PEM_TEMPLATE = "-----BEGIN PUBLIC KEY-----\n%s\n-----END PUBLIC KEY-----"
 
+# =============================================================================
+@lru_cache(maxsize=256)
+def load_public_key(public_key):
+    """
+        Load a public key from a DCC request (cached, since requests
+        which could not be served are repeated in subsequent poll cycles)
+
+        Args:
+            public_key: the base64-encoded public key
+
+        Returns:
+            the public key (RSAPublicKey)
+    """
+
+    # Convert base64-encoded public key to PEM and load it
+    pem = (PEM_TEMPLATE % public_key).encode("utf-8")
+    return load_pem_public_key(pem, default_backend())
+
 # =============================================================================
 class DCC:
     """ Helper class to handle Digital Covid Certificates (DCCs) """
 
+    # Metrics of the last poll cycle
+    metrics = None
+
     def __init__(self, instance_id):
         """
             Args:
@@ -222,24 +251,80 @@ class DCC:
                 TODO make sure these errors appear in the scheduler logs
         """
 
-        db = current.db
-        s3db = current.s3db
-
-        table = s3db.disease_hcert_data
+        table = current.s3db.disease_hcert_data
         query = (table.instance_id == instance_id) & \
                 (table.type == "TEST") & \
                 (table.deleted == False)
-        row = db(query).select(table.disease_id,
-                               table.issuer_id,
-                               table.payload,
-                               table.vhash,
-                               table.status,
-                               table.valid_until,
-                               table.certified_on,
-                               limitby = (0, 1),
-                               ).first()
+        row = current.db(query).select(table.disease_id,
+                                       table.issuer_id,
+                                       table.payload,
+                                       table.vhash,
+                                       table.status,
+                                       limitby = (0, 1),
+                                       ).first()
         if not row:
             raise ValueError("Certificate data not found")
+
+        return cls.from_row(instance_id, row)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def load_many(cls, instance_ids):
+        """
+            Instantiate DCCs from stored HCERT data records, in a single query
+
+            Args:
+                instance_ids: iterable of instance IDs
+
+            Returns:
+                dict {instance_id: DCC instance}, instances which could
+                not be loaded are omitted
+        """
+
+        instance_ids = set(instance_ids)
+        if not instance_ids:
+            return {}
+
+        table = current.s3db.disease_hcert_data
+        query = (table.instance_id.belongs(instance_ids)) & \
+                (table.type == "TEST") & \
+                (table.deleted == False)
+        rows = current.db(query).select(table.instance_id,
+                                        table.disease_id,
+                                        table.issuer_id,
+                                        table.payload,
+                                        table.vhash,
+                                        table.status,
+                                        )
+        instances = {}
+        for row in rows:
+            instance_id = row.instance_id
+            if instance_id in instances:
+                continue
+            try:
+                instances[instance_id] = cls.from_row(instance_id, row)
+            except ValueError:
+                continue
+
+        return instances
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_row(cls, instance_id, row):
+        """
+            Instantiate a DCC from a HCERT data row
+
+            Args:
+                instance_id: the instance ID
+                row: the disease_hcert_data Row
+
+            Returns:
+                DCC instance
+
+            Raises:
+                ValueError for invalid data
+        """
+
         issuer_id = row.issuer_id
         if not issuer_id:
             raise ValueError("Certificate data lacking issuer ID")
@@ -441,10 +526,32 @@ class DCC:
                       }
         """
 
-        data = self.data
-        if not data:
+        if not self.data:
             return None
 
+        # Look up site name from site
+        ftable = current.s3db.org_facility
+        query = (ftable.site_id == self.data.get("site"))
+        facility = current.db(query).select(ftable.name, limitby=(0, 1)).first()
+        tc = facility.name if facility else None
+
+        return self.encrypt(self.hcert(dcci, tc), public_key)
+
+    # -------------------------------------------------------------------------
+    def hcert(self, dcci, tc):
+        """
+            Encode this instance as HCERT
+
+            Args:
+                dcci: the certificate ID from the DCC request
+                tc: the name of the test centre
+
+            Returns:
+                the HCERT as CBOR-bytestring
+        """
+
+        data = self.data
+
         # Convert timestamp into datetime
         timestamp = data.get("timestamp")
         expires = data.get("expires")
@@ -458,12 +565,6 @@ class DCC:
         result = data.get("result")
         tr = result_codes.get(result)
 
-        # Look up site name from site
-        ftable = current.s3db.org_facility
-        query = (ftable.site_id == data.get("site"))
-        facility = current.db(query).select(ftable.name, limitby=(0, 1)).first()
-        tc = facility.name if facility else None
-
         # Device code
         ma = data.get("device")
 
@@ -504,7 +605,7 @@ class DCC:
                  -260: { 1: data },
                  }
 
-        return self.encrypt(cbor2.dumps(hcert), public_key)
+        return cbor2.dumps(hcert)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -536,9 +637,8 @@ class DCC:
         encryptor = cipher.encryptor()
         encrypted = encryptor.update(padded) + encryptor.finalize()
 
-        # Convert base64-encoded public key to PEM and load it
-        pem = (PEM_TEMPLATE % public_key).encode("utf-8")
-        pkey = load_pem_public_key(pem, default_backend())
+        # Load the public key
+        pkey = load_public_key(public_key)
 
         # Encrypt the AES key with the public key
         sha256 = hashes.SHA256()
@@ -561,15 +661,22 @@ class DCC:
     # Background tasks
     # -------------------------------------------------------------------------
     @classmethod
-    def poll(cls):
+    def poll(cls, client=None):
         """
             Poll the server for DCC requests, and issue any requested DCCs
+
+            Args:
+                client: the DCCClient to use (default: a new DCCClient
+                        with the configured credentials)
+
+            Returns:
+                error messages (str), or None if successful
         """
 
         db = current.db
         s3db = current.s3db
 
-        settings = current.deployment_settings
+        start = time.monotonic()
 
         # Get the issuer IDs for all pending DCCs
         now = datetime.datetime.utcnow()
@@ -581,90 +688,157 @@ class DCC:
         rows = db(query).select(table.issuer_id,
                                 groupby = table.issuer_id,
                                 )
+        issuer_ids = [row.issuer_id for row in rows]
 
-        # The client credentials to access the server
-        cert, key, verify = cls.get_dcc_credentials()
-
-        # The server endpoint to poll
-        dcc_base_url = settings.get_custom("dcc_base_url")
-        endpoint = "%s/version/v1/publicKey/search" % (dcc_base_url.rstrip("/"))
+        if client is None:
+            client = DCCClient()
 
         errors = []
-        for row in rows:
-            # Search URL is per-issuer
-            search_url = "%s/%s" % (endpoint, row.issuer_id)
-            try:
-                sr = requests.get(search_url,
-                                  cert = (cert, key),
-                                  verify = verify,
-                                  )
-            except Exception:
-                # Local error
-                msg = "DCC requests: polling %s failed (local error: %s)" % \
-                      (search_url, sys.exc_info()[1])
-                errors.append(msg)
-                current.log.error(msg)
-                continue
-
-            # Check return code
-            if sr.status_code != 200:
-                # Remote error
-                msg = "DCC requests: polling %s failed, status code %s" % \
-                      (search_url, sr.status_code)
-                errors.append(msg)
-                current.log.error(msg)
-                continue
-
-            # Decode the results
-            try:
-                requested_dccs = sr.json()
-            except json.JSONDecodeError:
-                msg = "DCC results: %s server response parse error: %s" % \
-                      (search_url, sys.exc_info()[1])
-                errors.append(msg)
-                current.log.error(msg)
-                continue
-
-            # If there are any requests, issue the DCCs
-            cls.issue(requested_dccs)
+        with client:
+            # Poll for all issuers concurrently
+            requested_dccs = []
+            for issuer_id, items, error in client.map(client.search, issuer_ids):
+                if error:
+                    errors.append(error)
+                    current.log.error(error)
+                else:
+                    requested_dccs.append(items)
+            poll_time = time.monotonic()
+
+            # Issue the requested DCCs
+            metrics = cls.issue(requested_dccs, client=client)
+            if metrics.get("errors"):
+                errors.extend(metrics["errors"])
+
+        # Cycle metrics
+        end = time.monotonic()
+        metrics.update(issuers = len(issuer_ids),
+                       poll_errors = len(issuer_ids) - len(requested_dccs),
+                       poll_time = poll_time - start,
+                       duration = end - start,
+                       )
+        metrics.pop("errors", None)
+        cls.metrics = metrics
+        current.log.info("DCC poll cycle: %(issuers)s issuers polled, "
+                         "%(requested)s DCCs requested, %(issued)s issued, "
+                         "%(failed)s failed, %(deferred)s deferred; "
+                         "poll %(poll_time).3fs, encode %(encode_time).3fs, "
+                         "upload %(upload_time).3fs, total %(duration).3fs" % metrics)
 
         return "\n".join(errors) if errors else None
 
     # -------------------------------------------------------------------------
     @classmethod
-    def issue(cls, dcc_request_list):
+    def issue(cls, dcc_request_lists, client=None):
         """
             Upload the requested DCCs
 
             Args:
-                dcc_request_list: a list of dicts:
+                dcc_request_lists: a list of DCC request lists (one per
+                                   issuer), each a list of dicts:
                         {"testId":    DCC instance ID,
                          "dcci":      certificate ID,
                          "publicKey": public RSA key to encrypt the AES key
                          }
+                client: the DCCClient to use (default: a new DCCClient
+                        with the configured credentials)
+
+            Returns:
+                dict of cycle metrics
+
+            Note:
+                - the HCERTs are encoded in the main thread (requires
+                  database access), but encrypted and uploaded in the
+                  worker pool of the client
+                - the number of uploads per issuer is limited to the
+                  rate limit of the client, further requests are deferred
+                  to subsequent poll cycles
         """
 
-        if not isinstance(dcc_request_list, list):
-            return
+        start = time.monotonic()
 
-        for item in dcc_request_list:
-            if not isinstance(item, dict):
-                continue
+        if client is None:
+            client = DCCClient()
+        rate_limit = client.rate_limit
 
-            instance_id = item.get("testId")
-            if not instance_id:
+        # Collect the valid requests
+        requested = {}
+        for dcc_request_list in dcc_request_lists:
+            if not isinstance(dcc_request_list, list):
                 continue
-            try:
-                inst = cls.load(instance_id)
-            except ValueError:
+            for item in dcc_request_list:
+                if not isinstance(item, dict):
+                    continue
+                instance_id = item.get("testId")
+                dcci = item.get("dcci")
+                public_key = item.get("publicKey")
+                if instance_id and dcci and public_key:
+                    requested[instance_id] = (dcci, public_key)
+
+        # Load all requested instances
+        instances = cls.load_many(requested.keys())
+
+        # Look up the site names for all instances
+        site_ids = {inst.data.get("site") for inst in instances.values()}
+        ftable = current.s3db.org_facility
+        query = (ftable.site_id.belongs(site_ids)) & \
+                (ftable.deleted == False)
+        rows = current.db(query).select(ftable.site_id, ftable.name)
+        site_names = {row.site_id: row.name for row in rows}
+
+        # Encode the HCERTs, observing the per-issuer rate limit
+        jobs, errors = [], []
+        counts = {}
+        failed = deferred = 0
+        for instance_id, inst in instances.items():
+            if inst.status != "PENDING":
                 continue
 
-            dcci = item.get("dcci")
-            public_key = item.get("publicKey")
-            if not dcci or not public_key:
+            issuer_id = inst.issuer_id
+            count = counts.get(issuer_id, 0)
+            if count >= rate_limit:
+                deferred += 1
                 continue
+            counts[issuer_id] = count + 1
 
-            inst.upload(dcci, public_key)
+            dcci, public_key = requested[instance_id]
+            try:
+                hcert = inst.hcert(dcci, site_names.get(inst.data.get("site")))
+            except ValueError:
+                error = "DCC encoding failed, %s" % sys.exc_info()[1]
+                # This is a permanent error, so store error message and
+                # set status to invalid:
+                inst.status = "INVALID"
+                inst.save(errors=error)
+                errors.append(error)
+                failed += 1
+                continue
+            jobs.append((inst, hcert, public_key))
+        encode_time = time.monotonic()
+
+        # Encrypt and upload in the worker pool
+        results = client.map(client.upload, jobs)
+        upload_time = time.monotonic()
+
+        # Update the record status
+        issued = 0
+        for inst, error in results:
+            inst.save(errors=error)
+            if error:
+                current.log.error(error)
+                errors.append(error)
+                failed += 1
+            else:
+                issued += 1
+
+        return {"requested": len(requested),
+                "issued": issued,
+                "failed": failed,
+                "deferred": deferred,
+                "encode_time": encode_time - start,
+                "upload_time": upload_time - encode_time,
+                "errors": errors,
+                }
 
     # -------------------------------------------------------------------------
     # Tools
@@ -891,4 +1065,198 @@ class DCC:
 
         return expired, anonymized
 
+# =============================================================================
+class DCCClient:
+    """
+        Client for the DCC server, with a keep-alive connection pool
+        (client certificate loaded once) and a bounded worker pool for
+        concurrent requests
+
+        Note:
+            - the worker methods (search, upload) run in separate threads,
+              and must therefore not access the database or current
+            - the client is a context manager; nested contexts share the
+              same worker pool, which is shut down (and the connections
+              closed) when the outermost context is left
+    """
+
+    def __init__(self, base_url=None, credentials=None, workers=None, rate_limit=None):
+        """
+            Args:
+                base_url: the DCC server base URL (default: dcc_base_url
+                          from the template settings)
+                credentials: tuple (cert, key, verify), default: the
+                             configured credentials (DCC.get_dcc_credentials)
+                workers: the maximum number of concurrent requests
+                         (default: dcc_poll_workers setting, or POLL_WORKERS)
+                rate_limit: the maximum number of uploads per issuer and
+                            poll cycle (default: dcc_issuer_rate_limit
+                            setting, or ISSUER_RATE_LIMIT)
+        """
+
+        settings = current.deployment_settings
+
+        if base_url is None:
+            base_url = settings.get_custom("dcc_base_url")
+        self.base_url = base_url.rstrip("/")
+
+        if credentials is None:
+            credentials = DCC.get_dcc_credentials()
+        self.credentials = credentials
+
+        if not workers:
+            workers = settings.get_custom("dcc_poll_workers") or POLL_WORKERS
+        self.workers = workers
+
+        if not rate_limit:
+            rate_limit = settings.get_custom("dcc_issuer_rate_limit") or ISSUER_RATE_LIMIT
+        self.rate_limit = rate_limit
+
+        self.session = None
+        self.executor = None
+        self.depth = 0
+
+    # -------------------------------------------------------------------------
+    def __enter__(self):
+        """
+            Open the session and start the worker pool
+        """
+
+        if not self.depth:
+            cert, key, verify = self.credentials
+
+            session = requests.Session()
+            session.cert = (cert, key)
+            session.verify = verify
+
+            # Keep as many connections alive as there are workers
+            adapter = HTTPAdapter(pool_connections = 1,
+                                  pool_maxsize = self.workers,
+                                  )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            self.session = session
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        self.depth += 1
+        return self
+
+    # -------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+            Shut down the worker pool and close the session
+        """
+
+        self.depth -= 1
+        if not self.depth:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            self.session.close()
+            self.session = None
+
+    # -------------------------------------------------------------------------
+    def map(self, func, items):
+        """
+            Run a worker method for all items in the worker pool
+
+            Args:
+                func: the worker method
+                items: the items
+
+            Returns:
+                list of results, in the order of the items
+        """
+
+        if not items:
+            return []
+        with self:
+            results = list(self.executor.map(func, items))
+        return results
+
+    # -------------------------------------------------------------------------
+    def search(self, issuer_id):
+        """
+            Poll the server for DCC requests for an issuer (worker method)
+
+            Args:
+                issuer_id: the issuer ID
+
+            Returns:
+                tuple (issuer_id, dcc_request_list, error)
+        """
+
+        # Search URL is per-issuer
+        search_url = "%s/version/v1/publicKey/search/%s" % (self.base_url, issuer_id)
+        try:
+            sr = self.session.get(search_url, timeout=TIMEOUT)
+        except Exception:
+            # Local error
+            msg = "DCC requests: polling %s failed (local error: %s)" % \
+                  (search_url, sys.exc_info()[1])
+            return issuer_id, None, msg
+
+        # Check return code
+        if sr.status_code != 200:
+            # Remote error
+            msg = "DCC requests: polling %s failed, status code %s" % \
+                  (search_url, sr.status_code)
+            return issuer_id, None, msg
+
+        # Decode the results
+        try:
+            requested_dccs = sr.json()
+        except ValueError:
+            msg = "DCC results: %s server response parse error: %s" % \
+                  (search_url, sys.exc_info()[1])
+            return issuer_id, None, msg
+
+        return issuer_id, requested_dccs, None
+
+    # -------------------------------------------------------------------------
+    def upload(self, job):
+        """
+            Encrypt a DCC and send it to the server (worker method),
+            updates the status of the DCC instance, but does not save it
+
+            Args:
+                job: tuple (instance, hcert, public_key)
+
+            Returns:
+                tuple (instance, error)
+        """
+
+        inst, hcert, public_key = job
+
+        try:
+            dcc_json = DCC.encrypt(hcert, public_key)
+        except ValueError:
+            # Invalid public key - permanent error
+            inst.status = "INVALID"
+            return inst, "DCC encoding failed, %s" % sys.exc_info()[1]
+
+        # The server endpoint to send to
+        endpoint = "%s/version/v1/test/%s/dcc" % (self.base_url, inst.instance_id)
+
+        error = None
+        try:
+            sr = self.session.post(endpoint, json=dcc_json, timeout=TIMEOUT)
+        except Exception:
+            # Local errors
+            error = "DCC upload failed (local error: %s)" % sys.exc_info()[1]
+        else:
+            # Check return code (should be 204, but 202/200 would also be good news)
+            status_code = sr.status_code
+            if status_code not in (204, 202, 200, 409):
+                error = "DCC upload failed, status code %s" % status_code
+                if status_code in (403, 404):
+                    # Either test result was not found, or we're not
+                    # authorized to certify it - this is a permanent
+                    # error, so set status to invalid
+                    inst.status = "INVALID"
+            else:
+                inst.status = "ISSUED"
+
+        return inst, error
+
 # END =========================================================================
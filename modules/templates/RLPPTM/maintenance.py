@@ -11,41 +11,78 @@ import time
 from gluon import current
 from gluon.settings import global_settings
 
+from core import MaintenanceJobs
+
 # =============================================================================
-class Daily():
+class Daily(MaintenanceJobs):
     """ Daily Maintenance Tasks """
 
-    def __call__(self):
+    jobs = ("cleanup_scheduler",
+            "cleanup_sync",
+            "cleanup_sessions",
+            "cleanup_unverified_accounts",
+            "cleanup_realm_sets",
+            "rebuild_hierarchies",
+            "update_rat_list",
+            "cleanup_dcc",
+            "check_public_registry",
+            )
 
-        db = current.db
-        s3db = current.s3db
-        request = current.request
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def week_past():
+        """
+            The cut-off date for log and session cleanups
 
-        current.log.info("Daily Maintenance RLPPTM")
-        errors = None
+            Returns:
+                datetime (UTC)
+        """
 
-        now = datetime.datetime.utcnow()
-        week_past = now - datetime.timedelta(weeks=1)
+        return datetime.datetime.utcnow() - datetime.timedelta(weeks=1)
+
+    # -------------------------------------------------------------------------
+    def cleanup_scheduler(self):
+        """
+            Remove scheduler, maintenance and profile logs older than one week
+        """
+
+        s3db = current.s3db
+        week_past = self.week_past()
 
-        # Cleanup Scheduler logs
         table = s3db.scheduler_run
-        db(table.start_time < week_past).delete()
+        self.delete_batched(table, table.start_time < week_past)
+
+        table = s3db.s3_maintenance_log
+        self.delete_batched(table, table.start_time < week_past)
+
+        table = s3db.s3_profile_log
+        self.delete_batched(table, table.date < week_past)
+
+    # -------------------------------------------------------------------------
+    def cleanup_sync(self):
+        """
+            Remove sync logs older than one week
+        """
+
+        table = current.s3db.sync_log
+        self.delete_batched(table, table.timestmp < self.week_past())
 
-        # Cleanup Sync logs
-        table = s3db.sync_log
-        db(table.timestmp < week_past).delete()
+    # -------------------------------------------------------------------------
+    def cleanup_sessions(self):
+        """
+            Remove session files older than one week
+        """
 
-        # Cleanup Sessions
         osjoin = os.path.join
         osstat = os.stat
         osremove = os.remove
         folder = osjoin(global_settings.applications_parent,
-                        request.folder,
+                        current.request.folder,
                         "sessions",
                         )
 
         # Convert to UNIX time
-        week_past_u = time.mktime(week_past.timetuple())
+        week_past_u = time.mktime(self.week_past().timetuple())
         for file in os.listdir(folder):
             filepath = osjoin(folder, file)
             status = osstat(filepath)
@@ -55,28 +92,9 @@ class Daily():
                 except:
                     pass
 
-        # Cleanup unverified accounts
-        self.cleanup_unverified_accounts()
-
-        # Update the RAT device list
-        from .rat import RATList
-        RATList.sync()
-
-        # Cleanup DCC data
-        from .dcc import DCC
-        DCC.cleanup()
-
-        # On Sundays, cleanup public test station registry
-        settings = current.deployment_settings
-        if settings.get_custom(key="test_station_cleanup") and \
-           now.weekday() == 6:
-            errors = self.cleanup_public_registry()
-
-        return errors if errors else None
-
     # -------------------------------------------------------------------------
-    @staticmethod
-    def cleanup_unverified_accounts():
+    @classmethod
+    def cleanup_unverified_accounts(cls):
         """
             Remove unverified user accounts
         """
@@ -105,30 +123,71 @@ class Daily():
                 (ltable.id == None) & \
                 (mtable.id == None)
 
-        rows = db(query).select(utable.id,
-                                utable.email,
-                                left = left,
-                                )
-        for row in rows:
+        def delete_temp_data(user_ids):
+            db(ttable.user_id.belongs(user_ids)).delete()
+
+        deleted = cls.delete_batched(utable, query,
+                                     left = left,
+                                     before = delete_temp_data,
+                                     )
+        if deleted:
+            current.log.info("Deleted %s unverified user accounts" % deleted)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cleanup_realm_sets():
+        """
+            Remove stored realm sets not accessed for one week
+        """
+
+        from core import S3Permission
+        S3Permission.cleanup_realm_sets(days=7)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def rebuild_hierarchies():
+        """
+            Rebuild stored hierarchies which are still dirty
+        """
+
+        from core import S3Hierarchy
+        S3Hierarchy.rebuild()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_rat_list():
+        """
+            Update the RAT device list
+        """
 
-            email = row.email
+        from .rat import RATList
+        RATList.sync()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cleanup_dcc():
+        """
+            Cleanup DCC data
+        """
 
-            try:
-                success = db(ttable.user_id == row.id).delete()
-            except:
-                success = False
-            if not success:
-                current.log.warning("Could not delete temp data for user %s" % email)
-                continue
+        from .dcc import DCC
+        DCC.cleanup()
 
-            try:
-                success = row.delete_record()
-            except:
-                success = False
-            if not success:
-                current.log.warning("Could not delete unverified user %s" % email)
+    # -------------------------------------------------------------------------
+    def check_public_registry(self):
+        """
+            On Sundays, cleanup public test station registry
+
+            Returns:
+                error message, or None if successful
+        """
+
+        settings = current.deployment_settings
+        if settings.get_custom(key="test_station_cleanup") and \
+           datetime.datetime.utcnow().weekday() == 6:
+            return self.cleanup_public_registry()
 
-            current.log.info("Deleted unverified user account %s" % email)
+        return None
 
     # -------------------------------------------------------------------------
     @staticmethod
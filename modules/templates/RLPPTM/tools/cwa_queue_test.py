@@ -0,0 +1,213 @@
+# Test for the CWA result transmission queue against a local stub CWA server
+#
+# RLPPTM Template Version 1.0
+#
+# Execute in web2py folder like:
+# python web2py.py -S eden -M -R applications/eden/modules/templates/RLPPTM/tools/cwa_queue_test.py
+#
+# Note:
+#   - creates temporary queue entries, and removes them again after the test
+#   - the stub server records all received results, and can be set to
+#     reject requests to test retries
+#
+import datetime
+import json
+import sys
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from templates.RLPPTM.cwa import CWAResultQueue
+
+# Number of labs (=senders)
+LABS = 3
+
+# Number of queued results per lab
+RESULTS = 120
+
+# Maximum number of results per request
+BATCH_SIZE = 50
+
+# Override auth (disables all permission checks)
+auth.override = True
+
+def info(msg):
+    sys.stderr.write("%s\n" % msg)
+
+# Received results {result_id: number of times received}, and requests
+received = {}
+requests_log = []
+
+# HTTP status to respond with (None = accept)
+reject = {"status": None}
+
+# =============================================================================
+class StubCWAServer(BaseHTTPRequestHandler):
+    """ Request handler simulating the CWA server """
+
+    def do_POST(self):
+        """ Receive a QuickTestResultList """
+
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length))
+
+        status = reject["status"]
+        if status:
+            self.send_response(status)
+        else:
+            results = data.get("testResults", [])
+            requests_log.append((data.get("labId"), len(results)))
+            for result in results:
+                result_id = result.get("id")
+                received[result_id] = received.get(result_id, 0) + 1
+            self.send_response(204)
+
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        """ Suppress request logging """
+        pass
+
+# =============================================================================
+def create_entries():
+    """
+        Create pending queue entries for all labs
+
+        Returns:
+            the IDs of the results
+    """
+
+    table = s3db.disease_result_transmission
+
+    now = datetime.datetime.utcnow()
+    result_ids = []
+    for i in range(LABS):
+        lab_id = "cwaqueuetest%04d" % i
+        for j in range(RESULTS):
+            result_id = uuid.uuid4().hex
+            table.insert(target = "CWA",
+                         sender_id = lab_id,
+                         payload = {"id": result_id,
+                                    "result": 6,
+                                    "sc": int(now.timestamp()),
+                                    },
+                         status = "PENDING",
+                         next_attempt = now,
+                         )
+            result_ids.append(result_id)
+    db.commit()
+
+    return result_ids
+
+# =============================================================================
+def remove_entries():
+    """
+        Remove all test queue entries
+    """
+
+    table = s3db.disease_result_transmission
+    db(table.sender_id.like("cwaqueuetest%")).delete()
+    db.commit()
+
+# =============================================================================
+def make_queue(base_url):
+    """
+        Create a queue instance sending to the stub server
+
+        Args:
+            base_url: the stub server URL
+
+        Returns:
+            CWAResultQueue
+    """
+
+    queue = CWAResultQueue(batch_size=BATCH_SIZE)
+    queue.server_url = base_url
+    queue._session = requests.Session()
+
+    return queue
+
+# =============================================================================
+def make_due():
+    """
+        Make all pending test queue entries due immediately
+    """
+
+    table = s3db.disease_result_transmission
+    query = (table.sender_id.like("cwaqueuetest%")) & \
+            (table.status == "PENDING")
+    db(query).update(next_attempt = datetime.datetime.utcnow())
+    db.commit()
+
+# -----------------------------------------------------------------------------
+# Start the stub server
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubCWAServer)
+thread = threading.Thread(target=server.serve_forever, daemon=True)
+thread.start()
+base_url = "http://127.0.0.1:%s" % server.server_address[1]
+
+failures = []
+def check(condition, msg):
+    if not condition:
+        failures.append(msg)
+    info("%s: %s" % ("OK" if condition else "FAILED", msg))
+
+table = s3db.disease_result_transmission
+entries = table.sender_id.like("cwaqueuetest%")
+
+info("CWA queue test: %s labs x %s results, batch size %s" % (LABS, RESULTS, BATCH_SIZE))
+try:
+    remove_entries()
+    result_ids = create_entries()
+    total = len(result_ids)
+
+    # Concurrent runs claim disjoint sets of entries
+    first, second = make_queue(base_url), make_queue(base_url)
+    claimed = first.claim()
+    check(len(claimed) == total, "first run claims all %s entries" % total)
+    check(len(second.claim()) == 0, "second run claims no entries")
+    first.close()
+    second.close()
+    make_due()
+
+    # Rejected batches are retried with backoff
+    reject["status"] = 503
+    errors = make_queue(base_url).process()
+    check(errors is not None, "rejected batches are reported")
+    rows = db(entries).select(table.status, table.attempts, table.next_attempt)
+    now = datetime.datetime.utcnow()
+    check(all(row.status == "PENDING" and row.attempts == 1 and row.next_attempt > now
+              for row in rows),
+          "rejected entries remain pending with backoff")
+    check(not received, "nothing received while rejecting")
+
+    # Sending after the backoff
+    reject["status"] = None
+    make_due()
+    errors = make_queue(base_url).process()
+    check(errors is None, "all batches accepted")
+    rows = db(entries).select(table.status)
+    check(all(row.status == "SENT" for row in rows), "all entries marked as sent")
+    check(set(received) == set(result_ids), "all results received")
+    check(all(n == 1 for n in received.values()), "each result received exactly once")
+    check(all(size <= BATCH_SIZE for _, size in requests_log), "batch size respected")
+    check(len(set(lab_id for lab_id, _ in requests_log)) == LABS, "results grouped by lab")
+
+    # Nothing left to send
+    requests_log.clear()
+    make_queue(base_url).process()
+    check(not requests_log, "no requests without due entries")
+finally:
+    server.shutdown()
+    remove_entries()
+
+if failures:
+    info("%s check(s) failed" % len(failures))
+    sys.exit(1)
+info("All checks passed")
+
+# END =========================================================================
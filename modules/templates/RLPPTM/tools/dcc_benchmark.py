@@ -0,0 +1,197 @@
+# Benchmark for the DCC poll/issue cycle against a local mock DCC server
+#
+# RLPPTM Template Version 1.0
+#
+# Execute in web2py folder like:
+# python web2py.py -S eden -M -R applications/eden/modules/templates/RLPPTM/tools/dcc_benchmark.py
+#
+# Note:
+#   - creates temporary HCERT data records for a number of fake issuers,
+#     and removes them again after the benchmark
+#   - the mock server simulates network latency for each request
+#
+import base64
+import datetime
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from templates.RLPPTM.dcc import DCC, DCCClient
+
+# Number of issuers (=test stations)
+ISSUERS = 50
+
+# Number of DCC requests per issuer
+REQUESTS = 10
+
+# Simulated network latency (seconds)
+LATENCY = 0.05
+
+# Numbers of workers to compare
+WORKERS = (1, 8, 16)
+
+# Override auth (disables all permission checks)
+auth.override = True
+
+def info(msg):
+    sys.stderr.write("%s\n" % msg)
+
+# Generate the public key for the DCC requests
+private_key = rsa.generate_private_key(public_exponent = 65537,
+                                       key_size = 2048,
+                                       backend = default_backend(),
+                                       )
+der = private_key.public_key().public_bytes(serialization.Encoding.DER,
+                                            serialization.PublicFormat.SubjectPublicKeyInfo,
+                                            )
+PUBLIC_KEY = base64.b64encode(der).decode("utf-8")
+
+# Pending requests per issuer, filled per run
+pending = {}
+
+# =============================================================================
+class MockDCCServer(BaseHTTPRequestHandler):
+    """ Request handler simulating the DCC server """
+
+    def do_GET(self):
+        """ Search for DCC requests """
+
+        time.sleep(LATENCY)
+
+        issuer_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+        items = [{"testId": instance_id,
+                  "dcci": "URN:UVCI:V1:DE:%s" % instance_id[:26].upper(),
+                  "publicKey": PUBLIC_KEY,
+                  } for instance_id in pending.get(issuer_id, ())]
+        body = json.dumps(items).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """ Receive an encrypted DCC """
+
+        time.sleep(LATENCY)
+
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        """ Suppress request logging """
+        pass
+
+# =============================================================================
+def create_records(run, site_id):
+    """
+        Create pending HCERT data records for all issuers
+
+        Args:
+            run: the run number (to generate unique instance IDs)
+            site_id: the site ID to use as test station
+    """
+
+    pending.clear()
+
+    now = datetime.datetime.utcnow()
+    timestamp = int(DCC.utc_timestamp(now))
+
+    for i in range(ISSUERS):
+        issuer_id = "lsjvrlpbenchmark%04d" % i
+        instance_ids = pending[issuer_id] = []
+        for j in range(REQUESTS):
+            test_id = "benchmark-%s-%s-%s" % (run, i, j)
+            instance_id = hashlib.sha256(test_id.encode("utf-8")).hexdigest().lower()
+
+            instance = DCC(instance_id)
+            instance.status = "PENDING"
+            instance.issuer_id = issuer_id
+            instance.data = {"fn": "Erika",
+                             "ln": "Mustermann",
+                             "dob": "1964-08-12",
+                             "disease": None,
+                             "site": site_id,
+                             "device": "1232",
+                             "timestamp": timestamp,
+                             "expires": timestamp + 48 * 3600,
+                             "result": "NEG",
+                             }
+            instance.save()
+            instance_ids.append(instance_id)
+
+    db.commit()
+
+# =============================================================================
+def remove_records():
+    """
+        Remove all benchmark HCERT data records
+    """
+
+    table = s3db.disease_hcert_data
+    db(table.issuer_id.like("lsjvrlpbenchmark%")).delete()
+    db.commit()
+
+# -----------------------------------------------------------------------------
+# Find a test station
+ftable = s3db.org_facility
+facility = db(ftable.deleted == False).select(ftable.site_id, limitby=(0, 1)).first()
+if not facility:
+    info("No facility found - aborting")
+    sys.exit(1)
+
+# Dummy client credentials (not used for plain HTTP)
+folder = tempfile.mkdtemp()
+cert = os.path.join(folder, "cert.pem")
+key = os.path.join(folder, "key.pem")
+for path in (cert, key):
+    with open(path, "w") as f:
+        f.write("")
+
+# Start the mock server
+server = ThreadingHTTPServer(("127.0.0.1", 0), MockDCCServer)
+thread = threading.Thread(target=server.serve_forever, daemon=True)
+thread.start()
+base_url = "http://127.0.0.1:%s" % server.server_address[1]
+
+info("DCC poll cycle benchmark: %s issuers x %s requests, latency %sms" % \
+     (ISSUERS, REQUESTS, int(LATENCY * 1000)))
+try:
+    for run, workers in enumerate(WORKERS):
+        create_records(run, facility.site_id)
+
+        client = DCCClient(base_url = base_url,
+                           credentials = (cert, key, False),
+                           workers = workers,
+                           rate_limit = REQUESTS,
+                           )
+        errors = DCC.poll(client=client)
+        if errors:
+            info(errors)
+
+        metrics = DCC.metrics
+        info("%(workers)2s workers: %(issued)s issued, %(failed)s failed in %(duration).3fs "
+             "(poll %(poll_time).3fs, encode %(encode_time).3fs, upload %(upload_time).3fs)" % \
+             dict(metrics, workers=workers))
+
+        remove_records()
+finally:
+    server.shutdown()
+    remove_records()
+
+# END =========================================================================
@@ -33,6 +33,10 @@ def config(settings):
     # Theme (folder to use for views/layout.html)
     #settings.base.theme = "default"
 
+    # Uncomment this to profile the fixed overhead of requests
+    # (aggregated timings in s3_profile_log, see admin/profile)
+    #settings.base.request_profile = True
+
     # Authentication settings
     # These settings should be changed _after_ the 1st (admin) user is
     # registered in order to secure the deployment
@@ -445,6 +449,15 @@ def config(settings):
     #settings.gis.search_geonames = False
     # Uncomment to modify the Simplify Tolerance
     #settings.gis.simplify_tolerance = 0.001
+    # Uncomment to store simplified polygons at multiple levels, and vary
+    # the simplification level & precision by the zoom level of the map
+    #settings.gis.geometry_pyramid = True
+    # Uncomment to use an in-process spatial index (requires Shapely) for
+    # geometry queries when not using a spatial DB
+    #settings.gis.spatial_index = True
+    # Uncomment to serve Feature Layers as vector tiles (MVT) from
+    # gis/tiles/{layer_id}/{z}/{x}/{y}.mvt
+    #settings.gis.vector_tiles = True
     # Uncomment this for highly-zoomed maps showing buildings
     #settings.gis.precision = 5
     # Uncomment to Hide the Toolbar from the main Map
@@ -470,6 +483,9 @@ def config(settings):
     #settings.msg.require_international_phone_numbers = False
     # Uncomment to make basestation codes unique
     #settings.msg.basestation_code_unique = True
+    # Uncomment to notify subscribers in batches in-process, rather than with
+    # a lookup request per subscriber (controller preps are not applied)
+    #settings.msg.notify_batch = True
 
     # Use 'soft' deletes
     #settings.security.archive_not_delete = False
@@ -28,6 +28,18 @@ class Daily():
         table = s3db.sync_log
         db(table.timestmp < month_past).delete()
 
+        # Cleanup Request Profile logs
+        table = s3db.s3_profile_log
+        db(table.date < month_past).delete()
+
+        # Cleanup stored realm sets
+        from core import S3Permission
+        S3Permission.cleanup_realm_sets(days=7)
+
+        # Rebuild stored hierarchies which are still dirty
+        from core import S3Hierarchy
+        S3Hierarchy.rebuild()
+
         # Cleanup Sessions
         osjoin = os.path.join
         osstat = os.stat
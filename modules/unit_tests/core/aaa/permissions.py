@@ -3,6 +3,7 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/core/aaa/permission.py
 #
+import datetime
 import unittest
 import re
 
@@ -279,6 +280,71 @@ class ACLManagementTests(unittest.TestCase):
                 del table[acl_id]
             auth.s3_delete_role(group_id)
 
+    # -------------------------------------------------------------------------
+    def testCompiledACLs(self):
+        """ Test compilation and invalidation of ACLs """
+
+        auth = current.auth
+        permission = auth.permission
+
+        group_id = auth.s3_create_role("Test Role", uid="TEST")
+        acl_ids = []
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        try:
+            READ = permission.READ
+            ALL = permission.ALL
+
+            acl_ids.append(permission.update_acl(group_id,
+                                                 c="pr", f="person",
+                                                 uacl=READ, oacl=ALL))
+            acl_ids.append(permission.update_acl(group_id,
+                                                 t="pr_person",
+                                                 uacl=READ, oacl=ALL))
+
+            version = S3Permission.acl_version
+            acls = permission.acls
+            assertEqual(acls["pages"].get((group_id, "pr", "person")),
+                        [(False, None, READ, ALL)])
+            assertEqual(acls["tables"].get((group_id, "pr_person")),
+                        [(False, None, READ, ALL)])
+            assertTrue("pr_person" in acls["restricted"])
+
+            # Compiled ACLs are shared between requests
+            other = S3Permission(auth)
+            assertTrue(other.acls is acls)
+
+            # Updating an ACL invalidates the compiled ACLs
+            permission.update_acl(group_id, c="pr", f="person", uacl=ALL, oacl=ALL)
+            assertTrue(S3Permission.acl_version > version)
+            acls = permission.acls
+            assertEqual(acls["pages"].get((group_id, "pr", "person")),
+                        [(False, None, ALL, ALL)])
+
+            # Changes in other processes are detected, even with an
+            # earlier modification date
+            table = permission.table
+            earlier = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+            current.db(table.id == acl_ids[0]).update(uacl = READ,
+                                                      modified_on = earlier,
+                                                      )
+            acls = S3Permission(auth).acls
+            assertEqual(acls["pages"].get((group_id, "pr", "person")),
+                        [(False, None, READ, ALL)])
+
+            # Deleted ACLs are not compiled
+            permission.delete_acl(group_id, t="pr_person")
+            acls = permission.acls
+            assertEqual(acls["tables"].get((group_id, "pr_person")), None)
+        finally:
+            table = permission.table
+            for acl_id in acl_ids:
+                if acl_id:
+                    del table[acl_id]
+            auth.s3_delete_role(group_id)
+
 # =============================================================================
 class HasPermissionTests(unittest.TestCase):
     """ Test permission check method """
@@ -1396,6 +1462,56 @@ class AccessibleQueryTests(unittest.TestCase):
         s3db.pr_remove_affiliation(self.org[0], self.org[1], role="TestOrgUnit")
         auth.s3_withdraw_role(auth.user.id, self.editor)
 
+    # -------------------------------------------------------------------------
+    def testRealmSets(self):
+        """ Test realm queries with stored realm sets """
+
+        db = current.db
+        permission = current.auth.permission
+
+        table = db.org_permission_test
+        entities = list(self.org)
+
+        # Small realms are inlined
+        query = permission.realm_query(table, entities)
+        self.assertIn(" IN (", str(query))
+        self.assertNotIn("SELECT", str(query))
+
+        permission.REALM_SET_THRESHOLD = 2
+        try:
+            # New large realms are inlined until the set is stored
+            query = permission.realm_query(table, entities)
+            self.assertNotIn("SELECT", str(query))
+            self.assertIsNone(permission.realm_set(set(entities)))
+
+            S3Permission.store_realm_set(entities)
+            permission.realm_sets.clear()
+
+            # Stored large realms are referenced by subquery
+            query = permission.realm_query(table, entities)
+            self.assertIn(" IN (SELECT", str(query))
+
+            rows = db(query).select(table.id)
+            self.assertEqual(set(row.id for row in rows),
+                             {self.record1, self.record2, self.record3})
+
+            # Same set of entities uses the same realm set
+            set_id = permission.realm_set(set(entities))
+            permission.realm_sets.clear()
+            self.assertEqual(permission.realm_set(set(reversed(entities))), set_id)
+
+            etable = db[permission.REALM_ENTITY_TABLE]
+            rows = db(etable.set_id == set_id).select(etable.pe_id)
+            self.assertEqual(set(row.pe_id for row in rows), set(entities))
+
+            # Cleanup removes sets not accessed recently
+            stable = db[permission.REALM_SET_TABLE]
+            db(stable.id == set_id).update(accessed_on=None)
+            self.assertTrue(S3Permission.cleanup_realm_sets() >= 1)
+            self.assertTrue(db(etable.set_id == set_id).isempty())
+        finally:
+            del permission.REALM_SET_THRESHOLD
+
     # -------------------------------------------------------------------------
     @classmethod
     def assertSameQuery(cls, l, r, msg=None):
@@ -50,6 +50,7 @@ import unittest
 from gluon import current
 from gluon.storage import Storage
 
+from s3dal import Row
 from unit_tests import run_suite
 
 def info(msg):
@@ -286,6 +287,295 @@ class S3PerformanceTests(unittest.TestCase):
 
         current.auth.override = False
 
+    # -------------------------------------------------------------------------
+    def testResourceDataExtract(self):
+        """ Row-wise vs. columnar extraction of joined rows """
+
+        from core.resource.select import S3ResourceData, S3Columns
+
+        pkey = "master.id"
+        columns = ["master.name", "joined.value"]
+        colnames = [pkey] + columns
+
+        def extractor(data, columnar):
+            # Bare S3ResourceData with fresh field data
+            rdata = S3ResourceData.__new__(S3ResourceData)
+            rdata.field_data = {c: ({}, {}, c[:6] == "joined", False, False, False)
+                                for c in colnames}
+            rdata.effort = dict.fromkeys(colnames, 0)
+            if columnar:
+                return lambda: rdata.extract_columns(data, pkey, columns, represent=True)
+            else:
+                return lambda: rdata.extract(data, pkey, columns, represent=True)
+
+        info("")
+        for size in (10000, 100000, 1000000):
+
+            # Synthetic join: 4 joined rows per master record
+            ids = [i // 4 for i in range(size)]
+            names = ["Name %s" % i for i in ids]
+            values = [i % 7 for i in range(size)]
+
+            rows = [Row(master = Row(id=i, name=n), joined = Row(value=v))
+                    for i, n, v in zip(ids, names, values)]
+            data = S3Columns(colnames, [ids, names, values])
+
+            mlt_rows = timeit.Timer(extractor(rows, False)).timeit(number=1)
+            mlt_cols = timeit.Timer(extractor(data, True)).timeit(number=1)
+            info("S3ResourceData.extract (%s rows) = %s ms, columnar = %s ms (x%.1f)" % \
+                 (size, mlt_rows * 1000, mlt_cols * 1000, mlt_rows / mlt_cols))
+
+    # -------------------------------------------------------------------------
+    def testVoucherChainVerify(self):
+        """ Batched verification of a voucher transaction chain """
+
+        import datetime
+        import multiprocessing
+        import uuid
+
+        s3db = current.s3db
+        program = s3db.fin_VoucherProgram
+        hmac = s3db.fin_voucher_hmac
+
+        key = current.deployment_settings.hmac_key
+        puuid = uuid.uuid4().urn
+        size = 1000000
+        batch_size = 5000
+
+        # Synthetic chain of DBT transactions
+        info("")
+        date = datetime.datetime(2021, 1, 1)
+        ouuid = ohash = None
+        batches = []
+        rows = []
+        for i in range(1, size + 1):
+            data = {"ouuid": ouuid,
+                    "date": date,
+                    "type": "DBT",
+                    "credit": 1,
+                    "voucher": -1,
+                    "debit": 1,
+                    "compensation": -1,
+                    "voucher_id": i,
+                    "debit_id": i,
+                    }
+            vhash = hmac((key, [program._hash_input(puuid, data, ohash)]))[0]
+            row = Row(id=i, uuid=uuid.uuid4().urn, vhash=vhash, **data)
+            rows.append(row)
+            if len(rows) == batch_size:
+                batches.append(rows)
+                rows = []
+            ouuid, ohash = row.uuid, vhash
+        if rows:
+            batches.append(rows)
+
+        def verify(pool=None):
+            def run():
+                hashes = {}
+                for rows in batches:
+                    for row in rows:
+                        hashes[row.uuid] = row.vhash
+                    invalid, broken = program.verify_batch(puuid, key, rows, hashes,
+                                                           pool = pool,
+                                                           )
+                    assert not invalid and not broken
+            return run
+
+        mlt = timeit.Timer(verify()).timeit(number=1)
+        info("fin_VoucherProgram.verify_batch (%s transactions) = %s sec (=%s trans/sec)" % \
+             (size, mlt, int(size / mlt)))
+
+        processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        try:
+            mlt = timeit.Timer(verify(pool)).timeit(number=1)
+        finally:
+            pool.close()
+            pool.join()
+        info("fin_VoucherProgram.verify_batch (%s transactions, %s processes) = %s sec (=%s trans/sec)" % \
+             (size, processes, mlt, int(size / mlt)))
+
+    # -------------------------------------------------------------------------
+    def testHierarchyUpdate(self):
+        """ Full rebuild vs. incremental update of a stored hierarchy """
+
+        from s3dal import Field
+        from core import S3Hierarchy
+
+        db = current.db
+        s3db = current.s3db
+
+        tablename = "bench_hierarchy"
+        size = 100000
+
+        table = s3db.define_table(tablename,
+                                  Field("name"),
+                                  Field("parent", "reference %s" % tablename),
+                                  )
+        s3db.configure(tablename, hierarchy="parent")
+        try:
+            # Synthetic tree with 10 children per node
+            info("")
+            table.bulk_insert([{"name": "Root"}])
+            for i in range(2, size + 1):
+                table.insert(name="Node %s" % i, parent=i // 10 or 1)
+
+            hierarchies = current.model["hierarchies"]
+
+            def rebuild():
+                S3Hierarchy.dirty(tablename)
+                hierarchies.clear()
+                S3Hierarchy(tablename).theset
+
+            mlt = timeit.Timer(rebuild).timeit(number=1)
+            info("S3Hierarchy rebuild (%s nodes) = %s sec" % (size, mlt))
+
+            def update():
+                node_id = table.insert(name="New", parent=size // 2)
+                S3Hierarchy.update_node(tablename, node_id)
+                db(table.id == node_id).update(parent=size // 3)
+                S3Hierarchy.update_node(tablename, node_id)
+
+            mlt = timeit.Timer(update).timeit(number=100) * 10
+            info("S3Hierarchy.update_node (%s nodes) = %s ms/node" % (size, mlt))
+
+            def load():
+                hierarchies.clear()
+                S3Hierarchy(tablename, roots=[1]).theset
+
+            mlt = timeit.Timer(load).timeit(number=1)
+            info("S3Hierarchy load (%s nodes) = %s sec" % (size, mlt))
+        finally:
+            s3db.clear_config(tablename)
+            ntable = s3db.s3_hierarchy_node
+            db(ntable.tablename == tablename).delete()
+            htable = s3db.s3_hierarchy
+            db(htable.tablename == tablename).delete()
+            table.drop()
+            db.commit()
+
+    # -------------------------------------------------------------------------
+    def testSpatialIndex(self):
+        """ Spatial index vs. linear scan for intersecting polygons """
+
+        import random
+
+        from shapely.geometry import box
+        from shapely.prepared import prep
+        from shapely.wkt import loads as wkt_loads
+
+        from core import SpatialIndex
+
+        size = 100000
+
+        # Synthetic polygons (squares of 0.5 degrees)
+        random.seed(4711)
+        wkts = {}
+        index = SpatialIndex()
+        for i in range(1, size + 1):
+            x = random.uniform(-180, 179.5)
+            y = random.uniform(-90, 89.5)
+            bounds = (x, y, x + 0.5, y + 0.5)
+            index.bounds[i] = bounds
+            wkts[i] = box(*bounds).wkt
+
+        info("")
+        mlt = timeit.Timer(index.build).timeit(number=1)
+        info("SpatialIndex.build (%s polygons) = %s ms" % (size, mlt * 1000))
+
+        # Pre-fill the geometry cache
+        index.CACHE_SIZE = size
+        for i, wkt in wkts.items():
+            index.geometries[i] = prep(wkt_loads(wkt))
+
+        shape = wkt_loads("POLYGON ((0 0, 10 0, 10 10, 0 0))")
+
+        def linear():
+            return [i for i, wkt in wkts.items() if wkt_loads(wkt).intersects(shape)]
+
+        def indexed():
+            return index.intersects(shape)
+
+        self.assertEqual(sorted(linear()), sorted(indexed()))
+
+        mlt_linear = timeit.Timer(linear).timeit(number=1)
+        mlt_indexed = timeit.Timer(indexed).timeit(number=10) / 10
+        info("SpatialIndex.intersects (%s polygons) = %s ms, linear scan = %s ms (x%.1f)" % \
+             (size, mlt_indexed * 1000, mlt_linear * 1000, mlt_linear / mlt_indexed))
+
+    # -------------------------------------------------------------------------
+    def testPermissionCheck(self):
+        """ Permission checks with compiled ACLs vs. ACL queries """
+
+        auth = current.auth
+        db = current.db
+
+        permission = auth.permission
+        if not permission.use_cacls:
+            info("\nPermission check benchmark requires security policy 3+")
+            return
+
+        # Check as anonymous user
+        user_id = auth.user.id if auth.user else None
+        auth.s3_impersonate(None)
+
+        checks = [(method, c, f, t)
+                  for method in ("read", "update")
+                  for c, f, t in (("org", "organisation", "org_organisation"),
+                                  ("org", "office", "org_office"),
+                                  ("pr", "person", "pr_person"),
+                                  ("hrm", "staff", "hrm_human_resource"),
+                                  ("default", "index", None),
+                                  )]
+        number = 10000
+
+        sr = auth.get_system_roles()
+        roles = [sr.ANONYMOUS]
+        table = permission.table
+
+        def compiled():
+            for i in range(number):
+                method, c, f, t = checks[i % len(checks)]
+                # Clear the per-request cache to measure the lookup
+                permission.permission_cache = {}
+                permission.has_permission(method, c=c, f=f, t=t)
+
+        def queried():
+            # ACL queries as previously run for each check
+            for i in range(number):
+                method, c, f, t = checks[i % len(checks)]
+                query = (table.group_id.belongs(roles)) & \
+                        (table.deleted == False) & \
+                        (((table.controller == c) & \
+                          ((table.function == None) | (table.function == f))) | \
+                         ((table.tablename == t) & \
+                          (table.controller == None) & \
+                          (table.function == None)))
+                db(query).select(table.group_id,
+                                 table.controller,
+                                 table.function,
+                                 table.tablename,
+                                 table.unrestricted,
+                                 table.entity,
+                                 table.uacl,
+                                 table.oacl,
+                                 cacheable = True,
+                                 )
+
+        try:
+            info("")
+            mlt_compiled = timeit.Timer(compiled).timeit(number=1)
+            mlt_queried = timeit.Timer(queried).timeit(number=1)
+            info("S3Permission.has_permission (%s checks) = %s ms (compiled ACLs), "
+                 "ACL queries alone = %s ms (x%.1f)" % \
+                 (number,
+                  mlt_compiled * 1000,
+                  mlt_queried * 1000,
+                  mlt_queried / mlt_compiled,
+                  ))
+        finally:
+            auth.s3_impersonate(user_id)
+
 # =============================================================================
 if __name__ == "__main__":
 
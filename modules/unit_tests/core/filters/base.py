@@ -133,11 +133,70 @@ class FilterWidgetTests(unittest.TestCase):
         self.assertTrue("2" in values)
         self.assertTrue("3" in values)
 
+# =============================================================================
+class FilterOptionsTests(unittest.TestCase):
+    """ Tests for batched lookup of options filter options """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    def tearDown(self):
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testPrefetch(self):
+        """ Test that prefetched option keys match the per-widget lookup """
+
+        s3db = current.s3db
+
+        otable = s3db.org_organisation
+        org_ids = [otable.insert(name="FilterOptionsTest %s" % i)
+                   for i in range(3)]
+
+        ftable = s3db.org_office
+        for org_id in org_ids[:2]:
+            ftable.insert(name="FilterOptionsTest Office", organisation_id=org_id)
+        ftable.insert(name="FilterOptionsTest Other", organisation_id=org_ids[2])
+
+        widgets = [S3OptionsFilter("organisation_id"),
+                   S3OptionsFilter("name"),
+                   S3OptionsFilter("location_id$L1", options={"A": "A"}),
+                   ]
+
+        query = FS("name") == "FilterOptionsTest Office"
+
+        # Look up the options per widget
+        resource = s3db.resource("org_office", filter=query)
+        expected = [w._options(resource) for w in widgets]
+
+        # Prefetch the options for all eligible widgets
+        resource = s3db.resource("org_office", filter=query)
+        prefetched = S3FilterOptions(resource, widgets).prefetch()
+        self.assertEqual(prefetched, 2)
+
+        options = [w._options(resource) for w in widgets]
+        self.assertEqual(options, expected)
+
+        # Options only include organisations linked to offices
+        org_options = dict(options[0][1])
+        self.assertIn(org_ids[0], org_options)
+        self.assertIn(org_ids[1], org_options)
+        self.assertNotIn(org_ids[2], org_options)
+
+        # Prefetched keys are not used for another resource
+        other = s3db.resource("org_office")
+        self.assertNotEqual(widgets[1]._options(other)[1], options[1][1])
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         FilterWidgetTests,
+        FilterOptionsTests,
     )
 
 # END ========================================================================
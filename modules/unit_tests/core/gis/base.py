@@ -3,11 +3,14 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/core/gis/base.py
 
-import unittest
 import datetime
+import os
+import shutil
+import sys
+import unittest
 
 from gluon import *
-from gluon.storage import Storage
+from gluon.storage import List, Storage
 
 from core import *
 
@@ -147,8 +150,8 @@ class LocationTreeTests(unittest.TestCase):
         self._testL3_L1_parent(with_level=False)
 
     # -------------------------------------------------------------------------
-    def testULT1_update_location_tree_disabled(self):
-        """ Test inserting a location during prepop with location tree updates disabled """
+    def testULT1_update_location_tree_deferred(self):
+        """ Test inserting a location during prepop with location tree updates deferred """
 
         from core import GIS
 
@@ -171,9 +174,9 @@ class LocationTreeTests(unittest.TestCase):
                              parent = L0_id,
                              )
 
-        # When disable_update_location_tree is set to True, update_location_tree
+        # When location tree updates are deferred, update_location_tree
         # should just return without making changes.
-        GIS.disable_update_location_tree = True
+        GIS.defer_location_tree()
         L1_feature = dict(id = L1_id)
         gis.update_location_tree(L1_feature)
 
@@ -188,10 +191,10 @@ class LocationTreeTests(unittest.TestCase):
         assertEqual(L1_record.lat, None)
         assertEqual(L1_record.lon, None)
 
-        # Update again, this time in the normal case with location tree
-        # updates active.
-        GIS.disable_update_location_tree = False
-        gis.update_location_tree(L1_feature)
+        # Flush the deferred updates, which should update the location
+        assertEqual(GIS.deferred_location_tree, {L1_id})
+        GIS.flush_location_tree()
+        self.assertIsNone(GIS.deferred_location_tree)
 
         # Verify that the path, lat, lon, inherited are properly set.
         L1_record = db(table.id == L1_id).select(*self.fields,
@@ -212,10 +215,10 @@ class LocationTreeTests(unittest.TestCase):
         db = current.db
         gis = current.gis
 
-        # Mimic doing prepopulate by turning off location tree updates.
+        # Mimic doing prepopulate by deferring location tree updates.
         # Has no effect here as we're not doing validation, but leave this in
         # in case someone modifies this test so it does call validation.
-        GIS.disable_update_location_tree = True
+        GIS.defer_location_tree()
 
         # Insert a country
         L0_lat = 10.0
@@ -242,8 +245,7 @@ class LocationTreeTests(unittest.TestCase):
                              )
 
         # After prepop data is loaded, an update of all locations is run.
-        GIS.disable_update_location_tree = False
-        gis.update_location_tree()
+        GIS.flush_location_tree(rebuild_all=True)
 
         assertEqual = self.assertEqual
 
@@ -362,6 +364,90 @@ class LocationTreeTests(unittest.TestCase):
         # We should have seen all the expected parents.
         self.assertEqual(len(expected_parents), 0)
 
+    # -------------------------------------------------------------------------
+    def testULT5_rebuild_location_tree(self):
+        """ Test bulk update of the location tree for a subtree """
+
+        from core import GIS
+
+        table = self.table
+        db = current.db
+
+        # Insert a country with a polygon, but without centroid and bounds
+        L0_id = table.insert(level = "L0",
+                             name = "s3gis.testULT5.L0",
+                             wkt = "POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))",
+                             )
+        # Insert two L1s
+        L1a_id = table.insert(level = "L1",
+                              name = "s3gis.testULT5.L1a",
+                              parent = L0_id,
+                              )
+        L1b_id = table.insert(level = "L1",
+                              name = "s3gis.testULT5.L1b",
+                              parent = L0_id,
+                              )
+        # And a specific location in the first, skipping over L2
+        specific_id = table.insert(name = "s3gis.testULT5.specific",
+                                   parent = L1a_id,
+                                   )
+
+        assertEqual = self.assertEqual
+        no_progress = lambda *args: None
+
+        # Update the first L1 and its descendants
+        updated = GIS.rebuild_location_tree(location_ids = [L1a_id],
+                                            progress = no_progress,
+                                            )
+        assertEqual(updated, 2)
+
+        record = db(table.id == specific_id).select(*self.fields,
+                                                    limitby=(0, 1)
+                                                    ).first()
+        assertEqual(record.inherited, True)
+        assertEqual(record.path, "%s/%s/%s" % (L0_id, L1a_id, specific_id))
+        assertEqual(record.L0, "s3gis.testULT5.L0")
+        assertEqual(record.L1, "s3gis.testULT5.L1a")
+        assertEqual(record.L2, None)
+
+        # The country and the other L1 have not been updated
+        for location_id in (L0_id, L1b_id):
+            record = db(table.id == location_id).select(*self.fields,
+                                                        limitby=(0, 1)
+                                                        ).first()
+            assertEqual(record.path, None)
+
+        # Update the country and all its descendants
+        updated = GIS.rebuild_location_tree(location_ids = [L0_id],
+                                            progress = no_progress,
+                                            )
+        assertEqual(updated, 4)
+
+        # Centroid and bounds of the country computed
+        record = db(table.id == L0_id).select(*self.fields,
+                                              limitby=(0, 1)
+                                              ).first()
+        assertEqual(record.path, str(L0_id))
+        assertEqual(record.lat, 5.0)
+        assertEqual(record.lon, 5.0)
+        assertEqual(record.lat_min, 0)
+        assertEqual(record.lon_max, 10)
+
+        # ...and inherited by the descendants
+        for location_id in (L1a_id, L1b_id, specific_id):
+            record = db(table.id == location_id).select(*self.fields,
+                                                        limitby=(0, 1)
+                                                        ).first()
+            assertEqual(record.inherited, True)
+            assertEqual(record.lat, 5.0)
+            assertEqual(record.lon, 5.0)
+
+        # Nothing left to update
+        updated = GIS.rebuild_location_tree(location_ids = [L0_id],
+                                            progress = no_progress,
+                                            )
+        assertEqual(updated, 0)
+
     # -------------------------------------------------------------------------
     def _testL0(self, with_level):
         """ Test updating a Country with Polygon """
@@ -783,6 +869,356 @@ class LocationTreeTests(unittest.TestCase):
         if self.spatialdb:
             self.assertTrue(record.the_geom is not None)
 
+# =============================================================================
+class GeometryPyramidTests(unittest.TestCase):
+    """ Tests for the geometry pyramid """
+
+    WKT = "POLYGON ((10 10, 10.005 10.5, 10 11, 11 11, 11 10, 10 10))"
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_location
+        self.location_id = table.insert(name = "Geometry Pyramid Test",
+                                        gis_feature_type = 3,
+                                        wkt = self.WKT,
+                                        )
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.request.get_vars.pop("zoom", None)
+        current.request.get_vars.pop("bbox", None)
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testGetGeometryLevel(self):
+        """ Test the choice of the pyramid level by zoom or bbox """
+
+        assertEqual = self.assertEqual
+
+        gis = current.gis
+        get_vars = current.request.get_vars
+
+        # Fallback to tolerance
+        assertEqual(gis.get_geometry_level(0.01), 0)
+        assertEqual(gis.get_geometry_level(0.005), 1)
+        assertEqual(gis.get_geometry_level(0.00001), 2)
+        self.assertIsNone(gis.get_geometry_level(0))
+
+        # Zoom level
+        get_vars["zoom"] = "4"
+        assertEqual(gis.get_geometry_level(0), 0)
+        get_vars["zoom"] = "10"
+        assertEqual(gis.get_geometry_level(0), 1)
+        get_vars["zoom"] = "18"
+        assertEqual(gis.get_geometry_level(0), 2)
+        del get_vars["zoom"]
+
+        # Bounding box
+        get_vars["bbox"] = "5.0,45.0,20.0,55.0"
+        assertEqual(gis.get_geometry_level(0), 0)
+        get_vars["bbox"] = "7.0,50.0,7.5,50.3"
+        assertEqual(gis.get_geometry_level(0), 2)
+
+    # -------------------------------------------------------------------------
+    def testUpdateGeometryLevels(self):
+        """ Test update and lookup of simplified geometries """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+        gis = current.gis
+
+        gtable = s3db.gis_location
+        ptable = s3db.gis_location_geometry
+        location_id = self.location_id
+
+        # Build the pyramid
+        updated = gis.update_geometry_levels([location_id])
+        assertEqual(updated, 1)
+        query = (ptable.location_id == location_id)
+        rows = db(query).select(ptable.level,
+                                ptable.geojson,
+                                orderby = ptable.level,
+                                )
+        assertEqual([row.level for row in rows], [0, 1, 2])
+
+        # Coarsest level has the spike removed, finest level retains it
+        self.assertNotIn("10.5", rows[0].geojson)
+        self.assertIn("10.5", rows[2].geojson)
+
+        # Pyramid is up-to-date
+        assertEqual(gis.update_geometry_levels([location_id]), 0)
+
+        # Lookup
+        query = (gtable.id == location_id)
+        output = gis.get_simplified_geojson(query, gtable.id, 2)
+        assertEqual(output, [(location_id, rows[2].geojson)])
+
+        # Update the geometry, lookup simplifies the new geometry...
+        wkt = "POLYGON ((10 10, 10 11, 12 11, 12 10, 10 10))"
+        db(gtable.id == location_id).update(wkt = wkt,
+                                            modified_on = datetime.datetime.utcnow() + \
+                                                          datetime.timedelta(seconds=1),
+                                            )
+        output = gis.get_simplified_geojson(query, gtable.id, 0)
+        assertEqual(len(output), 1)
+        self.assertIn("12", output[0][1])
+
+        # ...but does not store it
+        query = (ptable.location_id == location_id) & (ptable.level == 0)
+        row = db(query).select(ptable.geojson, limitby=(0, 1)).first()
+        self.assertNotIn("12", row.geojson)
+        assertEqual(gis.update_geometry_levels([location_id]), 1)
+
+# =============================================================================
+class SpatialIndexTests(unittest.TestCase):
+    """ Tests for the in-process spatial index """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.spatial_index = settings.gis.get("spatial_index")
+        settings.gis.spatial_index = True
+
+        table = current.s3db.gis_location
+        locations = {"A": "POLYGON ((0 0, 0 2, 2 2, 2 0, 0 0))",
+                     "B": "POLYGON ((3 3, 3 5, 5 5, 5 3, 3 3))",
+                     "C": "POLYGON ((0 3.5, 0 5, 1.8 5, 0 3.5))",
+                     }
+        self.location_ids = ids = {}
+        for name, wkt in locations.items():
+            form = Storage(vars = Storage(wkt = wkt), errors = Storage())
+            current.gis.wkt_centroid(form)
+            ids[name] = table.insert(name = "Spatial Index Test %s" % name,
+                                     **form.vars)
+        ids["D"] = table.insert(name = "Spatial Index Test D",
+                                gis_feature_type = 1,
+                                lat = 4.5,
+                                lon = 0.2,
+                                )
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        SpatialIndex.invalidate()
+
+        current.deployment_settings.gis.spatial_index = self.spatial_index
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testIntersects(self):
+        """ Test lookup of locations intersecting a shape """
+
+        from shapely.wkt import loads as wkt_loads
+
+        assertEqual = self.assertEqual
+
+        ids = self.location_ids
+        index = current.gis.get_spatial_index()
+        self.assertIsNotNone(index)
+
+        # Bounds of A, B and C intersect, geometry of C does not
+        shape = wkt_loads("POLYGON ((1.5 1.5, 1.5 4.5, 4.5 1.5, 1.5 1.5))")
+        result = set(index.intersects(shape))
+        assertEqual(result & set(ids.values()), {ids["A"], ids["B"]})
+
+        # Bounding box intersects A, C and D
+        result = set(index.query_bbox(-1, -1, 0.5, 4.6))
+        assertEqual(result & set(ids.values()), {ids["A"], ids["C"], ids["D"]})
+
+        # Point within A
+        rows = current.gis.get_features_by_latlon(1, 1)
+        result = {row.id for row in rows}
+        assertEqual(result & set(ids.values()), {ids["A"]})
+
+    # -------------------------------------------------------------------------
+    def testRefresh(self):
+        """ Test refresh of the index after location updates """
+
+        from shapely.geometry import Point
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        ids = self.location_ids
+        index = current.gis.get_spatial_index()
+
+        point = Point(10, 10)
+        self.assertNotIn(ids["B"], index.intersects(point))
+
+        # Move B
+        form = Storage(vars = Storage(wkt = "POLYGON ((9 9, 9 11, 11 11, 11 9, 9 9))"),
+                       errors = Storage())
+        current.gis.wkt_centroid(form)
+        db(table.id == ids["B"]).update(**form.vars)
+        SpatialIndex.invalidate([ids["B"]])
+
+        index = current.gis.get_spatial_index()
+        self.assertIn(ids["B"], index.intersects(point))
+
+    # -------------------------------------------------------------------------
+    def testLateCommit(self):
+        """ Test refresh with locations committed with an earlier modified_on """
+
+        import datetime
+
+        table = current.s3db.gis_location
+
+        index = current.gis.get_spatial_index()
+        self.assertEqual(index.query_bbox(20, 20, 22, 22), [])
+
+        modified_on = current.request.utcnow - datetime.timedelta(minutes=2)
+        location_id = table.insert(name = "Spatial Index Test E",
+                                   gis_feature_type = 1,
+                                   lat = 21,
+                                   lon = 21,
+                                   modified_on = modified_on,
+                                   )
+
+        # Throttled check
+        index = current.gis.get_spatial_index()
+        self.assertNotIn(location_id, index.query_bbox(20, 20, 22, 22))
+
+        # Next check includes the location
+        index.checked = None
+        index = current.gis.get_spatial_index()
+        self.assertIn(location_id, index.query_bbox(20, 20, 22, 22))
+
+# =============================================================================
+class VectorTileTests(unittest.TestCase):
+    """ Tests for the vector tile (MVT) encoder """
+
+    # -------------------------------------------------------------------------
+    def testBounds(self):
+        """ Test tile bounds """
+
+        assertAlmostEqual = self.assertAlmostEqual
+
+        lon_min, lat_min, lon_max, lat_max = VectorTiles.bounds(0, 0, 0)
+        assertAlmostEqual(lon_min, -180.0)
+        assertAlmostEqual(lon_max, 180.0)
+        assertAlmostEqual(lat_min, -85.0511, places=4)
+        assertAlmostEqual(lat_max, 85.0511, places=4)
+
+        lon_min, lat_min, lon_max, lat_max = VectorTiles.bounds(1, 1, 0)
+        assertAlmostEqual(lon_min, 0.0)
+        assertAlmostEqual(lat_min, 0.0)
+
+        # Buffer extends the bounds
+        buffered = VectorTiles.bounds(1, 1, 0, buffer=64)
+        self.assertTrue(buffered[0] < 0.0)
+        self.assertTrue(buffered[1] < 0.0)
+
+    # -------------------------------------------------------------------------
+    def testProject(self):
+        """ Test projection into tile coordinates """
+
+        layer = MVTLayer("test", 1, 1, 1)
+        self.assertEqual(layer.project(0, 0), (0, 0))
+        self.assertEqual(layer.project(180, -85.0511287798066), (4096, 4096))
+
+    # -------------------------------------------------------------------------
+    def testEncodePoint(self):
+        """ Test encoding of a point feature """
+
+        layer = MVTLayer("test", 0, 0, 0)
+        layer.add_feature({"type": "Point", "coordinates": [0, 0]},
+                          properties = {"name": "A"},
+                          feature_id = 1,
+                          )
+        tile = layer.encode()
+
+        # Point feature: MoveTo(1) to (2048, 2048) in zigzag
+        self.assertIn(b"\x22\x05\x09\x80\x20\x80\x20", tile)
+        self.assertIn(b"test", tile)
+        self.assertIn(b"name", tile)
+
+    # -------------------------------------------------------------------------
+    def testEncodePolygon(self):
+        """ Test encoding of polygons """
+
+        layer = MVTLayer("test", 0, 0, 0)
+
+        # Counter-clockwise exterior ring (GeoJSON convention)
+        ring = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+        parts = layer.encode_polygons([[ring]])
+
+        # MoveTo + LineTo + ClosePath, closing point omitted
+        self.assertEqual([p[0] for p in parts], [1, 2, 7])
+        points = parts[0][1] + parts[1][1]
+        self.assertEqual(len(points), 4)
+
+        # Exterior ring clockwise in tile coordinates
+        self.assertTrue(layer.area(points) > 0)
+
+        # Polygon collapsing into a single tile pixel is skipped
+        ring = [[0, 0], [1e-6, 0], [1e-6, 1e-6], [0, 0]]
+        self.assertEqual(layer.encode_polygons([[ring]]), [])
+
+    # -------------------------------------------------------------------------
+    def testEncodeValue(self):
+        """ Test encoding of property values """
+
+        encode = MVTLayer.encode_value
+
+        self.assertEqual(encode("A"), b"\x0a\x01A")
+        self.assertEqual(encode(True), b"\x38\x01")
+        self.assertEqual(encode(300), b"\x28\xac\x02")
+        self.assertEqual(encode(-1), b"\x30\x01")
+        self.assertEqual(encode(1.0), b"\x19\x00\x00\x00\x00\x00\x00\xf0\x3f")
+
+    # -------------------------------------------------------------------------
+    def testFilterVars(self):
+        """ Test parsing of the layer filter """
+
+        get_vars = VectorTiles.filter_vars("~.status=1&~.type__belongs=2,3")
+        self.assertEqual(get_vars, {"~.status": "1", "~.type__belongs": "2,3"})
+
+        self.assertEqual(VectorTiles.filter_vars(None), {})
+
+    # -------------------------------------------------------------------------
+    def testDataStamps(self):
+        """ Test re-use of the data stamps of a layer """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        tiles = VectorTiles(-1)
+        tiles._layer = Storage(layer_id = -1,
+                               controller = "org",
+                               function = "organisation",
+                               modified_on = None,
+                               )
+        key = (current.db._uri_hash, -1)
+        VectorTiles.stamps.pop(key, None)
+
+        try:
+            stamps = tiles.data_stamps()
+            version = tiles.version()
+
+            # New record => stamps are re-used until they expire
+            current.s3db.org_organisation.insert(name="Vector Tile Test Org")
+            assertEqual(tiles.data_stamps(), stamps)
+            assertEqual(tiles.version(), version)
+
+            VectorTiles.stamps.pop(key)
+            assertNotEqual(tiles.data_stamps(), stamps)
+            assertNotEqual(tiles.version(), version)
+        finally:
+            VectorTiles.stamps.pop(key, None)
+            current.db.rollback()
+
 # =============================================================================
 class NoGisConfigTests(unittest.TestCase):
     """
@@ -818,11 +1254,151 @@ class NoGisConfigTests(unittest.TestCase):
         xml = map.xml()
         self.assertTrue(b"Map cannot display without GIS config!" in xml)
 
+# =============================================================================
+class VectorTileControllerTests(unittest.TestCase):
+    """ Tests for the vector tile controller (gis/tiles) """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_layer_feature
+        layer_id = table.insert(name = "Vector Tile Controller Test",
+                                controller = "org",
+                                function = "organisation",
+                                )
+        record = {"id": layer_id}
+        current.s3db.update_super(table, record)
+        cls.layer_id = table[layer_id].layer_id
+
+        current.db.commit()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        s3db = current.s3db
+        layer_id = cls.layer_id
+
+        table = s3db.gis_layer_feature
+        db(table.layer_id == layer_id).delete()
+        table = s3db.gis_layer_entity
+        db(table.layer_id == layer_id).delete()
+        db.commit()
+
+        # Remove the cached tiles
+        folder = os.path.join(current.request.folder,
+                              "uploads",
+                              "gis_cache",
+                              "tiles",
+                              str(layer_id),
+                              )
+        shutil.rmtree(folder, ignore_errors=True)
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        gis_settings = current.deployment_settings.gis
+        self.vector_tiles = gis_settings.get("vector_tiles")
+        gis_settings.vector_tiles = True
+
+        request = current.request
+        self.args = request.args
+        self.extension = request.extension
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.deployment_settings.gis.vector_tiles = self.vector_tiles
+
+        request = current.request
+        request.args = self.args
+        request.extension = self.extension
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def tiles(self, *args):
+        """
+            Run the tiles controller with a request path, as routed by
+            web2py (i.e. with the extension left in the last arg)
+
+            Args:
+                args: the request args
+
+            Returns:
+                the controller output
+        """
+
+        request = current.request
+        request.args = List(args)
+        request.extension = "html"
+
+        path = os.path.join(request.folder, "controllers", "gis.py")
+        environment = {"request": request,
+                       "response": current.response,
+                       "T": current.T,
+                       "settings": current.deployment_settings,
+                       "auth": current.auth,
+                       "s3base": sys.modules["core"],
+                       "HTTP": HTTP,
+                       "ERROR": current.ERROR,
+                       }
+        with open(path) as f:
+            exec(compile(f.read(), path, "exec"), environment)
+
+        return environment["tiles"]()
+
+    # -------------------------------------------------------------------------
+    def testTile(self):
+        """ Test that the documented tile URL returns a tile """
+
+        layer_id = str(self.layer_id)
+
+        tile = self.tiles(layer_id, "0", "0", "0.mvt")
+        self.assertTrue(isinstance(tile, bytes))
+        self.assertEqual(current.response.headers["Content-Type"],
+                         "application/vnd.mapbox-vector-tile",
+                         )
+
+    # -------------------------------------------------------------------------
+    def testInvalidRequests(self):
+        """ Test that invalid tile URLs are rejected """
+
+        assertRaises = self.assertRaises
+
+        layer_id = str(self.layer_id)
+
+        # Wrong extension, invalid or missing coordinates
+        for args in ((layer_id, "0", "0", "0.png"),
+                     (layer_id, "0", "0", "0"),
+                     (layer_id, "0", "x", "0.mvt"),
+                     (layer_id, "1", "2", "0.mvt"),
+                     (layer_id, "0", "0.mvt"),
+                     ):
+            with assertRaises(HTTP) as cm:
+                self.tiles(*args)
+            self.assertEqual(cm.exception.status, 400)
+
+        # Unknown layer
+        with assertRaises(HTTP) as cm:
+            self.tiles("0", "0", "0", "0.mvt")
+        self.assertEqual(cm.exception.status, 404)
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         LocationTreeTests,
+        GeometryPyramidTests,
+        SpatialIndexTests,
+        VectorTileTests,
+        VectorTileControllerTests,
         NoGisConfigTests,
         )
 
@@ -6,11 +6,11 @@
 import datetime
 import unittest
 
-from gluon import current, IS_EMPTY_OR, IS_FLOAT_IN_RANGE, IS_INT_IN_RANGE, IS_IN_SET, IS_NOT_EMPTY
+from gluon import current, Field, IS_EMPTY_OR, IS_FLOAT_IN_RANGE, IS_INT_IN_RANGE, IS_IN_SET, IS_NOT_EMPTY
 from gluon.languages import lazyT
 from gluon.storage import Storage
 
-from core import s3_meta_fields, DYNAMIC_PREFIX, IS_NOT_ONE_OF, IS_ONE_OF, IS_UTC_DATE, IS_UTC_DATETIME
+from core import s3_meta_fields, DataModel, DYNAMIC_PREFIX, IS_NOT_ONE_OF, IS_ONE_OF, IS_UTC_DATE, IS_UTC_DATETIME
 from core.model.dynamic import DynamicTableModel
 
 from unit_tests import run_suite
@@ -223,11 +223,156 @@ class SuperEntityTests(unittest.TestCase):
         super_record = super_table[se_id]
         self.assertFalse(super_record.deleted)
 
+# =============================================================================
+class ModelIndexTests(unittest.TestCase):
+    """ Tests for the model index """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.indexes = dict(DataModel.indexes)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        DataModel.indexes.clear()
+        DataModel.indexes.update(self.indexes)
+
+    # -------------------------------------------------------------------------
+    def testRegisteredNames(self):
+        """ Test registration of names defined by models """
+
+        current.s3db.pr_person
+
+        names = current.response.get(DataModel.NAMES)
+        self.assertEqual(names.get("pr_person"), ("s3db.pr", "PRPersonModel"))
+
+        timings = DataModel.timings()
+        self.assertIn("PRPersonModel", [item[0] for item in timings])
+        for name, prefix, duration in timings:
+            self.assertTrue(duration >= 0)
+
+    # -------------------------------------------------------------------------
+    def testIndexedModel(self):
+        """ Test lookup of models in the index """
+
+        s3db = current.s3db
+        modules = s3db.module_map["pr"]
+
+        DataModel.indexes[current.request.folder] = {
+            "pr_person": ("s3db.pr", "PRPersonModel"),
+            "pr_unknown": ("s3db.pr", "PRUnknownModel"),
+            }
+
+        from s3db.pr import PRPersonModel
+        self.assertEqual(DataModel.indexed_model("pr_person", modules), PRPersonModel)
+
+        # Unknown names, models or modules are not found
+        self.assertEqual(DataModel.indexed_model("pr_unknown", modules), None)
+        self.assertEqual(DataModel.indexed_model("pr_other", modules), None)
+        self.assertEqual(DataModel.indexed_model("pr_person", s3db.module_map["org"]), None)
+
+# =============================================================================
+class CreateIndexesTests(unittest.TestCase):
+    """ Tests for DataModel.create_indexes """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        current.s3db.define_table("index_test",
+                                  Field("name"),
+                                  Field("value", "integer"),
+                                  )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.index_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def testCreateIndexes(self):
+        """ Test creation of single- and multi-column indexes """
+
+        settings = current.deployment_settings
+        if settings.get_database_type() != "sqlite" or \
+           not settings.get_base_migrate():
+            self.skipTest("requires sqlite with migration enabled")
+
+        db = current.db
+        DataModel.create_indexes("index_test", "name", ("name", "value"))
+
+        sql = "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='index_test';"
+        indexes = {row[0] for row in db.executesql(sql)}
+        self.assertIn("index_test_name_idx", indexes)
+        self.assertIn("index_test_name_value_idx", indexes)
+
+        # Indexes are created only once per process
+        key = (db._uri_hash, "index_test_name_idx")
+        self.assertIn(key, DataModel.db_indexes)
+
+        # Repeated call is harmless
+        DataModel.create_indexes("index_test", "name")
+
+# =============================================================================
+class TableVersionTests(unittest.TestCase):
+    """ Tests for DataModel.table_version """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        current.s3db.define_table("version_test",
+                                  Field("name"),
+                                  )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.version_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testTableVersion(self):
+        """ Test that writes increase the table version """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = db.version_test
+
+        version = s3db.table_version(table)
+        self.assertEqual(s3db.table_version(table), version)
+
+        record_id = table.insert(name="Test")
+        self.assertNotEqual(s3db.table_version(table), version)
+
+        version = s3db.table_version(table)
+        db(table.id == record_id).update(name="Updated")
+        self.assertNotEqual(s3db.table_version(table), version)
+
+        version = s3db.table_version(table)
+        db(table.id == record_id).delete()
+        self.assertNotEqual(s3db.table_version(table), version)
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         SuperEntityTests,
+        ModelIndexTests,
+        CreateIndexesTests,
+        TableVersionTests,
     )
 
 # END ========================================================================
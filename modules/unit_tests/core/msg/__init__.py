@@ -1 +1,2 @@
 from .base import *
+from .notify import *
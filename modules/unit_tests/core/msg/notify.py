@@ -0,0 +1,201 @@
+# Eden Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/core/msg/notify.py
+#
+import datetime
+import unittest
+
+from gluon import *
+from gluon.storage import Storage
+from core import *
+
+from unit_tests import run_suite
+
+# =============================================================================
+class NotifyBatchTests(unittest.TestCase):
+    """ Tests for batched subscription notifications """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        self.send_by_pe_id = current.msg.send_by_pe_id
+        self.sent = sent = []
+        def send_by_pe_id(pe_id, subject=None, message=None, **kwargs):
+            sent.append((pe_id,
+                         kwargs.get("contact_method"),
+                         message,
+                         current.T.accepted_language,
+                         ))
+            return True
+        current.msg.send_by_pe_id = send_by_pe_id
+
+        self.records = []
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.msg.send_by_pe_id = self.send_by_pe_id
+
+        # notify_batch commits, so remove the test records explicitly
+        db = current.db
+        for table, record_id in reversed(self.records):
+            db(table.id == record_id).delete()
+        db.commit()
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def insert(self, table, **data):
+        """ Insert a test record and register it for removal """
+
+        record_id = table.insert(**data)
+        self.records.append((table, record_id))
+        return record_id
+
+    # -------------------------------------------------------------------------
+    def subscribe(self, last_check_time, method=("EMAIL",), language=None):
+        """
+            Create a subscription to new organisations for a new person,
+            with a user account if a language is specified
+        """
+
+        s3db = current.s3db
+
+        ptable = s3db.pr_person
+        person_id = self.insert(ptable, first_name="NotifyBatch", last_name="Test")
+        person = Storage(id=person_id)
+        s3db.update_super(ptable, person)
+        pe_id = person.pe_id
+
+        if language:
+            utable = current.auth.settings.table_user
+            user_id = self.insert(utable,
+                                  first_name = "NotifyBatch",
+                                  last_name = "Test",
+                                  email = "notifybatch%s@example.com" % person_id,
+                                  password = "",
+                                  language = language,
+                                  )
+            self.insert(s3db.pr_person_user, pe_id=pe_id, user_id=user_id)
+
+        subscription_id = self.insert(s3db.pr_subscription,
+                                      pe_id = pe_id,
+                                      notify_on = ["new"],
+                                      frequency = "hourly",
+                                      method = list(method),
+                                      email_format = "text",
+                                      )
+        resource_id = self.insert(s3db.pr_subscription_resource,
+                                  subscription_id = subscription_id,
+                                  resource = "org_organisation",
+                                  url = "org/organisation",
+                                  locked = True,
+                                  last_check_time = last_check_time,
+                                  )
+        return pe_id, resource_id
+
+    # -------------------------------------------------------------------------
+    def testBatches(self):
+        """ Test grouping of subscriptions into batches """
+
+        now = datetime.datetime.utcnow()
+        minutes = lambda m: now + datetime.timedelta(minutes=m)
+
+        def row(resource_id, tablename, last_check_time, filter_id=None):
+            return Storage(pr_subscription_resource = Storage(id = resource_id,
+                                                              resource = tablename,
+                                                              url = "org/organisation",
+                                                              last_check_time = last_check_time,
+                                                              ),
+                           pr_subscription = Storage(filter_id = filter_id,
+                                                     notify_on = ["new", "upd"],
+                                                     ),
+                           )
+
+        rows = [row(1, "org_organisation", minutes(0)),
+                row(2, "org_organisation", minutes(3)),
+                row(3, "org_organisation", minutes(20)),
+                row(4, "org_office", minutes(0)),
+                row(5, "org_organisation", minutes(1), filter_id=7),
+                ]
+
+        batches = S3Notifications._batches(rows)
+        self.assertEqual(sorted(batches), [[1, 2], [3], [4], [5]])
+
+    # -------------------------------------------------------------------------
+    def testNotifyBatch(self):
+        """ Test in-process notification of a batch of subscribers """
+
+        db = current.db
+        s3db = current.s3db
+
+        last_check_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+
+        pe_id1, resource_id1 = self.subscribe(last_check_time)
+        pe_id2, resource_id2 = self.subscribe(last_check_time)
+
+        otable = s3db.org_organisation
+        self.insert(otable, name="NotifyBatchTestOrganisation")
+        db.commit()
+
+        message = S3Notifications.notify_batch([resource_id1, resource_id2])
+        self.assertEqual(message, "2 subscribers notified, 0 failed.")
+
+        # Both subscribers notified, with the same message
+        sent = self.sent
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(set(item[0] for item in sent), {pe_id1, pe_id2})
+        self.assertEqual(set(item[1] for item in sent), {"EMAIL"})
+        self.assertEqual(sent[0][2], sent[1][2])
+
+        # Subscriptions unlocked and checked at the same time
+        rtable = s3db.pr_subscription_resource
+        rows = db(rtable.id.belongs((resource_id1, resource_id2))).select(rtable.locked,
+                                                                          rtable.last_check_time,
+                                                                          rtable.next_check_time,
+                                                                          )
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(set(row.last_check_time for row in rows)), 1)
+        for row in rows:
+            self.assertFalse(row.locked)
+            self.assertTrue(row.last_check_time > last_check_time)
+            self.assertEqual(row.next_check_time - row.last_check_time,
+                             datetime.timedelta(minutes=60))
+
+    # -------------------------------------------------------------------------
+    def testLanguagePartitions(self):
+        """ Test that subscribers are notified in their own language """
+
+        db = current.db
+        T = current.T
+
+        ui_language = T.accepted_language
+        last_check_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+
+        pe_id1, resource_id1 = self.subscribe(last_check_time, language="en")
+        pe_id2, resource_id2 = self.subscribe(last_check_time, language="de")
+
+        otable = current.s3db.org_organisation
+        self.insert(otable, name="NotifyBatchTestOrganisation")
+        db.commit()
+
+        message = S3Notifications.notify_batch([resource_id1, resource_id2])
+        self.assertEqual(message, "2 subscribers notified, 0 failed.")
+
+        languages = dict((item[0], item[3]) for item in self.sent)
+        self.assertEqual(languages, {pe_id1: "en", pe_id2: "de"})
+
+        # UI language restored
+        self.assertEqual(T.accepted_language, ui_language)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        NotifyBatchTests,
+    )
+
+# END ========================================================================
@@ -1169,6 +1169,163 @@ class UIDCollisionHandlingTests(unittest.TestCase):
             assertEqual(row.type1_id, type1_id)
             assertEqual(row.type2_id, type2_id)
 
+# =============================================================================
+class BulkImportTests(unittest.TestCase):
+    """ Tests for bulk mode imports """
+
+    @classmethod
+    def setUpClass(cls):
+
+        db = current.db
+
+        # Define test table
+        db.define_table("bulk_test",
+                        Field("name"),
+                        Field("secondary"),
+                        *s3_meta_fields())
+
+        # Create sample records
+        table = db.bulk_test
+        table.insert(uuid="BULK0", name="Alpha")
+        table.insert(uuid="BULK1", name="Beta")
+
+        current.db.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.bulk_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        self.accepted = accepted = []
+        current.s3db.configure("bulk_test",
+                               deduplicate = S3Duplicate(),
+                               onaccept = lambda form: accepted.append(form.vars.id),
+                               )
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        current.s3db.clear_config("bulk_test")
+
+    # -------------------------------------------------------------------------
+    def testBulkImport(self):
+        """ Test deduplication and batch inserts in bulk mode """
+
+        assertEqual = self.assertEqual
+        assertIn = self.assertIn
+
+        xmlstr = """
+<s3xml>
+    <resource name="bulk_test" uuid="BULK0">
+        <data field="name">Alpha0</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">beta</data>
+        <data field="secondary">X</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Gamma</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">gamma</data>
+        <data field="secondary">Y</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Delta</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Epsilon</data>
+    </resource>
+</s3xml>"""
+
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        resource = current.s3db.resource("bulk_test")
+        result = resource.import_xml(tree, bulk=2)
+        assertEqual(result.error, None)
+
+        db = current.db
+        table = db.bulk_test
+        rows = db(table.deleted == False).select(table.id,
+                                                 table.uuid,
+                                                 table.name,
+                                                 table.secondary,
+                                                 orderby = table.id,
+                                                 )
+        records = {row.name: row for row in rows}
+
+        # Existing records updated by UID and by S3Duplicate
+        assertEqual(records["Alpha0"].uuid, "BULK0")
+        assertEqual(records["beta"].uuid, "BULK1")
+        assertEqual(records["beta"].secondary, "X")
+
+        # Duplicate of a pending insert updates the new record
+        assertEqual(len(rows), 5)
+        assertEqual(records["gamma"].secondary, "Y")
+
+        # New records have IDs and have been post-processed
+        assertEqual(len(result.created), 3)
+        for name in ("gamma", "Delta", "Epsilon"):
+            record_id = records[name].id
+            assertIn(record_id, result.created + result.updated)
+            assertIn(record_id, self.accepted)
+
+    # -------------------------------------------------------------------------
+    def testBatchInserts(self):
+        """ Test that new records without UID are inserted in batches """
+
+        assertEqual = self.assertEqual
+
+        xmlstr = """
+<s3xml>
+    <resource name="bulk_test">
+        <data field="name">Zeta1</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Zeta2</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Zeta3</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Zeta4</data>
+    </resource>
+    <resource name="bulk_test">
+        <data field="name">Zeta5</data>
+    </resource>
+</s3xml>"""
+
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        # Record the size of each batch insert
+        batches = []
+        bulk_insert = ImportJob.bulk_insert
+        def counted(job, table, batch):
+            batches.append(len(batch))
+            return bulk_insert(job, table, batch)
+
+        ImportJob.bulk_insert = counted
+        try:
+            resource = current.s3db.resource("bulk_test")
+            result = resource.import_xml(tree, bulk=2)
+        finally:
+            ImportJob.bulk_insert = bulk_insert
+
+        assertEqual(result.error, None)
+        assertEqual(len(result.created), 5)
+
+        # Lookups of records without UID do not flush pending inserts
+        assertEqual(batches, [2, 2, 1])
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1183,6 +1340,7 @@ if __name__ == "__main__":
         ObjectReferencesTests,
         ObjectReferencesImportTests,
         UIDCollisionHandlingTests,
+        BulkImportTests,
         )
 
 # END ========================================================================
@@ -477,6 +477,106 @@ class ResourceExportTests(unittest.TestCase):
         uuid = child.get("uuid", None)
         assertEqual(uuid, last)
 
+    # -------------------------------------------------------------------------
+    def testStreamTree(self):
+        """ Test streaming export in batches of records """
+
+        assertEqual = self.assertEqual
+
+        xml = current.xml
+        s3db = current.s3db
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_organisation" uuid="STO1">
+        <data field="name">StreamTestOrganisation1</data>
+    </resource>
+    <resource name="org_organisation" uuid="STO2">
+        <data field="name">StreamTestOrganisation2</data>
+    </resource>
+    <resource name="org_office" uuid="STF1">
+        <data field="name">StreamTestOffice1</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="STO1"/>
+    </resource>
+    <resource name="org_office" uuid="STF2">
+        <data field="name">StreamTestOffice2</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="STO2"/>
+    </resource>
+    <resource name="org_office" uuid="STF3">
+        <data field="name">StreamTestOffice3</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="STO1"/>
+    </resource>
+</s3xml>"""
+
+        uids = ["STF1", "STF2", "STF3"]
+
+        def uuids(elements, name):
+            return {e.get("uuid") for e in elements if e.get("name") == name}
+
+        try:
+            xmltree = etree.ElementTree(etree.fromstring(xmlstr))
+            resource = s3db.resource("org_office")
+            resource.import_xml(xmltree)
+
+            # Build the complete tree
+            resource = s3db.resource("org_office", uid=uids)
+            tree = S3ResourceTree(resource).build(mcomponents=None)
+            expected = tree.getroot()
+
+            # Stream the tree in batches of two master records
+            from io import BytesIO
+            resource = s3db.resource("org_office", uid=uids)
+            stream = BytesIO()
+            results = S3ResourceTree(resource).stream(stream,
+                                                      batch_size = 2,
+                                                      mcomponents = None,
+                                                      )
+            assertEqual(results, 3)
+
+            root = etree.fromstring(stream.getvalue())
+            assertEqual(root.tag, xml.TAG.root)
+            assertEqual(dict(root.attrib), dict(expected.attrib))
+            assertEqual(len(root), len(expected))
+            for name in ("org_office", "org_organisation"):
+                assertEqual(uuids(root, name), uuids(expected, name))
+
+            # Organisations are exported only once
+            assertEqual(len(uuids(root, "org_organisation")), 2)
+
+            # The resource filter is restored after the export
+            assertEqual(resource.count(), 3)
+
+            # Stream the tree in chunks, one per batch
+            resource = s3db.resource("org_office", uid=uids)
+            chunks = list(S3ResourceTree(resource).chunks(batch_size = 2,
+                                                          mcomponents = None,
+                                                          ))
+            self.assertTrue(len(chunks) > 1)
+            root = etree.fromstring(b"".join(chunks))
+            assertEqual(len(root), len(expected))
+
+            # Stream as S3JSON
+            resource = s3db.resource("org_office", uid=uids)
+            stream = BytesIO()
+            S3ResourceTree(resource).stream(stream,
+                                            as_json = True,
+                                            batch_size = 2,
+                                            mcomponents = None,
+                                            )
+            output = json.loads(stream.getvalue().decode("utf-8"))
+            expected = xml.tree2json(tree, as_dict=True)
+
+            assertEqual(set(output.keys()), set(expected.keys()))
+            for key, value in expected.items():
+                if isinstance(value, list):
+                    assertEqual(sorted(output[key], key=lambda i: i["@uuid"]),
+                                sorted(value, key=lambda i: i["@uuid"]),
+                                )
+                else:
+                    assertEqual(output[key], value)
+        finally:
+            current.db.rollback()
+
     # -------------------------------------------------------------------------
     def testExportXMLWithSyncFilters(self):
         """ Test XML Export with Sync Filters """
@@ -2252,6 +2352,178 @@ class ResourceSelectTests(unittest.TestCase):
         # - returns all matching record ids, however
         assertEqual(len(data.ids), numitems)
 
+    # -------------------------------------------------------------------------
+    def testSelectColumnar(self):
+        """ Test columnar extraction gives the same results as Rows extraction """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        resource = s3db.resource("select_master")
+        fields = ["id", "name", "status"]
+
+        for represent in (False, True):
+
+            # Unlimited select
+            expected = resource.select(fields,
+                                       orderby = "select_master.name",
+                                       represent = represent,
+                                       )
+            data = resource.select(fields,
+                                   orderby = "select_master.name",
+                                   represent = represent,
+                                   columnar = True,
+                                   )
+            assertEqual(data.rows, expected.rows)
+
+            # Page with count
+            expected = resource.select(fields,
+                                       start = 2,
+                                       limit = 4,
+                                       count = True,
+                                       orderby = "select_master.name",
+                                       represent = represent,
+                                       )
+            data = resource.select(fields,
+                                   start = 2,
+                                   limit = 4,
+                                   count = True,
+                                   orderby = "select_master.name",
+                                   represent = represent,
+                                   columnar = True,
+                                   )
+            assertEqual(data.rows, expected.rows)
+            assertEqual(data.numrows, expected.numrows)
+
+        # Virtual field falls back to Rows extraction
+        data = resource.select(["name", "status", "code"],
+                               orderby = "select_master.name",
+                               columnar = True,
+                               )
+        rows = data.rows
+        assertEqual(len(rows), len(self.test_data))
+        for row in rows:
+            assertEqual(row["select_master.code"], row["select_master.status"])
+
+    # -------------------------------------------------------------------------
+    def testSelectBigtableCount(self):
+        """ Test counting in bigtable mode (window function, totals cache) """
+
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        assertEqual = self.assertEqual
+
+        numitems = len([item for item in self.test_data if item[1] == "A"])
+
+        base = settings.base
+        defaults = (base.get("bigtable"),
+                    base.get("window_count"),
+                    base.get("count_cache"),
+                    )
+        base.bigtable = True
+        try:
+            for window_count, count_cache in ((False, False),
+                                              (True, False),
+                                              (True, 60),
+                                              ):
+                base.window_count = window_count
+                base.count_cache = count_cache
+
+                query = (FS("status") == "A")
+                resource = s3db.resource("select_master", filter=query)
+
+                for start in (0, 2, numitems + 2, 0):
+                    data = resource.select(["id", "name"],
+                                           start = start,
+                                           limit = 2,
+                                           count = True,
+                                           orderby = "select_master.name",
+                                           )
+                    assertEqual(len(data.rows), max(0, min(2, numitems - start)))
+                    assertEqual(data.numrows, numitems)
+
+            # Cached totals are renewed after writes
+            table = s3db.select_master
+            record_id = table.insert(name="selectX", status="A")
+            data = resource.select(["id", "name"],
+                                   start = 0,
+                                   limit = 2,
+                                   count = True,
+                                   orderby = "select_master.name",
+                                   )
+            assertEqual(data.numrows, numitems + 1)
+            current.db(table.id == record_id).delete()
+        finally:
+            base.bigtable, base.window_count, base.count_cache = defaults
+
+    # -------------------------------------------------------------------------
+    def testSelectKeyset(self):
+        """ Test keyset pagination gives the same pages as OFFSET """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        resource = s3db.resource("select_master")
+        numitems = len(self.test_data)
+
+        for orderby in (None,
+                        "select_master.name",
+                        "select_master.status desc",
+                        ):
+            expected = resource.select(["id", "name"],
+                                       orderby = orderby,
+                                       ).rows
+
+            rows = []
+            after = ""
+            while after is not None:
+                data = resource.select(["id", "name"],
+                                       limit = 2,
+                                       count = True,
+                                       orderby = orderby,
+                                       after = after,
+                                       )
+                assertEqual(data.numrows, numitems)
+                self.assertTrue(data.keyset)
+                rows.extend(data.rows)
+                after = data.next
+            # - all records in the same order (ties broken by ID)
+            key = lambda row: row["select_master.id"]
+            if orderby is None:
+                expected = sorted(expected, key=key)
+            elif orderby == "select_master.status desc":
+                status = dict((key(row), row["select_master.status"])
+                              for row in resource.select(["id", "status"]).rows)
+                expected = sorted(expected, key=key)
+                expected.sort(key=lambda row: status[key(row)], reverse=True)
+            assertEqual(rows, expected)
+
+        # Invalid token
+        with self.assertRaises(ValueError):
+            resource.select(["id", "name"],
+                            limit = 2,
+                            orderby = "select_master.name",
+                            after = "invalid",
+                            )
+
+    # -------------------------------------------------------------------------
+    def testIterate(self):
+        """ Test batched iteration over all records """
+
+        s3db = current.s3db
+
+        resource = s3db.resource("select_master", filter=(FS("status") == "A"))
+        expected = resource.select(["name"], orderby="select_master.name").rows
+
+        rows = list(resource.iterate(["name"],
+                                     batch_size = 2,
+                                     orderby = "select_master.name",
+                                     ))
+        self.assertEqual(rows, expected)
+
     # -------------------------------------------------------------------------
     def testSelectSubsetFilter(self):
         """ Test selection of filtered subset (pagination) """
@@ -3278,6 +3550,242 @@ class ResourceDeleteTests(unittest.TestCase):
             component.drop()
             del current.model["components"]["del_master"]["component"]
 
+    # -------------------------------------------------------------------------
+    def testArchiveCascadeBatch(self):
+        """
+            Test archiving of multiple records which are referenced by
+            other records, in batches
+        """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        s3db = current.s3db
+        s3db.clear_config("del_master", "super_entity")
+
+        # Define component table
+        s3db.define_table("del_component",
+                          Field("del_master_id",
+                                s3db.del_master,
+                                ondelete="CASCADE"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+        s3db.add_components("del_master",
+                            del_component="del_master_id")
+
+        # Tables with ondelete-hook are processed row by row
+        s3db.configure("del_master", ondelete=None)
+
+        batch_size = DeleteProcess.BATCH_SIZE
+        try:
+            # Create master and component records
+            table = s3db.del_master
+            master_ids = [self.master_id] + [table.insert() for _ in range(4)]
+            component_ids = [component.insert(del_master_id=master_id)
+                             for master_id in master_ids
+                             for _ in range(2)
+                             ]
+            current.db.commit()
+
+            DeleteProcess.BATCH_SIZE = 2
+
+            # Delete all master records
+            resource = s3db.resource("del_master", id=master_ids)
+            success = resource.delete()
+            assertEqual(success, 5)
+            assertEqual(resource.error, None)
+
+            # Master records are deleted
+            rows = current.db(table.id.belongs(master_ids)).select(table.deleted)
+            assertTrue(all(row.deleted for row in rows))
+
+            # Component records are deleted and unlinked
+            rows = current.db(component.id.belongs(component_ids)).select(
+                                                    component.deleted,
+                                                    component.del_master_id,
+                                                    )
+            assertEqual(len(rows), 10)
+            for row in rows:
+                assertTrue(row.deleted)
+                assertEqual(row.del_master_id, None)
+
+        finally:
+            DeleteProcess.BATCH_SIZE = batch_size
+            component.drop()
+            del current.model["components"]["del_master"]["component"]
+
+    # -------------------------------------------------------------------------
+    def create_masters(self, number):
+        """
+            Create master records linked to the super-entity
+
+            Args:
+                number: the number of records to create
+
+            Returns:
+                list of tuples (master_id, super_id)
+        """
+
+        s3db = current.s3db
+        table = s3db.del_master
+
+        records = []
+        for _ in range(number):
+            master_id = table.insert()
+            s3db.update_super(table, {"id": master_id})
+            records.append((master_id, table[master_id].del_super_id))
+        current.db.commit()
+
+        return records
+
+    # -------------------------------------------------------------------------
+    def testArchiveSuperBatchSkipUndeletable(self):
+        """
+            Test archiving of super-entity instance records in a batch
+            where one super-record is restricted, skipping undeletable rows
+        """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        s3db = current.s3db
+        s3db.configure("del_master", ondelete=None)
+
+        # Define component table
+        s3db.define_table("del_component",
+                          s3db.super_link("del_super_id",
+                                          "del_super",
+                                          ondelete="RESTRICT"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+
+        batch_size = DeleteProcess.BATCH_SIZE
+        try:
+            records = self.create_masters(3)
+            master_ids = [record[0] for record in records]
+
+            # Restrict the super-record of the second master record
+            restricted_id, restricted_super_id = records[1]
+            component.insert(del_super_id=restricted_super_id)
+            current.db.commit()
+
+            DeleteProcess.BATCH_SIZE = 3
+
+            # Delete all master records, skipping undeletable rows
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = DeleteProcess(resource)
+            success = delete(skip_undeletable=True)
+            assertEqual(success, 2)
+            assertEqual(list(delete.errors), [("del_master", restricted_id)])
+
+            table = s3db.del_master
+            stable = s3db.del_super
+            for master_id, super_id in records:
+                record = table[master_id]
+                srecord = stable[super_id]
+                if master_id == restricted_id:
+                    # Restricted record is neither deleted nor unlinked
+                    assertFalse(record.deleted)
+                    assertEqual(record.del_super_id, super_id)
+                    assertFalse(srecord.deleted)
+                else:
+                    # Other records are deleted, including their super-records
+                    assertTrue(record.deleted)
+                    assertEqual(record.del_super_id, None)
+                    assertTrue(srecord.deleted)
+        finally:
+            DeleteProcess.BATCH_SIZE = batch_size
+            component.drop()
+
+    # -------------------------------------------------------------------------
+    def testArchiveSuperBatchFailure(self):
+        """
+            Test archiving of super-entity instance records in a batch
+            where one super-record is restricted, failing for all rows
+        """
+
+        assertEqual = self.assertEqual
+        assertFalse = self.assertFalse
+
+        s3db = current.s3db
+        s3db.configure("del_master", ondelete=None)
+
+        # Define component table
+        s3db.define_table("del_component",
+                          s3db.super_link("del_super_id",
+                                          "del_super",
+                                          ondelete="RESTRICT"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+
+        batch_size = DeleteProcess.BATCH_SIZE
+        try:
+            records = self.create_masters(3)
+            master_ids = [record[0] for record in records]
+
+            # Restrict the super-record of the second master record
+            restricted_id, restricted_super_id = records[1]
+            component.insert(del_super_id=restricted_super_id)
+            current.db.commit()
+
+            DeleteProcess.BATCH_SIZE = 3
+
+            # Delete all master records
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = DeleteProcess(resource)
+            success = delete()
+            assertEqual(success, 0)
+            assertEqual(resource.error, current.ERROR.INTEGRITY_ERROR)
+
+            # Error is reported for the failing record only
+            assertEqual(list(delete.errors), [("del_master", restricted_id)])
+
+            # Nothing is deleted
+            table = s3db.del_master
+            stable = s3db.del_super
+            for master_id, super_id in records:
+                record = table[master_id]
+                assertFalse(record.deleted)
+                assertEqual(record.del_super_id, super_id)
+                assertFalse(stable[super_id].deleted)
+        finally:
+            DeleteProcess.BATCH_SIZE = batch_size
+            component.drop()
+
+    # -------------------------------------------------------------------------
+    def testArchiveOndeleteOrder(self):
+        """
+            Test that the ondelete-hook runs immediately after the
+            deletion of each record, even if batch size permits more
+        """
+
+        assertEqual = self.assertEqual
+
+        s3db = current.s3db
+        table = s3db.del_master
+
+        records = self.create_masters(3)
+        master_ids = [record[0] for record in records]
+
+        # Count the deleted records whenever the hook is called
+        counts = []
+        def ondelete(row):
+            query = (table.id.belongs(master_ids)) & (table.deleted == True)
+            counts.append(current.db(query).count())
+        s3db.configure("del_master", ondelete=ondelete)
+
+        batch_size = DeleteProcess.BATCH_SIZE
+        try:
+            DeleteProcess.BATCH_SIZE = 3
+
+            resource = s3db.resource("del_master", id=master_ids)
+            success = resource.delete()
+            assertEqual(success, 3)
+            assertEqual(counts, [1, 2, 3])
+        finally:
+            DeleteProcess.BATCH_SIZE = batch_size
+
     # -------------------------------------------------------------------------
     def testArchiveRestrict(self):
         """
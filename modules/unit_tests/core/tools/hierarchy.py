@@ -671,6 +671,88 @@ class SimpleHierarchyTests(unittest.TestCase):
             if parent_id:
                 assertTrue(parent_id in nodes)
 
+    # -------------------------------------------------------------------------
+    def testIncrementalUpdate(self):
+        """ Test incremental update of the stored hierarchy """
+
+        db = current.db
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+        assertIn = self.assertIn
+        assertNotIn = self.assertNotIn
+
+        uids = self.uids
+        parent1 = uids["HIERARCHY1"]
+        parent2 = uids["HIERARCHY2"]
+
+        hierarchies = current.model["hierarchies"]
+
+        htable = s3db.s3_hierarchy
+        query = (htable.tablename == "test_hierarchy")
+
+        # Reading a dirty hierarchy does not store it
+        S3Hierarchy.dirty("test_hierarchy")
+        h = S3Hierarchy("test_hierarchy")
+        assertEqual(len(h.nodes), len(uids))
+        row = db(query).select(htable.dirty, limitby=(0, 1)).first()
+        self.assertTrue(row.dirty)
+
+        # Rebuild and store the hierarchy
+        self.assertEqual(S3Hierarchy.rebuild("test_hierarchy"), 1)
+        row = db(query).select(htable.dirty, limitby=(0, 1)).first()
+        self.assertFalse(row.dirty)
+
+        table = db.test_hierarchy
+        try:
+            # Add a node
+            node_id = table.insert(uuid = "HIERARCHY1-5",
+                                   name = "Type 1-5",
+                                   category = "Cat 1",
+                                   parent = parent1,
+                                   )
+            S3Hierarchy.update_node("test_hierarchy", node_id)
+
+            # Verify that the node has been added in memory
+            h = S3Hierarchy("test_hierarchy")
+            assertIn(node_id, h.children(parent1))
+
+            # ...and in the stored hierarchy
+            hierarchies.clear()
+            h = S3Hierarchy("test_hierarchy")
+            assertIn(node_id, h.children(parent1))
+            assertEqual(h.category(node_id), "Cat 1")
+
+            # Move the node
+            db(table.id == node_id).update(parent=parent2)
+            S3Hierarchy.update_node("test_hierarchy", node_id)
+
+            h = S3Hierarchy("test_hierarchy")
+            assertNotIn(node_id, h.children(parent1))
+            assertIn(node_id, h.children(parent2))
+
+            # Load only the subtree under the new parent
+            hierarchies.clear()
+            h = S3Hierarchy("test_hierarchy", roots=[parent2])
+            nodes = h.nodes
+            assertIn(node_id, nodes)
+            assertNotIn(parent1, nodes)
+            assertEqual(h.root(node_id), parent2)
+
+            # Remove the node
+            resource = s3db.resource("test_hierarchy", id=node_id)
+            resource.delete()
+
+            hierarchies.clear()
+            h = S3Hierarchy("test_hierarchy")
+            assertNotIn(node_id, h.nodes)
+
+            # The stored hierarchy is still current
+            row = db(query).select(htable.dirty, limitby=(0, 1)).first()
+            self.assertFalse(row.dirty)
+        finally:
+            db(table.uuid == "HIERARCHY1-5").delete()
+
 # =============================================================================
 class LinkedHierarchyTests(unittest.TestCase):
     """ Tests for linktable-based hierarchies """
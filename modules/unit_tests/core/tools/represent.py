@@ -1041,6 +1041,154 @@ class ExportLazyFKRepresentationTests(unittest.TestCase):
         except:
             pass
 
+# =============================================================================
+class SharedRepresentCacheTests(unittest.TestCase):
+    """ Tests for the process-wide representation cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        s3db = current.s3db
+
+        otable = s3db.org_organisation
+        org = Storage(name="Shared Cache Test Organisation")
+        org_id = otable.insert(**org)
+        org.update(id=org_id)
+        s3db.update_super(otable, org)
+
+        self.org_id = org_id
+
+        # Enable the shared cache
+        settings = current.deployment_settings
+        self.represent_cache = settings.base.get("represent_cache")
+        settings.base.represent_cache = 100
+        S3RepresentCache._instance = None
+
+    # -------------------------------------------------------------------------
+    def testSharedLookup(self):
+        """ Test sharing of representations between instances """
+
+        assertEqual = self.assertEqual
+
+        org_id = self.org_id
+
+        # First instance looks up from DB
+        r = S3Represent(lookup="org_organisation")
+        assertEqual(r(org_id), "Shared Cache Test Organisation")
+        assertEqual(r.queries, 1)
+
+        cache = S3RepresentCache.instance()
+        stats = cache.stats()
+        assertEqual(stats["misses"], 1)
+        assertEqual(stats["hits"], 0)
+
+        # Second instance uses the shared cache
+        r = S3Represent(lookup="org_organisation")
+        assertEqual(r(org_id), "Shared Cache Test Organisation")
+        assertEqual(r.queries, 0)
+        assertEqual(cache.stats()["hits"], 1)
+
+        # Different fields use a different namespace
+        r = S3Represent(lookup="org_organisation", fields=["name", "acronym"])
+        r(org_id)
+        assertEqual(r.queries, 1)
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test invalidation of shared representations on update """
+
+        assertEqual = self.assertEqual
+
+        s3db = current.s3db
+        org_id = self.org_id
+
+        r = S3Represent(lookup="org_organisation")
+        assertEqual(r(org_id), "Shared Cache Test Organisation")
+
+        # Update the record and run onaccept
+        otable = s3db.org_organisation
+        record = {"id": org_id, "name": "Shared Cache Test Renamed"}
+        current.db(otable.id == org_id).update(**record)
+        s3db.onaccept(otable, record, method="update")
+
+        # New instance looks up from DB again
+        r = S3Represent(lookup="org_organisation")
+        assertEqual(r(org_id), "Shared Cache Test Renamed")
+        assertEqual(r.queries, 1)
+
+    # -------------------------------------------------------------------------
+    def testEviction(self):
+        """ Test LRU eviction """
+
+        assertEqual = self.assertEqual
+        assertNotIn = self.assertNotIn
+
+        cache = S3RepresentCache(size=2)
+        namespace = ("test", )
+        cache.register(namespace, ["test_table"])
+
+        cache.set(namespace, {1: "One", 2: "Two"})
+        # Access 1 so that 2 becomes least recently used
+        assertEqual(cache.get(namespace, [1]), {1: "One"})
+        cache.set(namespace, {3: "Three"})
+
+        found = cache.get(namespace, [1, 2, 3])
+        assertEqual(found, {1: "One", 3: "Three"})
+        assertNotIn(2, cache.values[namespace])
+
+        # Markup is not cached
+        cache.set(namespace, {4: SPAN("Four")})
+        assertEqual(cache.get(namespace, [4]), {})
+
+    # -------------------------------------------------------------------------
+    def testExpiry(self):
+        """ Test expiry of entries after their time-to-live """
+
+        assertEqual = self.assertEqual
+
+        namespace = ("test", )
+
+        cache = S3RepresentCache(size=10, ttl=0)
+        cache.register(namespace, ["test_table"])
+        cache.set(namespace, {1: "One"})
+        assertEqual(cache.get(namespace, [1]), {})
+        assertEqual(cache.stats()["size"], 0)
+
+        cache = S3RepresentCache(size=10, ttl=60)
+        cache.register(namespace, ["test_table"])
+        cache.set(namespace, {1: "One"})
+        assertEqual(cache.get(namespace, [1]), {1: "One"})
+
+    # -------------------------------------------------------------------------
+    def testLinkOverride(self):
+        """ Test that representations with custom links bypass the cache """
+
+        class LinkRepresent(S3Represent):
+            def link(self, k, v, row=None):
+                return v if row is None else A(v, _href="#")
+
+        r = LinkRepresent(lookup="org_organisation", show_link=True)
+        r(self.org_id)
+        self.assertEqual(r.cache, None)
+        self.assertEqual(r.queries, 1)
+
+        # Repeated lookup retrieves the row again
+        r = LinkRepresent(lookup="org_organisation", show_link=True)
+        result = r(self.org_id)
+        self.assertEqual(r.queries, 1)
+        self.assertTrue(isinstance(result, A))
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        current.deployment_settings.base.represent_cache = self.represent_cache
+        S3RepresentCache._instance = None
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1048,6 +1196,7 @@ if __name__ == "__main__":
         BulkRepresentTests,
         ExtractLazyFKRepresentationTests,
         ExportLazyFKRepresentationTests,
+        SharedRepresentCacheTests,
     )
 
 # END ========================================================================
@@ -0,0 +1,244 @@
+# Eden Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/core/tools/tasks.py
+#
+import time
+import unittest
+
+from core import *
+
+from unit_tests import run_suite
+
+# =============================================================================
+class TaskQueueTests(unittest.TestCase):
+    """ Tests for S3Task queuing and duplicate checks """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.tasks = current.response.s3.tasks
+        self.calls = calls = []
+        current.response.s3.tasks = {"test_task": lambda *args, **vars: calls.append((args, vars)),
+                                     }
+        self.alive = dict(S3Task._alive)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.response.s3.tasks = self.tasks
+        S3Task._alive.clear()
+        S3Task._alive.update(self.alive)
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def set_alive(self, alive):
+        """ Override the cached worker liveness state """
+
+        S3Task._alive[current.db._uri_hash] = (time.time() + 60, alive)
+
+    # -------------------------------------------------------------------------
+    def testIsAliveCached(self):
+        """ Test that the worker liveness state is cached """
+
+        s3task = current.s3task
+
+        self.set_alive(True)
+        self.assertTrue(s3task._is_alive())
+
+        self.set_alive(False)
+        self.assertFalse(s3task._is_alive())
+
+        # Expired state is refreshed
+        S3Task._alive[current.db._uri_hash] = (time.time() - 1, True)
+        alive = s3task._is_alive()
+        self.assertTrue(S3Task._alive[current.db._uri_hash][0] > time.time())
+        self.assertEqual(S3Task._alive[current.db._uri_hash][1], alive)
+
+    # -------------------------------------------------------------------------
+    def testRunAsyncManySynchronous(self):
+        """ Test run_async_many without worker """
+
+        self.set_alive(False)
+
+        jobs = [([1], {"a": 1}),
+                ([2], None),
+                ]
+        result = current.s3task.run_async_many("test_task", jobs)
+
+        self.assertEqual(result, [None, None])
+        self.assertEqual(self.calls, [((1,), {"a": 1}), ((2,), {})])
+
+    # -------------------------------------------------------------------------
+    def testRunAsyncManyQueued(self):
+        """ Test run_async_many with worker """
+
+        self.set_alive(True)
+
+        db = current.db
+        table = db.scheduler_task
+
+        jobs = [([i], {"a": i}) for i in range(3)]
+        task_ids = current.s3task.run_async_many("test_task", jobs, timeout=60)
+
+        self.assertEqual(len(task_ids), 3)
+        self.assertNotIn(None, task_ids)
+        self.assertEqual(self.calls, [])
+
+        rows = db(table.id.belongs(task_ids)).select(table.id,
+                                                     table.function_name,
+                                                     table.args,
+                                                     table.status,
+                                                     table.timeout,
+                                                     )
+        rows = {row.id: row for row in rows}
+        for i, task_id in enumerate(task_ids):
+            row = rows[task_id]
+            self.assertEqual(row.function_name, "test_task")
+            self.assertEqual(row.args, "[%s]" % i)
+            self.assertEqual(row.status, "QUEUED")
+            self.assertEqual(row.timeout, 60)
+
+    # -------------------------------------------------------------------------
+    def testDuplicateTaskExists(self):
+        """ Test duplicate check for scheduled tasks """
+
+        s3task = current.s3task
+        exists = s3task._duplicate_task_exists
+
+        vars = {"b": 2, "a": 1}
+        self.assertFalse(exists("test_task", [1], vars))
+
+        task_id = s3task.schedule_task("test_task",
+                                       args = [1],
+                                       vars = dict(vars),
+                                       user_id = False,
+                                       )
+        self.assertTrue(task_id)
+
+        self.assertTrue(exists("test_task", [1], vars))
+        self.assertTrue(exists("test_task", [1], {"a": 1, "b": 2}))
+        self.assertFalse(exists("test_task", [2], vars))
+        self.assertFalse(exists("test_task", [1], {"a": 1}))
+
+        # Completed tasks are no duplicates
+        table = current.db.scheduler_task
+        current.db(table.id == task_id).update(status="COMPLETED")
+        self.assertFalse(exists("test_task", [1], vars))
+
+# =============================================================================
+class MaintenanceJobsTests(unittest.TestCase):
+    """ Tests for MaintenanceJobs """
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testDeleteBatched(self):
+        """ Test set-based deletion in batches """
+
+        db = current.db
+        table = current.s3db.s3_maintenance_log
+
+        record_ids = [table.insert(period="test", job="job%s" % i) for i in range(5)]
+        query = table.id.belongs(record_ids)
+
+        batches = []
+        deleted = MaintenanceJobs.delete_batched(table, query,
+                                                 before = batches.append,
+                                                 batch_size = 2,
+                                                 )
+        self.assertEqual(deleted, 5)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertTrue(db(query).isempty())
+
+    # -------------------------------------------------------------------------
+    def testDeleteBatchedFailure(self):
+        """ Test that undeletable records do not block batch deletion """
+
+        db = current.db
+        table = current.s3db.s3_maintenance_log
+
+        record_ids = [table.insert(period="test", job="job%s" % i) for i in range(5)]
+        query = table.id.belongs(record_ids)
+        undeletable = record_ids[1]
+
+        # Commit the fixtures, as delete_batched commits each batch
+        db.commit()
+
+        def before(ids):
+            if undeletable in ids:
+                raise RuntimeError("Undeletable")
+
+        try:
+            deleted = MaintenanceJobs.delete_batched(table, query,
+                                                     before = before,
+                                                     batch_size = 2,
+                                                     )
+            self.assertEqual(deleted, 4)
+            rows = db(query).select(table.id)
+            self.assertEqual([row.id for row in rows], [undeletable])
+        finally:
+            db(query).delete()
+            db.commit()
+
+    # -------------------------------------------------------------------------
+    def testRunJob(self):
+        """ Test running and logging of single jobs """
+
+        db = current.db
+        table = current.s3db.s3_maintenance_log
+
+        calls = []
+
+        class TestJobs(MaintenanceJobs):
+            period = "test"
+            jobs = ("success", "failure", "error")
+            def success(self):
+                calls.append("success")
+            def failure(self):
+                calls.append("failure")
+                return "Failed"
+            def error(self):
+                raise RuntimeError("Error")
+            def undeclared(self):
+                calls.append("undeclared")
+
+        routine = TestJobs()
+        try:
+            self.assertEqual(routine.run("success"), None)
+            self.assertEqual(routine.run("failure"), "Failed")
+            self.assertEqual(routine.run("error"), "Error")
+            self.assertEqual(routine.run("undeclared"), "Unknown job undeclared")
+            self.assertEqual(calls, ["success", "failure"])
+
+            rows = db(table.period == "test").select(table.job,
+                                                     table.status,
+                                                     table.duration,
+                                                     table.result,
+                                                     orderby = table.id,
+                                                     )
+            self.assertEqual([(row.job, row.status, row.result) for row in rows],
+                             [("success", "SUCCESS", None),
+                              ("failure", "FAILED", "Failed"),
+                              ("error", "FAILED", "Error"),
+                              ])
+            for row in rows:
+                self.assertTrue(row.duration >= 0)
+        finally:
+            # Jobs commit, so remove the log entries explicitly
+            db(table.period == "test").delete()
+            db.commit()
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        TaskQueueTests,
+        MaintenanceJobsTests,
+    )
+
+# END ========================================================================
@@ -52,11 +52,42 @@ class FKWrappersTests(unittest.TestCase):
         #self.assertEqual(key, None)
         #self.assertEqual(multiple, None)
 
+# =============================================================================
+class SavepointTests(unittest.TestCase):
+    """ Test s3_savepoint """
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testSavepoint(self):
+        """ Test that a failure rolls back only the savepoint """
+
+        db = current.db
+        table = current.s3db.s3_maintenance_log
+
+        table.insert(period="test", job="outer")
+
+        with self.assertRaises(RuntimeError):
+            with s3_savepoint():
+                table.insert(period="test", job="inner")
+                raise RuntimeError("test")
+
+        with s3_savepoint():
+            table.insert(period="test", job="released")
+
+        # Transaction remains usable, with the outer and released changes
+        rows = db(table.period == "test").select(table.job, orderby=table.id)
+        self.assertEqual([row.job for row in rows], ["outer", "released"])
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         FKWrappersTests,
+        SavepointTests,
         )
 
 # END ========================================================================
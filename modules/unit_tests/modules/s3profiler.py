@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Request Profiler Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/modules/s3profiler.py
+#
+import unittest
+
+from gluon import current
+from s3profiler import S3Profiler
+
+from unit_tests import run_suite
+
+# =============================================================================
+class ProfilerTests(unittest.TestCase):
+    """ Request Profiler Tests """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.samples = dict(S3Profiler.samples)
+        S3Profiler.samples.clear()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        S3Profiler.samples.clear()
+        S3Profiler.samples.update(self.samples)
+
+        db = current.db
+        db.rollback()
+
+        # Flush commits the log entries, so remove them explicitly
+        table = current.s3db.s3_profile_log
+        db(table.category == "test").delete()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def testPercentile(self):
+        """ Test percentile calculation """
+
+        percentile = S3Profiler.percentile
+
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+
+        self.assertEqual(percentile([7], 50), 7)
+        self.assertEqual(percentile([], 50), None)
+
+    # -------------------------------------------------------------------------
+    def testDisabled(self):
+        """ Test that nothing is recorded when disabled """
+
+        profiler = S3Profiler()
+        profiler.enabled = False
+
+        profiler.mark("test.py")
+        with profiler.measure("test", "block"):
+            pass
+        profiler.commit()
+
+        self.assertEqual(profiler.timings, [])
+        self.assertEqual(S3Profiler.samples, {})
+        self.assertEqual(profiler.flush(force=True), 0)
+
+    # -------------------------------------------------------------------------
+    def testCommitAndFlush(self):
+        """ Test recording, aggregation and logging of timings """
+
+        db = current.db
+        table = current.s3db.s3_profile_log
+
+        profiler = S3Profiler()
+        profiler.enabled = True
+
+        # Timings before commit are buffered
+        profiler.mark("test.py")
+        profiler.add("test", "item", 0.002)
+        profiler.getters = {"get_test": 0.001}
+        self.assertEqual(S3Profiler.samples, {})
+
+        profiler.commit()
+        self.assertEqual(profiler.timings, [])
+
+        # Timings after commit are stored immediately
+        wrapped = profiler.wrap("test", "item", lambda: 0.004)
+        self.assertEqual(wrapped(), 0.004)
+
+        samples = S3Profiler.samples[current.request.folder]
+        self.assertIn(("file", "test.py"), samples)
+        self.assertIn(("settings", "(all getters)"), samples)
+        self.assertIn(("settings", "get_test"), samples)
+        self.assertEqual(len(samples[("test", "item")]), 2)
+
+        # Not flushed before the interval has elapsed
+        self.assertEqual(profiler.flush(), 0)
+
+        written = profiler.flush(force=True)
+        self.assertEqual(written, len(samples))
+        self.assertEqual(S3Profiler.samples[current.request.folder], {})
+
+        row = db((table.category == "test") & (table.name == "item")) \
+                .select(table.samples, table.p50, table.maximum,
+                        orderby = ~table.id,
+                        limitby = (0, 1),
+                        ).first()
+        self.assertEqual(row.samples, 2)
+        self.assertTrue(row.p50 < 2.0)
+        self.assertAlmostEqual(row.maximum, 2.0)
+
+    # -------------------------------------------------------------------------
+    def testFlushRollback(self):
+        """ Test that samples are not lost when the log cannot be written """
+
+        db = current.db
+        table = current.s3db.s3_profile_log
+
+        profiler = S3Profiler()
+        profiler.enabled = True
+        profiler.commit()
+
+        profiler.add("test", "failed", 0.003)
+
+        def bulk_insert(rows):
+            raise RuntimeError("test")
+        table.bulk_insert = bulk_insert
+        try:
+            self.assertEqual(profiler.flush(force=True), 0)
+        finally:
+            del table.bulk_insert
+
+        # Samples are kept, and merged with new samples
+        profiler.add("test", "failed", 0.001)
+        samples = S3Profiler.samples[current.request.folder]
+        self.assertEqual(list(samples[("test", "failed")]), [0.003, 0.001])
+
+        # ...and written with the next flush, surviving a rollback
+        self.assertEqual(profiler.flush(force=True), 1)
+        db.rollback()
+        row = db((table.category == "test") & (table.name == "failed")) \
+                .select(table.samples, limitby=(0, 1)).first()
+        self.assertEqual(row.samples, 2)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        ProfilerTests,
+    )
+
+# END ========================================================================
@@ -142,6 +142,80 @@ class PRTests(unittest.TestCase):
         users = s3db.pr_realm_users(None)
         self.assertTrue(all([u in users for u in all_users]))
 
+    # -------------------------------------------------------------------------
+    def testHierarchyClosure(self):
+        """ Test maintenance and lookups of the OU hierarchy closure """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        otable = s3db.org_organisation
+        org3 = Storage(name="Test PR Organisation 3")
+        org3_id = otable.insert(**org3)
+        org3.update(id=org3_id)
+        s3db.update_super(otable, org3)
+        org3 = s3db.pr_get_pe_id("org_organisation", org3_id)
+
+        org1 = self.org1
+        org2 = self.org2
+
+        # org1 => org2 => org3
+        s3db.pr_add_affiliation(org1, org2, role="Branches")
+        s3db.pr_add_affiliation(org2, org3, role="Branches")
+
+        ancestors = s3db.pr_ancestors([org2, org3])
+        assertEqual(ancestors[org2], [str(org1)])
+        assertEqual(ancestors[org3], [str(org2), str(org1)])
+
+        descendants = s3db.pr_descendants([org1])
+        assertEqual(descendants, {org1: [org2, org3]})
+
+        descendants = s3db.pr_get_descendants(org2)
+        assertEqual(descendants, [org3])
+        assertEqual(s3db.pr_check_closure(), [])
+
+        # Detach org2 => org3 is moved along
+        s3db.pr_remove_affiliation(org1, org2, role="Branches")
+
+        ancestors = s3db.pr_ancestors([org2, org3])
+        assertEqual(ancestors[org2], [])
+        assertEqual(ancestors[org3], [str(org2)])
+
+        descendants = s3db.pr_descendants([org1])
+        assertEqual(descendants, {})
+        assertEqual(s3db.pr_check_closure(), [])
+
+        # Rebuild produces the same result
+        s3db.pr_rebuild_closure()
+        assertEqual(s3db.pr_check_closure(), [])
+        assertEqual(s3db.pr_descendants([org2]), {org2: [org3]})
+
+    # -------------------------------------------------------------------------
+    def testHierarchyClosureInit(self):
+        """ Test automatic build of an empty OU hierarchy closure """
+
+        from s3db.pr import PR_CLOSURE_READY
+
+        s3db = current.s3db
+        db = current.db
+
+        assertEqual = self.assertEqual
+
+        org1 = self.org1
+        org2 = self.org2
+        s3db.pr_add_affiliation(org1, org2, role="Branches")
+
+        # Empty closure, as after upgrading an existing database
+        ctable = s3db.pr_ou_closure
+        db(ctable.id > 0).delete()
+        PR_CLOSURE_READY.discard(db._uri_hash)
+
+        # Closure is built on first lookup
+        assertEqual(s3db.pr_get_descendants(org1), [org2])
+        assertEqual(s3db.pr_check_closure(), [])
+        self.assertTrue(db._uri_hash in PR_CLOSURE_READY)
+
     # -------------------------------------------------------------------------
     def tearDown(self):
 
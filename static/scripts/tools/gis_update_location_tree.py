@@ -5,6 +5,11 @@
 # Needs to be run in the web2py environment
 # python web2py.py -S eden -M -R applications/eden/static/scripts/tools/gis_update_location_tree.py
 
+import sys
+
+def progress(message, done, total):
+    sys.stderr.write("%s: %s/%s\n" % (message, done, total))
+
 s3db.gis_location
-gis.update_location_tree()
+gis.rebuild_location_tree(progress=progress)
 db.commit()
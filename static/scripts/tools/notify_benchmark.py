@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# This is a script to measure the throughput of subscription notifications,
+# comparing per-subscriber processing with in-process batches
+# (S3Notifications.notify_batch)
+
+# Needs to be run in the web2py environment
+# python web2py.py -S eden -M -R applications/eden/static/scripts/tools/notify_benchmark.py
+#
+# Note:
+#   - creates temporary persons and subscriptions to new organisations,
+#     and removes them again after the benchmark
+#   - messages are not actually sent (S3Msg.send_by_pe_id is replaced
+#     by a counter)
+#   - the per-subscriber mode processes each subscription in-process,
+#     i.e. excluding the cost of the lookup request of S3Notifications.notify
+
+import datetime
+import sys
+import time
+
+# Number of subscribers
+SUBSCRIBERS = 500
+
+# Number of new records to notify about
+RECORDS = 20
+
+def info(msg):
+    sys.stderr.write("%s\n" % msg)
+
+# Override auth (disables all permission checks)
+auth.override = True
+
+ptable = s3db.pr_person
+stable = s3db.pr_subscription
+rtable = s3db.pr_subscription_resource
+otable = s3db.org_organisation
+
+# Count instead of sending messages
+sent = []
+def send_by_pe_id(pe_id, **kwargs):
+    sent.append(pe_id)
+    return True
+msg.send_by_pe_id = send_by_pe_id
+
+def create_records():
+    """
+        Create test persons with subscriptions, and new organisations
+
+        Returns:
+            list of pr_subscription_resource record IDs
+    """
+
+    last_check_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+
+    resource_ids = []
+    for i in range(SUBSCRIBERS):
+        person = {"first_name": "NotifyBenchmark", "last_name": "%04d" % i}
+        person["id"] = ptable.insert(**person)
+        s3db.update_super(ptable, person)
+        subscription_id = stable.insert(pe_id = person["pe_id"],
+                                        notify_on = ["new"],
+                                        frequency = "hourly",
+                                        method = ["EMAIL"],
+                                        email_format = "text",
+                                        )
+        resource_ids.append(rtable.insert(subscription_id = subscription_id,
+                                          resource = "org_organisation",
+                                          url = "org/organisation",
+                                          locked = True,
+                                          last_check_time = last_check_time,
+                                          ))
+    for i in range(RECORDS):
+        otable.insert(name="NotifyBenchmark%04d" % i)
+
+    db.commit()
+    return resource_ids
+
+def remove_records():
+    """
+        Remove all benchmark records
+    """
+
+    query = (ptable.first_name == "NotifyBenchmark")
+    pe_ids = [row.pe_id for row in db(query).select(ptable.pe_id)]
+    subscription_ids = [row.id for row in db(stable.pe_id.belongs(pe_ids)).select(stable.id)]
+    db(rtable.subscription_id.belongs(subscription_ids)).delete()
+    db(stable.id.belongs(subscription_ids)).delete()
+    db(query).delete()
+    db(otable.name.like("NotifyBenchmark%")).delete()
+    db.commit()
+
+notify_batch = s3base.S3Notifications.notify_batch
+
+info("Notification benchmark: %s subscribers, %s new records" % (SUBSCRIBERS, RECORDS))
+try:
+    for mode in ("per-subscriber", "batch"):
+        resource_ids = create_records()
+        del sent[:]
+
+        start = time.time()
+        if mode == "batch":
+            notify_batch(resource_ids)
+        else:
+            for resource_id in resource_ids:
+                notify_batch([resource_id])
+        duration = time.time() - start
+
+        info("%14s: %s messages in %.3fs (%.1f subscribers/sec)" % \
+             (mode, len(sent), duration, SUBSCRIBERS / duration))
+
+        remove_records()
+finally:
+    remove_records()
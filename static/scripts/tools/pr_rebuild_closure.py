@@ -0,0 +1,12 @@
+#!/usr/bin/python
+
+# This is a script to rebuild the OU Hierarchy Closure in the Database
+# (e.g. to repair inconsistencies reported by s3db.pr_check_closure(); an
+# empty closure is built automatically on first use after upgrading)
+
+# Needs to be run in the web2py environment
+# python web2py.py -S eden -M -R applications/eden/static/scripts/tools/pr_rebuild_closure.py
+
+s3db.pr_ou_closure
+s3db.pr_rebuild_closure()
+db.commit()